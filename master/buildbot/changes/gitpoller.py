@@ -20,7 +20,6 @@ from future.utils import itervalues
 from future.utils import text_type
 
 import os
-import re
 
 from twisted.internet import defer
 from twisted.internet import utils
@@ -210,69 +209,69 @@ class GitPoller(base.PollingChangeSource, StateMixin):
     def _decode(self, git_output):
         return bytes2unicode(git_output, self.encoding)
 
-    def _get_commit_comments(self, rev):
-        args = ['--no-walk', r'--format=%s%n%b', rev, '--']
-        d = self._dovccmd('log', args, path=self.workdir)
-        d.addCallback(self._decode)
-        return d
-
-    def _get_commit_timestamp(self, rev):
-        # unix timestamp
-        args = ['--no-walk', r'--format=%ct', rev, '--']
-        d = self._dovccmd('log', args, path=self.workdir)
+    # format of the commits read by _get_commits; with -z, git also ends each
+    # commit's message and each changed file with a NUL
+    COMMIT_FORMAT = r'--format=%x00%H%x00%ct%x00%aN <%aE>%x00%s%n%b'
 
-        @d.addCallback
-        def process(git_output):
-            if self.usetimestamps:
-                try:
-                    stamp = int(git_output)
-                except Exception as e:
-                    log.msg(
-                        'gitpoller: caught exception converting output \'%s\' to timestamp' % git_output)
-                    raise e
-                return stamp
-            else:
-                return None
-        return d
+    def _get_commits(self, args):
+        """
+        Get the metadata of the commits selected by the given C{git log}
+        arguments, oldest first, with a single git process.
 
-    def _get_commit_files(self, rev):
-        args = ['--name-only', '--no-walk', r'--format=%n', rev, '--']
+        @returns: list of (rev, timestamp, author, files, comments) tuples,
+            via Deferred
+        """
+        args = ['-z', '--reverse', '--name-only', self.COMMIT_FORMAT] + args
         d = self._dovccmd('log', args, path=self.workdir)
-
-        def decode_file(file):
-            # git use octal char sequences in quotes when non ASCII
-            match = re.match('^"(.*)"$', file)
-            if match:
-                file = bytes2unicode(match.groups()[0], 'unicode_escape')
-            return self._decode(file)
-
-        @d.addCallback
-        def process(git_output):
-            fileList = [decode_file(file)
-                        for file in
-                        [s for s in git_output.splitlines() if len(s)]]
-            return fileList
+        d.addCallback(lambda git_output: list(self._parse_commits(git_output)))
         return d
 
-    def _get_commit_author(self, rev):
-        args = ['--no-walk', r'--format=%aN <%aE>', rev, '--']
-        d = self._dovccmd('log', args, path=self.workdir)
-
-        @d.addCallback
-        def process(git_output):
-            git_output = self._decode(git_output)
-            if len(git_output) == 0:
-                raise EnvironmentError('could not get commit author for rev')
-            return git_output
-        return d
+    def _parse_commits(self, git_output):
+        # each commit is output as
+        #   NUL rev NUL timestamp NUL author NUL comments NUL
+        # followed by its changed files, each ended by a NUL (the first one
+        # starting with a newline), so that splitting on NUL gives an empty
+        # field before each commit, and at the end
+        fields = git_output.split('\0')
+        i = 0
+        while i < len(fields) - 1:
+            if fields[i] != '' or i + 5 >= len(fields):
+                raise EnvironmentError(
+                    'unexpected git log output: %r' % (git_output,))
+            rev, timestamp, author, comments = fields[i + 1:i + 5]
+            i += 5
+            files = []
+            while fields[i] != '':
+                files.append(self._decode(fields[i].lstrip('\n')))
+                i += 1
+            yield (rev,
+                   self._parse_timestamp(timestamp),
+                   self._parse_author(author),
+                   files,
+                   self._decode(comments.strip()))
+
+    def _parse_timestamp(self, git_output):
+        if not self.usetimestamps:
+            return None
+        try:
+            return int(git_output)
+        except Exception:
+            log.msg('gitpoller: caught exception converting output \'%s\' to '
+                    'timestamp' % git_output)
+            raise
+
+    def _parse_author(self, git_output):
+        git_output = self._decode(git_output.strip())
+        if len(git_output) == 0:
+            raise EnvironmentError('could not get commit author for rev')
+        return git_output
 
     @defer.inlineCallbacks
     def _process_changes(self, newRev, branch):
         """
         Read changes since last change.
 
-        - Read list of commit hashes.
-        - Extract details from each commit.
+        - Read the details of the new commits.
         - Add changes to database.
         """
 
@@ -295,49 +294,26 @@ class GitPoller(base.PollingChangeSource, StateMixin):
                             (newRev, branch))
                     rebuild = True
 
-        # get the change list
-        revListArgs = ([b'--format=%H', r'%s' % newRev] +
+        # get the new commits, oldest first
+        revListArgs = ([r'%s' % newRev] +
                        [b'^' + unicode2bytes(rev, 'ascii', 'ignore')
                         for rev in sorted(itervalues(self.lastRev))] +
                        [b'--'])
         self.changeCount = 0
-        results = yield self._dovccmd('log', revListArgs, path=self.workdir)
+        commits = yield self._get_commits(revListArgs)
 
-        # process oldest change first
-        revList = results.split()
-        revList.reverse()
+        if rebuild and len(commits) == 0:
+            commits = yield self._get_commits(['--no-walk', newRev, '--'])
 
-        if rebuild and len(revList) == 0:
-            revList = [newRev]
-
-        self.changeCount = len(revList)
+        self.changeCount = len(commits)
         self.lastRev[branch] = newRev
 
         if self.changeCount:
             log.msg('gitpoller: processing %d changes: %s from "%s" branch "%s"'
-                    % (self.changeCount, revList, self.repourl, branch))
-
-        for rev in revList:
-            dl = defer.DeferredList([
-                self._get_commit_timestamp(rev),
-                self._get_commit_author(rev),
-                self._get_commit_files(rev),
-                self._get_commit_comments(rev),
-            ], consumeErrors=True)
-
-            results = yield dl
-
-            # check for failures
-            failures = [r[1] for r in results if not r[0]]
-            if failures:
-                for failure in failures:
-                    log.err(
-                        failure, "while processing changes for {} {}".format(newRev, branch))
-                # just fail on the first error; they're probably all related!
-                failures[0].raiseException()
-
-            timestamp, author, files, comments = [r[1] for r in results]
+                    % (self.changeCount, [c[0] for c in commits],
+                       self.repourl, branch))
 
+        for rev, timestamp, author, files, comments in commits:
             yield self.master.data.updates.addChange(
                 author=author, revision=ascii2unicode(rev), files=files,
                 comments=comments, when_timestamp=timestamp,
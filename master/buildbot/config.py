@@ -201,8 +201,11 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
         self.changeHorizon = None
         self.logHorizon = None
         self.buildHorizon = None
+        self.cleanupTimeBudget = 60
+        self.logChunkStore = None
         self.logCompressionLimit = 4 * 1024
         self.logCompressionMethod = 'gz'
+        self.logCompressionDictionaries = False
         self.logEncoding = 'utf-8'
         self.logMaxSize = None
         self.logMaxTailSize = None
@@ -210,6 +213,7 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
         self.collapseRequests = None
         self.codebaseGenerator = None
         self.prioritizeBuilders = None
+        self.batchBuildRequestClaims = False
         self.multiMaster = False
         self.manhole = None
         self.protocols = {}
@@ -229,8 +233,10 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
         )
         self.metrics = None
         self.caches = dict(
+            BuildDetails=50,
             Builds=15,
             Changes=10,
+            CollapseSignatures=100,
         )
         self.schedulers = {}
         self.builders = []
@@ -251,6 +257,7 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
         self.services = {}
 
     _known_config_keys = set([
+        "batchBuildRequestClaims",
         "buildbotNetUsageData",
         "buildbotURL",
         "buildCacheSize",
@@ -261,9 +268,12 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
         "codebaseGenerator",
         "changeCacheSize",
         "changeHorizon",
+        "cleanupTimeBudget",
         'db',
         "db_poll_interval",
         "db_url",
+        "logChunkStore",
+        "logCompressionDictionaries",
         "logCompressionLimit",
         "logCompressionMethod",
         "logEncoding",
@@ -416,6 +426,7 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
         copy_int_param('changeHorizon')
         copy_int_param('logHorizon')
         copy_int_param('buildHorizon')
+        copy_int_param('cleanupTimeBudget')
 
         if 'eventHorizon' in config_dict:
             warnDeprecated(
@@ -427,9 +438,9 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
 
         self.logCompressionMethod = config_dict.get(
             'logCompressionMethod', 'gz')
-        if self.logCompressionMethod not in ('raw', 'bz2', 'gz', 'lz4'):
+        if self.logCompressionMethod not in ('raw', 'bz2', 'gz', 'lz4', 'zstd'):
             error(
-                "c['logCompressionMethod'] must be 'raw', 'bz2', 'gz' or 'lz4'")
+                "c['logCompressionMethod'] must be 'raw', 'bz2', 'gz', 'lz4' or 'zstd'")
 
         if self.logCompressionMethod == "lz4":
             try:
@@ -440,6 +451,28 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
                 error(
                     "To set c['logCompressionMethod'] to 'lz4' you must install the lz4 library ('pip install lz4')")
 
+        if self.logCompressionMethod == "zstd":
+            try:
+
+                import zstandard
+                [zstandard]
+            except ImportError:
+                error(
+                    "To set c['logCompressionMethod'] to 'zstd' you must install the zstandard library ('pip install zstandard')")
+
+        self.logCompressionDictionaries = config_dict.get(
+            'logCompressionDictionaries', False)
+        if not isinstance(self.logCompressionDictionaries, bool):
+            error("c['logCompressionDictionaries'] must be a boolean")
+
+        logChunkStore = config_dict.get('logChunkStore')
+        if logChunkStore is not None:
+            from buildbot.db.logstores import LogChunkStore
+            if not isinstance(logChunkStore, LogChunkStore):
+                error("c['logChunkStore'] must be a LogChunkStore instance")
+            else:
+                self.logChunkStore = logChunkStore
+
         copy_int_param('logMaxSize')
         copy_int_param('logMaxTailSize')
         copy_param('logEncoding')
@@ -471,6 +504,11 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
         else:
             self.prioritizeBuilders = prioritizeBuilders
 
+        self.batchBuildRequestClaims = config_dict.get(
+            'batchBuildRequestClaims', False)
+        if not isinstance(self.batchBuildRequestClaims, bool):
+            error("c['batchBuildRequestClaims'] must be a boolean")
+
         protocols = config_dict.get('protocols', {})
         if isinstance(protocols, dict):
             for proto, options in iteritems(protocols):
@@ -914,9 +952,6 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
             s.checkConfig(self.status)
 
     def check_horizons(self):
-        if self.logHorizon is not None or self.buildHorizon is not None:
-            log.msg("NOTE: `buildHorizon` and `logHorizon` are currently ignored "
-                    "(see http://trac.buildbot.net/ticket/3572)")
         if self.logHorizon is not None and self.buildHorizon is not None:
             if self.logHorizon > self.buildHorizon:
                 error("logHorizon must be less than or equal to buildHorizon")
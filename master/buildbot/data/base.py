@@ -87,6 +87,11 @@ class Endpoint(object):
     def get(self, resultSpec, kwargs):
         raise NotImplementedError
 
+    def stream(self, resultSpec, kwargs):
+        # raw endpoints may override this to return their content in batches,
+        # as a 'read' function instead of a 'raw' string
+        return self.get(resultSpec, kwargs)
+
     def control(self, action, args, kwargs):
         raise exceptions.InvalidControlException
 
@@ -102,8 +102,26 @@ class RawLogChunkEndpoint(LogChunkEndpointBase):
         /builders/n:builderid/builds/n:build_number/steps/n:step_number/logs/i:log_slug/raw
     """
 
+    # number of lines fetched from the database at once when streaming a log
+    BATCH_LINES = 1000
+
     @defer.inlineCallbacks
     def get(self, resultSpec, kwargs):
+        data = yield self.stream(resultSpec, kwargs)
+        if data is None:
+            return
+        read = data.pop('read')
+        batches = []
+        while True:
+            batch = yield read()
+            if batch is None:
+                break
+            batches.append(batch)
+        data['raw'] = u''.join(batches)
+        defer.returnValue(data)
+
+    @defer.inlineCallbacks
+    def stream(self, resultSpec, kwargs):
         logid, dbdict = yield self.getLogIdAndDbDictFromKwargs(kwargs)
         if logid is None:
             return
@@ -112,20 +130,52 @@ class RawLogChunkEndpoint(LogChunkEndpointBase):
             dbdict = yield self.master.db.logs.getLog(logid)
             if not dbdict:
                 return
-        lastline = max(0, dbdict['num_lines'] - 1)
-
-        logLines = yield self.master.db.logs.getLogLines(
-            logid, 0, lastline)
-
-        if dbdict['type'] == 's':
-            logLines = "\n".join([line[1:] for line in logLines.splitlines()])
+        reader = RawLogReader(self.master, logid, dbdict['type'],
+                              dbdict['num_lines'], self.BATCH_LINES)
 
         defer.returnValue({
-            'raw': logLines,
+            'read': reader.read,
             'mime-type': u'text/html' if dbdict['type'] == 'h' else u'text/plain',
             'filename': dbdict['slug']})
 
 
+class RawLogReader(object):
+
+    """
+    Read the content of a log in batches of lines, stripping the stream
+    prefixes of stream logs along the way.
+    """
+
+    def __init__(self, master, logid, logtype, num_lines, batch_lines):
+        self.master = master
+        self.logid = logid
+        self.logtype = logtype
+        self.num_lines = num_lines
+        self.batch_lines = batch_lines
+        self.next_line = 0
+
+    @defer.inlineCallbacks
+    def read(self):
+        """
+        Get the next batch of content, or None once the whole log was read.
+        """
+        if self.next_line >= self.num_lines:
+            return
+        first_line = self.next_line
+        last_line = min(first_line + self.batch_lines, self.num_lines) - 1
+        self.next_line = last_line + 1
+        logLines = yield self.master.db.logs.getLogLines(
+            self.logid, first_line, last_line)
+
+        if self.logtype == 's':
+            # stream logs lose their trailing newline, for compatibility
+            lines = [line[1:] for line in logLines.split(u'\n')[:-1]]
+            logLines = u'\n'.join(lines)
+            if first_line > 0 and lines:
+                logLines = u'\n' + logLines
+        defer.returnValue(logLines)
+
+
 class LogChunk(base.ResourceType):
 
     name = "logchunk"
@@ -178,6 +178,15 @@ class Master(base.ResourceType):
         yield self.master.db.buildrequests.unclaimBuildRequests(
             brids=[br['buildrequestid'] for br in buildrequests])
 
+        # release the distributed master locks it held, and wake up the
+        # builds waiting for them on the other masters
+        released = yield self.master.db.masterlocks.releaseMasterClaims(
+            masterid=masterid)
+        for lockid, slots in sorted(released.items()):
+            self.master.mq.produce(('masterlocks', str(lockid), 'released'),
+                                   dict(lockid=lockid, masterid=masterid,
+                                        slots=slots))
+
     @defer.inlineCallbacks
     def _masterDeactivated(self, masterid, name):
         yield self._masterDeactivatedHousekeeping(masterid, name)
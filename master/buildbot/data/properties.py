@@ -15,7 +15,6 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
-from future.utils import iteritems
 
 from twisted.internet import defer
 
@@ -66,17 +65,12 @@ class Properties(base.ResourceType):
     @base.updateMethod
     @defer.inlineCallbacks
     def setBuildProperties(self, buildid, properties):
-        to_update = {}
-        oldproperties = yield self.master.data.get(('builds', str(buildid), "properties"))
-        for k, v in iteritems(properties.getProperties().asDict()):
-            if k in oldproperties and oldproperties[k] == v:
-                continue
-            to_update[k] = v
-
+        # only the properties which changed since the last call are written
+        properties = properties.getProperties()
+        to_update = properties.getDirtyProperties()
         if to_update:
-            for k, v in iteritems(to_update):
-                yield self.master.db.builds.setBuildProperty(
-                    buildid, k, v[0], v[1])
+            yield self.master.db.builds.setBuildProperties(buildid, to_update)
+            properties.markClean(to_update)
             yield self.generateUpdateEvent(buildid, to_update)
 
     @base.updateMethod
@@ -17,11 +17,14 @@ from __future__ import absolute_import
 from __future__ import print_function
 from future.utils import iteritems
 
+from operator import itemgetter
+
 import sqlalchemy as sa
 
 from twisted.python import log
 
 from buildbot.data import base
+from buildbot.util import lru
 
 
 class FieldBase(object):
@@ -157,6 +160,107 @@ class ReverseComparator(object):
         return other.value > self.value
 
 
+class CompiledResultSpec(object):
+
+    """
+    The filters, ordering and field selection of a L{ResultSpec}, compiled
+    into functions to apply them to collections in Python: filters are
+    closures specialized for their operator and values, ordering uses
+    C{itemgetter} keys instead of comparator objects, and fields are only
+    selected from the rows which are returned.
+
+    @param key: the key returned by L{ResultSpec.getCompileKey}: a tuple of
+    filters (as (field, op, values) tuples), fields and order
+    """
+
+    __slots__ = ['predicates', 'sortKeys', 'fields', 'missingField',
+                 '__weakref__']
+
+    def __init__(self, key):
+        filters, fields, order = key
+        self.predicates = [self.compileFilter(field, op, values)
+                           for field, op, values in filters]
+        self.sortKeys = []
+        # the rows are sorted by the least significant key first, relying on
+        # the stability of the sort
+        for k in reversed(order or ()):
+            if k.startswith('-'):
+                self.sortKeys.append((k[1:], True))
+            else:
+                self.sortKeys.append((k, False))
+        self.fields = fields
+        # as far as the result is concerned, fields are selected before
+        # filtering and ordering: filtering or ordering on a field which is
+        # not selected fails
+        self.missingField = None
+        if fields:
+            used = [f[0] for f in filters] + [k for k, _ in self.sortKeys]
+            for k in used:
+                if k not in fields:
+                    self.missingField = k
+                    break
+
+    @staticmethod
+    def compileFilter(field, op, values):
+        if len(values) == 1:
+            v = values[0]
+            if op == 'eq':
+                return lambda d: d[field] == v
+            if op == 'ne':
+                return lambda d: d[field] != v
+            if op == 'lt':
+                return lambda d: d[field] < v
+            if op == 'le':
+                return lambda d: d[field] <= v
+            if op == 'gt':
+                return lambda d: d[field] > v
+            if op == 'ge':
+                return lambda d: d[field] >= v
+            fn = FieldBase.singular_operators[op]
+        else:
+            if op in ('eq', 'ne'):
+                try:
+                    values = frozenset(values)
+                except TypeError:
+                    pass
+            if op == 'eq':
+                return lambda d: d[field] in values
+            if op == 'ne':
+                return lambda d: d[field] not in values
+            fn = FieldBase.plural_operators[op]
+        return lambda d: fn(d[field], values)
+
+    def select(self, data):
+        """Return a new list of the rows of C{data} matching the filters, in
+        order"""
+        rows = data
+        for predicate in self.predicates:
+            rows = filter(predicate, rows)
+        rows = list(rows)
+        if rows and self.missingField is not None:
+            raise KeyError(self.missingField)
+        for k, reverse in self.sortKeys:
+            key = itemgetter(k)
+            if None in map(key, rows):
+                # None cannot be compared on Python 3; it sorts first
+                def key(d, k=k):
+                    v = d[k]
+                    return (v is not None, v)
+            rows.sort(key=key, reverse=reverse)
+        return rows
+
+    def project(self, rows):
+        """Return the rows with only the selected fields"""
+        fields = self.fields
+        if not fields:
+            return rows
+        return [{k: d[k] for k in fields if k in d} for d in rows]
+
+
+# compiled result specs, by ResultSpec.getCompileKey
+_compiledSpecs = lru.LRUCache(CompiledResultSpec, max_size=200)
+
+
 class ResultSpec(object):
 
     __slots__ = ['filters', 'fields', 'properties',
@@ -187,6 +291,22 @@ class ResultSpec(object):
     def __ne__(self, b):
         return not (self == b)
 
+    def getCompileKey(self):
+        return (tuple((f.field, f.op, tuple(f.values)) for f in self.filters),
+                tuple(self.fields) if self.fields else None,
+                tuple(self.order) if self.order else None)
+
+    def compile(self):
+        """Return the L{CompiledResultSpec} for the current filters, fields
+        and order; they are cached, as the same queries tend to be repeated
+        (e.g. by polling clients)"""
+        key = self.getCompileKey()
+        try:
+            return _compiledSpecs.get(key)
+        except TypeError:
+            # unhashable filter values
+            return CompiledResultSpec(key)
+
     def popProperties(self):
         values = []
         for p in self.properties:
@@ -330,90 +450,44 @@ class ResultSpec(object):
         if data is None:
             return data
 
-        if self.fields:
-            fields = set(self.fields)
-
-            def includeFields(d):
-                return dict((k, v) for k, v in iteritems(d)
-                            if k in fields)
-            applyFields = includeFields
-        else:
-            fields = None
-
         if isinstance(data, dict):
             # item details
-            if fields:
-                data = applyFields(data)
+            if self.fields:
+                fields = set(self.fields)
+                data = dict((k, v) for k, v in iteritems(data)
+                            if k in fields)
             return data
+
+        # item collection
+        if isinstance(data, base.ListResult):
+            # if pagination was applied, then fields, etc. must be empty
+            assert not self.fields and not self.order and not self.filters, \
+                "endpoint must apply fields, order, and filters if it performs pagination"
+            offset, total = data.offset, data.total
+            limit = data.limit
         else:
-            filters = self.filters
-            order = self.order
-
-            # item collection
-            if isinstance(data, base.ListResult):
-                # if pagination was applied, then fields, etc. must be empty
-                assert not fields and not order and not filters, \
-                    "endpoint must apply fields, order, and filters if it performs pagination"
-                offset, total = data.offset, data.total
-                limit = data.limit
-            else:
-                offset, total = None, None
-                limit = None
-
-            if fields:
-                data = (applyFields(d) for d in data)
-
-            # link the filters together and then flatten to list
-            for f in self.filters:
-                data = f.apply(data)
-            data = list(data)
-
-            if total is None:
-                total = len(data)
-
-            if self.order:
-                def keyFunc(elem, order=self.order):
-                    """
-                    Do a multi-level sort by passing in the keys
-                    to sort by.
-
-                    @param elem: each item in the list to sort.  It must be
-                              a C{dict}
-                    @param order: a list of keys to sort by, such as:
-                                ('lastName', 'firstName', 'age')
-                    @return: a key used by sorted(). This will be a
-                             list such as:
-                             [a['lastName', a['firstName'], a['age']]
-                    @rtype: a C{list}
-                    """
-                    compareKey = []
-                    for k in order:
-                        doReverse = False
-                        if k[0] == '-':
-                            # If we get a key '-lastName',
-                            # it means sort by 'lastName' in reverse.
-                            k = k[1:]
-                            doReverse = True
-                        val = NoneComparator(elem[k])
-                        if doReverse:
-                            val = ReverseComparator(val)
-                        compareKey.append(val)
-                    return compareKey
-
-                data.sort(key=keyFunc)
-
-            # finally, slice out the limit/offset
-            if self.offset is not None or self.limit is not None:
-                if offset is not None or limit is not None:
-                    raise AssertionError("endpoint must clear offset/limit")
-                end = ((self.offset or 0) + self.limit
-                       if self.limit is not None
-                       else None)
-                data = data[self.offset:end]
-                offset = self.offset
-                limit = self.limit
-
-            rv = base.ListResult(data)
-            rv.offset, rv.total = offset, total
-            rv.limit = limit
-            return rv
+            offset, total = None, None
+            limit = None
+
+        compiled = self.compile()
+        data = compiled.select(data)
+
+        if total is None:
+            total = len(data)
+
+        # slice out the limit/offset
+        if self.offset is not None or self.limit is not None:
+            if offset is not None or limit is not None:
+                raise AssertionError("endpoint must clear offset/limit")
+            end = ((self.offset or 0) + self.limit
+                   if self.limit is not None
+                   else None)
+            data = data[self.offset:end]
+            offset = self.offset
+            limit = self.limit
+
+        # finally, select the fields of the returned rows
+        rv = base.ListResult(compiled.project(data))
+        rv.offset, rv.total = offset, total
+        rv.limit = limit
+        return rv
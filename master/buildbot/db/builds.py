@@ -15,6 +15,7 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
+from future.utils import iteritems
 
 import json
 
@@ -25,12 +26,17 @@ from twisted.internet import reactor
 
 from buildbot.db import NULL
 from buildbot.db import base
+from buildbot.process.results import SUCCESS
 from buildbot.util import epoch2datetime
 
 
 class BuildsConnectorComponent(base.DBConnectorComponent):
     # Documentation is in developer/db.rst
 
+    # getPrevBuild compares the source stamps of this many candidate builds
+    # at a time, so that a long history is not loaded all at once
+    PREV_BUILD_BATCH = 50
+
     def _getBuild(self, whereclause):
         def thd(conn):
             q = self.db.model.builds.select(whereclause=whereclause)
@@ -52,52 +58,90 @@ class BuildsConnectorComponent(base.DBConnectorComponent):
             (self.db.model.builds.c.builderid == builderid) &
             (self.db.model.builds.c.number == number))
 
-    def _getRecentBuilds(self, whereclause, offset=0, limit=1):
+    def getPrevBuild(self, builderid, number, results=None, skipResults=None,
+                     ssBuild=None):
+        """ Get the build of the builder with the highest number below
+        C{number}, finished or not, with a result in C{results} (if given,
+        so the build is finished) but not in C{skipResults} (if given), and
+        built from source stamps with the same repositories, branches and
+        codebases as C{ssBuild} (if given) """
+        return self._getPrevBuild(builderid, number, results, skipResults,
+                                  ssBuild, byCompletion=False)
+
+    def getPrevSuccessfulBuild(self, builderid, number, ssBuild):
+        # the most recently completed one, rather than the highest number
+        return self._getPrevBuild(builderid, number, [SUCCESS], None,
+                                  ssBuild, byCompletion=True)
+
+    def _getPrevBuild(self, builderid, number, results, skipResults, ssBuild,
+                      byCompletion):
         def thd(conn):
             tbl = self.db.model.builds
+            whereclause = sa.and_(tbl.c.builderid == builderid,
+                                  tbl.c.number < number)
+            if results is not None:
+                whereclause = sa.and_(whereclause, tbl.c.results.in_(results))
+            if skipResults:
+                whereclause = sa.and_(
+                    whereclause,
+                    sa.or_(tbl.c.results == NULL,
+                           ~tbl.c.results.in_(skipResults)))
+            if byCompletion:
+                order_by = [sa.desc(tbl.c.complete_at), sa.desc(tbl.c.number)]
+            else:
+                order_by = [sa.desc(tbl.c.number)]
 
-            q = tbl.select(whereclause=whereclause,
-                           order_by=[sa.desc(tbl.c.complete_at)],
-                           offset=offset,
-                           limit=limit)
+            if ssBuild is None:
+                q = tbl.select(whereclause=whereclause, order_by=order_by,
+                               limit=1)
+                row = conn.execute(q).fetchone()
+                return self._builddictFromRow(row) if row else None
 
-            res = conn.execute(q)
-            return list([self._builddictFromRow(row)
-                         for row in res.fetchall()])
+            # get the source stamps of the candidate builds along with them,
+            # so that they can be compared without any further query
+            matchssBuild = set([(ss['repository'],
+                                 ss['branch'],
+                                 ss['codebase']) for ss in ssBuild])
+            reqs_tbl = self.db.model.buildrequests
+            bsss_tbl = self.db.model.buildset_sourcestamps
+            sstamps_tbl = self.db.model.sourcestamps
+            from_clause = tbl.outerjoin(
+                reqs_tbl, tbl.c.buildrequestid == reqs_tbl.c.id)
+            from_clause = from_clause.outerjoin(
+                bsss_tbl, reqs_tbl.c.buildsetid == bsss_tbl.c.buildsetid)
+            from_clause = from_clause.outerjoin(
+                sstamps_tbl, bsss_tbl.c.sourcestampid == sstamps_tbl.c.id)
+            offset = 0
+            while True:
+                # the next batch of candidate builds
+                q = sa.select([tbl.c.id],
+                              whereclause=whereclause,
+                              order_by=order_by,
+                              offset=offset,
+                              limit=self.PREV_BUILD_BATCH)
+                batch = [row.id for row in conn.execute(q).fetchall()]
+                if not batch:
+                    return None
 
+                q = sa.select([tbl,
+                               sstamps_tbl.c.id.label('ssid'),
+                               sstamps_tbl.c.repository,
+                               sstamps_tbl.c.branch,
+                               sstamps_tbl.c.codebase],
+                              whereclause=tbl.c.id.in_(batch),
+                              from_obj=from_clause)
+                rows = {}
+                for row in conn.execute(q).fetchall():
+                    rows.setdefault(row.id, []).append(row)
+                for buildid in batch:
+                    ssbuild = set([(row.repository, row.branch, row.codebase)
+                                   for row in rows[buildid]
+                                   if row.ssid is not None])
+                    if ssbuild == matchssBuild:
+                        return self._builddictFromRow(rows[buildid][0])
+                offset += len(batch)
         return self.db.pool.do(thd)
 
-    @defer.inlineCallbacks
-    def getPrevSuccessfulBuild(self, builderid, number, ssBuild):
-        gssfb = self.master.db.sourcestamps.getSourceStampsForBuild
-        rv = None
-        tbl = self.db.model.builds
-        offset = 0
-        matchssBuild = set([(ss['repository'],
-                             ss['branch'],
-                             ss['codebase']) for ss in ssBuild])
-        while rv is None:
-            # Get some recent successful builds on the same builder
-            prevBuilds = yield self._getRecentBuilds(whereclause=((tbl.c.builderid == builderid) &
-                                                                  (tbl.c.number < number) &
-                                                                  (tbl.c.results == 0)),
-                                                     offset=offset,
-                                                     limit=10)
-            if not prevBuilds:
-                break
-            for prevBuild in prevBuilds:
-                prevssBuild = set([(ss['repository'],
-                                    ss['branch'],
-                                    ss['codebase']) for ss in (yield gssfb(prevBuild['id']))])
-                if prevssBuild == matchssBuild:
-                    # A successful build with the same
-                    # repository/branch/codebase was found !
-                    rv = prevBuild
-                    break
-            offset += 10
-
-        defer.returnValue(rv)
-
     def getBuilds(self, builderid=None, buildrequestid=None, workerid=None, complete=None, resultSpec=None):
         def thd(conn):
             tbl = self.db.model.builds
@@ -207,6 +251,101 @@ class BuildsConnectorComponent(base.DBConnectorComponent):
                              dict(value=value_js, source=source))
         return self.db.pool.do(thd)
 
+    def setBuildProperties(self, bid, properties):
+        """ Set several properties at once, in a single transaction;
+        C{properties} is a dictionary mapping names to (value, source) """
+        def thd(conn):
+            bp_tbl = self.db.model.build_properties
+            for name, (value, source) in iteritems(properties):
+                self.checkLength(bp_tbl.c.name, name)
+                self.checkLength(bp_tbl.c.source, source)
+            q = sa.select([bp_tbl.c.name, bp_tbl.c.value, bp_tbl.c.source],
+                          whereclause=(bp_tbl.c.buildid == bid))
+            existing = dict((row.name, (row.value, row.source))
+                            for row in conn.execute(q))
+
+            inserts = []
+            updates = []
+            for name, (value, source) in iteritems(properties):
+                value_js = json.dumps(value)
+                if name not in existing:
+                    inserts.append(dict(buildid=bid, name=name,
+                                        value=value_js, source=source))
+                elif existing[name] != (value_js, source):
+                    updates.append(dict(b_name=name, value=value_js,
+                                        source=source))
+
+            transaction = conn.begin()
+            if inserts:
+                conn.execute(bp_tbl.insert(), inserts)
+            if updates:
+                q = bp_tbl.update(
+                    whereclause=sa.and_(bp_tbl.c.buildid == bid,
+                                        bp_tbl.c.name == sa.bindparam('b_name')))
+                conn.execute(q, updates)
+            transaction.commit()
+        return self.db.pool.do(thd)
+
+    def pruneBuilds(self, builderid, buildHorizon, limit=100):
+        """
+        Called periodically by DBConnector, this method deletes at most
+        C{limit} finished builds of C{builderid} older than the last
+        C{buildHorizon} builds, along with their steps, logs and properties.
+
+        @returns: tuple (builds, rows, bytes) via Deferred
+        """
+        if not buildHorizon:
+            return defer.succeed((0, 0, 0))
+
+        def thd(conn):
+            tbl = self.db.model.builds
+
+            # find the newest build which must go, using builds_number
+            q = sa.select([tbl.c.number])
+            q = q.where(tbl.c.builderid == builderid)
+            q = q.order_by(sa.desc(tbl.c.number))
+            q = q.offset(buildHorizon).limit(1)
+            horizon_number = conn.scalar(q)
+            if horizon_number is None:
+                return 0, 0, 0
+
+            q = sa.select([tbl.c.id])
+            q = q.where(tbl.c.builderid == builderid)
+            q = q.where(tbl.c.number <= horizon_number)
+            q = q.where(tbl.c.complete_at != NULL)
+            q = q.order_by(tbl.c.number).limit(limit)
+            buildids = [r.id for r in conn.execute(q)]
+            if not buildids:
+                return 0, 0, 0
+
+            steps_tbl = self.db.model.steps
+            logs_tbl = self.db.model.logs
+            stepids = sa.select([steps_tbl.c.id]).where(
+                steps_tbl.c.buildid.in_(buildids))
+            logids = [r.id for r in conn.execute(
+                sa.select([logs_tbl.c.id]).where(logs_tbl.c.stepid.in_(stepids)))]
+
+            transaction = conn.begin()
+            rows, nbytes = 0, 0
+            if logids:
+                rows, nbytes = self.db.logs.thdDeleteLogChunks(conn, logids)
+                rows += conn.execute(
+                    logs_tbl.delete().where(logs_tbl.c.id.in_(logids))).rowcount
+            rows += conn.execute(
+                steps_tbl.delete().where(steps_tbl.c.buildid.in_(buildids))).rowcount
+            bp_tbl = self.db.model.build_properties
+            rows += conn.execute(
+                bp_tbl.delete().where(bp_tbl.c.buildid.in_(buildids))).rowcount
+            # buildsets triggered by the pruned builds lose their parent
+            bs_tbl = self.db.model.buildsets
+            conn.execute(bs_tbl.update(whereclause=bs_tbl.c.parent_buildid.in_(buildids)),
+                         parent_buildid=None).close()
+            rows += conn.execute(
+                tbl.delete().where(tbl.c.id.in_(buildids))).rowcount
+            transaction.commit()
+            return len(buildids), rows, nbytes
+        return self.db.pool.do(thd)
+
     def _builddictFromRow(self, row):
         def mkdt(epoch):
             if epoch:
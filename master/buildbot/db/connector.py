@@ -32,6 +32,7 @@ from buildbot.db import changesources
 from buildbot.db import enginestrategy
 from buildbot.db import exceptions
 from buildbot.db import logs
+from buildbot.db import masterlocks
 from buildbot.db import masters
 from buildbot.db import model
 from buildbot.db import pool
@@ -42,6 +43,7 @@ from buildbot.db import steps
 from buildbot.db import tags
 from buildbot.db import users
 from buildbot.db import workers
+from buildbot.process import metrics
 from buildbot.util import service
 from buildbot.worker_transition import WorkerAPICompatMixin
 
@@ -71,6 +73,11 @@ class DBConnector(WorkerAPICompatMixin, service.ReconfigurableServiceMixin,
     # periodic cleanup actions on this schedule.
     CLEANUP_PERIOD = 3600
 
+    # Number of builds (for buildHorizon) or logs (for logHorizon) deleted in
+    # each cleanup transaction.  The cleanup task runs such batches until
+    # there is nothing left to delete, or c['cleanupTimeBudget'] is spent.
+    CLEANUP_BATCH_SIZE = 100
+
     def __init__(self, basedir):
         service.AsyncMultiService.__init__(self)
         self.setName('db')
@@ -101,6 +108,7 @@ class DBConnector(WorkerAPICompatMixin, service.ReconfigurableServiceMixin,
         self._registerOldWorkerAttr("workers", name="buildslaves")
         self.users = users.UsersConnectorComponent(self)
         self.masters = masters.MastersConnectorComponent(self)
+        self.masterlocks = masterlocks.MasterLocksConnectorComponent(self)
         self.builders = builders.BuildersConnectorComponent(self)
         self.steps = steps.StepsConnectorComponent(self)
         self.tags = tags.TagsConnectorComponent(self)
@@ -133,6 +141,14 @@ class DBConnector(WorkerAPICompatMixin, service.ReconfigurableServiceMixin,
                     log.msg(l)
                 raise exceptions.DatabaseNotReadyError()
 
+    @defer.inlineCallbacks
+    def stopService(self):
+        # write out any buffered log lines before the pool goes away
+        if self.pool is not None:
+            yield self.logs.stopBuffering()
+            self.logs.stopCompressing()
+        yield service.AsyncMultiService.stopService(self)
+
     def reconfigServiceWithBuildbotConfig(self, new_config):
         # double-check -- the master ensures this in config checks
         assert self.configured_url == new_config.db['db_url']
@@ -152,4 +168,55 @@ class DBConnector(WorkerAPICompatMixin, service.ReconfigurableServiceMixin,
 
         d = self.changes.pruneChanges(self.master.config.changeHorizon)
         d.addErrback(log.err, 'while pruning changes')
+        d.addCallback(lambda _: self._pruneHorizons())
+        d.addErrback(log.err, 'while pruning builds and logs')
         return d
+
+    @defer.inlineCallbacks
+    def _pruneHorizons(self):
+        config = self.master.config
+        if not config.buildHorizon and not config.logHorizon:
+            return
+
+        timer = metrics.Timer("DBConnector._pruneHorizons()")
+        timer.start()
+        deadline = self.master.reactor.seconds() + config.cleanupTimeBudget
+        pruned = dict(builds=0, logs=0, rows=0, bytes=0)
+
+        builders = yield self.builders.getBuilders()
+        for builder in builders:
+            # prune builds first, as that also removes their logs
+            yield self._pruneBatches(self.builds.pruneBuilds, builder['id'],
+                                     config.buildHorizon, deadline,
+                                     pruned, 'builds')
+            yield self._pruneBatches(self.logs.pruneLogChunks, builder['id'],
+                                     config.logHorizon, deadline,
+                                     pruned, 'logs')
+            if self.master.reactor.seconds() >= deadline:
+                log.msg("cleanup time budget exhausted; pruning of builds and "
+                        "logs will continue during the next cleanup")
+                break
+
+        timer.stop()
+        metrics.MetricCountEvent.log('DBConnector.pruned_builds', pruned['builds'])
+        metrics.MetricCountEvent.log('DBConnector.pruned_logs', pruned['logs'])
+        metrics.MetricCountEvent.log('DBConnector.pruned_rows', pruned['rows'])
+        metrics.MetricCountEvent.log('DBConnector.pruned_bytes', pruned['bytes'])
+        if pruned['rows']:
+            log.msg("pruned %(builds)d builds and the logs of %(logs)d others, "
+                    "deleting %(rows)d rows and %(bytes)d bytes of log content"
+                    % pruned)
+
+    @defer.inlineCallbacks
+    def _pruneBatches(self, pruneFn, builderid, horizon, deadline, pruned, what):
+        # run batches until the builder is clean or the time is up
+        if not horizon:
+            return
+        while self.master.reactor.seconds() < deadline:
+            count, rows, nbytes = yield pruneFn(builderid, horizon,
+                                                limit=self.CLEANUP_BATCH_SIZE)
+            pruned[what] += count
+            pruned['rows'] += rows
+            pruned['bytes'] += nbytes
+            if count < self.CLEANUP_BATCH_SIZE:
+                break
@@ -16,14 +16,28 @@
 from __future__ import absolute_import
 from __future__ import print_function
 from future.builtins import range
+from future.utils import iteritems
 from future.utils import itervalues
 
+import array
+import re
+import threading
+
 import sqlalchemy as sa
 
 from twisted.internet import defer
+from twisted.internet import threads
 from twisted.python import log
+from twisted.python import threadpool
 
+from buildbot.db import NULL
 from buildbot.db import base
+from buildbot.util import lru
+
+
+_NEWLINE_RE = re.compile(u'\n')
+
+ZSTD_LEVEL = 10
 
 
 def dumps_gzip(data):
@@ -37,13 +51,20 @@ def read_gzip(data):
 
 
 def dumps_lz4(data):
-    import lz4
-    return lz4.dumps(data)
+    # lz4.dumps was replaced by lz4.block.compress, using the same format
+    try:
+        from lz4.block import compress
+    except ImportError:
+        from lz4 import dumps as compress
+    return compress(data)
 
 
 def read_lz4(data):
-    import lz4
-    return lz4.loads(data)
+    try:
+        from lz4.block import decompress
+    except ImportError:
+        from lz4 import loads as decompress
+    return decompress(data)
 
 
 def dumps_bz2(data):
@@ -56,6 +77,60 @@ def read_bz2(data):
     return bz2.decompress(data)
 
 
+def dumps_zstd(data, zdict=None):
+    import zstandard
+    kwargs = {'dict_data': zdict} if zdict is not None else {}
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL, **kwargs).compress(data)
+
+
+def read_zstd(data, zdict=None):
+    import zstandard
+    kwargs = {'dict_data': zdict} if zdict is not None else {}
+    return zstandard.ZstdDecompressor(**kwargs).decompress(data)
+
+
+class _LogAppendBuffer(object):
+
+    # Lines appended to a log which have not been committed to the database
+    # yet.  Each segment is a tuple (first_line, last_line, content) where
+    # content is utf-8 encoded and omits the trailing newline, just like a
+    # logchunks row.  Segments are only dropped once they are committed, so
+    # readers can always find a line either in the db or here.
+
+    def __init__(self):
+        self.logdict = None  # set once the log row has been loaded
+        self.waiters = []  # appendLog calls waiting for logdict
+        self.segments = []
+
+    @property
+    def num_lines(self):
+        return self.logdict['num_lines']
+
+
+class _DecodedLogChunk(object):
+
+    # The decompressed and decoded content of a logchunks row, with the offset
+    # of each newline in it, so that any range of its lines can be sliced
+    # without scanning the content.
+
+    __slots__ = ('first_line', 'content', 'newlines', '__weakref__')
+
+    def __init__(self, first_line, content):
+        self.first_line = first_line
+        self.content = content
+        self.newlines = array.array(
+            'I', (m.start() for m in _NEWLINE_RE.finditer(content)))
+
+    def getLines(self, first_line, last_line):
+        # return the given lines of this chunk, without the trailing newline
+        start = first_line - self.first_line
+        end = last_line - self.first_line
+        start = self.newlines[start - 1] + 1 if start > 0 else 0
+        if end < len(self.newlines):
+            return self.content[start:self.newlines[end]]
+        return self.content[start:]
+
+
 class LogsConnectorComponent(base.DBConnectorComponent):
 
     # Postgres and MySQL will both allow bigger sizes than this.  The limit
@@ -65,11 +140,70 @@ class LogsConnectorComponent(base.DBConnectorComponent):
     COMPRESSION_MODE = {"raw": {"id": 0, "dumps": lambda x: x, "read": lambda x: x},
                         "gz": {"id": 1, "dumps": dumps_gzip, "read": read_gzip},
                         "bz2": {"id": 2, "dumps": dumps_bz2, "read": read_bz2},
-                        "lz4": {"id": 3, "dumps": dumps_lz4, "read": read_lz4}}
+                        "lz4": {"id": 3, "dumps": dumps_lz4, "read": read_lz4},
+                        "zstd": {"id": 4, "dumps": dumps_zstd, "read": read_zstd}}
     COMPRESSION_BYID = dict((x["id"], x) for x in itervalues(COMPRESSION_MODE))
     total_raw_bytes = 0
     total_compressed_bytes = 0
 
+    # appended lines are buffered in memory and written to the database in
+    # batches, once APPEND_FLUSH_SIZE bytes are pending for all logs, or
+    # APPEND_FLUSH_DELAY seconds after the first pending append.
+    APPEND_FLUSH_SIZE = 1 << 20
+    APPEND_FLUSH_DELAY = 0.5
+    # once more than APPEND_HIGH_WATER bytes are pending, appendLog only
+    # returns when its lines are written, so that callers (and the workers
+    # behind them) slow down to the pace of the database
+    APPEND_HIGH_WATER = 8 << 20
+
+    # default number of decompressed chunks kept in memory for getLogLines,
+    # overridden by c['caches']['logchunks']
+    CHUNK_CACHE_SIZE = 20
+
+    # zstd dictionaries are trained on up to DICT_TRAINING_MAX_BYTES of the
+    # most recent log content of a builder, cut in samples of DICT_SAMPLE_SIZE
+    # bytes, once there is at least DICT_TRAINING_MIN_BYTES of it.  Builders
+    # without a dictionary are looked up again every DICT_RECHECK_INTERVAL
+    # seconds, in case another master trained one, and training is not
+    # attempted again for them before that either.
+    DICT_SIZE = 65536
+    DICT_SAMPLE_SIZE = 4096
+    DICT_TRAINING_MIN_BYTES = 1 << 20
+    DICT_TRAINING_MAX_BYTES = 8 << 20
+    DICT_RECHECK_INTERVAL = 3600
+
+    # chunks are compressed, and dictionaries trained, in a thread pool of
+    # at most COMPRESS_THREADS threads, so that this work neither holds a
+    # database connection nor starves the reactor's thread pool
+    COMPRESS_THREADS = 2
+
+    def __init__(self, connector):
+        base.DBConnectorComponent.__init__(self, connector)
+        # zstd dictionaries, by dict_id, and (dict_id, checked_at) of the
+        # current dictionary of each builder; both are used from db threads
+        self._dictionaries = {}
+        self._builderDictionaries = {}
+        # time of the last failed training attempt for each builder
+        self._trainingAttempts = {}
+        self._compressPool = None
+        self._compressPoolStopEvt = None
+        # logids being compressed, with the Deferreds waiting for them
+        self._compressingLogs = {}
+        self._appendBuffers = {}
+        self._pendingBytes = 0
+        self._flushTimer = None
+        self._flushing = False
+        self._buffering = True
+        self._flushWaiters = []
+        # total bytes appended, and written, since the start; appendLog calls
+        # above the high-water mark wait for the written count to reach the
+        # appended count at the time of their call
+        self._appendedBytes = 0
+        self._writtenBytes = 0
+        self._drainWaiters = []
+        self._chunkCache = self._makeChunkCache()
+        self._chunkCacheLock = threading.Lock()
+
     def _getLog(self, whereclause):
         def thd_getLog(conn):
             q = self.db.model.logs.select(whereclause=whereclause)
@@ -84,11 +218,18 @@ class LogsConnectorComponent(base.DBConnectorComponent):
         return self.db.pool.do(thd_getLog)
 
     def getLog(self, logid):
-        return self._getLog(self.db.model.logs.c.id == logid)
+        buf = self._appendBuffers.get(logid)
+        if buf is not None and buf.logdict is not None:
+            return defer.succeed(buf.logdict.copy())
+        d = self._getLog(self.db.model.logs.c.id == logid)
+        d.addCallback(self._addBufferedNumLines)
+        return d
 
     def getLogBySlug(self, stepid, slug):
         tbl = self.db.model.logs
-        return self._getLog((tbl.c.slug == slug) & (tbl.c.stepid == stepid))
+        d = self._getLog((tbl.c.slug == slug) & (tbl.c.stepid == stepid))
+        d.addCallback(self._addBufferedNumLines)
+        return d
 
     def getLogs(self, stepid=None):
         def thdGetLogs(conn):
@@ -99,41 +240,136 @@ class LogsConnectorComponent(base.DBConnectorComponent):
             q = q.order_by(tbl.c.id)
             res = conn.execute(q)
             return [self._logdictFromRow(row) for row in res.fetchall()]
-        return self.db.pool.do(thdGetLogs)
+        d = self.db.pool.do(thdGetLogs)
+
+        @d.addCallback
+        def addBufferedNumLines(logdicts):
+            return [self._addBufferedNumLines(ld) for ld in logdicts]
+        return d
+
+    def getLogIds(self, afterid=None, limit=None):
+        def thdGetLogIds(conn):
+            tbl = self.db.model.logs
+            q = sa.select([tbl.c.id])
+            if afterid is not None:
+                q = q.where(tbl.c.id > afterid)
+            q = q.order_by(tbl.c.id)
+            if limit is not None:
+                q = q.limit(limit)
+            return [row.id for row in conn.execute(q).fetchall()]
+        return self.db.pool.do(thdGetLogIds)
+
+    def countLogs(self, afterid=None):
+        def thdCountLogs(conn):
+            tbl = self.db.model.logs
+            q = sa.select([sa.func.count(tbl.c.id)])
+            if afterid is not None:
+                q = q.where(tbl.c.id > afterid)
+            return conn.scalar(q)
+        return self.db.pool.do(thdCountLogs)
 
     def getLogLines(self, logid, first_line, last_line):
+        # lines which are still buffered are read from memory; everything
+        # before the first buffered segment is guaranteed to be committed.
+        buf = self._appendBuffers.get(logid)
+        segments = list(buf.segments) if buf is not None else []
+        db_last_line = last_line
+        if segments:
+            db_last_line = min(last_line, segments[0][0] - 1)
+
         def thdGetLogLines(conn):
+            store = self._getChunkStore()
+            if store is None:
+                return thdGetLogLinesLocked(conn, store)
+            # keep the chunks from moving until they are read
+            with store.locked(logid):
+                return thdGetLogLinesLocked(conn, store)
+
+        def thdGetLogLinesLocked(conn, store):
             # get a set of chunks that completely cover the requested range
             tbl = self.db.model.logchunks
-            q = sa.select([tbl.c.first_line, tbl.c.last_line,
-                           tbl.c.content, tbl.c.compressed])
+            q = sa.select([tbl.c.first_line, tbl.c.last_line])
             q = q.where(tbl.c.logid == logid)
-            q = q.where(tbl.c.first_line <= last_line)
+            q = q.where(tbl.c.first_line <= db_last_line)
             q = q.where(tbl.c.last_line >= first_line)
             q = q.order_by(tbl.c.first_line)
-            rv = []
-            for row in conn.execute(q):
-                # Retrieve associated "reader" and extract the data
-                # Note that row.content is stored as bytes, and our caller expects unicode
-                data = self.COMPRESSION_BYID[
-                    row.compressed]["read"](row.content)
-                content = data.decode('utf-8')
-
-                if row.first_line < first_line:
-                    idx = -1
-                    count = first_line - row.first_line
-                    for _ in range(count):
-                        idx = content.index('\n', idx + 1)
-                    content = content[idx + 1:]
-                if row.last_line > last_line:
-                    idx = len(content) + 1
-                    count = row.last_line - last_line
-                    for _ in range(count):
-                        idx = content.rindex('\n', 0, idx)
-                    content = content[:idx]
-                rv.append(content)
-            return u'\n'.join(rv) + u'\n' if rv else u''
-        return self.db.pool.do(thdGetLogLines)
+            bounds = [tuple(row) for row in conn.execute(q)]
+            if not bounds:
+                return u''
+
+            chunks = self._getCachedChunks(logid, bounds)
+            missing = [b for b in bounds if b not in chunks]
+            if missing:
+                # only fetch the content of the chunks which are not cached
+                q = sa.select([tbl.c.first_line, tbl.c.last_line,
+                               tbl.c.content, tbl.c.compressed,
+                               tbl.c.content_offset, tbl.c.content_length])
+                q = q.where(tbl.c.logid == logid)
+                q = q.where(tbl.c.first_line >= missing[0][0])
+                q = q.where(tbl.c.first_line <= missing[-1][0])
+                q = q.order_by(tbl.c.first_line)
+                rows = [row for row in conn.execute(q).fetchall()
+                        if (row.first_line, row.last_line) not in chunks]
+                new_chunks = {}
+                for row, raw in zip(rows, self.thdReadChunks(store, logid, rows)):
+                    # Retrieve associated "reader" and extract the data
+                    # Note that row.content is stored as bytes, and our caller expects unicode
+                    data = self.thdDecompressChunk(conn, row.compressed, raw)
+                    new_chunks[(row.first_line, row.last_line)] = \
+                        _DecodedLogChunk(row.first_line, data.decode('utf-8'))
+                self._putCachedChunks(logid, new_chunks)
+                chunks.update(new_chunks)
+                if any(b not in chunks for b in missing):
+                    # the chunks were merged by compressLog in the meantime
+                    return thdGetLogLinesLocked(conn, store)
+
+            rv = [chunks[b].getLines(first_line, db_last_line) for b in bounds]
+            return u'\n'.join(rv) + u'\n'
+
+        if first_line <= db_last_line:
+            d = self.db.pool.do(thdGetLogLines)
+        else:
+            d = defer.succeed(u'')
+        if db_last_line < last_line:
+            d.addCallback(lambda lines: lines + self._getBufferedLogLines(
+                segments, first_line, last_line))
+        return d
+
+    def _getCachedChunks(self, logid, bounds):
+        # called from db threads
+        with self._chunkCacheLock:
+            self._chunkCache.set_max_size(self.master.config.caches.get(
+                'logchunks', self.CHUNK_CACHE_SIZE))
+            chunks = {}
+            for b in bounds:
+                chunk = self._chunkCache.get((logid,) + b)
+                if chunk is not None:
+                    chunks[b] = chunk
+            return chunks
+
+    def _putCachedChunks(self, logid, chunks):
+        # called from db threads
+        with self._chunkCacheLock:
+            for b, chunk in iteritems(chunks):
+                self._chunkCache.put((logid,) + b, chunk)
+
+    def _invalidateCachedChunks(self, logids):
+        # called from db threads; log ids may be reused once deleted
+        with self._chunkCacheLock:
+            logids = set(logids)
+            if any(key[0] in logids for key in self._chunkCache.keys()):
+                self._chunkCache = self._makeChunkCache()
+
+    def _makeChunkCache(self):
+        return lru.LRUCache(lambda key: None, self.CHUNK_CACHE_SIZE)
+
+    def _getBufferedLogLines(self, segments, first_line, last_line):
+        buf_first_line = segments[0][0]
+        content = b'\n'.join(seg[2] for seg in segments).decode('utf-8')
+        lines = content.split(u'\n')
+        rv = lines[max(first_line - buf_first_line, 0):
+                   last_line - buf_first_line + 1]
+        return u'\n'.join(rv) + u'\n' if rv else u''
 
     def addLog(self, stepid, name, slug, type):
         assert type in 'tsh', "Log type must be one of t, s, or h"
@@ -149,7 +385,7 @@ class LogsConnectorComponent(base.DBConnectorComponent):
                     "log with slug '%r' already exists in this step" % (slug,))
         return self.db.pool.do(thdAddLog)
 
-    def thdCompressChunk(self, chunk):
+    def thdCompressChunk(self, chunk, zdict=None):
         # Set the default compressed mode to "raw" id
         compressed_id = self.COMPRESSION_MODE["raw"]["id"]
         self.total_raw_bytes += len(chunk)
@@ -157,7 +393,10 @@ class LogsConnectorComponent(base.DBConnectorComponent):
         if self.master.config.logCompressionMethod != "raw":
             compressed_mode = self.COMPRESSION_MODE[
                 self.master.config.logCompressionMethod]
-            compressed_chunk = compressed_mode["dumps"](chunk)
+            if zdict is not None:
+                compressed_chunk = dumps_zstd(chunk, zdict)
+            else:
+                compressed_chunk = compressed_mode["dumps"](chunk)
             # Is it useful to compress the chunk?
             if len(chunk) > len(compressed_chunk):
                 compressed_id = compressed_mode["id"]
@@ -165,49 +404,446 @@ class LogsConnectorComponent(base.DBConnectorComponent):
         self.total_compressed_bytes += len(chunk)
         return chunk, compressed_id
 
-    def thdSplitAndAppendChunk(self, conn, logid, content, first_line):
-        # Break the content up into chunks.  This takes advantage of the
-        # fact that no character but u'\n' maps to b'\n' in UTF-8.
+    def thdDecompressChunk(self, conn, compressed, data):
+        # conn may be None if the dictionary of the chunk, if any, was loaded
+        # by thdLoadDictionaries
+        if compressed == self.COMPRESSION_MODE["zstd"]["id"]:
+            import zstandard
+            dict_id = zstandard.get_frame_parameters(data).dict_id
+            zdict = self._thdGetDictionary(conn, dict_id) if dict_id else None
+            return read_zstd(data, zdict)
+        return self.COMPRESSION_BYID[compressed]["read"](data)
+
+    def thdLoadDictionaries(self, conn, chunks):
+        # load the dictionaries needed to decompress the given (compressed,
+        # data) chunks, so that it can be done without a connection
+        if any(compressed == self.COMPRESSION_MODE["zstd"]["id"]
+               for compressed, _ in chunks):
+            import zstandard
+            for compressed, data in chunks:
+                if compressed == self.COMPRESSION_MODE["zstd"]["id"]:
+                    dict_id = zstandard.get_frame_parameters(data).dict_id
+                    if dict_id:
+                        self._thdGetDictionary(conn, dict_id)
+
+    def thdSplitChunks(self, logid, content, first_line, zdict=None):
+        # Break the content up into logchunks rows.  This takes advantage of
+        # the fact that no character but u'\n' maps to b'\n' in UTF-8.
+        rows = []
         remaining = content
         chunk_first_line = last_line = first_line
         while remaining:
             chunk, remaining = self._splitBigChunk(remaining, logid)
             last_line = chunk_first_line + chunk.count(b'\n')
 
-            chunk, compressed_id = self.thdCompressChunk(chunk)
-            conn.execute(self.db.model.logchunks.insert(),
-                         dict(logid=logid, first_line=chunk_first_line,
-                              last_line=last_line, content=chunk,
-                              compressed=compressed_id)).close()
+            chunk, compressed_id = self.thdCompressChunk(chunk, zdict)
+            rows.append(dict(logid=logid, first_line=chunk_first_line,
+                             last_line=last_line, content=chunk,
+                             compressed=compressed_id))
             chunk_first_line = last_line + 1
-        conn.execute(self.db.model.logs.update(whereclause=(self.db.model.logs.c.id == logid)),
-                     num_lines=last_line + 1).close()
-        return first_line, last_line
+        return rows
+
+    def _useDictionaries(self):
+        config = self.master.config
+        return (config.logCompressionMethod == 'zstd' and
+                config.logCompressionDictionaries)
+
+    def _thdGetDictionary(self, conn, dict_id):
+        zdict = self._dictionaries.get(dict_id)
+        if zdict is None:
+            import zstandard
+            tbl = self.db.model.logchunk_dictionaries
+            q = sa.select([tbl.c.content]).where(tbl.c.dict_id == dict_id)
+            content = conn.execute(q).scalar() if conn is not None else None
+            if content is None:
+                raise RuntimeError("zstd dictionary %d is missing" % (dict_id,))
+            zdict = zstandard.ZstdCompressionDict(content)
+            self._dictionaries[dict_id] = zdict
+        return zdict
+
+    def _thdGetBuilderDictionary(self, conn, builderid, now):
+        # get the dictionary to compress the logs of the given builder with
+        dict_id, checked_at = self._builderDictionaries.get(
+            builderid, (None, None))
+        if dict_id is None and (checked_at is None or
+                                checked_at + self.DICT_RECHECK_INTERVAL <= now):
+            tbl = self.db.model.logchunk_dictionaries
+            q = sa.select([tbl.c.dict_id]).where(tbl.c.builderid == builderid)
+            q = q.order_by(sa.desc(tbl.c.id)).limit(1)
+            dict_id = conn.execute(q).scalar()
+            self._builderDictionaries[builderid] = (dict_id, now)
+        if dict_id is None:
+            return None
+        return self._thdGetDictionary(conn, dict_id)
+
+    def thdGetLogBuilderids(self, conn, logids):
+        logs_tbl = self.db.model.logs
+        steps_tbl = self.db.model.steps
+        builds_tbl = self.db.model.builds
+        q = sa.select([logs_tbl.c.id, builds_tbl.c.builderid])
+        q = q.select_from(logs_tbl.join(steps_tbl).join(builds_tbl))
+        q = q.where(logs_tbl.c.id.in_(logids))
+        return dict(tuple(row) for row in conn.execute(q))
+
+    def _getLogDictionaries(self, logids):
+        """
+        Get the zstd dictionary to compress the new chunks of each of the
+        given logs with, as a dictionary keyed by logid.
+        """
+        if not self._useDictionaries():
+            return defer.succeed({})
+        now = self.master.reactor.seconds()
+
+        def thd(conn):
+            builderids = self.thdGetLogBuilderids(conn, logids)
+            return dict((logid, self._thdGetBuilderDictionary(conn, builderid, now))
+                        for logid, builderid in iteritems(builderids))
+        return self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def _getCompressionDictionary(self, logid, now):
+        """
+        Get the zstd dictionary to recompress the given log with, training
+        one for its builder if it has none yet.
+        """
+        def thdGetDictionary(conn):
+            builderid = self.thdGetLogBuilderids(conn, [logid]).get(logid)
+            if builderid is None:
+                return None, None, None
+            zdict = self._thdGetBuilderDictionary(conn, builderid, now)
+            attempted_at = self._trainingAttempts.get(builderid)
+            if zdict is not None or (attempted_at is not None and
+                                     attempted_at + self.DICT_RECHECK_INTERVAL > now):
+                return builderid, zdict, None
+            return builderid, None, self.thdGetTrainingChunks(conn, builderid)
+        builderid, zdict, chunks = yield self.db.pool.do(thdGetDictionary)
+        if chunks is None:
+            defer.returnValue(zdict)
+
+        zdict = yield self._deferToCompressPool(
+            self.thdTrainDictionary, builderid, chunks)
+        if zdict is None:
+            self._trainingAttempts[builderid] = now
+            defer.returnValue(None)
+
+        def thdAddDictionary(conn):
+            dict_id = zdict.dict_id()
+            conn.execute(self.db.model.logchunk_dictionaries.insert(),
+                         dict(builderid=builderid, dict_id=dict_id,
+                              content=zdict.as_bytes())).close()
+            self._dictionaries[dict_id] = zdict
+            self._builderDictionaries[builderid] = (dict_id, now)
+        yield self.db.pool.do(thdAddDictionary)
+        self._trainingAttempts.pop(builderid, None)
+        defer.returnValue(zdict)
+
+    def thdGetTrainingChunks(self, conn, builderid):
+        # get the (compressed, data) chunks of the most recent log content of
+        # the given builder, up to DICT_TRAINING_MAX_BYTES of stored data
+        logs_tbl = self.db.model.logs
+        steps_tbl = self.db.model.steps
+        builds_tbl = self.db.model.builds
+        tbl = self.db.model.logchunks
+        q = sa.select([tbl.c.logid, tbl.c.content, tbl.c.compressed,
+                       tbl.c.content_offset, tbl.c.content_length])
+        q = q.select_from(tbl.join(logs_tbl).join(steps_tbl).join(builds_tbl))
+        q = q.where(builds_tbl.c.builderid == builderid)
+        q = q.order_by(sa.desc(tbl.c.logid), tbl.c.first_line)
+        res = conn.execute(q)
+        chunks = []
+        nbytes = 0
+        store = self._getChunkStore()
+        for row in res:
+            raw, = self.thdReadChunks(store, row.logid, [row])
+            chunks.append((row.compressed, raw))
+            nbytes += len(raw)
+            if nbytes >= self.DICT_TRAINING_MAX_BYTES:
+                break
+        res.close()
+        self.thdLoadDictionaries(conn, chunks)
+        return chunks
+
+    def thdTrainDictionary(self, builderid, chunks):
+        """
+        Train a zstd dictionary on the given (compressed, data) chunks of a
+        builder's logs; called from the compression thread pool.  Returns
+        None if there is not enough content yet.
+        """
+        import zstandard
+        samples = []
+        nbytes = 0
+        for compressed, raw in chunks:
+            data = self.thdDecompressChunk(None, compressed, raw)
+            for i in range(0, len(data), self.DICT_SAMPLE_SIZE):
+                samples.append(data[i:i + self.DICT_SAMPLE_SIZE])
+            nbytes += len(data)
+            if nbytes >= self.DICT_TRAINING_MAX_BYTES:
+                break
+        if nbytes < self.DICT_TRAINING_MIN_BYTES:
+            return None
+
+        try:
+            return zstandard.train_dictionary(self.DICT_SIZE, samples)
+        except zstandard.ZstdError as e:
+            log.msg("could not train a log compression dictionary for "
+                    "builder %d: %s" % (builderid, e))
+            return None
+
+    def _deferToCompressPool(self, f, *args):
+        if self._compressPool is None:
+            self._compressPool = threadpool.ThreadPool(
+                minthreads=0, maxthreads=self.COMPRESS_THREADS,
+                name='LogCompressPool')
+            self._compressPool.start()
+            self._compressPoolStopEvt = self.master.reactor.addSystemEventTrigger(
+                'during', 'shutdown', self._stopCompressPool)
+        return threads.deferToThreadPool(
+            self.master.reactor, self._compressPool, f, *args)
+
+    def _stopCompressPool(self):
+        self._compressPoolStopEvt = None
+        pool, self._compressPool = self._compressPool, None
+        pool.stop()
+
+    def stopCompressing(self):
+        """
+        Stop the compression thread pool.  It is started again when more
+        content is compressed.  Called when the db connector stops.
+        """
+        if self._compressPoolStopEvt is not None:
+            self.master.reactor.removeSystemEventTrigger(
+                self._compressPoolStopEvt)
+            self._stopCompressPool()
+
+    def _getChunkStore(self):
+        store = self.master.config.logChunkStore
+        if store is not None:
+            store.setBasedir(self.master.basedir)
+        return store
+
+    def thdStoreChunks(self, store, logid, rows):
+        # move the content of the given logchunks rows to the chunk store,
+        # leaving only its position in the rows
+        offsets = store.thdAppend(logid, [row['content'] for row in rows])
+        for row, offset in zip(rows, offsets):
+            row['content_offset'] = offset
+            row['content_length'] = len(row['content'])
+            row['content'] = None
 
-    def thdAppendLog(self, conn, logid, content):
+    def thdReadChunks(self, store, logid, rows):
+        # get the (still compressed) content of the given logchunks rows,
+        # from the chunk store for those whose content is not in the db
+        external = [row for row in rows if row.content is None]
+        if not external:
+            return [row.content for row in rows]
+        if store is None:
+            raise RuntimeError("content of log %d is kept in a log chunk "
+                               "store, but logChunkStore is not configured"
+                               % (logid,))
+        contents = iter(store.thdRead(
+            logid, [(row.content_offset, row.content_length)
+                    for row in external]))
+        return [next(contents) if row.content is None else row.content
+                for row in rows]
+
+    def appendLog(self, logid, content):
         # check for trailing newline and strip it for storage -- chunks omit
         # the trailing newline
         assert content[-1] == u'\n'
         # Note that row.content is stored as bytes, and our caller is sending unicode
         content = content[:-1].encode('utf-8')
-        q = sa.select([self.db.model.logs.c.num_lines])
-        q = q.where(self.db.model.logs.c.id == logid)
-        res = conn.execute(q)
-        num_lines = res.fetchone()
-        res.close()
-        if not num_lines:
-            return  # ignore a missing log
+        if len(content) >= self.MAX_CHUNK_SIZE:
+            # truncate overlong lines right away, so that buffered lines read
+            # the same before and after they are written to the db
+            chunks = []
+            while content is not None:
+                chunk, content = self._splitBigChunk(content, logid)
+                chunks.append(chunk)
+            content = b'\n'.join(chunks)
 
-        return self.thdSplitAndAppendChunk(conn=conn,
-                                           logid=logid,
-                                           content=content,
-                                           first_line=num_lines[0])
+        buf = self._appendBuffers.get(logid)
+        if buf is None:
+            buf = self._appendBuffers[logid] = _LogAppendBuffer()
+            d = self._getLog(self.db.model.logs.c.id == logid)
+            d.addCallback(self._appendBufferLoaded, logid, buf)
+            d.addErrback(self._appendBufferFailed, logid, buf)
+        if buf.logdict is None:
+            d = defer.Deferred()
+            buf.waiters.append(d)
 
-    def appendLog(self, logid, content):
-        def thdappendLog(conn):
-            return self.thdAppendLog(conn, logid, content)
+            @d.addCallback
+            def loaded(found):
+                if not found:
+                    return  # ignore a missing log
+                return self._bufferLines(buf, content)
+            return d
+        return self._bufferLines(buf, content)
+
+    def _appendBufferLoaded(self, logdict, logid, buf):
+        if logdict is None:
+            del self._appendBuffers[logid]
+        else:
+            buf.logdict = logdict
+        waiters, buf.waiters = buf.waiters, []
+        for d in waiters:
+            d.callback(logdict is not None)
+
+    def _appendBufferFailed(self, f, logid, buf):
+        del self._appendBuffers[logid]
+        waiters, buf.waiters = buf.waiters, []
+        for d in waiters:
+            d.errback(f)
 
-        return self.db.pool.do(thdappendLog)
+    def _bufferLines(self, buf, content):
+        first_line = buf.num_lines
+        last_line = first_line + content.count(b'\n')
+        buf.logdict['num_lines'] = last_line + 1
+        buf.segments.append((first_line, last_line, content))
+        self._pendingBytes += len(content)
+        self._appendedBytes += len(content)
+        if self._pendingBytes >= self.APPEND_FLUSH_SIZE or not self._buffering:
+            self._startFlush()
+        elif self._flushTimer is None:
+            self._flushTimer = self.master.reactor.callLater(
+                self.APPEND_FLUSH_DELAY, self._startFlush)
+        if self._pendingBytes > self.APPEND_HIGH_WATER:
+            d = defer.Deferred()
+            self._drainWaiters.append((self._appendedBytes, d))
+            d.addCallback(lambda _: (first_line, last_line))
+            return d
+        return defer.succeed((first_line, last_line))
+
+    def _addBufferedNumLines(self, logdict):
+        if logdict is not None:
+            buf = self._appendBuffers.get(logdict['id'])
+            if buf is not None and buf.logdict is not None:
+                logdict['num_lines'] = buf.num_lines
+        return logdict
+
+    def _startFlush(self):
+        if self._flushTimer is not None:
+            if self._flushTimer.active():
+                self._flushTimer.cancel()
+            self._flushTimer = None
+        if self._flushing:
+            # the running flush picks up any new lines when it is done
+            return
+        d = self._flush()
+        d.addErrback(log.err, 'while flushing log lines')
+
+    @defer.inlineCallbacks
+    def _flush(self):
+        self._flushing = True
+        try:
+            while True:
+                batch = []
+                nbytes = 0
+                for logid, buf in iteritems(self._appendBuffers):
+                    if buf.segments:
+                        segments = list(buf.segments)
+                        batch.append((logid, segments))
+                        nbytes += sum(len(seg[2]) for seg in segments)
+                if not batch:
+                    break
+                # all the lines appended so far are in this batch
+                appended = self._appendedBytes
+
+                # compress outside of the db threads, so that connections
+                # are only held for the actual writes
+                zdicts = yield self._getLogDictionaries(
+                    [logid for logid, _ in batch])
+                rows, updates = yield self._deferToCompressPool(
+                    self.thdPrepareChunks, batch, zdicts)
+
+                def thdFlush(conn):
+                    tbl = self.db.model.logs
+                    q = tbl.update(whereclause=(tbl.c.id == sa.bindparam('_logid')))
+                    q = q.values(num_lines=sa.bindparam('_num_lines'))
+                    transaction = conn.begin()
+                    if rows:
+                        conn.execute(self.db.model.logchunks.insert(), rows).close()
+                    conn.execute(q, updates).close()
+                    transaction.commit()
+
+                yield self.db.pool.do(thdFlush)
+                # the lines are committed, so they can be read from the db
+                for logid, segments in batch:
+                    buf = self._appendBuffers.get(logid)
+                    if buf is not None:
+                        del buf.segments[:len(segments)]
+                self._pendingBytes -= nbytes
+                self._writtenBytes = appended
+                self._fireDrainWaiters()
+
+                if self._buffering and self._pendingBytes < self.APPEND_FLUSH_SIZE:
+                    break
+        finally:
+            self._flushing = False
+            waiters, self._flushWaiters = self._flushWaiters, []
+            for d in waiters:
+                d.callback(None)
+            # a waiter may have started another flush already
+            if (self._hasPendingLines() and not self._flushing and
+                    self._flushTimer is None):
+                self._flushTimer = self.master.reactor.callLater(
+                    self.APPEND_FLUSH_DELAY, self._startFlush)
+
+    def _fireDrainWaiters(self):
+        waiters = []
+        remaining = []
+        for appended, d in self._drainWaiters:
+            if appended <= self._writtenBytes:
+                waiters.append(d)
+            else:
+                remaining.append((appended, d))
+        self._drainWaiters = remaining
+        for d in waiters:
+            d.callback(None)
+
+    def thdPrepareChunks(self, batch, zdicts):
+        # get the logchunks rows and num_lines updates for a batch of
+        # buffered segments; called from the compression thread pool
+        rows = []
+        updates = []
+        store = self._getChunkStore()
+        for logid, segments in batch:
+            content = b'\n'.join(seg[2] for seg in segments)
+            logrows = self.thdSplitChunks(
+                logid, content, segments[0][0], zdicts.get(logid))
+            if store is not None:
+                self.thdStoreChunks(store, logid, logrows)
+            rows.extend(logrows)
+            updates.append(dict(_logid=logid,
+                                _num_lines=segments[-1][1] + 1))
+        return rows, updates
+
+    def _hasPendingLines(self, logid=None):
+        if logid is None:
+            return any(buf.segments for buf in itervalues(self._appendBuffers))
+        buf = self._appendBuffers.get(logid)
+        return buf is not None and bool(buf.segments)
+
+    @defer.inlineCallbacks
+    def flushLogs(self, logid=None):
+        while self._hasPendingLines(logid):
+            if self._flushing:
+                d = defer.Deferred()
+                self._flushWaiters.append(d)
+                yield d
+            else:
+                if self._flushTimer is not None:
+                    self._flushTimer.cancel()
+                    self._flushTimer = None
+                yield self._flush()
+
+    def stopBuffering(self):
+        """
+        Flush all buffered lines, and write lines appended from now on right
+        away.  Called when the db connector stops, as steps may still write
+        to their logs while the master shuts down.
+        """
+        self._buffering = False
+        return self.flushLogs()
 
     def _splitBigChunk(self, content, logid):
         """
@@ -241,18 +877,53 @@ class LogsConnectorComponent(base.DBConnectorComponent):
         else:
             return truncline, content[i + 1:]
 
+    @defer.inlineCallbacks
     def finishLog(self, logid):
+        yield self.flushLogs(logid)
+        self._appendBuffers.pop(logid, None)
+
         def thdfinishLog(conn):
             tbl = self.db.model.logs
             q = tbl.update(whereclause=(tbl.c.id == logid))
             conn.execute(q, complete=1)
-        return self.db.pool.do(thdfinishLog)
+        yield self.db.pool.do(thdfinishLog)
 
     @defer.inlineCallbacks
-    def compressLog(self, logid, force=False):
-        def thdcompressLog(conn):
-            tbl = self.db.model.logchunks
-            q = sa.select([tbl.c.first_line, tbl.c.last_line, sa.func.length(tbl.c.content),
+    def compressLog(self, logid, force=False, convertFrom=None):
+        # a log is compressed in several steps, so compressions of the same
+        # log are serialized
+        while logid in self._compressingLogs:
+            d = defer.Deferred()
+            self._compressingLogs[logid].append(d)
+            yield d
+        self._compressingLogs[logid] = []
+        try:
+            saved = yield self._compressLog(logid, force, convertFrom)
+        finally:
+            for d in self._compressingLogs.pop(logid):
+                d.callback(None)
+        defer.returnValue(saved)
+
+    @defer.inlineCallbacks
+    def _compressLog(self, logid, force, convertFrom):
+        yield self.flushLogs(logid)
+        now = self.master.reactor.seconds()
+        # chunks compressed with one of these methods are recompressed with
+        # the configured one, even if they do not need gathering
+        convert_ids = set(self.COMPRESSION_MODE[method]["id"]
+                          for method in convertFrom or [])
+        store = self._getChunkStore()
+        tbl = self.db.model.logchunks
+        # chunks kept in the chunk store have a NULL content
+        length = sa.func.coalesce(sa.func.length(tbl.c.content),
+                                  tbl.c.content_length)
+
+        zdict = None
+        if self._useDictionaries():
+            zdict = yield self._getCompressionDictionary(logid, now)
+
+        def thdGetGatherList(conn):
+            q = sa.select([tbl.c.first_line, tbl.c.last_line, length.label('length'),
                            tbl.c.compressed])
             q = q.where(tbl.c.logid == logid)
             q = q.order_by(tbl.c.first_line)
@@ -265,74 +936,189 @@ class LogsConnectorComponent(base.DBConnectorComponent):
             todo_first_line = 0
             todo_last_line = 0
             todo_length = 0
+            todo_convert = False
             # first pass, we fetch the full list of chunks (without content) and find out
             # the chunk groups which could use some gathering.
             for row in rows:
-                if (todo_length + row.length_1 > self.MAX_CHUNK_SIZE or
+                if (todo_length + row.length > self.MAX_CHUNK_SIZE or
                         (row.last_line - todo_first_line) > self.MAX_CHUNK_LINES):
-                    if todo_numchunks > 1 or (force and todo_numchunks):
+                    if todo_numchunks > 1 or ((force or todo_convert) and todo_numchunks):
                         # this group is worth re-compressing
                         todo_gather_list.append((todo_first_line, todo_last_line))
                     todo_first_line = row.first_line
                     todo_length = 0
                     todo_numchunks = 0
+                    todo_convert = False
 
                 todo_last_line = row.last_line
                 # note that we count the compressed size for efficiency reason
                 # unlike to the on-the-flow chunk splitter
-                todo_length += row.length_1
-                totlength += row.length_1
+                todo_length += row.length
+                totlength += row.length
                 todo_numchunks += 1
                 numchunks += 1
+                if row.compressed in convert_ids:
+                    todo_convert = True
             rows.close()
 
-            if todo_numchunks > 1 or (force and todo_numchunks):
+            if todo_numchunks > 1 or ((force or todo_convert) and todo_numchunks):
                 # last chunk group
                 todo_gather_list.append((todo_first_line, todo_last_line))
-            for todo_first_line, todo_last_line in todo_gather_list:
-                # decompress this group of chunks. Note that the content is binary bytes.
-                # no need to decode anything as we are going to put in back stored as bytes anyway
-                q = sa.select(
-                    [tbl.c.first_line, tbl.c.last_line, tbl.c.content, tbl.c.compressed])
-                q = q.where(tbl.c.logid == logid)
-                q = q.where(tbl.c.first_line >= todo_first_line)
-                q = q.where(tbl.c.last_line <= todo_last_line)
-                q = q.order_by(tbl.c.first_line)
-                rows = conn.execute(q)
-                chunk = b""
-                for row in rows:
-                    if chunk:
-                        chunk += b"\n"
-                    chunk += self.COMPRESSION_BYID[row.compressed][
-                        "read"](row.content)
-                rows.close()
-
-                # Transaction is necessary so that readers don't see disappeared chunks
-                transaction = conn.begin()
-
-                # we remove the chunks that we are compressing
-                d = tbl.delete()
-                d = d.where(tbl.c.logid == logid)
-                d = d.where(tbl.c.first_line >= todo_first_line)
-                d = d.where(tbl.c.last_line <= todo_last_line)
-                conn.execute(d).close()
-
-                # and we recompress them in one big chunk
-                chunk, compressed_id = self.thdCompressChunk(chunk)
-                conn.execute(tbl.insert(),
-                             dict(logid=logid, first_line=todo_first_line,
-                                  last_line=todo_last_line, content=chunk,
-                                  compressed=compressed_id)).close()
-                transaction.commit()
+            return todo_gather_list, totlength
+
+        def thdReadGroup(conn, todo_first_line, todo_last_line):
+            # get the chunks of a group; the content is binary bytes.  No
+            # need to decode anything as we are going to put in back stored
+            # as bytes anyway
+            q = sa.select(
+                [tbl.c.first_line, tbl.c.last_line, tbl.c.content, tbl.c.compressed,
+                 tbl.c.content_offset, tbl.c.content_length])
+            q = q.where(tbl.c.logid == logid)
+            q = q.where(tbl.c.first_line >= todo_first_line)
+            q = q.where(tbl.c.last_line <= todo_last_line)
+            q = q.order_by(tbl.c.first_line)
+            if store is None:
+                rows = conn.execute(q).fetchall()
+                raws = self.thdReadChunks(store, logid, rows)
+            else:
+                with store.locked(logid):
+                    rows = conn.execute(q).fetchall()
+                    raws = self.thdReadChunks(store, logid, rows)
+            chunks = [(row.compressed, raw) for row, raw in zip(rows, raws)]
+            self.thdLoadDictionaries(conn, chunks)
+            return chunks
+
+        def thdReplaceGroup(conn, newrow):
+            if store is not None:
+                self.thdStoreChunks(store, logid, [newrow])
+
+            # Transaction is necessary so that readers don't see disappeared chunks
+            transaction = conn.begin()
+
+            # we remove the chunks that we are compressing
+            d = tbl.delete()
+            d = d.where(tbl.c.logid == logid)
+            d = d.where(tbl.c.first_line >= newrow['first_line'])
+            d = d.where(tbl.c.last_line <= newrow['last_line'])
+            conn.execute(d).close()
+
+            conn.execute(tbl.insert(), newrow).close()
+            transaction.commit()
+
+        def thdFinish(conn, compact):
+            if store is not None and compact:
+                with store.locked(logid):
+                    thdCompactSegment(conn, store)
 
             # calculate how many bytes we saved
-            q = sa.select([sa.func.sum(sa.func.length(tbl.c.content))])
+            q = sa.select([sa.func.sum(length)])
             q = q.where(tbl.c.logid == logid)
-            newsize = conn.execute(q).fetchone()[0]
-            return totlength - newsize
+            # (pruned logs have no chunks left)
+            return conn.execute(q).fetchone()[0] or 0
 
-        saved = yield self.db.pool.do(thdcompressLog)
-        defer.returnValue(saved)
+        def thdCompactSegment(conn, store):
+            # drop the content of the chunks replaced above from the log's
+            # segment, and record where the remaining chunks moved
+            q = sa.select([tbl.c.first_line, tbl.c.content_offset,
+                           tbl.c.content_length])
+            q = q.where(tbl.c.logid == logid)
+            q = q.where(tbl.c.content == NULL)
+            q = q.order_by(tbl.c.first_line)
+            rows = conn.execute(q).fetchall()
+            if not rows:
+                return
+            offsets = store.thdCompact(
+                logid, [(row.content_offset, row.content_length) for row in rows])
+            q = tbl.update(whereclause=((tbl.c.logid == logid) &
+                                        (tbl.c.first_line == sa.bindparam('_first_line'))))
+            q = q.values(content_offset=sa.bindparam('_offset'))
+            conn.execute(q, [dict(_first_line=row.first_line, _offset=offset)
+                             for row, offset in zip(rows, offsets)]).close()
+
+        todo_gather_list, totlength = yield self.db.pool.do(thdGetGatherList)
+        # only the reads and writes are done in the db threads; the chunks
+        # are recompressed in the compression thread pool
+        for todo_first_line, todo_last_line in todo_gather_list:
+            chunks = yield self.db.pool.do(
+                thdReadGroup, todo_first_line, todo_last_line)
+            newrow = yield self._deferToCompressPool(
+                self.thdGatherChunks, logid, todo_first_line, todo_last_line,
+                chunks, zdict)
+            yield self.db.pool.do(thdReplaceGroup, newrow)
+
+        newsize = yield self.db.pool.do(thdFinish, bool(todo_gather_list))
+        defer.returnValue(totlength - newsize)
+
+    def thdGatherChunks(self, logid, first_line, last_line, chunks, zdict):
+        # decompress the given (compressed, data) chunks, and recompress them
+        # in one big logchunks row; called from the compression thread pool
+        chunk = b"\n".join(self.thdDecompressChunk(None, compressed, raw)
+                           for compressed, raw in chunks)
+        chunk, compressed_id = self.thdCompressChunk(chunk, zdict)
+        return dict(logid=logid, first_line=first_line, last_line=last_line,
+                    content=chunk, compressed=compressed_id)
+
+    def thdDeleteLogChunks(self, conn, logids):
+        # delete all chunks of the given logs, returning the number of rows
+        # and content bytes removed
+        tbl = self.db.model.logchunks
+        length = sa.func.coalesce(sa.func.length(tbl.c.content),
+                                  tbl.c.content_length)
+        q = sa.select([sa.func.count(), sa.func.sum(length)])
+        q = q.where(tbl.c.logid.in_(logids))
+        rows, nbytes = conn.execute(q).fetchone()
+        conn.execute(tbl.delete().where(tbl.c.logid.in_(logids))).close()
+        self._invalidateCachedChunks(logids)
+        store = self._getChunkStore()
+        if store is not None:
+            for logid in logids:
+                store.thdRemove(logid)
+        return rows, nbytes or 0
+
+    def pruneLogChunks(self, builderid, logHorizon, limit=100):
+        """
+        Called periodically by DBConnector, this method deletes the chunks of
+        at most C{limit} logs belonging to builds of C{builderid} older than
+        the last C{logHorizon} builds.  Pruned logs are kept with type 'd'.
+
+        @returns: tuple (logs, rows, bytes) via Deferred
+        """
+        if not logHorizon:
+            return defer.succeed((0, 0, 0))
+
+        def thd(conn):
+            builds_tbl = self.db.model.builds
+            steps_tbl = self.db.model.steps
+            logs_tbl = self.db.model.logs
+
+            # find the newest build whose logs must go, using builds_number
+            q = sa.select([builds_tbl.c.number])
+            q = q.where(builds_tbl.c.builderid == builderid)
+            q = q.order_by(sa.desc(builds_tbl.c.number))
+            q = q.offset(logHorizon).limit(1)
+            horizon_number = conn.scalar(q)
+            if horizon_number is None:
+                return 0, 0, 0
+
+            q = sa.select([logs_tbl.c.id])
+            q = q.select_from(logs_tbl
+                              .join(steps_tbl, logs_tbl.c.stepid == steps_tbl.c.id)
+                              .join(builds_tbl, steps_tbl.c.buildid == builds_tbl.c.id))
+            q = q.where(builds_tbl.c.builderid == builderid)
+            q = q.where(builds_tbl.c.number <= horizon_number)
+            q = q.where(logs_tbl.c.type != 'd')
+            q = q.order_by(logs_tbl.c.id).limit(limit)
+            logids = [r.id for r in conn.execute(q)]
+            if not logids:
+                return 0, 0, 0
+
+            transaction = conn.begin()
+            rows, nbytes = self.thdDeleteLogChunks(conn, logids)
+            q = logs_tbl.update(whereclause=logs_tbl.c.id.in_(logids))
+            conn.execute(q, type='d').close()
+            transaction.commit()
+            return len(logids), rows, nbytes
+        return self.db.pool.do(thd)
 
     def _logdictFromRow(self, row):
         rv = dict(row)
@@ -0,0 +1,226 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+from future.utils import string_types
+
+import contextlib
+import mmap
+import os
+import threading
+
+from buildbot import config
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class LogChunkStore(object):
+
+    """
+    Base class for stores keeping the content of log chunks outside of the
+    database.  The database only keeps the position of each chunk in the
+    store, as a (offset, length) pair relative to the log's segment.
+
+    All C{thd*} methods are called from database threads; the store must
+    serialize access to a single log's segment itself.  Callers hold
+    L{locked} for a log while they need its chunk positions to stay valid.
+    """
+
+    def setBasedir(self, basedir):
+        pass
+
+    def thdAppend(self, logid, chunks):
+        """
+        Append the given chunks (bytes) to the log's segment.
+
+        @returns: list of offsets of the chunks
+        """
+        raise NotImplementedError
+
+    def thdRead(self, logid, ranges):
+        """
+        Read chunks from the log's segment.
+
+        @param ranges: list of (offset, length) tuples
+        @returns: list of bytes
+        """
+        raise NotImplementedError
+
+    def thdCompact(self, logid, ranges):
+        """
+        Rewrite the log's segment so that it only contains the given ranges,
+        in the given order.  Must be called with the log L{locked}.
+
+        @param ranges: list of (offset, length) tuples
+        @returns: list of new offsets for those ranges
+        """
+        raise NotImplementedError
+
+    def thdRemove(self, logid):
+        """Remove the log's segment, if any."""
+        raise NotImplementedError
+
+    def locked(self, logid):
+        """
+        Context manager preventing L{thdCompact} from moving the chunks of the
+        given log.
+        """
+        raise NotImplementedError
+
+
+class FileLogChunkStore(LogChunkStore):
+
+    """
+    Store each log's chunks in an append-only segment file on local disk,
+    below C{path} (relative to the master's basedir).  Segments are read with
+    mmap.  In a multi-master setup, all masters must share this directory.
+
+    Besides a lock per log for the threads of this master, L{locked} takes an
+    exclusive C{flock} on a lock file in the segment's directory, so that a
+    compaction by one master cannot move chunks that another master is
+    reading.  The directory must thus be on a filesystem where C{flock} works
+    across hosts, and the store cannot be shared where C{fcntl} is missing.
+    """
+
+    def __init__(self, path='logchunks'):
+        if not isinstance(path, string_types):
+            config.error("FileLogChunkStore path must be a string")
+        self.path = path
+        self.basedir = '.'
+        self._locks = {}
+        self._locksLock = threading.Lock()
+
+    def setBasedir(self, basedir):
+        self.basedir = basedir
+
+    def _segmentPath(self, logid):
+        # spread segments over 1000 directories
+        return os.path.join(self.basedir, self.path,
+                            '%03d' % (logid % 1000), str(logid))
+
+    def _lockPath(self, logid):
+        # one lock file per directory, which is never removed, so that no
+        # master can lock a file that another one is about to remove
+        return os.path.join(os.path.dirname(self._segmentPath(logid)), '.lock')
+
+    def _makeDirs(self, logid):
+        dirname = os.path.dirname(self._segmentPath(logid))
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # created by another thread meanwhile
+                if not os.path.isdir(dirname):
+                    raise
+
+    @contextlib.contextmanager
+    def locked(self, logid):
+        with self._locksLock:
+            lock = self._locks.get(logid)
+            if lock is None:
+                lock = self._locks[logid] = _SegmentLock()
+            lock.users += 1
+        try:
+            with lock.lock:
+                # only the outermost holder in this master takes the file
+                # lock, as flock is not reentrant across file descriptors
+                if lock.depth == 0 and fcntl is not None:
+                    self._makeDirs(logid)
+                    lock.lockfile = open(self._lockPath(logid), 'ab')
+                    fcntl.flock(lock.lockfile.fileno(), fcntl.LOCK_EX)
+                lock.depth += 1
+                try:
+                    yield
+                finally:
+                    lock.depth -= 1
+                    if lock.depth == 0 and lock.lockfile is not None:
+                        # closing the file releases the flock
+                        lock.lockfile.close()
+                        lock.lockfile = None
+        finally:
+            with self._locksLock:
+                lock.users -= 1
+                if lock.users == 0:
+                    del self._locks[logid]
+
+    def thdAppend(self, logid, chunks):
+        path = self._segmentPath(logid)
+        self._makeDirs(logid)
+        offsets = []
+        with self.locked(logid):
+            with open(path, 'ab') as f:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                for chunk in chunks:
+                    offsets.append(offset)
+                    offset += len(chunk)
+                f.write(b''.join(chunks))
+        return offsets
+
+    def thdRead(self, logid, ranges):
+        if not any(length for _, length in ranges):
+            return [b'' for _ in ranges]
+        with self.locked(logid):
+            with open(self._segmentPath(logid), 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    return [m[offset:offset + length]
+                            for offset, length in ranges]
+                finally:
+                    m.close()
+
+    def thdCompact(self, logid, ranges):
+        if not any(length for _, length in ranges):
+            self.thdRemove(logid)
+            return [0 for _ in ranges]
+        path = self._segmentPath(logid)
+        tmppath = path + '.tmp'
+        offsets = []
+        with self.locked(logid):
+            with open(path, 'rb') as src, open(tmppath, 'wb') as dst:
+                m = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    for offset, length in ranges:
+                        offsets.append(dst.tell())
+                        dst.write(m[offset:offset + length])
+                finally:
+                    m.close()
+            os.rename(tmppath, path)
+        return offsets
+
+    def thdRemove(self, logid):
+        with self.locked(logid):
+            try:
+                os.remove(self._segmentPath(logid))
+            except OSError:
+                if os.path.exists(self._segmentPath(logid)):
+                    raise
+
+
+class _SegmentLock(object):
+
+    # the lock of a log in FileLogChunkStore: a thread lock, with its number
+    # of users, and the lock file held while the thread lock is, if any
+    __slots__ = ('lock', 'users', 'depth', 'lockfile')
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.users = 0
+        self.depth = 0
+        self.lockfile = None
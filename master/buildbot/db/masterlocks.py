@@ -0,0 +1,114 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sqlalchemy as sa
+
+from twisted.internet import reactor
+
+from buildbot.db import base
+from buildbot.util import epoch2datetime
+
+
+class MasterLockAlreadyClaimedError(Exception):
+    pass
+
+
+class MasterLockClaimDict(dict):
+    pass
+
+
+class MasterLocksConnectorComponent(base.DBConnectorComponent):
+
+    """
+    The slots of the distributed master locks held by each master.  A
+    counting claim takes one slot out of the lock's maxCount, an exclusive
+    claim takes all of them.
+    """
+
+    def findLockId(self, name):
+        tbl = self.db.model.masterlocks
+        return self.findSomethingId(
+            tbl=tbl,
+            whereclause=(tbl.c.name == name),
+            insert_values=dict(
+                name=name,
+                name_hash=self.hashColumns(name),
+            ))
+
+    def getLockClaims(self, lockid):
+        def thd(conn):
+            tbl = self.db.model.masterlock_claims
+            q = tbl.select(whereclause=(tbl.c.lockid == lockid))
+            q = q.order_by(tbl.c.slot)
+            return [self._claimdictFromRow(row)
+                    for row in conn.execute(q).fetchall()]
+        return self.db.pool.do(thd)
+
+    def claimLockSlots(self, lockid, slots, masterid, exclusive,
+                       _reactor=reactor):
+        def thd(conn):
+            transaction = conn.begin()
+            tbl = self.db.model.masterlock_claims
+            claimed_at = _reactor.seconds()
+
+            try:
+                q = tbl.insert()
+                conn.execute(q, [
+                    dict(lockid=lockid, slot=slot, masterid=masterid,
+                         exclusive=1 if exclusive else 0,
+                         claimed_at=claimed_at)
+                    for slot in slots])
+            except (sa.exc.IntegrityError, sa.exc.ProgrammingError):
+                transaction.rollback()
+                raise MasterLockAlreadyClaimedError()
+
+            transaction.commit()
+        return self.db.pool.do(thd)
+
+    def releaseLockSlots(self, lockid, slots, masterid):
+        def thd(conn):
+            tbl = self.db.model.masterlock_claims
+            q = tbl.delete(whereclause=((tbl.c.lockid == lockid) &
+                                        tbl.c.slot.in_(slots) &
+                                        (tbl.c.masterid == masterid)))
+            conn.execute(q)
+        return self.db.pool.do(thd)
+
+    def releaseMasterClaims(self, masterid):
+        """Release all the slots held by the given master; returns a dict
+        mapping the ids of the locks it held to the slots released."""
+        def thd(conn):
+            transaction = conn.begin()
+            tbl = self.db.model.masterlock_claims
+            whereclause = (tbl.c.masterid == masterid)
+            q = sa.select([tbl.c.lockid, tbl.c.slot], whereclause=whereclause)
+            released = {}
+            for row in conn.execute(q).fetchall():
+                released.setdefault(row.lockid, []).append(row.slot)
+            conn.execute(tbl.delete(whereclause=whereclause))
+            transaction.commit()
+            for slots in released.values():
+                slots.sort()
+            return released
+        return self.db.pool.do(thd)
+
+    def _claimdictFromRow(self, row):
+        return MasterLockClaimDict(lockid=row.lockid, slot=row.slot,
+                                   masterid=row.masterid,
+                                   exclusive=bool(row.exclusive),
+                                   claimed_at=epoch2datetime(row.claimed_at))
@@ -0,0 +1,47 @@
+# This file is part of Buildbot. Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sqlalchemy as sa
+
+from buildbot.util import sautils
+
+
+def upgrade(migrate_engine):
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    sautils.Table('builders', metadata, autoload=True)
+
+    logchunk_dictionaries = sautils.Table(
+        'logchunk_dictionaries', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('builderid', sa.Integer,
+                  sa.ForeignKey('builders.id', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('dict_id', sa.BigInteger, nullable=False),
+        sa.Column('content', sa.LargeBinary(65536), nullable=False),
+    )
+    logchunk_dictionaries.create()
+
+    idx = sa.Index('logchunk_dictionaries_builderid',
+                   logchunk_dictionaries.c.builderid)
+    idx.create()
+
+    idx = sa.Index('logchunk_dictionaries_dict_id',
+                   logchunk_dictionaries.c.dict_id, unique=True)
+    idx.create()
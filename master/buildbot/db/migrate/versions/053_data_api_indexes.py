@@ -0,0 +1,44 @@
+# This file is part of Buildbot. Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sqlalchemy as sa
+
+from buildbot.util import sautils
+
+
+def upgrade(migrate_engine):
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    buildrequests = sautils.Table('buildrequests', metadata, autoload=True)
+    builds = sautils.Table('builds', metadata, autoload=True)
+    logs = sautils.Table('logs', metadata, autoload=True)
+
+    # used to find the pending build requests of a builder
+    idx = sa.Index('buildrequests_builderid_complete',
+                   buildrequests.c.builderid, buildrequests.c.complete)
+    idx.create()
+
+    # used to list the most recent builds of a builder
+    idx = sa.Index('builds_builderid_complete_at',
+                   builds.c.builderid, builds.c.complete_at)
+    idx.create()
+
+    # used to list the logs of a step, in order
+    idx = sa.Index('logs_stepid_id', logs.c.stepid, logs.c.id)
+    idx.create()
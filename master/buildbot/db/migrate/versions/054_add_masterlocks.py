@@ -0,0 +1,62 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sqlalchemy as sa
+
+from buildbot.util import sautils
+
+
+def upgrade(migrate_engine):
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    sautils.Table('masters', metadata, autoload=True)
+
+    masterlocks = sautils.Table(
+        'masterlocks', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('name', sa.Text, nullable=False),
+        sa.Column('name_hash', sa.String(40), nullable=False),
+    )
+    masterlocks.create()
+
+    masterlock_claims = sautils.Table(
+        'masterlock_claims', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('lockid', sa.Integer,
+                  sa.ForeignKey('masterlocks.id', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('slot', sa.Integer, nullable=False),
+        sa.Column('masterid', sa.Integer,
+                  sa.ForeignKey('masters.id', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('exclusive', sa.SmallInteger, nullable=False),
+        sa.Column('claimed_at', sa.Integer, nullable=False),
+    )
+    masterlock_claims.create()
+
+    idx = sa.Index('masterlock_name_hash', masterlocks.c.name_hash,
+                   unique=True)
+    idx.create()
+
+    idx = sa.Index('masterlock_claims_slot', masterlock_claims.c.lockid,
+                   masterlock_claims.c.slot, unique=True)
+    idx.create()
+
+    idx = sa.Index('masterlock_claims_masterid', masterlock_claims.c.masterid)
+    idx.create()
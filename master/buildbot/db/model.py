@@ -191,9 +191,26 @@ class Model(base.DBConnectorComponent):
         sa.Column('first_line', sa.Integer, nullable=False),
         sa.Column('last_line', sa.Integer, nullable=False),
         # log contents, including a terminating newline, encoded in utf-8 or,
-        # if 'compressed' is not 0, compressed with gzip, bzip2 or lz4
+        # if 'compressed' is not 0, compressed with gzip, bzip2, lz4 or zstd
         sa.Column('content', sa.LargeBinary(65536)),
         sa.Column('compressed', sa.SmallInteger, nullable=False),
+        # if content is NULL, the contents are kept in the configured
+        # logChunkStore, at this position in the log's segment
+        sa.Column('content_offset', sa.BigInteger),
+        sa.Column('content_length', sa.Integer),
+    )
+
+    # zstd dictionaries trained on the logs of each builder, used to compress
+    # the new chunks of its logs when logCompressionDictionaries is set
+    logchunk_dictionaries = sautils.Table(
+        'logchunk_dictionaries', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('builderid', sa.Integer,
+                  sa.ForeignKey('builders.id', ondelete='CASCADE'),
+                  nullable=False),
+        # dictionary ID, as recorded in the frames compressed with it
+        sa.Column('dict_id', sa.BigInteger, nullable=False),
+        sa.Column('content', sa.LargeBinary(65536), nullable=False),
     )
 
     # buildsets
@@ -632,11 +649,43 @@ class Model(base.DBConnectorComponent):
         sa.Column('last_active', sa.Integer, nullable=False),
     )
 
+    # master locks
+
+    # MasterLocks shared by all the masters (created with distributed=True)
+    masterlocks = sautils.Table(
+        'masterlocks', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('name', sa.Text, nullable=False),
+        # sha1 of name; used for a unique index
+        sa.Column('name_hash', sa.String(40), nullable=False),
+    )
+
+    # This table records the slots of the master locks held by each master: a
+    # counting claim takes one slot out of the lock's maxCount, an exclusive
+    # claim takes all of them.  The unique index on (lockid, slot) makes the
+    # claims atomic.  The claims of a master are deleted when the master is
+    # marked inactive.
+    masterlock_claims = sautils.Table(
+        'masterlock_claims', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('lockid', sa.Integer,
+                  sa.ForeignKey('masterlocks.id', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('slot', sa.Integer, nullable=False),
+        sa.Column('masterid', sa.Integer,
+                  sa.ForeignKey('masters.id', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('exclusive', sa.SmallInteger, nullable=False),
+        sa.Column('claimed_at', sa.Integer, nullable=False),
+    )
+
     # indexes
 
     sa.Index('buildrequests_buildsetid', buildrequests.c.buildsetid)
     sa.Index('buildrequests_builderid', buildrequests.c.builderid)
     sa.Index('buildrequests_complete', buildrequests.c.complete)
+    sa.Index('buildrequests_builderid_complete',
+             buildrequests.c.builderid, buildrequests.c.complete)
     sa.Index('build_properties_buildid', build_properties.c.buildid)
     sa.Index('builds_buildrequestid', builds.c.buildrequestid)
     sa.Index('buildsets_complete', buildsets.c.complete)
@@ -712,13 +761,26 @@ class Model(base.DBConnectorComponent):
              builds.c.workerid)
     sa.Index('builds_masterid',
              builds.c.masterid)
+    sa.Index('builds_builderid_results_number',
+             builds.c.builderid, builds.c.results, builds.c.number)
+    sa.Index('builds_builderid_complete_at',
+             builds.c.builderid, builds.c.complete_at)
     sa.Index('steps_number', steps.c.buildid, steps.c.number,
              unique=True)
     sa.Index('steps_name', steps.c.buildid, steps.c.name,
              unique=True)
     sa.Index('logs_slug', logs.c.stepid, logs.c.slug, unique=True)
+    sa.Index('logs_stepid_id', logs.c.stepid, logs.c.id)
     sa.Index('logchunks_firstline', logchunks.c.logid, logchunks.c.first_line)
     sa.Index('logchunks_lastline', logchunks.c.logid, logchunks.c.last_line)
+    sa.Index('logchunk_dictionaries_builderid',
+             logchunk_dictionaries.c.builderid)
+    sa.Index('logchunk_dictionaries_dict_id',
+             logchunk_dictionaries.c.dict_id, unique=True)
+    sa.Index('masterlock_name_hash', masterlocks.c.name_hash, unique=True)
+    sa.Index('masterlock_claims_slot', masterlock_claims.c.lockid,
+             masterlock_claims.c.slot, unique=True)
+    sa.Index('masterlock_claims_masterid', masterlock_claims.c.masterid)
 
     # MySQL creates indexes for foreign keys, and these appear in the
     # reflection.  This is a list of (table, index) names that should be
@@ -29,6 +29,7 @@ from twisted.python import threadpool
 
 from buildbot.db.buildrequests import AlreadyClaimedError
 from buildbot.db.changesources import ChangeSourceAlreadyClaimedError
+from buildbot.db.masterlocks import MasterLockAlreadyClaimedError
 from buildbot.db.schedulers import SchedulerAlreadyClaimedError
 from buildbot.process import metrics
 
@@ -203,7 +204,9 @@ class DBThreadPool(object):
                     continue
                 # AlreadyClaimedError are normal especially in a multimaster
                 # configuration
-                except (AlreadyClaimedError, ChangeSourceAlreadyClaimedError, SchedulerAlreadyClaimedError):
+                except (AlreadyClaimedError, ChangeSourceAlreadyClaimedError,
+                        SchedulerAlreadyClaimedError,
+                        MasterLockAlreadyClaimedError):
                     raise
                 except Exception as e:
                     log.err(e, 'Got fatal Exception on DB')
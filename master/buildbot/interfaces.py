@@ -1095,3 +1095,6 @@ class IHttpResponse(Interface):
         """
     master = Attribute('code',
                        "http status code of the request's response (e.g 200)")
+    headers = Attribute('headers',
+                        "headers of the response, to be read with "
+                        "buildbot.util.httpclientservice.getResponseHeader")
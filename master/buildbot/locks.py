@@ -15,11 +15,15 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
+from future.utils import iteritems
+
+from collections import OrderedDict
 
 from twisted.internet import defer
 from twisted.python import log
 
 from buildbot import util
+from buildbot.db import masterlocks
 from buildbot.util import subscription
 from buildbot.util.eventual import eventually
 from buildbot.worker_transition import WorkerAPICompatMixin
@@ -27,9 +31,10 @@ from buildbot.worker_transition import deprecatedWorkerModuleAttribute
 from buildbot.worker_transition import reportDeprecatedWorkerNameUsage
 
 if False:  # for debugging  pylint: disable=using-constant-test
-    debuglog = log.msg
+    def debuglog(msg, *args):
+        log.msg(msg % args)
 else:
-    debuglog = lambda m: None
+    debuglog = lambda msg, *args: None
 
 
 class BaseLock:
@@ -41,16 +46,23 @@ class BaseLock:
     We maintain the wait queue in FIFO order, and ensure that counting waiters
     in the queue behind exclusive waiters cannot acquire the lock. This ensures
     that exclusive waiters are not starved.
+
+    The cost of the operations does not depend on the number of waiters: the
+    owners are counted as they come and go, the wait queue is indexed by
+    waiter, and at most C{maxCount} waiters at the head of the queue are
+    looked at to decide whether the lock is available, or whom to wake up.
     """
     description = "<BaseLock>"
 
     def __init__(self, name, maxCount=1):
         # Name of the lock
         self.name = name
-        # Current queue, tuples (waiter, LockAccess, deferred)
-        self.waiting = []
-        # Current owners, tuples (owner, LockAccess)
-        self.owners = []
+        # Current queue, in FIFO order: waiter -> (LockAccess, deferred)
+        self.waiting = OrderedDict()
+        # Current owners: owner -> list of LockAccess, one per claim
+        self.owners = {}
+        self._numExclusive = 0
+        self._numCounting = 0
         # maximal number of counting owners
         self.maxCount = maxCount
 
@@ -66,51 +78,97 @@ class BaseLock:
 
             @return: Tuple (number exclusive owners, number counting owners)
         """
-        num_excl, num_counting = 0, 0
-        for owner in self.owners:
-            if owner[1].mode == 'exclusive':
-                num_excl = num_excl + 1
-            else:  # mode == 'counting'
-                num_counting = num_counting + 1
-
+        num_excl, num_counting = self._numExclusive, self._numCounting
         assert (num_excl == 1 and num_counting == 0) \
             or (num_excl == 0 and num_counting <= self.maxCount)
         return num_excl, num_counting
 
     def isAvailable(self, requester, access):
         """ Return a boolean whether the lock is available for claiming """
-        debuglog("%s isAvailable(%s, %s): self.owners=%r"
-                 % (self, requester, access, self.owners))
+        debuglog("%s isAvailable(%s, %s): self.owners=%r",
+                 self, requester, access, self.owners)
         num_excl, num_counting = self._getOwnersCount()
-
-        # Find all waiters ahead of the requester in the wait queue
-        for idx, waiter in enumerate(self.waiting):
-            if waiter[0] == requester:
-                w_index = idx
-                break
-        else:
-            w_index = len(self.waiting)
-        ahead = self.waiting[:w_index]
-
-        if access.mode == 'counting':
-            # Wants counting access
-            return num_excl == 0 and num_counting + len(ahead) < self.maxCount \
-                and all([w[1].mode == 'counting' for w in ahead])
-        else:
-            # Wants exclusive access
-            return num_excl == 0 and num_counting == 0 and len(ahead) == 0
+        if num_excl > 0:
+            return False
+
+        if access.mode == 'exclusive':
+            # Wants exclusive access: nobody may own the lock or wait ahead
+            if num_counting > 0 or not self.waiting:
+                return num_counting == 0
+            return next(iter(self.waiting)) == requester
+
+        # Wants counting access: all the waiters ahead of the requester in
+        # the wait queue must be counting, and get the lock too.  Only the
+        # waiters which may still fit in the lock need to be looked at.
+        if requester is None:
+            return self._countingRoom() > 0
+        free = self.maxCount - num_counting
+        for w_owner, (w_access, d) in iteritems(self.waiting):
+            if free <= 0:
+                return False
+            if w_owner == requester:
+                return True
+            if w_access.mode != 'counting':
+                return False
+            free -= 1
+        return free > 0
+
+    def _countingRoom(self):
+        """ Return the number of counting claims that may still be made by
+        newcomers, after all the current waiters got the lock """
+        num_excl, num_counting = self._getOwnersCount()
+        if num_excl > 0:
+            return 0
+        free = self.maxCount - num_counting
+        for w_owner, (w_access, d) in iteritems(self.waiting):
+            if free <= 0 or w_access.mode != 'counting':
+                return 0
+            free -= 1
+        return max(free, 0)
+
+    def isAvailableAfter(self, access, pending):
+        """ Return a boolean whether the lock would still be available for
+        claiming by nobody in particular, once the accesses in C{pending} are
+        claimed as well """
+        if not pending:
+            return self.isAvailable(None, access)
+        if access.mode == 'exclusive' or \
+                any(p.mode == 'exclusive' for p in pending):
+            return False
+        return self._countingRoom() > len(pending)
 
     def claim(self, owner, access):
         """ Claim the lock (lock must be available) """
-        debuglog("%s claim(%s, %s)" % (self, owner, access.mode))
+        debuglog("%s claim(%s, %s)", self, owner, access.mode)
         assert owner is not None
         assert self.isAvailable(owner, access), "ask for isAvailable() first"
 
         assert isinstance(access, LockAccess)
         assert access.mode in ['counting', 'exclusive']
-        self.waiting = [w for w in self.waiting if w[0] != owner]
-        self.owners.append((owner, access))
-        debuglog(" %s is claimed '%s'" % (self, access.mode))
+        self.waiting.pop(owner, None)
+        self._addOwner(owner, access)
+        debuglog(" %s is claimed '%s'", self, access.mode)
+
+    def _addOwner(self, owner, access):
+        self.owners.setdefault(owner, []).append(access)
+        if access.mode == 'exclusive':
+            self._numExclusive += 1
+        else:
+            self._numCounting += 1
+
+    def _removeOwner(self, owner, access):
+        """Remove one claim of C{owner}; return False if it had none."""
+        accesses = self.owners.get(owner)
+        if not accesses or access not in accesses:
+            return False
+        accesses.remove(access)
+        if not accesses:
+            del self.owners[owner]
+        if access.mode == 'exclusive':
+            self._numExclusive -= 1
+        else:
+            self._numCounting -= 1
+        return True
 
     def subscribeToReleases(self, callback):
         """Schedule C{callback} to be invoked every time this lock is
@@ -121,18 +179,17 @@ class BaseLock:
         """ Release the lock """
         assert isinstance(access, LockAccess)
 
-        debuglog("%s release(%s, %s)" % (self, owner, access.mode))
-        entry = (owner, access)
-        if entry not in self.owners:
-            debuglog("%s already released" % self)
+        debuglog("%s release(%s, %s)", self, owner, access.mode)
+        if not self._removeOwner(owner, access):
+            debuglog("%s already released", self)
             return
-        self.owners.remove(entry)
         # who can we wake up?
         # After an exclusive access, we may need to wake up several waiting.
         # Break out of the loop when the first waiting client should not be
         # awakened.
         num_excl, num_counting = self._getOwnersCount()
-        for i, (w_owner, w_access, d) in enumerate(self.waiting):
+        woken = []
+        for w_owner, (w_access, d) in iteritems(self.waiting):
             if w_access.mode == 'counting':
                 if num_excl > 0 or num_counting == self.maxCount:
                     break
@@ -148,8 +205,10 @@ class BaseLock:
             # If the waiter has a deferred, wake it up and clear the deferred
             # from the wait queue entry to indicate that it has been woken.
             if d:
-                self.waiting[i] = (w_owner, w_access, None)
-                eventually(d.callback, self)
+                woken.append((w_owner, w_access, d))
+        for w_owner, w_access, d in woken:
+            self.waiting[w_owner] = (w_access, None)
+            eventually(d.callback, self)
 
         # notify any listeners
         self.release_subs.deliver()
@@ -161,28 +220,24 @@ class BaseLock:
         this would be named 'waitUntilAvailable', and the deferred would fire
         after the lock had been claimed.
         """
-        debuglog("%s waitUntilAvailable(%s)" % (self, owner))
+        debuglog("%s waitUntilAvailable(%s)", self, owner)
         assert isinstance(access, LockAccess)
         if self.isAvailable(owner, access):
             return defer.succeed(self)
         d = defer.Deferred()
 
-        # Are we already in the wait queue?
-        w = [i for i, w in enumerate(self.waiting) if w[0] == owner]
-        if w:
-            self.waiting[w[0]] = (owner, access, d)
-        else:
-            self.waiting.append((owner, access, d))
+        # if we are already in the wait queue, we keep our place
+        self.waiting[owner] = (access, d)
         return d
 
     def stopWaitingUntilAvailable(self, owner, access, d):
-        debuglog("%s stopWaitingUntilAvailable(%s)" % (self, owner))
+        debuglog("%s stopWaitingUntilAvailable(%s)", self, owner)
         assert isinstance(access, LockAccess)
-        assert (owner, access, d) in self.waiting
-        self.waiting = [w for w in self.waiting if w[0] != owner]
+        assert self.waiting.get(owner) == (access, d)
+        del self.waiting[owner]
 
     def isOwner(self, owner, access):
-        return (owner, access) in self.owners
+        return access in self.owners.get(owner, ())
 
 
 class RealMasterLock(BaseLock):
@@ -195,6 +250,290 @@ class RealMasterLock(BaseLock):
         return self
 
 
+class RealDistributedMasterLock(RealMasterLock):
+
+    """
+    A MasterLock shared by all the masters using the same database.
+
+    Each claim holds slots of the lock in the database: one for counting
+    access, all C{maxCount} of them for exclusive access, so the database
+    decides which master gets the lock.  As claim() is synchronous, the
+    slots are taken when a waiter is woken up, and kept for it until it
+    claims the lock.  If it does not do so within C{reservationTimeout}
+    seconds (e.g., because it is waiting for another lock), they are given
+    back, and the waiter leaves the queue.  The waiters of each master are
+    served in FIFO order.
+
+    The slots held by the other masters are cached, and kept up to date
+    with the messages sent when a master claims or releases slots, so that
+    checking whether the lock is available does not query the database.
+    While waiters cannot be served, the cache is reloaded every
+    C{pollInterval} seconds, in case a message was missed.
+    """
+
+    reservationTimeout = 10
+    pollInterval = 60
+
+    def __init__(self, lockid, master):
+        RealMasterLock.__init__(self, lockid)
+        self.description = "<MasterLock(%s, %s, distributed)>" % (
+            self.name, self.maxCount)
+        self.master = master
+        # id of the lock in the database, once known
+        self.dblockid = None
+        # waiter -> (LockAccess, slots, timer), for the waiters woken up
+        self.reserved = {}
+        # owner -> list of (LockAccess, slots), one per claim
+        self.claimedSlots = {}
+        # slots held by this master, including those being released
+        self.localSlots = set()
+        # slot -> masterid, for the slots held by the other masters
+        self.remoteSlots = {}
+        self._consumer = None
+        self._pollTimer = None
+        self._reserving = False
+        self._reserveAgain = False
+        self._reloadClaims = True
+        self._discarded = False
+
+    def isAvailable(self, requester, access):
+        debuglog("%s isAvailable(%s, %s): self.owners=%r",
+                 self, requester, access, self.owners)
+        if requester is not None:
+            reservation = self.reserved.get(requester)
+            return reservation is not None and reservation[0] == access
+
+        # nobody in particular: is there room for one more claim after the
+        # waiters, as far as we know?
+        if self.dblockid is None:
+            # start caching the claims of the other masters
+            self._maybeReserve()
+        if access.mode == 'exclusive':
+            return not (self.localSlots or self.remoteSlots or self.waiting)
+        return self._countingRoom() > 0
+
+    def _countingRoom(self):
+        free = self.maxCount - len(self.localSlots) - len(self.remoteSlots)
+        for w_owner, (w_access, d) in iteritems(self.waiting):
+            if w_owner in self.reserved:
+                # its slots are already taken
+                continue
+            if free <= 0 or w_access.mode != 'counting':
+                return 0
+            free -= 1
+        return max(free, 0)
+
+    def claim(self, owner, access):
+        RealMasterLock.claim(self, owner, access)
+        _, slots, timer = self.reserved.pop(owner)
+        timer.cancel()
+        self.claimedSlots.setdefault(owner, []).append((access, slots))
+
+    def release(self, owner, access):
+        assert isinstance(access, LockAccess)
+
+        debuglog("%s release(%s, %s)", self, owner, access.mode)
+        if not self._removeOwner(owner, access):
+            debuglog("%s already released", self)
+            return
+        claims = self.claimedSlots[owner]
+        for i, (c_access, slots) in enumerate(claims):
+            if c_access == access:
+                del claims[i]
+                break
+        if not claims:
+            del self.claimedSlots[owner]
+        # the subscribers are notified once the slots are released
+        self._releaseSlots(slots)
+
+    def waitUntilMaybeAvailable(self, owner, access):
+        debuglog("%s waitUntilAvailable(%s)", self, owner)
+        assert isinstance(access, LockAccess)
+        if self.isAvailable(owner, access):
+            return defer.succeed(self)
+        if owner in self.reserved:
+            # the slots were taken for another access mode
+            self._cancelReservation(owner)
+        d = defer.Deferred()
+
+        # if we are already in the wait queue, we keep our place
+        self.waiting[owner] = (access, d)
+        self._maybeReserve()
+        return d
+
+    def stopWaitingUntilAvailable(self, owner, access, d):
+        debuglog("%s stopWaitingUntilAvailable(%s)", self, owner)
+        assert isinstance(access, LockAccess)
+        self.waiting.pop(owner, None)
+        if owner in self.reserved:
+            self._cancelReservation(owner)
+        else:
+            self._maybeStopConsuming()
+
+    def _cancelReservation(self, owner):
+        _, slots, timer = self.reserved.pop(owner)
+        if timer.active():
+            timer.cancel()
+        self._releaseSlots(slots)
+
+    def _expireReservation(self, owner):
+        log.msg("%s: %s did not claim the lock within %d seconds; "
+                "releasing it" % (self, owner, self.reservationTimeout))
+        self.waiting.pop(owner, None)
+        self._cancelReservation(owner)
+
+    def _maybeReserve(self):
+        # only one loop claiming slots at a time
+        if self._reserving:
+            self._reserveAgain = True
+            return
+        self._reserving = True
+        d = self._reserve()
+        d.addErrback(log.err, "while claiming %r" % (self,))
+
+        @d.addBoth
+        def done(_):
+            self._reserving = False
+            if self._reserveAgain:
+                self._reserveAgain = False
+                self._maybeReserve()
+            else:
+                self._maybeStopConsuming()
+
+    @defer.inlineCallbacks
+    def _reserve(self):
+        db = self.master.db.masterlocks
+        if self.dblockid is None:
+            dblockid = yield db.findLockId(self.name)
+            self._consumer = yield self.master.mq.startConsuming(
+                self._lockMessage, ('masterlocks', str(dblockid), None))
+            self.dblockid = dblockid
+
+        while True:
+            if self._reloadClaims:
+                self._reloadClaims = False
+                claims = yield db.getLockClaims(self.dblockid)
+                self.remoteSlots = dict(
+                    (c['slot'], c['masterid']) for c in claims
+                    if c['slot'] not in self.localSlots)
+
+            # serve the waiters in order; an exclusive waiter blocks the
+            # counting waiters behind it
+            for owner, (access, d) in iteritems(self.waiting):
+                if owner not in self.reserved:
+                    break
+            else:
+                return
+            slots = self._freeSlots(access)
+            if slots is None:
+                self._schedulePoll()
+                return
+
+            exclusive = access.mode == 'exclusive'
+            self.localSlots.update(slots)
+            try:
+                yield db.claimLockSlots(self.dblockid, slots,
+                                        self.master.masterid, exclusive,
+                                        _reactor=self.master.reactor)
+            except masterlocks.MasterLockAlreadyClaimedError:
+                # another master got there first
+                self.localSlots.difference_update(slots)
+                self._reloadClaims = True
+                continue
+            except Exception:
+                self.localSlots.difference_update(slots)
+                raise
+            self.master.mq.produce(
+                ('masterlocks', str(self.dblockid), 'claimed'),
+                dict(lockid=self.dblockid, masterid=self.master.masterid,
+                     slots=slots, exclusive=exclusive))
+
+            if self.waiting.get(owner) != (access, d):
+                # it stopped waiting meanwhile
+                self._releaseSlots(slots)
+                continue
+            timer = self.master.reactor.callLater(
+                self.reservationTimeout, self._expireReservation, owner)
+            self.reserved[owner] = (access, slots, timer)
+            self.waiting[owner] = (access, None)
+            eventually(d.callback, self)
+
+    def _freeSlots(self, access):
+        """Return the slots to claim for C{access}, or None if they are
+        not all free."""
+        if access.mode == 'exclusive':
+            if self.localSlots or self.remoteSlots:
+                return None
+            return list(range(self.maxCount))
+        for slot in range(self.maxCount):
+            if slot not in self.localSlots and slot not in self.remoteSlots:
+                return [slot]
+        return None
+
+    def _releaseSlots(self, slots):
+        d = self.master.db.masterlocks.releaseLockSlots(
+            self.dblockid, slots, self.master.masterid)
+
+        @d.addCallback
+        def released(_):
+            self.localSlots.difference_update(slots)
+            self.master.mq.produce(
+                ('masterlocks', str(self.dblockid), 'released'),
+                dict(lockid=self.dblockid, masterid=self.master.masterid,
+                     slots=slots))
+            self._maybeReserve()
+            self.release_subs.deliver()
+        d.addErrback(log.err, "while releasing %r" % (self,))
+        return d
+
+    def discard(self):
+        """This instance of the lock is not handed out anymore (e.g., the
+        lock was reconfigured): stop following the claims of the other
+        masters once it is not held or waited for anymore."""
+        self._discarded = True
+        self._maybeStopConsuming()
+
+    def _maybeStopConsuming(self):
+        if not self._discarded or self._reserving:
+            return
+        if self.owners or self.waiting or self.reserved or self.localSlots:
+            return
+        if self._consumer is not None:
+            self._consumer.stopConsuming()
+            self._consumer = None
+            # the claims are reloaded if the lock is used again
+            self.dblockid = None
+            self._reloadClaims = True
+        if self._pollTimer is not None and self._pollTimer.active():
+            self._pollTimer.cancel()
+        self._pollTimer = None
+
+    def _schedulePoll(self):
+        if self._pollTimer is None or not self._pollTimer.active():
+            self._pollTimer = self.master.reactor.callLater(
+                self.pollInterval, self._poll)
+
+    def _poll(self):
+        self._reloadClaims = True
+        self._maybeReserve()
+
+    def _lockMessage(self, key, msg):
+        # the slots of this instance are kept in localSlots; the claims of
+        # the other instances of the lock, including those of this master
+        # (e.g., an instance replaced by a reconfig, and still held), are
+        # followed like those of the other masters
+        if key[-1] == 'claimed':
+            for slot in msg['slots']:
+                if slot not in self.localSlots:
+                    self.remoteSlots[slot] = msg['masterid']
+        else:
+            for slot in msg['slots']:
+                if self.remoteSlots.get(slot) == msg['masterid']:
+                    del self.remoteSlots[slot]
+            self._maybeReserve()
+            self.release_subs.deliver()
+
+
 class RealWorkerLock:
 
     def __init__(self, lockid):
@@ -286,14 +625,19 @@ class MasterLock(BaseLockId):
 
     Use this to protect a resource that is shared among all builders and all
     workers, for example to limit the load on a common SVN repository.
+
+    By default, the lock is only enforced among the builds of each master.
+    With distributed=True, it is shared by all the masters using the same
+    database.
     """
 
-    compare_attrs = ('name', 'maxCount')
+    compare_attrs = ('name', 'maxCount', 'distributed')
     lockClass = RealMasterLock
 
-    def __init__(self, name, maxCount=1):
+    def __init__(self, name, maxCount=1, distributed=False):
         self.name = name
         self.maxCount = maxCount
+        self.distributed = distributed
 
 
 class WorkerLock(BaseLockId, WorkerAPICompatMixin):
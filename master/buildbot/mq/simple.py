@@ -30,7 +30,7 @@ class SimpleMQ(service.ReconfigurableServiceMixin, base.MQBase):
 
     def __init__(self):
         base.MQBase.__init__(self)
-        self.qrefs = []
+        self.qrefs = tuplematch.TupleIndex()
         self.persistent_qrefs = {}
         self.debug = False
 
@@ -42,9 +42,8 @@ class SimpleMQ(service.ReconfigurableServiceMixin, base.MQBase):
     def produce(self, routingKey, data):
         if self.debug:
             log.msg("MSG: %s\n%s" % (routingKey, pprint.pformat(data)))
-        for qref in self.qrefs:
-            if tuplematch.matchTuple(routingKey, qref.filter):
-                qref.invoke(routingKey, data)
+        for qref in self.qrefs.match(routingKey):
+            qref.invoke(routingKey, data)
 
     def startConsuming(self, callback, filter, persistent_name=None):
         if any(not isinstance(k, str) and k is not None for k in filter):
@@ -55,11 +54,11 @@ class SimpleMQ(service.ReconfigurableServiceMixin, base.MQBase):
                 qref.startConsuming(callback)
             else:
                 qref = PersistentQueueRef(self, callback, filter)
-                self.qrefs.append(qref)
+                self.qrefs.add(filter, qref)
                 self.persistent_qrefs[persistent_name] = qref
         else:
             qref = QueueRef(self, callback, filter)
-            self.qrefs.append(qref)
+            self.qrefs.add(filter, qref)
         return defer.succeed(qref)
 
 
@@ -75,8 +74,8 @@ class QueueRef(base.QueueRef):
     def stopConsuming(self):
         self.callback = None
         try:
-            self.mq.qrefs.remove(self)
-        except ValueError:
+            self.mq.qrefs.remove(self.filter, self)
+        except KeyError:
             pass
 
 
@@ -0,0 +1 @@
+The new :bb:cfg:`batchBuildRequestClaims` option lets the master claim the build requests of all the builds it can start in a single database transaction.
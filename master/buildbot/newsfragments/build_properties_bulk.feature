@@ -0,0 +1 @@
+Builds only write the properties which changed since the previous step to the database, all at once with the new ``db.builds.setBuildProperties`` method, instead of re-reading all properties and writing each changed one separately.
@@ -0,0 +1 @@
+``buildbot cleanupdb`` goes through the logs in batches rather than loading them all first. It recompresses several logs at a time (``--jobs``) and resumes where an interrupted run stopped. It can stop after a time budget (``--time-limit``), recompresses only the chunks using given compression methods (``--convert``), and prints its throughput.
@@ -0,0 +1 @@
+The default ``collapseRequests`` strategy compares a signature of the sourcestamps of each buildset, kept in the new ``CollapseSignatures`` cache, rather than fetching both buildsets from the data API for each pair of build requests.
@@ -0,0 +1 @@
+New database indexes speed up listing the pending build requests of a builder, the most recent builds of a builder, and the logs of a step; a new test suite checks that the queries behind the most used data API endpoints use indexes.
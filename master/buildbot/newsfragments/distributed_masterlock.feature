@@ -0,0 +1 @@
+:py:class:`~buildbot.locks.MasterLock` accepts ``distributed=True`` to share a lock between all the masters of a multi-master configuration; its claims are kept in the database (new ``masterlocks`` and ``masterlock_claims`` tables) and released when a master is deactivated.
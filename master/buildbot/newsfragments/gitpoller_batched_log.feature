@@ -0,0 +1 @@
+:py:class:`~buildbot.changes.gitpoller.GitPoller` reads the metadata of all new commits with a single ``git log`` process, instead of running four ``git`` processes per commit.
@@ -0,0 +1 @@
+:bb:cfg:`buildHorizon` and :bb:cfg:`logHorizon` are no longer ignored: old builds and logs are now deleted in small batches by the periodic database cleanup, within the new :bb:cfg:`cleanupTimeBudget`.
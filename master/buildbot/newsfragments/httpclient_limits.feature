@@ -0,0 +1 @@
+:py:class:`~buildbot.util.httpclientservice.HTTPClientService`, used by the GitHub, GitLab, Bitbucket, Stash and HTTP reporters, now limits the number of concurrent requests to each host, queues the others, and retries requests which failed to connect or got a ``429`` or ``503`` answer (or ``502`` and ``504`` for idempotent methods), with exponential backoff.
@@ -0,0 +1 @@
+Log content appended by running steps is now buffered in the master and written to the database in batches, turning many small ``logchunks`` inserts into a few multi-row ones (see :py:meth:`~buildbot.db.logs.LogsConnectorComponent.flushLogs`).
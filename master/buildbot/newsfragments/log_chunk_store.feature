@@ -0,0 +1 @@
+The new :bb:cfg:`logChunkStore` parameter keeps the content of build logs outside of the database, e.g. in append-only files with ``util.FileLogChunkStore``.
@@ -0,0 +1 @@
+Reading a range of log lines no longer scans the chunks for newlines, and recently read chunks are kept decompressed in the new ``logchunks`` cache (see :bb:cfg:`caches`).
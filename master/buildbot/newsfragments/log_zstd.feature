@@ -0,0 +1 @@
+Build logs can be compressed with zstd (:bb:cfg:`logCompressionMethod` ``'zstd'``), optionally with per-builder dictionaries (:bb:cfg:`logCompressionDictionaries`), and log compression no longer runs on the database threads.
@@ -0,0 +1 @@
+The simple message queue indexes its consumers by filter, so the cost of delivering a message no longer grows with the number of consumers (e.g. open web UI pages).
@@ -0,0 +1,2 @@
+Collecting the stdout or stderr of a remote command (``collectStdout``, used e.g. by :bb:step:`SetPropertyFromCommand`) and ``BufferLogObserver`` no longer take quadratic time for large outputs; output larger than 16 MiB is kept in a temporary file rather than in memory.
+Very long log lines arriving in many chunks are no longer copied on each chunk.
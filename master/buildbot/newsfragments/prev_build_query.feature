@@ -0,0 +1 @@
+Finding the previous build of a build, for reporters (skipping retried builds) and for the changes of a build (the previous successful build with the same source stamps), is done with batched database queries, backed by a new index on the builder, results and number of builds.
@@ -0,0 +1 @@
+Raw log downloads are now streamed to the client in batches of lines, so downloading a large log no longer loads it into the master's memory.
@@ -0,0 +1 @@
+The master now applies backpressure to workers sending command output faster than it can be written to the logs: once more than 1 MiB of output for a command (or 64 MiB for the whole master) is waiting to be written, the worker's updates are only acknowledged after they have been written, slowing the worker down instead of buffering the output in the master's memory.
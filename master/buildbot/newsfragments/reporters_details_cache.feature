@@ -0,0 +1 @@
+Reporters share the build details (build requests, buildsets, builders, properties, steps and logs) they fetch from the data API through the new ``BuildDetails`` cache (see :bb:cfg:`caches`), so configuring several reporters no longer fetches the same details several times for each build event.
@@ -0,0 +1 @@
+The filters, ordering and field selection of data API queries which cannot be handled by the database are now compiled and cached; ordering a collection of 100k items is about 15 times faster.
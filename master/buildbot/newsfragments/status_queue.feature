@@ -0,0 +1 @@
+:bb:reporter:`GitHubStatusPush` and :bb:reporter:`GitLabStatusPush` now send their statuses one at a time, replace statuses still waiting to be sent by newer ones for the same commit and context, and pace their requests according to the rate limit headers of the answers.
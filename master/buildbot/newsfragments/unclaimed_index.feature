@@ -0,0 +1 @@
+The master keeps an in-memory index of unclaimed build requests, updated from the message queue, so that distributing builds no longer queries all unclaimed requests of a builder each time.
@@ -0,0 +1,2 @@
+The worker now coalesces the updates of a command (output, headers, return code) produced while several update calls are waiting for the master's acknowledgement into a single call, instead of making one call per update, and logs per-command statistics on the number of updates, calls, queue length and round-trip times.
+Together with the master's delayed acknowledgements, this keeps a fast command from flooding a slow master.
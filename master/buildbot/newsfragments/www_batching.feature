@@ -0,0 +1 @@
+WebSocket and SSE clients can ask for events to be sent in batches (the ``setBatching`` WebSocket command, or the ``batch`` argument of ``/sse/listen``), with superseded updates of a resource collapsed, and a bounded number of events kept for clients whose connection does not keep up.
@@ -170,6 +170,11 @@ class BotMaster(service.ReconfigurableServiceMixin, service.AsyncMultiService):
             if buildername:
                 self.maybeStartBuildsForBuilder(buildername)
 
+        # start the children first, so that the distributor's index of
+        # unclaimed build requests is updated before the messages below are
+        # consumed
+        yield service.AsyncMultiService.startService(self)
+
         # consume both 'new' and 'unclaimed' build requests
         startConsuming = self.master.mq.startConsuming
         self.buildrequest_consumer_new = yield startConsuming(
@@ -178,7 +183,6 @@ class BotMaster(service.ReconfigurableServiceMixin, service.AsyncMultiService):
         self.buildrequest_consumer_unclaimed = yield startConsuming(
             buildRequestAdded,
             ('buildrequests', None, 'unclaimed'))
-        yield service.AsyncMultiService.startService(self)
 
     @defer.inlineCallbacks
     def reconfigServiceWithBuildbotConfig(self, new_config):
@@ -257,6 +261,9 @@ class BotMaster(service.ReconfigurableServiceMixin, service.AsyncMultiService):
         if self.buildrequest_consumer_unclaimed:
             self.buildrequest_consumer_unclaimed.stopConsuming()
             self.buildrequest_consumer_unclaimed = None
+        for lock in itervalues(self.locks):
+            if isinstance(lock, locks.RealDistributedMasterLock):
+                lock.discard()
         return service.AsyncMultiService.stopService(self)
 
     def getLockByID(self, lockid):
@@ -266,7 +273,18 @@ class BotMaster(service.ReconfigurableServiceMixin, service.AsyncMultiService):
         """
         assert isinstance(lockid, (locks.MasterLock, locks.WorkerLock))
         if lockid not in self.locks:
-            self.locks[lockid] = lockid.lockClass(lockid)
+            if getattr(lockid, 'distributed', False):
+                # the instance of a reconfigured lock is replaced; it keeps
+                # following the claims of the other masters until released
+                for old_lockid, old_lock in list(iteritems(self.locks)):
+                    if (isinstance(old_lock, locks.RealDistributedMasterLock) and
+                            old_lock.name == lockid.name):
+                        del self.locks[old_lockid]
+                        old_lock.discard()
+                self.locks[lockid] = locks.RealDistributedMasterLock(
+                    lockid, self.master)
+            else:
+                self.locks[lockid] = lockid.lockClass(lockid)
         # if the master.cfg file has changed maxCount= on the lock, the next
         # time a build is started, they'll get a new RealLock instance. Note
         # that this requires that MasterLock and WorkerLock (marker) instances
@@ -314,6 +314,13 @@ class Builder(util_service.ReconfigurableServiceMixin,
     deprecatedWorkerClassMethod(locals(), canStartWithWorkerForBuilder,
                                 compat_name="canStartWithSlavebuilder")
 
+    def getLocksForWorker(self, workerforbuilder):
+        """Return the (lock, access) pairs a build of this builder would
+        claim on the given worker."""
+        return [(self.botmaster.getLockFromLockAccess(access)
+                 .getLock(workerforbuilder.worker), access)
+                for access in self.config.locks]
+
     def canStartBuild(self, workerforbuilder, breq):
         if callable(self.config.canStartBuild):
             return defer.maybeDeferred(self.config.canStartBuild, self, workerforbuilder, breq)
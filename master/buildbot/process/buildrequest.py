@@ -46,6 +46,17 @@ class BuildRequestCollapser(object):
     def __init__(self, master, brids):
         self.master = master
         self.brids = brids
+        # signatures looked up by this collapser, by buildsetid, so that a
+        # queue longer than the CollapseSignatures cache does not make every
+        # lookup of the scan miss the cache
+        self._signatures = {}
+
+    @defer.inlineCallbacks
+    def _getCollapseSignature(self, buildsetid):
+        if buildsetid not in self._signatures:
+            self._signatures[buildsetid] = yield BuildRequest.getCollapseSignature(
+                self.master, buildsetid)
+        defer.returnValue(self._signatures[buildsetid])
 
     @defer.inlineCallbacks
     def _getUnclaimedBrs(self, builderid):
@@ -60,8 +71,29 @@ class BuildRequestCollapser(object):
         unclaim_brs.sort(key=lambda brd: brd['submitted_at'])
         defer.returnValue(unclaim_brs)
 
+    @defer.inlineCallbacks
+    def _getCollapsibleBrs(self, br, unclaim_brs):
+        # Same result as calling BuildRequest.canBeCollapsed for each of the
+        # unclaimed buildrequests, but with one signature lookup for each
+        # buildset, which is cached
+        signature = yield self._getCollapseSignature(br['buildsetid'])
+        collapsible = []
+        for unclaim_br in unclaim_brs:
+            if unclaim_br['buildrequestid'] == br['buildrequestid']:
+                continue
+            if unclaim_br['buildsetid'] != br['buildsetid']:
+                if signature is None:
+                    continue
+                other = yield self._getCollapseSignature(unclaim_br['buildsetid'])
+                if other != signature:
+                    continue
+            collapsible.append(unclaim_br)
+        defer.returnValue(collapsible)
+
     @defer.inlineCallbacks
     def collapse(self):
+        # the builder module imports this one
+        from buildbot.process.builder import Builder
         collapseBRs = []
 
         for brid in self.brids:
@@ -80,6 +112,13 @@ class BuildRequestCollapser(object):
             if not collapseRequestsFn or not unclaim_brs:
                 continue
 
+            # the default strategy only depends on the buildsets, so it is
+            # done without calling the function for each pair
+            if collapseRequestsFn is Builder._defaultCollapseRequestFn:
+                collapsible = yield self._getCollapsibleBrs(br, unclaim_brs)
+                collapseBRs.extend(collapsible)
+                continue
+
             for unclaim_br in unclaim_brs:
                 if unclaim_br['buildrequestid'] == br['buildrequestid']:
                     continue
@@ -136,6 +175,15 @@ class TempChange(object):
         self.who = d['author']
 
 
+class _CollapseSignature(object):
+    # the caches only hold objects that can be weakly referenced
+
+    __slots__ = ('value', '__weakref__')
+
+    def __init__(self, value):
+        self.value = value
+
+
 class BuildRequest(object):
 
     """
@@ -255,43 +303,49 @@ class BuildRequest(object):
             defer.returnValue(True)
             return
 
-        # get the buidlsets for each buildrequest
-        selfBuildsets = yield master.data.get(
-            ('buildsets', str(br1['buildsetid'])))
-        otherBuildsets = yield master.data.get(
-            ('buildsets', str(br2['buildsetid'])))
-
-        # extract sourcestamps, as dictionaries by codebase
-        selfSources = dict((ss['codebase'], ss)
-                           for ss in selfBuildsets['sourcestamps'])
-        otherSources = dict((ss['codebase'], ss)
-                            for ss in otherBuildsets['sourcestamps'])
-
-        # if the sets of codebases do not match, we can't collapse
-        if set(selfSources) != set(otherSources):
+        selfSignature = yield BuildRequest.getCollapseSignature(
+            master, br1['buildsetid'])
+        # anything with a patch won't be collapsed
+        if selfSignature is None:
             defer.returnValue(False)
             return
+        otherSignature = yield BuildRequest.getCollapseSignature(
+            master, br2['buildsetid'])
+        defer.returnValue(selfSignature == otherSignature)
 
-        for c, selfSS in iteritems(selfSources):
-            otherSS = otherSources[c]
-            if selfSS['revision'] != otherSS['revision']:
-                defer.returnValue(False)
-                return
-            if selfSS['repository'] != otherSS['repository']:
-                defer.returnValue(False)
-                return
-            if selfSS['branch'] != otherSS['branch']:
-                defer.returnValue(False)
-                return
-            if selfSS['project'] != otherSS['project']:
-                defer.returnValue(False)
-                return
-            # anything with a patch won't be collapsed
-            if selfSS['patch'] or otherSS['patch']:
-                defer.returnValue(False)
-                return
+    @staticmethod
+    def getCollapseSignature(master, buildsetid):
+        """
+        Returns the collapse signature of a buildset, via Deferred: the
+        buildrequests of two buildsets can be collapsed by the default
+        strategy if their signatures are equal.  The signature is a tuple of
+        the codebase, revision, repository, branch and project of each
+        sourcestamp, or None if a sourcestamp has a patch, since those are
+        never collapsed.
+
+        The signatures are kept in the C{CollapseSignatures} cache.
+        """
+        cache = master.caches.get_cache("CollapseSignatures",
+                                        BuildRequest._makeCollapseSignature)
+        d = cache.get(buildsetid, master=master)
+        d.addCallback(lambda signature: signature.value)
+        return d
 
-        defer.returnValue(True)
+    @staticmethod
+    @defer.inlineCallbacks
+    def _makeCollapseSignature(buildsetid, master):
+        buildset = yield master.data.get(('buildsets', str(buildsetid)))
+        # sourcestamps by codebase
+        sources = dict((ss['codebase'], ss)
+                       for ss in buildset['sourcestamps'])
+        signature = []
+        for codebase, ss in sorted(iteritems(sources)):
+            if ss['patch']:
+                defer.returnValue(_CollapseSignature(None))
+                return
+            signature.append((codebase, ss['revision'], ss['repository'],
+                              ss['branch'], ss['project']))
+        defer.returnValue(_CollapseSignature(tuple(signature)))
 
     def mergeSourceStampsWith(self, others):
         """ Returns one merged sourcestamp for every codebase """
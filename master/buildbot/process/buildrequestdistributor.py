@@ -16,6 +16,7 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import heapq
 import random
 from datetime import datetime
 
@@ -33,6 +34,237 @@ from buildbot.util import epoch2datetime
 from buildbot.util import service
 
 
+def unclaimedSortKey(brdict):
+    # highest priority first, then oldest first
+    return (-brdict['priority'], brdict['submitted_at'],
+            brdict['buildrequestid'])
+
+
+@defer.inlineCallbacks
+def fetchUnclaimedBrdicts(master, builderid):
+    # get the unclaimed brdicts of the builder from the data API, sorted with
+    # unclaimedSortKey
+    brdicts = yield master.data.get(('builders', builderid, 'buildrequests'),
+                                    [resultspec.Filter('claimed', 'eq',
+                                                       [False])])
+    brdicts.sort(key=unclaimedSortKey)
+    defer.returnValue(brdicts)
+
+
+class _UnclaimedQueue(object):
+
+    # unclaimed brdicts of a builder, as a heap of [sortkey, brid] entries and
+    # a dict of brid: (entry, brdict); entries of removed brdicts stay in the
+    # heap until they reach its top, or it is compacted.  version changes
+    # whenever the queue does, so that views know when to start over.
+
+    def __init__(self, brdicts):
+        self.brdicts = {}
+        self.heap = []
+        self.version = 0
+        for brdict in brdicts:
+            entry = [unclaimedSortKey(brdict), brdict['buildrequestid']]
+            self.brdicts[entry[1]] = (entry, brdict)
+            self.heap.append(entry)
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.brdicts)
+
+    def update(self, brdict):
+        brid = brdict['buildrequestid']
+        if brdict['claimed'] or brdict['complete']:
+            self.remove(brid)
+            return
+        if brid in self.brdicts:
+            entry = self.brdicts[brid][0]
+            self.brdicts[brid] = (entry, brdict)
+        else:
+            entry = [unclaimedSortKey(brdict), brid]
+            self.brdicts[brid] = (entry, brdict)
+            heapq.heappush(self.heap, entry)
+        self.version += 1
+
+    def remove(self, brid):
+        if self.brdicts.pop(brid, None) is None:
+            return
+        self.version += 1
+        # drop removed entries from the top of the heap, and compact it when
+        # they make up most of it
+        heap = self.heap
+        while heap and self._isRemoved(heap[0]):
+            heapq.heappop(heap)
+        if len(heap) > 2 * len(self.brdicts) + 16:
+            self.heap = [entry for entry, _ in self.brdicts.values()]
+            heapq.heapify(self.heap)
+
+    def _isRemoved(self, entry):
+        current = self.brdicts.get(entry[1])
+        return current is None or current[0] is not entry
+
+    def view(self):
+        return _UnclaimedView(self)
+
+    def sorted(self):
+        return list(self.view())
+
+
+class _UnclaimedView(object):
+
+    # a build chooser's view of an _UnclaimedQueue: the brdicts in order,
+    # except those removed from the view.  They are taken from the queue's
+    # heap as they are needed, by walking it with a heap of its frontier, so
+    # that getting the first brdict is O(log n) however long the queue is;
+    # the walk starts over when the queue changes.
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.removed = set()
+        self._taken = []
+        self._frontier = None
+        self._version = None
+
+    def _take(self, count=None):
+        queue = self.queue
+        if self._version != queue.version:
+            self._version = queue.version
+            self._taken = []
+            self._frontier = [(queue.heap[0], 0)] if queue.heap else []
+        heap = queue.heap
+        frontier = self._frontier
+        while frontier and (count is None or len(self._taken) < count):
+            entry, i = heapq.heappop(frontier)
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+            if queue._isRemoved(entry) or entry[1] in self.removed:
+                continue
+            self._taken.append(queue.brdicts[entry[1]][1])
+        return self._taken
+
+    def __len__(self):
+        return len(self.queue) - len(
+            [brid for brid in self.removed if brid in self.queue.brdicts])
+
+    def __bool__(self):
+        return bool(self._take(1))
+    __nonzero__ = __bool__
+
+    def __getitem__(self, index):
+        return self._take(index + 1)[index]
+
+    def __iter__(self):
+        return iter(list(self._take()))
+
+    def get(self, brid):
+        if brid in self.removed:
+            return None
+        current = self.queue.brdicts.get(brid)
+        return current[1] if current is not None else None
+
+    def remove(self, brdict):
+        brid = brdict['buildrequestid']
+        self.removed.add(brid)
+        self._taken = [brd for brd in self._taken
+                       if brd['buildrequestid'] != brid]
+
+
+class UnclaimedBuildRequests(service.AsyncService):
+
+    """
+    Master-wide index of the unclaimed build requests of each builder, kept up
+    to date from the C{buildrequests} messages, so that build choosers do not
+    need to query the database.
+
+    A builder's requests are fetched from the data API the first time they are
+    needed, and again after L{invalidate}.  Other masters' requests are only
+    seen through the message queue; claims that fail because the index was
+    stale should be followed by a call to L{invalidate}.
+    """
+
+    def __init__(self):
+        self._queues = {}
+        # builderid: list of messages received while loading the builder
+        self._loading = {}
+        self._loadWaiters = {}
+        self._consumer = None
+
+    @defer.inlineCallbacks
+    def startService(self):
+        self._consumer = yield self.master.mq.startConsuming(
+            self._buildRequestEvent, ('buildrequests', None, None))
+        yield service.AsyncService.startService(self)
+
+    def stopService(self):
+        if self._consumer:
+            self._consumer.stopConsuming()
+            self._consumer = None
+        self._queues = {}
+        return service.AsyncService.stopService(self)
+
+    def _buildRequestEvent(self, key, msg):
+        builderid = msg['builderid']
+        if builderid in self._loading:
+            self._loading[builderid].append(msg)
+        elif builderid in self._queues:
+            self._queues[builderid].update(msg)
+
+    @defer.inlineCallbacks
+    def getBuildRequests(self, builderid):
+        """
+        Get the unclaimed brdicts of the given builder, highest priority
+        first, then oldest first.  The result is a sequence which follows the
+        changes of the index, and only sorts as many brdicts as are looked
+        at; brdicts can be removed from it without changing the index.
+
+        @returns: sequence of brdicts, via Deferred
+        """
+        if not self.running:
+            brdicts = yield fetchUnclaimedBrdicts(self.master, builderid)
+            defer.returnValue(_UnclaimedQueue(brdicts).view())
+        queue = self._queues.get(builderid)
+        if queue is None:
+            queue = yield self._load(builderid)
+        defer.returnValue(queue.view())
+
+    def removeBuildRequests(self, builderid, brids):
+        """Forget the given build requests, e.g., once they are claimed."""
+        queue = self._queues.get(builderid)
+        if queue is not None:
+            for brid in brids:
+                queue.remove(brid)
+
+    def invalidate(self, builderid):
+        """Fetch the builder's requests from the data API when next needed."""
+        self._queues.pop(builderid, None)
+
+    @defer.inlineCallbacks
+    def _load(self, builderid):
+        if builderid in self._loading:
+            d = defer.Deferred()
+            self._loadWaiters.setdefault(builderid, []).append(d)
+            queue = yield d
+            defer.returnValue(queue)
+
+        self._loading[builderid] = []
+        try:
+            brdicts = yield fetchUnclaimedBrdicts(self.master, builderid)
+        except Exception:
+            self._loading.pop(builderid)
+            for d in self._loadWaiters.pop(builderid, []):
+                d.errback()
+            raise
+        queue = _UnclaimedQueue(brdicts)
+        # apply what happened while the query was running
+        for msg in self._loading.pop(builderid):
+            queue.update(msg)
+        if self.running:
+            self._queues[builderid] = queue
+        for d in self._loadWaiters.pop(builderid, []):
+            d.callback(queue)
+        defer.returnValue(queue)
+
+
 class BuildChooserBase(object):
     #
     # WARNING: This API is experimental and in active development.
@@ -51,6 +283,10 @@ class BuildChooserBase(object):
     # chooseNextBuild() that delegates out to two other functions:
     #   * bc.popNextBuild() - get the next (worker, breq) pair
 
+    # UnclaimedBuildRequests index to take the unclaimed brdicts from; set by
+    # BuildRequestDistributor.createBuildChooser
+    unclaimedBuildRequests = None
+
     def __init__(self, bldr, master):
         self.bldr = bldr
         self.master = master
@@ -82,15 +318,13 @@ class BuildChooserBase(object):
         # exists, this function does nothing. If a refetch is desired, set
         # the self.unclaimedBrdicts to None before calling."""
         if self.unclaimedBrdicts is None:
-            # TODO: use order of the DATA API
-            brdicts = yield self.master.data.get(('builders',
-                                                  (yield self.bldr.getBuilderId()),
-                                                  'buildrequests'),
-                                                 [resultspec.Filter('claimed',
-                                                                    'eq',
-                                                                    [False])])
-            # sort by submitted_at, so the first is the oldest
-            brdicts.sort(key=lambda brd: brd['submitted_at'])
+            builderid = yield self.bldr.getBuilderId()
+            if self.unclaimedBuildRequests is not None:
+                brdicts = yield self.unclaimedBuildRequests.getBuildRequests(
+                    builderid)
+            else:
+                brdicts = yield fetchUnclaimedBrdicts(self.master, builderid)
+                brdicts = _UnclaimedQueue(brdicts).view()
             self.unclaimedBrdicts = brdicts
         defer.returnValue(self.unclaimedBrdicts)
 
@@ -113,11 +347,7 @@ class BuildChooserBase(object):
         if breq is None:
             return None
 
-        brid = breq.id
-        for brdict in self.unclaimedBrdicts:
-            if brid == brdict['buildrequestid']:
-                return brdict
-        return None
+        return self.unclaimedBrdicts.get(breq.id)
 
     def _removeBuildRequest(self, breq):
         # Remove a BuildrRequest object (and its brdict)
@@ -126,7 +356,7 @@ class BuildChooserBase(object):
         if breq is None:
             return
 
-        brdict = self._getBrdictForBuildRequest(breq)
+        brdict = self.unclaimedBrdicts.get(breq.id)
         if brdict is not None:
             self.unclaimedBrdicts.remove(brdict)
 
@@ -325,13 +555,16 @@ class BuildRequestDistributor(service.AsyncMultiService):
 
         self._pendingMSBOCalls = []
 
+        self.unclaimedBuildRequests = UnclaimedBuildRequests()
+        self.unclaimedBuildRequests.setServiceParent(self)
+
     @defer.inlineCallbacks
     def stopService(self):
         # Lots of stuff happens asynchronously here, so we need to let it all
         # quiesce.  First, let the parent stopService succeed between
         # activities; then the loop will stop calling itself, since
         # self.running is false.
-        yield self.activity_lock.run(service.AsyncService.stopService, self)
+        yield self.activity_lock.run(service.AsyncMultiService.stopService, self)
 
         # now let any outstanding calls to maybeStartBuildsOn to finish, so
         # they don't get interrupted in mid-stride.  This tends to be
@@ -485,6 +718,22 @@ class BuildRequestDistributor(service.AsyncMultiService):
                 self.activity_lock.release()
                 break
 
+            if self.master.config.batchBuildRequestClaims:
+                # handle all the pending builders in a single pass
+                bldr_names, self._pending_builders = self._pending_builders, []
+                self.pending_builders_lock.release()
+
+                bldrs = [self.botmaster.builders[n] for n in bldr_names
+                         if n in self.botmaster.builders]
+                try:
+                    yield self._maybeStartBuildsOnBuilders(bldrs)
+                except Exception:
+                    log.err(Failure(),
+                            "from maybeStartBuild for builders %s" % (bldr_names,))
+
+                self.activity_lock.release()
+                continue
+
             bldr_name = self._pending_builders.pop(0)
             self.pending_builders_lock.release()
 
@@ -519,22 +768,134 @@ class BuildRequestDistributor(service.AsyncMultiService):
             brids = [br.id for br in breqs]
             claimed_at_epoch = _reactor.seconds()
             claimed_at = epoch2datetime(claimed_at_epoch)
-            if not (yield self.master.data.updates.claimBuildRequests(
-                    brids, claimed_at=claimed_at)):
+            if not (yield self._claimBuildRequests(bldr, brids, claimed_at)):
                 # some brids were already claimed, so start over
                 bc = self.createBuildChooser(bldr, self.master)
                 continue
 
-            buildStarted = yield bldr.maybeStartBuild(worker, breqs)
-            if not buildStarted:
-                yield self.master.data.updates.unclaimBuildRequests(brids)
-                # try starting builds again.  If we still have a working worker,
-                # then this may re-claim the same buildrequests
-                self.botmaster.maybeStartBuildsForBuilder(self.name)
+            yield self._startBuild(bldr, worker, breqs)
+
+    @defer.inlineCallbacks
+    def _maybeStartBuildsOnBuilders(self, bldrs, _reactor=reactor):
+        # Batched version of _maybeStartBuildsOnBuilder: choose builds for all
+        # the given builders first, then claim all their build requests in a
+        # single transaction, and start the builds.
+        timer = metrics.Timer(
+            'BuildRequestDistributor._maybeStartBuildsOnBuilders()')
+        timer.start()
+
+        assignments, retry = yield self._chooseBuilds(bldrs)
+
+        if assignments:
+            claimed_at = epoch2datetime(_reactor.seconds())
+            brids = [br.id for _, _, breqs in assignments for br in breqs]
+            if (yield self.master.data.updates.claimBuildRequests(
+                    brids, claimed_at=claimed_at)):
+                for bldr, _, breqs in assignments:
+                    self.unclaimedBuildRequests.removeBuildRequests(
+                        (yield bldr.getBuilderId()), [br.id for br in breqs])
+            else:
+                # some brids were already claimed, probably by another
+                # master; claim what is left one build at a time, and let the
+                # builders that lost a claim choose again
+                claimed = []
+                for bldr, worker, breqs in assignments:
+                    if (yield self._claimBuildRequests(
+                            bldr, [br.id for br in breqs], claimed_at)):
+                        claimed.append((bldr, worker, breqs))
+                    else:
+                        retry.add(bldr.name)
+                assignments = claimed
+
+            yield defer.gatherResults([
+                self._startBuild(bldr, worker, breqs)
+                for bldr, worker, breqs in assignments])
+
+        timer.stop()
+
+        if retry:
+            yield self._maybeStartBuildsOn(retry)
+
+    @defer.inlineCallbacks
+    def _chooseBuilds(self, bldrs):
+        # Return a list of (bldr, worker, breqs) to start, and the set of names
+        # of builders that should be given another pass.
+        timer = metrics.Timer('BuildRequestDistributor._chooseBuilds()')
+        timer.start()
+
+        assignments = []
+        retry = set()
+        # the workers of a builder are not aware of the builds chosen for
+        # other builders in this pass, so only give each worker one build;
+        # builders wanting a worker already used get another pass
+        used_workers = set()
+        # likewise, the locks are only claimed once the builds start: lock ->
+        # list of the accesses of the builds chosen in this pass
+        pending_locks = {}
+        for bldr in bldrs:
+            bc = self.createBuildChooser(bldr, self.master)
+            try:
+                while True:
+                    worker, breqs = yield bc.chooseNextBuild()
+                    if not worker or not breqs:
+                        break
+                    if worker.worker in used_workers:
+                        retry.add(bldr.name)
+                        break
+                    locks = bldr.getLocksForWorker(worker)
+                    if not self._locksAvailableAfter(locks, pending_locks):
+                        retry.add(bldr.name)
+                        break
+                    used_workers.add(worker.worker)
+                    for lock, access in locks:
+                        pending_locks.setdefault(lock, []).append(access)
+                    assignments.append((bldr, worker, breqs))
+            except Exception:
+                log.err(Failure(),
+                        "from maybeStartBuild for builder '%s'" % (bldr.name,))
+
+        timer.stop()
+        defer.returnValue((assignments, retry))
+
+    def _locksAvailableAfter(self, locks, pending_locks):
+        # only the conflicts with the builds chosen in this pass matter here:
+        # a lock that is not available anyway was accepted by the build
+        # chooser, and the build will wait for it
+        for lock, access in locks:
+            if lock.isAvailable(None, access) and \
+                    not lock.isAvailableAfter(access,
+                                              pending_locks.get(lock, [])):
+                return False
+        return True
+
+    @defer.inlineCallbacks
+    def _startBuild(self, bldr, worker, breqs):
+        buildStarted = yield bldr.maybeStartBuild(worker, breqs)
+        if not buildStarted:
+            yield self.master.data.updates.unclaimBuildRequests(
+                [br.id for br in breqs])
+            self.unclaimedBuildRequests.invalidate((yield bldr.getBuilderId()))
+            # try starting builds again.  If we still have a working worker,
+            # then this may re-claim the same buildrequests
+            self.botmaster.maybeStartBuildsForBuilder(self.name)
+
+    @defer.inlineCallbacks
+    def _claimBuildRequests(self, bldr, brids, claimed_at):
+        builderid = yield bldr.getBuilderId()
+        claimed = yield self.master.data.updates.claimBuildRequests(
+            brids, claimed_at=claimed_at)
+        if claimed:
+            self.unclaimedBuildRequests.removeBuildRequests(builderid, brids)
+        else:
+            # the index missed a claim, probably from another master
+            self.unclaimedBuildRequests.invalidate(builderid)
+        defer.returnValue(claimed)
 
     def createBuildChooser(self, bldr, master):
         # just instantiate the build chooser requested
-        return self.BuildChooser(bldr, master)
+        bc = self.BuildChooser(bldr, master)
+        bc.unclaimedBuildRequests = self.unclaimedBuildRequests
+        return bc
 
     def _quiet(self):
         # shim for tests
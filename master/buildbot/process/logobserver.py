@@ -19,6 +19,7 @@ from __future__ import print_function
 from zope.interface import implementer
 
 from buildbot import interfaces
+from buildbot.util.outputcollector import OutputCollector
 
 
 @implementer(interfaces.ILogObserver)
@@ -145,10 +146,17 @@ class OutputProgressObserver(LogObserver):
 
 class BufferLogObserver(LogObserver):
 
+    # output larger than this is kept in a temporary file rather than in
+    # memory
+    maxMemory = 16 * 1024 * 1024
+
     def __init__(self, wantStdout=True, wantStderr=False):
         LogObserver.__init__(self)
-        self.stdout = [] if wantStdout else None
-        self.stderr = [] if wantStderr else None
+        self.stdout = self._makeCollector() if wantStdout else None
+        self.stderr = self._makeCollector() if wantStderr else None
+
+    def _makeCollector(self):
+        return OutputCollector(empty=u'', maxMemory=self.maxMemory)
 
     def outReceived(self, data):
         if self.stdout is not None:
@@ -158,10 +166,10 @@ class BufferLogObserver(LogObserver):
         if self.stderr is not None:
             self.stderr.append(data)
 
-    def _get(self, chunks):
-        if chunks is None or not chunks:
+    def _get(self, collector):
+        if collector is None:
             return u''
-        return u''.join(chunks)
+        return collector.getvalue()
 
     def getStdout(self):
         return self._get(self.stdout)
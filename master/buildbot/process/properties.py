@@ -64,6 +64,12 @@ class Properties(util.ComparableMixin):
         # Track keys which are 'runtime', and should not be
         # persisted if a build is rebuilt
         self.runtime = set()
+        # Track keys which may have changed since they were last persisted:
+        # the keys which were set, and those whose mutable value was handed
+        # out, as it may have been changed in place
+        self.dirty = set()
+        # Serialized (value, source) of each key, as it was last persisted
+        self._persisted = {}
         self.build = None  # will be set by the Build when starting
         if kwargs:
             self.update(kwargs, "TEST")
@@ -84,6 +90,10 @@ class Properties(util.ComparableMixin):
         self.__dict__ = d
         if not hasattr(self, 'runtime'):
             self.runtime = set()
+        if not hasattr(self, 'dirty'):
+            self.dirty = set(self.properties)
+        if not hasattr(self, '_persisted'):
+            self._persisted = {}
 
     def __contains__(self, name):
         return name in self.properties
@@ -91,6 +101,7 @@ class Properties(util.ComparableMixin):
     def __getitem__(self, name):
         """Just get the value for this property."""
         rv = self.properties[name][0]
+        self._handedOut(name, rv)
         return rv
 
     def __bool__(self):
@@ -104,11 +115,15 @@ class Properties(util.ComparableMixin):
     def asList(self):
         """Return the properties as a sorted list of (name, value, source)"""
         l = sorted([(k, v[0], v[1]) for k, v in iteritems(self.properties)])
+        for k, v, _ in l:
+            self._handedOut(k, v)
         return l
 
     def asDict(self):
         """Return the properties as a simple key:value dictionary,
         properly unicoded"""
+        for k, (v, _) in iteritems(self.properties):
+            self._handedOut(k, v)
         return dict((k, (v, s)) for k, (v, s) in iteritems(self.properties))
 
     def __repr__(self):
@@ -123,6 +138,7 @@ class Properties(util.ComparableMixin):
 
     def updateFromProperties(self, other):
         """Update this object based on another object; the other object's """
+        self.dirty.update(other.properties)
         self.properties.update(other.properties)
         self.runtime.update(other.runtime)
 
@@ -131,12 +147,60 @@ class Properties(util.ComparableMixin):
         include properties that were marked as runtime."""
         for k, v in iteritems(other.properties):
             if k not in other.runtime:
+                self.dirty.add(k)
                 self.properties[k] = v
 
+    def _handedOut(self, name, value):
+        if isinstance(value, (list, dict)):
+            self.dirty.add(name)
+
+    def _isMutable(self, name):
+        return isinstance(self.properties.get(name, (None,))[0], (list, dict))
+
+    @staticmethod
+    def _serialize(value_source):
+        return json.dumps(value_source, sort_keys=True)
+
+    def getDirtyProperties(self):
+        """Return the properties changed since they were last marked clean,
+        as a name:(value, source) dictionary.
+
+        Only the properties which were set, or whose mutable value was got
+        (and so may have been changed in place, e.g. a list property which
+        was appended to), are compared with their last persisted value.  The
+        returned values are copies, which are not affected by later
+        mutations."""
+        dirty = {}
+        for k in list(self.dirty):
+            if k not in self.properties:
+                self.dirty.discard(k)
+                continue
+            serialized = self._serialize(self.properties[k])
+            if self._persisted.get(k) != serialized:
+                value, source = json.loads(serialized)
+                dirty[k] = (value, source)
+            elif not self._isMutable(k):
+                self.dirty.discard(k)
+        return dirty
+
+    def markClean(self, propdict):
+        """Mark the given properties, as returned by L{getDirtyProperties},
+        as persisted, unless they changed again meanwhile."""
+        for k, v in iteritems(propdict):
+            serialized = self._serialize(v)
+            self._persisted[k] = serialized
+            if k in self.properties and not self._isMutable(k) and \
+                    self._serialize(self.properties[k]) == serialized:
+                self.dirty.discard(k)
+
     # IProperties methods
 
     def getProperty(self, name, default=None):
-        return self.properties.get(name, (default,))[0]
+        if name not in self.properties:
+            return default
+        rv = self.properties[name][0]
+        self._handedOut(name, rv)
+        return rv
 
     def hasProperty(self, name):
         return name in self.properties
@@ -149,6 +213,7 @@ class Properties(util.ComparableMixin):
         source = util.ascii2unicode(source)
 
         self.properties[name] = (value, source)
+        self.dirty.add(name)
         if runtime:
             self.runtime.add(name)
 
@@ -29,6 +29,7 @@ from buildbot.process import metrics
 from buildbot.process.results import FAILURE
 from buildbot.process.results import SUCCESS
 from buildbot.util.eventual import eventually
+from buildbot.util.outputcollector import OutputCollector
 from buildbot.worker.protocols import base
 from buildbot.worker_transition import WorkerAPICompatMixin
 from buildbot.worker_transition import reportDeprecatedWorkerNameUsage
@@ -47,6 +48,21 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
     rc = None
     debug = False
 
+    # Flow control: when more than this many bytes of log data received from
+    # the worker are still being written to the logs, for this command or for
+    # all the commands of the master, the worker's update batches are only
+    # acknowledged once they are written, so that the worker buffers the
+    # output of its commands instead of the master.
+    maxPendingUpdateBytes = 1024 * 1024
+    maxTotalPendingUpdateBytes = 64 * 1024 * 1024
+
+    # bytes of log data being written, for all commands
+    _totalPendingUpdateBytes = 0
+
+    # collected stdout or stderr larger than this is kept in a temporary file
+    # rather than in memory
+    maxCollectedOutputInMemory = 16 * 1024 * 1024
+
     def __init__(self, remote_command, args, ignore_updates=False,
                  collectStdout=False, collectStderr=False, decodeRC=None,
                  stdioLogName='stdio'):
@@ -57,8 +73,10 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
         self._closeWhenFinished = {}
         self.collectStdout = collectStdout
         self.collectStderr = collectStderr
-        self.stdout = ''
-        self.stderr = ''
+        self._stdout = OutputCollector(
+            maxMemory=self.maxCollectedOutputInMemory)
+        self._stderr = OutputCollector(
+            maxMemory=self.maxCollectedOutputInMemory)
         self.updates = {}
         self.stdioLogName = stdioLogName
         self._startTime = None
@@ -69,6 +87,7 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
         self.decodeRC = decodeRC
         self.conn = None
         self.worker = None
+        self._pendingUpdateBytes = 0
         self._registerOldWorkerAttr("worker", name="buildslave")
         self.step = None
         self.builder_name = None
@@ -82,6 +101,28 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
     def __repr__(self):
         return "<RemoteCommand '%s' at %d>" % (self.remote_command, id(self))
 
+    def _setOutput(self, attr, value):
+        collector = OutputCollector(
+            maxMemory=self.maxCollectedOutputInMemory)
+        collector.append(value)
+        setattr(self, attr, collector)
+
+    @property
+    def stdout(self):
+        return self._stdout.getvalue()
+
+    @stdout.setter
+    def stdout(self, value):
+        self._setOutput('_stdout', value)
+
+    @property
+    def stderr(self):
+        return self._stderr.getvalue()
+
+    @stderr.setter
+    def stderr(self, value):
+        self._setOutput('_stderr', value)
+
     def run(self, step, conn, builder_name):
         self.active = True
         self.step = step
@@ -191,11 +232,16 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
         """
         self.worker.messageReceivedFromWorker()
         max_updatenum = 0
+        dl = []
+        size = 0
         for (update, num) in updates:
             # log.msg("update[%d]:" % num)
             try:
                 if self.active and not self.ignore_updates:
-                    self.remoteUpdate(update)
+                    size += self._updateSize(update)
+                    d = self.remoteUpdate(update)
+                    if isinstance(d, defer.Deferred):
+                        dl.append(d)
             except Exception:
                 # log failure, terminate build, let worker retire the update
                 self._finished(Failure())
@@ -203,8 +249,39 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
                 # skip the rest but ack them all
             if num > max_updatenum:
                 max_updatenum = num
+        if not dl:
+            return max_updatenum
+
+        self._pendingUpdateBytes += size
+        RemoteCommand._totalPendingUpdateBytes += size
+
+        def written(results):
+            self._pendingUpdateBytes -= size
+            RemoteCommand._totalPendingUpdateBytes -= size
+            for success, result in results:
+                if not success:
+                    log.err(result, "while processing update from worker")
+            return max_updatenum
+        d = defer.DeferredList(dl, consumeErrors=True)
+        d.addCallback(written)
+
+        if (self._pendingUpdateBytes > self.maxPendingUpdateBytes or
+                RemoteCommand._totalPendingUpdateBytes >
+                self.maxTotalPendingUpdateBytes):
+            # the ack is delayed until the updates are written
+            return d
         return max_updatenum
 
+    @staticmethod
+    def _updateSize(update):
+        size = 0
+        for k in ('stdout', 'stderr', 'header'):
+            if k in update:
+                size += len(update[k])
+        if 'log' in update:
+            size += len(update['log'][1])
+        return size
+
     def remote_complete(self, failure=None):
         """
         Called by the worker's
@@ -232,26 +309,26 @@ class RemoteCommand(base.RemoteCommandImpl, WorkerAPICompatMixin):
     @defer.inlineCallbacks
     def addStdout(self, data):
         if self.collectStdout:
-            self.stdout += data
+            self._stdout.append(data)
         if self.stdioLogName is not None and self.stdioLogName in self.logs:
             log_ = yield self._unwrap(self.logs[self.stdioLogName])
-            log_.addStdout(data)
+            yield log_.addStdout(data)
 
     @util.deferredLocked('loglock')
     @defer.inlineCallbacks
     def addStderr(self, data):
         if self.collectStderr:
-            self.stderr += data
+            self._stderr.append(data)
         if self.stdioLogName is not None and self.stdioLogName in self.logs:
             log_ = yield self._unwrap(self.logs[self.stdioLogName])
-            log_.addStderr(data)
+            yield log_.addStderr(data)
 
     @util.deferredLocked('loglock')
     @defer.inlineCallbacks
     def addHeader(self, data):
         if self.stdioLogName is not None and self.stdioLogName in self.logs:
             log_ = yield self._unwrap(self.logs[self.stdioLogName])
-            log_.addHeader(data)
+            yield log_.addHeader(data)
 
     @util.deferredLocked('loglock')
     @defer.inlineCallbacks
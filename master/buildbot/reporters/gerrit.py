@@ -300,8 +300,10 @@ class GerritStatusPush(service.BuildbotService):
 
     @defer.inlineCallbacks
     def getBuildDetails(self, build):
-        br = yield self.master.data.get(("buildrequests", build['buildrequestid']))
-        buildset = yield self.master.data.get(("buildsets", br['buildsetid']))
+        br = yield utils.getDetail(self.master, ("buildrequests", build['buildrequestid']),
+                                   event=build)
+        buildset = yield utils.getDetail(self.master, ("buildsets", br['buildsetid']),
+                                         event=build)
         yield utils.getDetailsForBuilds(self.master, buildset, [build], wantProperties=True)
 
     def isBuildReported(self, build):
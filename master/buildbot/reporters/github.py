@@ -143,37 +143,46 @@ class GitHubStatusPush(http.HttpStatusPushBase):
             repoName = '.'.join(repo[1].split('.')[:-1])
 
         for sourcestamp in sourcestamps:
-            sha = sourcestamp['revision']
-            try:
-                repo_user = unicode2NativeString(repoOwner)
-                repo_name = unicode2NativeString(repoName)
-                sha = unicode2NativeString(sha)
-                state = unicode2NativeString(state)
-                target_url = unicode2NativeString(build['url'])
-                context = unicode2NativeString(context)
-                issue = unicode2NativeString(issue)
-                description = unicode2NativeString(description)
-                yield self.createStatus(
-                    repo_user=repo_user,
-                    repo_name=repo_name,
-                    sha=sha,
-                    state=state,
-                    target_url=target_url,
-                    context=context,
-                    issue=issue,
-                    description=description
-                )
-                if self.verbose:
-                    log.msg(
-                        'Updated status with "{state}" for'
-                        '{repoOwner}/{repoName} at {sha}, issue {issue}.'.format(
-                            state=state, repoOwner=repoOwner, repoName=repoName, sha=sha, issue=issue))
-            except Exception as e:
-                log.err(
-                    e,
-                    'Failed to update "{state}" for '
-                    '{repoOwner}/{repoName} at {sha}, issue {issue}'.format(
-                        state=state, repoOwner=repoOwner, repoName=repoName, sha=sha, issue=issue))
+            yield self.statusQueue.add(
+                self.statusKey(repoOwner, repoName, sourcestamp['revision'],
+                               context, issue),
+                self.sendStatus,
+                repo_user=unicode2NativeString(repoOwner),
+                repo_name=unicode2NativeString(repoName),
+                sha=unicode2NativeString(sourcestamp['revision']),
+                state=unicode2NativeString(state),
+                target_url=unicode2NativeString(build['url']),
+                context=unicode2NativeString(context),
+                issue=unicode2NativeString(issue),
+                description=unicode2NativeString(description))
+
+    def statusKey(self, repoOwner, repoName, sha, context, issue):
+        """Waiting updates with the same key are replaced by newer ones"""
+        return (repoOwner, repoName, sha, context)
+
+    @defer.inlineCallbacks
+    def sendStatus(self, repo_user, repo_name, sha, state, issue, **kwargs):
+        try:
+            res = yield self.createStatus(
+                repo_user=repo_user,
+                repo_name=repo_name,
+                sha=sha,
+                state=state,
+                issue=issue,
+                **kwargs
+            )
+            if self.verbose:
+                log.msg(
+                    'Updated status with "{state}" for'
+                    '{repoOwner}/{repoName} at {sha}, issue {issue}.'.format(
+                        state=state, repoOwner=repo_user, repoName=repo_name, sha=sha, issue=issue))
+            defer.returnValue(res)
+        except Exception as e:
+            log.err(
+                e,
+                'Failed to update "{state}" for '
+                '{repoOwner}/{repoName} at {sha}, issue {issue}'.format(
+                    state=state, repoOwner=repo_user, repoName=repo_name, sha=sha, issue=issue))
 
 
 class GitHubCommentPush(GitHubStatusPush):
@@ -185,6 +194,10 @@ class GitHubCommentPush(GitHubStatusPush):
         self.startDescription = startDescription
         self.endDescription = endDescription or 'Build done.'
 
+    def statusKey(self, repoOwner, repoName, sha, context, issue):
+        # every comment is sent
+        return None
+
     def createStatus(self,
                      repo_user, repo_name, sha, state, target_url=None,
                      context=None, issue=None, description=None):
@@ -141,41 +141,43 @@ class GitLabStatusPush(http.HttpStatusPushBase):
         proj_id = self.project_ids[project_full_name]
         for sourcestamp in sourcestamps:
             sha = sourcestamp['revision']
-            try:
-                branch = unicode2NativeString(branch)
-                sha = unicode2NativeString(sha)
-                state = unicode2NativeString(state)
-                target_url = unicode2NativeString(build['url'])
-                context = unicode2NativeString(context)
-                description = unicode2NativeString(description)
-                res = yield self.createStatus(
-                    project_id=proj_id,
-                    branch=branch,
-                    sha=sha,
-                    state=state,
-                    target_url=target_url,
-                    context=context,
-                    description=description
-                )
-                if res.code not in (200, 201, 204):
-                    message = yield res.json()
-                    message = message.get('message', 'unspecified error')
-                    log.msg(
-                        'Could not send status "{state}" for '
-                        '{repoOwner}/{repoName} at {sha}: {message}'.format(
-                            state=state, repoOwner=repoOwner,
-                            repoName=repoName, sha=sha,
-                            message=message))
-                elif self.verbose:
-                    log.msg(
-                        'Status "{state}" sent for '
-                        '{repoOwner}/{repoName} at {sha}.'.format(
-                            state=state, repoOwner=repoOwner,
-                            repoName=repoName, sha=sha))
-            except Exception as e:
-                log.err(
-                    e,
-                    'Fail to send status "{state}" for '
-                    '{repoOwner}/{repoName} at {sha}'.format(
+            yield self.statusQueue.add(
+                (proj_id, branch, sha, context),
+                self.sendStatus,
+                repoOwner=repoOwner,
+                repoName=repoName,
+                project_id=proj_id,
+                branch=unicode2NativeString(branch),
+                sha=unicode2NativeString(sha),
+                state=unicode2NativeString(state),
+                target_url=unicode2NativeString(build['url']),
+                context=unicode2NativeString(context),
+                description=unicode2NativeString(description))
+
+    @defer.inlineCallbacks
+    def sendStatus(self, repoOwner, repoName, sha, state, **kwargs):
+        try:
+            res = yield self.createStatus(sha=sha, state=state, **kwargs)
+            if res.code not in (200, 201, 204):
+                message = yield res.json()
+                message = message.get('message', 'unspecified error')
+                log.msg(
+                    'Could not send status "{state}" for '
+                    '{repoOwner}/{repoName} at {sha}: {message}'.format(
+                        state=state, repoOwner=repoOwner,
+                        repoName=repoName, sha=sha,
+                        message=message))
+            elif self.verbose:
+                log.msg(
+                    'Status "{state}" sent for '
+                    '{repoOwner}/{repoName} at {sha}.'.format(
                         state=state, repoOwner=repoOwner,
                         repoName=repoName, sha=sha))
+            defer.returnValue(res)
+        except Exception as e:
+            log.err(
+                e,
+                'Fail to send status "{state}" for '
+                '{repoOwner}/{repoName} at {sha}'.format(
+                    state=state, repoOwner=repoOwner,
+                    repoName=repoName, sha=sha))
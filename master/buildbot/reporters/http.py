@@ -19,8 +19,10 @@ from future.utils import iteritems
 
 import abc
 import copy
+from collections import OrderedDict
 
 from twisted.internet import defer
+from twisted.internet import task
 from twisted.python import log
 
 from buildbot import config
@@ -29,8 +31,126 @@ from buildbot.util import httpclientservice
 from buildbot.util import service
 
 
+class StatusQueue(object):
+
+    """
+    Send the status updates of a reporter one at a time, in order.
+
+    Each update has a key, e.g. (repository, sha, context).  An update
+    added while an older one with the same key is still waiting replaces it,
+    so that bursts of events only send the latest state of each status.
+    Updates with a key of None never replace each other.
+
+    After each update, the queue waits as requested by the rate limit
+    headers of the response returned by the update function (GitHub's
+    C{X-RateLimit-*}, GitLab's C{RateLimit-*}, and C{Retry-After}), so that
+    the updates are spread over the remaining rate limit window instead of
+    exhausting it.
+    """
+
+    def __init__(self, reactor):
+        self.reactor = reactor
+        # key -> (fn, args, kwargs, deferreds waiting for the update)
+        self.pending = OrderedDict()
+        self.running = False
+        self.notBefore = 0
+        self._wait = None
+
+    def add(self, key, fn, *args, **kwargs):
+        """Queue the call of C{fn}, which returns an IHttpResponse via
+        deferred, or None.  The returned deferred fires when the update, or
+        the one which replaced it, has been sent."""
+        if key is None:
+            key = object()
+        d = defer.Deferred()
+        waiters = [d]
+        if key in self.pending:
+            waiters = self.pending[key][3] + waiters
+        self.pending[key] = (fn, args, kwargs, waiters)
+        if not self.running:
+            self._run()
+        return d
+
+    def stop(self):
+        """Drop the waiting updates"""
+        pending, self.pending = self.pending, OrderedDict()
+        if pending:
+            log.msg("dropping %d status updates" % (len(pending),))
+        if self._wait is not None:
+            self._wait.cancel()
+        for _, _, _, waiters in pending.values():
+            for d in waiters:
+                d.callback(None)
+
+    @defer.inlineCallbacks
+    def _run(self):
+        self.running = True
+        try:
+            while self.pending:
+                delay = self.notBefore - self.reactor.seconds()
+                if delay > 0:
+                    self._wait = task.deferLater(self.reactor, delay,
+                                                 lambda: None)
+                    try:
+                        yield self._wait
+                    except defer.CancelledError:
+                        pass
+                    finally:
+                        self._wait = None
+                    continue
+                _, (fn, args, kwargs, waiters) = self.pending.popitem(
+                    last=False)
+                try:
+                    res = yield fn(*args, **kwargs)
+                except Exception:
+                    log.err(None, 'while sending a status update')
+                    res = None
+                self.notBefore = self.reactor.seconds() + self.getDelay(res)
+                for d in waiters:
+                    d.callback(res)
+        finally:
+            self.running = False
+
+    def getDelay(self, res):
+        """Return the number of seconds to wait after the response C{res}
+        before sending the next update"""
+        if res is None:
+            return 0
+        retryAfter = httpclientservice.getResponseHeader(res, 'Retry-After')
+        if retryAfter is not None:
+            try:
+                return float(retryAfter)
+            except ValueError:
+                # an http date; rely on the rate limit headers
+                pass
+
+        def getNumber(*names):
+            for name in names:
+                value = httpclientservice.getResponseHeader(res, name)
+                if value is not None:
+                    try:
+                        return float(value)
+                    except ValueError:
+                        return None
+            return None
+        remaining = getNumber('X-RateLimit-Remaining', 'RateLimit-Remaining')
+        reset = getNumber('X-RateLimit-Reset', 'RateLimit-Reset')
+        if remaining is None or reset is None:
+            return 0
+        window = reset - self.reactor.seconds()
+        if window <= 0:
+            return 0
+        if remaining < 1:
+            return window
+        if remaining < len(self.pending):
+            # spread the waiting updates over the rest of the window
+            return window / remaining
+        return 0
+
+
 class HttpStatusPushBase(service.BuildbotService):
     neededDetails = dict()
+    statusQueue = None
 
     def checkConfig(self, *args, **kwargs):
         service.BuildbotService.checkConfig(self)
@@ -44,6 +164,8 @@ class HttpStatusPushBase(service.BuildbotService):
 
         self.builders = builders
         self.neededDetails = copy.copy(self.neededDetails)
+        if self.statusQueue is None:
+            self.statusQueue = StatusQueue(self.master.reactor)
         for k, v in iteritems(kwargs):
             if k.startswith("want"):
                 self.neededDetails[k] = v
@@ -64,6 +186,7 @@ class HttpStatusPushBase(service.BuildbotService):
     def stopService(self):
         self._buildCompleteConsumer.stopConsuming()
         self._buildStartedConsumer.stopConsuming()
+        self.statusQueue.stop()
 
     def buildStarted(self, key, build):
         return self.getMoreInfoAndSend(build)
@@ -276,8 +276,10 @@ class MailNotifier(service.BuildbotService):
     def buildComplete(self, key, build):
         if self.buildSetSummary:
             return
-        br = yield self.master.data.get(("buildrequests", build['buildrequestid']))
-        buildset = yield self.master.data.get(("buildsets", br['buildsetid']))
+        br = yield utils.getDetail(self.master, ("buildrequests", build['buildrequestid']),
+                                   event=build)
+        buildset = yield utils.getDetail(self.master, ("buildsets", br['buildsetid']),
+                                         event=build)
         yield utils.getDetailsForBuilds(
             self.master, buildset, [build],
             wantProperties=self.messageFormatter.wantProperties,
@@ -19,6 +19,8 @@ from future.moves.collections import UserList
 from future.utils import lrange
 from future.utils import string_types
 
+import copy
+
 from twisted.internet import defer
 from twisted.python import log
 
@@ -27,19 +29,84 @@ from buildbot.process.properties import renderer
 from buildbot.process.results import RETRY
 from buildbot.util import flatten
 
+# how long, in seconds, the results of the data API calls made by the
+# functions below are shared between callers; several reporters handling the
+# same build event then only fetch its details once.  The details of a build
+# or buildset which may still change are keyed on its state as well, so that
+# the reports of its next event do not get them.  Log contents are never
+# shared.
+DETAILS_CACHE_TTL = 5
+
+
+class _Detail(object):
+    # the caches only hold objects that can be weakly referenced
+
+    __slots__ = ('value', 'fetched_at', '__weakref__')
+
+    def __init__(self, value, fetched_at):
+        self.value = value
+        self.fetched_at = fetched_at
+
+
+def _fetchDetail(master, path, filters=None):
+    d = master.data.get(path, filters=filters)
+    d.addCallback(_Detail, master.reactor.seconds())
+    return d
+
+
+def _getDetailsCache(master):
+    def miss_fn(key, filters=None):
+        return _fetchDetail(master, key[0], filters=filters)
+    return master.caches.get_cache('BuildDetails', miss_fn)
+
+
+def _eventKey(event):
+    if event is None:
+        return None
+    return (event.get('buildid'), event.get('bsid'),
+            event['complete'], event['results'])
+
+
+@defer.inlineCallbacks
+def getDetail(master, path, filters=None, event=None):
+    """
+    Get C{path} from the data API, through the C{BuildDetails} cache: callers
+    getting the same path within L{DETAILS_CACHE_TTL} seconds of its fetch
+    share the same result, and concurrent callers share the same fetch.  Each
+    caller gets its own copy of the result, which it may modify.
+
+    If the result depends on the state of a build or buildset (e.g. its
+    steps), C{event} is the build or buildset dictionary of the event being
+    handled: the result is only shared with callers handling the same state
+    of that build or buildset.
+    """
+    filterKey = tuple((f.field, f.op, tuple(f.values))
+                      for f in filters or [])
+    key = (tuple(path), filterKey, _eventKey(event))
+    cache = _getDetailsCache(master)
+    detail = yield cache.get(key, filters=filters)
+    if master.reactor.seconds() - detail.fetched_at >= DETAILS_CACHE_TTL:
+        detail = yield _fetchDetail(master, path, filters=filters)
+        cache.put(key, detail)
+    defer.returnValue(copy.deepcopy(detail.value))
+
 
 @defer.inlineCallbacks
 def getPreviousBuild(master, build):
-    # naive n-1 algorithm. Still need to define what we should skip
+    # the last build before this one, finished or not, skipping the retried
+    # ones.  Still need to define what else we should skip:
     # SKIP builds? forced builds? rebuilds?
     # don't hesitate to contribute improvements to that algorithm
-    n = build['number'] - 1
-    while n >= 0:
-        prev = yield master.data.get(("builders", build['builderid'], "builds", n))
-        if prev and prev['results'] != RETRY:
-            defer.returnValue(prev)
-        n -= 1
-    defer.returnValue(None)
+    prev = yield master.db.builds.getPrevBuild(
+        build['builderid'], build['number'], skipResults=[RETRY])
+    if prev is None:
+        defer.returnValue(None)
+    if prev['results'] is None:
+        # still running, so not shared
+        prev = yield master.data.get(("builds", prev['id']))
+    else:
+        prev = yield getDetail(master, ("builds", prev['id']))
+    defer.returnValue(prev)
 
 
 @defer.inlineCallbacks
@@ -50,13 +117,15 @@ def getDetailsForBuildset(master, bsid, wantProperties=False, wantSteps=False,
     # to much in that. The idea is to do parallelism while keeping the code readable
     # and maintainable.
 
-    # first, just get the buildset and all build requests for our buildset id
-    dl = [master.data.get(("buildsets", bsid)),
-          master.data.get(('buildrequests', ),
-                          filters=[resultspec.Filter('buildsetid', 'eq', [bsid])])]
-    (buildset, breqs) = yield defer.gatherResults(dl)
+    # first, just get the buildset and all build requests for our buildset id;
+    # the buildset itself is not shared, as the rest is keyed on its state
+    buildset = yield master.data.get(("buildsets", bsid))
+    breqs = yield getDetail(master, ('buildrequests', ),
+                            filters=[resultspec.Filter('buildsetid', 'eq', [bsid])],
+                            event=buildset)
     # next, get the bdictlist for each build request
-    dl = [master.data.get(("buildrequests", breq['buildrequestid'], 'builds'))
+    dl = [getDetail(master, ("buildrequests", breq['buildrequestid'], 'builds'),
+                    event=buildset)
           for breq in breqs]
 
     builds = yield defer.gatherResults(dl)
@@ -71,8 +140,10 @@ def getDetailsForBuildset(master, bsid, wantProperties=False, wantSteps=False,
 @defer.inlineCallbacks
 def getDetailsForBuild(master, build, wantProperties=False, wantSteps=False,
                        wantPreviousBuild=False, wantLogs=False):
-    buildrequest = yield master.data.get(("buildrequests", build['buildrequestid']))
-    buildset = yield master.data.get(("buildsets", buildrequest['buildsetid']))
+    buildrequest = yield getDetail(master, ("buildrequests", build['buildrequestid']),
+                                   event=build)
+    buildset = yield getDetail(master, ("buildsets", buildrequest['buildsetid']),
+                               event=build)
     build['buildrequest'], build['buildset'] = buildrequest, buildset
     ret = yield getDetailsForBuilds(master, buildset, [build],
                                     wantProperties=wantProperties, wantSteps=wantSteps,
@@ -86,7 +157,7 @@ def getDetailsForBuilds(master, buildset, builds, wantProperties=False, wantStep
 
     builderids = set([build['builderid'] for build in builds])
 
-    builders = yield defer.gatherResults([master.data.get(("builders", _id))
+    builders = yield defer.gatherResults([getDetail(master, ("builders", _id))
                                           for _id in builderids])
 
     buildersbyid = dict([(builder['builderid'], builder)
@@ -94,7 +165,8 @@ def getDetailsForBuilds(master, buildset, builds, wantProperties=False, wantStep
 
     if wantProperties:
         buildproperties = yield defer.gatherResults(
-            [master.data.get(("builds", build['buildid'], 'properties'))
+            [getDetail(master, ("builds", build['buildid'], 'properties'),
+                       event=build)
              for build in builds])
     else:  # we still need a list for the big zip
         buildproperties = lrange(len(builds))
@@ -107,13 +179,18 @@ def getDetailsForBuilds(master, buildset, builds, wantProperties=False, wantStep
 
     if wantSteps:
         buildsteps = yield defer.gatherResults(
-            [master.data.get(("builds", build['buildid'], 'steps'))
+            [getDetail(master, ("builds", build['buildid'], 'steps'),
+                       event=build)
              for build in builds])
         if wantLogs:
-            for s in flatten(buildsteps, types=(list, UserList)):
-                s['logs'] = yield master.data.get(("steps", s['stepid'], 'logs'))
-                for l in s['logs']:
-                    l['content'] = yield master.data.get(("logs", l['logid'], 'contents'))
+            for build, steps in zip(builds, buildsteps):
+                for s in steps:
+                    s['logs'] = yield getDetail(master, ("steps", s['stepid'], 'logs'),
+                                                event=build)
+                    for l in s['logs']:
+                        # log contents can be big, so they are not cached
+                        l['content'] = yield master.data.get(
+                            ("logs", l['logid'], 'contents'))
 
     else:  # we still need a list for the big zip
         buildsteps = lrange(len(builds))
@@ -138,8 +215,8 @@ def getDetailsForBuilds(master, buildset, builds, wantProperties=False, wantStep
 # perhaps we need data api for users with sourcestamps/:id/users
 @defer.inlineCallbacks
 def getResponsibleUsersForSourceStamp(master, sourcestampid):
-    changesd = master.data.get(("sourcestamps", sourcestampid, "changes"))
-    sourcestampd = master.data.get(("sourcestamps", sourcestampid))
+    changesd = getDetail(master, ("sourcestamps", sourcestampid, "changes"))
+    sourcestampd = getDetail(master, ("sourcestamps", sourcestampid))
     changes, sourcestamp = yield defer.gatherResults([changesd, sourcestampd])
     blamelist = set()
     # normally, we get only one, but just assume there might be several
@@ -157,8 +234,8 @@ def getResponsibleUsersForSourceStamp(master, sourcestampid):
 @defer.inlineCallbacks
 def getResponsibleUsersForBuild(master, buildid):
     dl = [
-        master.data.get(("builds", buildid, "changes")),
-        master.data.get(("builds", buildid, 'properties'))
+        getDetail(master, ("builds", buildid, "changes")),
+        getDetail(master, ("builds", buildid, 'properties'))
     ]
     changes, properties = yield defer.gatherResults(dl)
     blamelist = set()
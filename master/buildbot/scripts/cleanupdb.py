@@ -21,6 +21,7 @@ import os
 import sys
 
 from twisted.internet import defer
+from twisted.internet import reactor
 
 from buildbot import config as config_module
 from buildbot import monkeypatches
@@ -28,9 +29,94 @@ from buildbot.master import BuildMaster
 from buildbot.scripts import base
 from buildbot.util import in_reactor
 
+# logs are recompressed in batches of BATCH_SIZE logs, in the order of their
+# ids.  The id of the last log of each batch is kept in the database, so that
+# an interrupted run resumes after it.
+BATCH_SIZE = 1000
+
 
 @defer.inlineCallbacks
-def doCleanupDatabase(config, master_cfg):
+def compressLogs(config, master_cfg, db, _reactor=reactor):
+    """
+    Recompress the logs, several at a time.  Returns true, via Deferred, if
+    all the logs were recompressed, or false if the time limit was reached.
+    """
+    quiet = config['quiet']
+    objectid = yield db.state.getObjectId('cleanupdb',
+                                          'buildbot.scripts.cleanupdb')
+    afterid = None
+    if not config['restart']:
+        afterid = yield db.state.getState(objectid, 'compress_logs_lastid',
+                                          None)
+        if afterid is not None and not quiet:
+            print("resuming after log %d" % (afterid,))
+    total = yield db.logs.countLogs(afterid)
+
+    jobs = config['jobs']
+    if jobs > 1 and master_cfg.db['db_url'].startswith("sqlite"):
+        # sqlite only has one writer at a time
+        jobs = 1
+    start = _reactor.seconds()
+    deadline = None
+    if config['time-limit'] is not None:
+        deadline = start + config['time-limit']
+
+    done = 0
+    saved = 0
+    while True:
+        logids = yield db.logs.getLogIds(afterid=afterid, limit=BATCH_SIZE)
+        if not logids:
+            break
+        todo = iter(logids)
+        batch_saved = []
+
+        # the workers take the logs in order and finish the ones they took,
+        # so the logs done form the beginning of the batch
+        @defer.inlineCallbacks
+        def worker():
+            while deadline is None or _reactor.seconds() < deadline:
+                logid = next(todo, None)
+                if logid is None:
+                    return
+                s = yield db.logs.compressLog(logid, force=config['force'],
+                                              convertFrom=config['convert'])
+                batch_saved.append(s)
+        yield defer.gatherResults([worker() for _ in range(jobs)],
+                                  consumeErrors=True)
+
+        if batch_saved:
+            done += len(batch_saved)
+            saved += sum(batch_saved)
+            afterid = logids[len(batch_saved) - 1]
+            yield db.state.setState(objectid, 'compress_logs_lastid', afterid)
+            if not quiet:
+                elapsed = max(_reactor.seconds() - start, 1e-3)
+                print(" {0}/{1} logs ({2}%), {3} bytes saved, "
+                      "{4:.1f} logs/s".format(
+                          done, total, done * 100 // max(total, 1), saved,
+                          done / elapsed))
+                sys.stdout.flush()
+        if len(batch_saved) < len(logids):
+            if not quiet and afterid is not None:
+                print("time limit reached; run cleanupdb again to resume "
+                      "after log %d" % (afterid,))
+            elif not quiet:
+                print("time limit reached")
+            defer.returnValue(False)
+            return
+
+    # all done: the next run starts from the first log again
+    yield db.state.setState(objectid, 'compress_logs_lastid', None)
+    if not quiet:
+        elapsed = max(_reactor.seconds() - start, 1e-3)
+        print("recompressed {0} logs in {1:.0f}s ({2:.1f} logs/s), "
+              "{3} bytes saved ({4:.0f} bytes/s)".format(
+                  done, elapsed, done / elapsed, saved, saved / elapsed))
+    defer.returnValue(True)
+
+
+@defer.inlineCallbacks
+def doCleanupDatabase(config, master_cfg, _reactor=reactor):
     if not config['quiet']:
         print("cleaning database (%s)" % (master_cfg.db['db_url']))
 
@@ -38,20 +124,11 @@ def doCleanupDatabase(config, master_cfg):
     master.config = master_cfg
     db = master.db
     yield db.setup(check_version=False, verbose=not config['quiet'])
-    res = yield db.logs.getLogs()
-    i = 0
-    percent = 0
-    saved = 0
-    for log in res:
-        saved += yield db.logs.compressLog(log['id'], force=config['force'])
-        i += 1
-        if not config['quiet'] and percent != i * 100 / len(res):
-            percent = i * 100 / len(res)
-            print(" {0}%  {1} saved".format(percent, saved))
-            saved = 0
-            sys.stdout.flush()
-
-    if master_cfg.db['db_url'].startswith("sqlite"):
+    complete = yield compressLogs(config, master_cfg, db, _reactor=_reactor)
+
+    # vacuuming rewrites the whole database, so it is left for the run which
+    # completes the recompression
+    if complete and master_cfg.db['db_url'].startswith("sqlite"):
         if not config['quiet']:
             print("executing sqlite vacuum function...")
 
@@ -83,7 +160,7 @@ def cleanupDatabase(config, _noMonkey=False):  # pragma: no cover
 
 
 @defer.inlineCallbacks
-def _cleanupDatabase(config, _noMonkey=False):
+def _cleanupDatabase(config, _noMonkey=False, _reactor=reactor):
 
     if not base.checkBasedir(config):
         defer.returnValue(1)
@@ -104,7 +181,7 @@ def _cleanupDatabase(config, _noMonkey=False):
         defer.returnValue(1)
         return
 
-    yield doCleanupDatabase(config, master_cfg)
+    yield doCleanupDatabase(config, master_cfg, _reactor=_reactor)
 
     if not config['quiet']:
         print("cleanup complete")
@@ -664,15 +664,40 @@ class CleanupDBOptions(base.BasedirMixin, base.SubcommandOptions):
     optFlags = [
         ["quiet", "q", "Do not emit the commands being run"],
         ["force", "f", "Force log recompression (useful when changing compression algorithm)"],
+        ["restart", None, "Start from the first log, rather than where an "
+         "interrupted run stopped"],
         # when this command has several maintainance jobs, we should make
         # them optional here. For now there is only one.
     ]
     optParameters = [
+        ["jobs", "j", 4, "Number of logs recompressed at the same time "
+         "(always 1 with SQLite)", int],
+        ["convert", None, None, "Recompress the log chunks compressed with "
+         "these methods (comma separated, e.g. 'gz,bz2') with the configured "
+         "logCompressionMethod"],
+        ["time-limit", None, None, "Stop after this many seconds; the next "
+         "run resumes where this one stopped", int],
     ]
 
     def getSynopsis(self):
         return "Usage:    buildbot cleanupdb [options] [<basedir>]"
 
+    def postOptions(self):
+        base.BasedirMixin.postOptions(self)
+        if self['jobs'] < 1:
+            raise usage.UsageError("jobs must be at least 1")
+        if self['time-limit'] is not None and self['time-limit'] < 1:
+            raise usage.UsageError("time-limit must be at least 1")
+        if self['convert'] is not None:
+            # imported here, so as not to pull in a reactor (see above)
+            from buildbot.db.logs import LogsConnectorComponent
+            methods = self['convert'].split(',')
+            for method in methods:
+                if method not in LogsConnectorComponent.COMPRESSION_MODE:
+                    raise usage.UsageError(
+                        "unknown compression method '%s'" % (method,))
+            self['convert'] = methods
+
     longdesc = textwrap.dedent("""
     This command takes an existing buildmaster working directory and
     do some optimization on the database.
@@ -680,7 +705,9 @@ class CleanupDBOptions(base.BasedirMixin, base.SubcommandOptions):
     This command is frontend for various database maintainance jobs:
 
     - optimiselogs: This optimization groups logs into bigger chunks
-      to apply higher level of compression.
+      to apply higher level of compression.  The logs are processed in
+      batches, in order; an interrupted run (or one stopped by
+      --time-limit) resumes after the last batch it completed.
 
     This command uses the database specified in
     the master configuration file.  If you wish to use a database other than
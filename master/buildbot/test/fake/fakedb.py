@@ -36,6 +36,7 @@ from twisted.internet import reactor
 from buildbot.data import resultspec
 from buildbot.db import buildrequests
 from buildbot.db import changesources
+from buildbot.db import masterlocks
 from buildbot.db import schedulers
 from buildbot.test.util import validation
 from buildbot.util import bytes2NativeString
@@ -579,7 +580,9 @@ class LogChunk(Row):
         first_line=0,
         last_line=0,
         content=u'',
-        compressed=0)
+        compressed=0,
+        content_offset=None,
+        content_length=None)
 
     required_columns = ('logid', )
     # 'content' column is sa.LargeBinary, it's bytestring.
@@ -601,6 +604,36 @@ class Master(Row):
     hashedColumns = [('name_hash', ('name',))]
 
 
+class MasterLock(Row):
+    table = "masterlocks"
+
+    defaults = dict(
+        id=None,
+        name='some:lock',
+        name_hash=None,
+    )
+
+    id_column = 'id'
+    hashedColumns = [('name_hash', ('name',))]
+
+
+class MasterLockClaim(Row):
+    table = "masterlock_claims"
+
+    defaults = dict(
+        id=None,
+        lockid=None,
+        slot=None,
+        masterid=None,
+        exclusive=0,
+        claimed_at=None,
+    )
+    foreignKeys = ('masterid',)
+
+    id_column = 'id'
+    required_columns = ('lockid', 'slot', 'masterid', 'claimed_at')
+
+
 class Builder(Row):
     table = "builders"
 
@@ -1914,6 +1947,42 @@ class FakeBuildsComponent(FakeDBComponent):
                 return defer.succeed(self._row2dict(row))
         return defer.succeed(None)
 
+    def getPrevBuild(self, builderid, number, results=None, skipResults=None,
+                     ssBuild=None):
+        return self._getPrevBuild(builderid, number, results, skipResults,
+                                  ssBuild, byCompletion=False)
+
+    def getPrevSuccessfulBuild(self, builderid, number, ssBuild):
+        return self._getPrevBuild(builderid, number, [0], None, ssBuild,
+                                  byCompletion=True)
+
+    @defer.inlineCallbacks
+    def _getPrevBuild(self, builderid, number, results, skipResults, ssBuild,
+                      byCompletion):
+        if byCompletion:
+            def key(row):
+                return (row['complete_at'] or 0, row['number'])
+        else:
+            def key(row):
+                return row['number']
+        candidates = sorted(
+            (row for row in itervalues(self.builds)
+             if row['builderid'] == builderid and row['number'] < number and
+             (results is None or row['results'] in results) and
+             (not skipResults or row['results'] not in skipResults)),
+            key=key, reverse=True)
+        if ssBuild is not None:
+            matchssBuild = set([(ss['repository'], ss['branch'], ss['codebase'])
+                                for ss in ssBuild])
+        for row in candidates:
+            if ssBuild is not None:
+                sstamps = yield self.db.sourcestamps.getSourceStampsForBuild(row['id'])
+                if set([(ss['repository'], ss['branch'], ss['codebase'])
+                        for ss in sstamps]) != matchssBuild:
+                    continue
+            defer.returnValue(self._row2dict(row))
+        defer.returnValue(None)
+
     def getBuilds(self, builderid=None, buildrequestid=None, workerid=None, complete=None, resultSpec=None):
         ret = []
         for (id, row) in iteritems(self.builds):
@@ -1972,6 +2041,11 @@ class FakeBuildsComponent(FakeDBComponent):
         self.builds[bid]['properties'][name] = (value, source)
         return defer.succeed(None)
 
+    def setBuildProperties(self, bid, properties):
+        assert bid in self.builds
+        self.builds[bid]['properties'].update(properties)
+        return defer.succeed(None)
+
 
 class FakeStepsComponent(FakeDBComponent):
 
@@ -2196,9 +2270,27 @@ class FakeLogsComponent(FakeDBComponent):
             self.logs['id'].complete = 1
         return defer.succeed(None)
 
-    def compressLog(self, logid, force=False):
+    def getLogIds(self, afterid=None, limit=None):
+        logids = sorted(logid for logid in self.logs
+                        if afterid is None or logid > afterid)
+        return defer.succeed(logids[:limit])
+
+    def countLogs(self, afterid=None):
+        return defer.succeed(len([logid for logid in self.logs
+                                  if afterid is None or logid > afterid]))
+
+    def compressLog(self, logid, force=False, convertFrom=None):
         return defer.succeed(None)
 
+    def flushLogs(self, logid=None):
+        return defer.succeed(None)
+
+    def stopBuffering(self):
+        return defer.succeed(None)
+
+    def stopCompressing(self):
+        pass
+
 
 class FakeUsersComponent(FakeDBComponent):
 
@@ -2371,6 +2463,68 @@ class FakeMastersComponent(FakeDBComponent):
         return defer.succeed(None)
 
 
+class FakeMasterLocksComponent(FakeDBComponent):
+
+    def setUp(self):
+        self.masterlocks = {}
+        # (lockid, slot) -> claim dict
+        self.claims = {}
+
+    def insertTestData(self, rows):
+        for row in rows:
+            if isinstance(row, MasterLock):
+                self.masterlocks[row.id] = dict(id=row.id, name=row.name)
+            if isinstance(row, MasterLockClaim):
+                self.claims[(row.lockid, row.slot)] = dict(
+                    lockid=row.lockid,
+                    slot=row.slot,
+                    masterid=row.masterid,
+                    exclusive=bool(row.exclusive),
+                    claimed_at=_mkdt(row.claimed_at))
+
+    def findLockId(self, name):
+        for l in itervalues(self.masterlocks):
+            if l['name'] == name:
+                return defer.succeed(l['id'])
+        id = max([0] + list(self.masterlocks)) + 1
+        self.masterlocks[id] = dict(id=id, name=name)
+        return defer.succeed(id)
+
+    def getLockClaims(self, lockid):
+        return defer.succeed(sorted(
+            (c for c in itervalues(self.claims) if c['lockid'] == lockid),
+            key=lambda c: c['slot']))
+
+    def claimLockSlots(self, lockid, slots, masterid, exclusive,
+                       _reactor=reactor):
+        for slot in slots:
+            if (lockid, slot) in self.claims:
+                return defer.fail(masterlocks.MasterLockAlreadyClaimedError())
+        for slot in slots:
+            self.claims[(lockid, slot)] = dict(
+                lockid=lockid,
+                slot=slot,
+                masterid=masterid,
+                exclusive=bool(exclusive),
+                claimed_at=_mkdt(_reactor.seconds()))
+        return defer.succeed(None)
+
+    def releaseLockSlots(self, lockid, slots, masterid):
+        for slot in slots:
+            claim = self.claims.get((lockid, slot))
+            if claim is not None and claim['masterid'] == masterid:
+                del self.claims[(lockid, slot)]
+        return defer.succeed(None)
+
+    def releaseMasterClaims(self, masterid):
+        released = {}
+        for key, claim in sorted(self.claims.items()):
+            if claim['masterid'] == masterid:
+                released.setdefault(claim['lockid'], []).append(claim['slot'])
+                del self.claims[key]
+        return defer.succeed(released)
+
+
 class FakeBuildersComponent(FakeDBComponent):
 
     def setUp(self):
@@ -2536,6 +2690,8 @@ class FakeDBConnector(service.AsyncMultiService):
         self._components.append(comp)
         self.masters = comp = FakeMastersComponent(self, testcase)
         self._components.append(comp)
+        self.masterlocks = comp = FakeMasterLocksComponent(self, testcase)
+        self._components.append(comp)
         self.builders = comp = FakeBuildersComponent(self, testcase)
         self._components.append(comp)
         self.tags = comp = FakeTagsComponent(self, testcase)
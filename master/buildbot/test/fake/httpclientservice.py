@@ -37,9 +37,10 @@ log = Logger()
 @implementer(IHttpResponse)
 class ResponseWrapper(object):
 
-    def __init__(self, code, content):
+    def __init__(self, code, content, headers=None):
         self._content = content
         self._code = code
+        self.headers = headers or {}
 
     def content(self):
         content = unicode2bytes(self._content)
@@ -98,7 +99,7 @@ class HTTPClientService(service.SharedService):
     checkAvailable = mock.Mock()
 
     def expect(self, method, ep, params=None, data=None, json=None, code=200,
-               content=None, content_json=None):
+               content=None, content_json=None, headers=None):
         if content is not None and content_json is not None:
             return ValueError("content and content_json cannot be both specified")
 
@@ -107,7 +108,7 @@ class HTTPClientService(service.SharedService):
 
         self._expected.append(dict(
             method=method, ep=ep, params=params, data=data, json=json, code=code,
-            content=content))
+            content=content, headers=headers))
 
     def assertNoOutstanding(self):
         self.case.assertEqual(0, len(self._expected),
@@ -140,7 +141,8 @@ class HTTPClientService(service.SharedService):
         if not self.quiet:
             log.debug("{method} {ep} -> {code} {content!r}",
                       method=method, ep=ep, code=expect['code'], content=expect['content'])
-        return defer.succeed(ResponseWrapper(expect['code'], expect['content']))
+        return defer.succeed(ResponseWrapper(expect['code'], expect['content'],
+                                             expect['headers']))
 
     # lets be nice to the auto completers, and don't generate that code
     def get(self, ep, **kwargs):
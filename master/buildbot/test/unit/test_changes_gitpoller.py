@@ -15,7 +15,6 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
-from future.utils import string_types
 from future.utils import text_type
 
 import os
@@ -39,6 +38,22 @@ from buildbot.util import bytes2unicode
 os.environ['TEST_THAT_ENVIRONMENT_GETS_PASSED_TO_SUBPROCESSES'] = 'TRUE'
 
 
+LOG_FORMAT = b'--format=%x00%H%x00%ct%x00%aN <%aE>%x00%s%n%b'
+
+
+def logOutput(revs):
+    """
+    Build the output of C{git log -z --name-only} in L{LOG_FORMAT} for the
+    given revisions, newest first like git outputs them without
+    C{--reverse}.
+    """
+    output = []
+    for rev in reversed(revs):
+        output.append('\0%s\0%s\0%s\0%s\n\0\n%s\0' % (
+            rev, 1273258009, 'by:' + rev[:8], 'hello!', '/etc/' + rev[:3]))
+    return ''.join(output)
+
+
 class GitOutputParsing(gpo.GetProcessOutputMixin, unittest.TestCase):
 
     """Test GitPoller methods for parsing git output"""
@@ -47,125 +62,94 @@ class GitOutputParsing(gpo.GetProcessOutputMixin, unittest.TestCase):
         self.poller = gitpoller.GitPoller('git@example.com:foo/baz.git')
         self.setUpGetProcessOutput()
 
-    dummyRevStr = b'12345abcde'
-
-    def _perform_git_output_test(self, methodToTest, args,
-                                 desiredGoodOutput, desiredGoodResult,
-                                 emptyRaisesException=True):
-
-        # make this call to self.patch here so that we raise a SkipTest if it
-        # is not supported
+    def expectLog(self, output, exit=0):
         self.expectCommands(
-            gpo.Expect(b'git', *args)
-            .path(b'gitpoller-work'),
-        )
-
-        d = defer.succeed(None)
-
-        @d.addCallback
-        def call_empty(_):
-            # we should get an Exception with empty output from git
-            return methodToTest(self.dummyRevStr)
-
-        def cb_empty(_):
-            if emptyRaisesException:
-                self.fail(
-                    "getProcessOutput should have failed on empty output")
-
-        def eb_empty(f):
-            if not emptyRaisesException:
-                self.fail(
-                    "getProcessOutput should NOT have failed on empty output")
-
-        d.addCallbacks(cb_empty, eb_empty)
-        d.addCallback(lambda _: self.assertAllCommandsRan())
-
-        # and the method shouldn't suppress any exceptions
-        self.expectCommands(
-            gpo.Expect(b'git', *args)
+            gpo.Expect(b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                       LOG_FORMAT, b'12345abcde', b'--')
             .path(b'gitpoller-work')
-            .exit(1),
+            .stdout(output)
+            .exit(exit),
         )
 
-        @d.addCallback
-        def call_exception(_):
-            return methodToTest(self.dummyRevStr)
+    @defer.inlineCallbacks
+    def test_get_commits(self):
+        self.expectLog(
+            '\0' + 'a' * 40 + '\0' + '1273258009\0Sammy Jankis <email@example.com>'
+            '\0this is a commit message\n\nthat is multiline\n\0'
+            '\nfile1\0dir with space/file2\0'
+            '\0' + 'b' * 40 + '\0' + '1273258010\0Other <other@example.com>'
+            '\0single line message\n\0'
+            '\0' + 'c' * 40 + '\0' + '1273258011\0Other <other@example.com>'
+            '\0\n\0\nfile3\0')
+
+        commits = yield self.poller._get_commits([b'12345abcde', b'--'])
+
+        self.assertAllCommandsRan()
+        self.assertEqual(commits, [
+            ('a' * 40, 1273258009, u'Sammy Jankis <email@example.com>',
+             [u'file1', u'dir with space/file2'],
+             u'this is a commit message\n\nthat is multiline'),
+            ('b' * 40, 1273258010, u'Other <other@example.com>',
+             [], u'single line message'),
+            ('c' * 40, 1273258011, u'Other <other@example.com>',
+             [u'file3'], u''),
+        ])
+        for _, _, author, files, comments in commits:
+            self.assertIsInstance(author, text_type)
+            self.assertIsInstance(comments, text_type)
+            for f in files:
+                self.assertIsInstance(f, text_type)
 
-        def cb_exception(_):
-            self.fail("getProcessOutput should have failed on stderr output")
+    @defer.inlineCallbacks
+    def test_get_commits_none(self):
+        self.expectLog('')
+        commits = yield self.poller._get_commits([b'12345abcde', b'--'])
+        self.assertAllCommandsRan()
+        self.assertEqual(commits, [])
 
-        def eb_exception(f):
-            pass
-        d.addCallbacks(cb_exception, eb_exception)
-        d.addCallback(lambda _: self.assertAllCommandsRan())
+    @defer.inlineCallbacks
+    def test_get_commits_non_ascii(self):
+        self.expectLog(
+            u'\0' + u'a' * 40 + u'\0' + u'1273258009\0J\xe9r\xf4me <j@example.com>'
+            u'\0caf\xe9\n\0\nd\xe9j\xe0 vu\0')
+        commits = yield self.poller._get_commits([b'12345abcde', b'--'])
+        self.assertEqual(commits, [
+            ('a' * 40, 1273258009, u'J\xe9r\xf4me <j@example.com>',
+             [u'd\xe9j\xe0 vu'], u'caf\xe9'),
+        ])
 
-        # finally we should get what's expected from good output
-        self.expectCommands(
-            gpo.Expect(b'git', *args)
-            .path(b'gitpoller-work')
-            .stdout(desiredGoodOutput)
-        )
+    @defer.inlineCallbacks
+    def test_get_commits_no_timestamps(self):
+        self.poller.usetimestamps = False
+        self.expectLog(logOutput(['4423cdbcbb89c14e50dd5f4152415afd686c5241']))
+        commits = yield self.poller._get_commits([b'12345abcde', b'--'])
+        self.assertEqual([c[1] for c in commits], [None])
 
-        @d.addCallback
-        def call_desired(_):
-            return methodToTest(self.dummyRevStr)
+    @defer.inlineCallbacks
+    def test_get_commits_empty_author(self):
+        self.expectLog('\0' + 'a' * 40 + '\0' + '1273258009\0 \0msg\n\0')
+        with self.assertRaises(EnvironmentError):
+            yield self.poller._get_commits([b'12345abcde', b'--'])
 
-        @d.addCallback
-        def cb_desired(r):
-            self.assertEqual(r, desiredGoodResult)
-            # check types
-            if isinstance(r, string_types):
-                self.assertIsInstance(r, text_type)
-            elif isinstance(r, list):
-                [self.assertIsInstance(e, text_type) for e in r]
-        d.addCallback(lambda _: self.assertAllCommandsRan())
-        return d
+    @defer.inlineCallbacks
+    def test_get_commits_bad_timestamp(self):
+        self.expectLog('\0' + 'a' * 40 + '\0' + 'never\0me <me@example.com>\0msg\n\0')
+        with self.assertRaises(ValueError):
+            yield self.poller._get_commits([b'12345abcde', b'--'])
 
-    def test_get_commit_author(self):
-        authorStr = u'Sammy Jankis <email@example.com>'
-        return self._perform_git_output_test(self.poller._get_commit_author,
-                                             [b'log', b'--no-walk', b'--format=%aN <%aE>',
-                                                 self.dummyRevStr, b'--'],
-                                             authorStr, authorStr)
-
-    def _test_get_commit_comments(self, commentStr):
-        return self._perform_git_output_test(self.poller._get_commit_comments,
-                                             [b'log', b'--no-walk', b'--format=%s%n%b',
-                                                 self.dummyRevStr, b'--'],
-                                             commentStr, commentStr, emptyRaisesException=False)
-
-    def test_get_commit_comments(self):
-        comments = [u'this is a commit message\n\nthat is multiline',
-                    u'single line message', u'']
-        return defer.DeferredList([self._test_get_commit_comments(commentStr) for commentStr in comments])
-
-    def test_get_commit_files(self):
-        filesStr = '\n\nfile1\nfile2\n"\146ile_octal"\nfile space'
-        filesRes = ['file1', 'file2', 'file_octal', 'file space']
-        return self._perform_git_output_test(self.poller._get_commit_files,
-                                             [b'log', b'--name-only', b'--no-walk',
-                                                 b'--format=%n', self.dummyRevStr, b'--'],
-                                             filesStr, filesRes, emptyRaisesException=False)
-
-    def test_get_commit_files_with_space_in_changed_files(self):
-        filesStr = 'normal_directory/file1\ndirectory with space/file2'
-        return self._perform_git_output_test(
-            self.poller._get_commit_files,
-            [b'log', b'--name-only', b'--no-walk',
-                b'--format=%n', self.dummyRevStr, b'--'],
-            filesStr,
-            [l for l in filesStr.splitlines() if l.strip()],
-            emptyRaisesException=False,
-        )
+    @defer.inlineCallbacks
+    def test_get_commits_truncated(self):
+        self.expectLog('\0' + 'a' * 40 + '\0' + '1273258009\0')
+        with self.assertRaises(EnvironmentError):
+            yield self.poller._get_commits([b'12345abcde', b'--'])
 
-    def test_get_commit_timestamp(self):
-        stampStr = '1273258009'
-        return self._perform_git_output_test(self.poller._get_commit_timestamp,
-                                             [b'log', b'--no-walk', b'--format=%ct',
-                                                 self.dummyRevStr, b'--'],
-                                             stampStr, float(stampStr))
+    @defer.inlineCallbacks
+    def test_get_commits_git_failure(self):
+        self.expectLog('', exit=1)
+        with self.assertRaises(EnvironmentError):
+            yield self.poller._get_commits([b'12345abcde', b'--'])
 
-    # _get_changes is tested in TestGitPoller, below
+    # _process_changes is tested in TestGitPoller, below
 
 
 class TestGitPoller(gpo.GetProcessOutputMixin,
@@ -281,8 +265,8 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        b'refs/buildbot/' + self.REPOURL_QUOTED + b'/master')
             .path(b'gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(b'git', b'log',
-                       b'--format=%H',
+            gpo.Expect(b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                       LOG_FORMAT,
                        b'4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'^fa3ae8ed68e664d4db24798611b352e3c6509930',
                        b'--')
@@ -345,8 +329,8 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        b'refs/buildbot/' + self.REPOURL_QUOTED + b'/master')
             .path(b'gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(b'git', b'log',
-                       b'--format=%H',
+            gpo.Expect(b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                       LOG_FORMAT,
                        b'4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'^4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'--')
@@ -411,50 +395,32 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        b'refs/buildbot/%s/master' % self.REPOURL_QUOTED)
             .path(b'gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(b'git', b'log',
-                       b'--format=%H',
+            gpo.Expect(b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                       LOG_FORMAT,
                        b'4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'^bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5',
                        b'^fa3ae8ed68e664d4db24798611b352e3c6509930',
                        b'--')
             .path(b'gitpoller-work')
-            .stdout('\n'.join([
+            .stdout(logOutput([
                 '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
                 '4423cdbcbb89c14e50dd5f4152415afd686c5241'])),
             gpo.Expect(b'git', b'rev-parse',
                        b'refs/buildbot/' + self.REPOURL_QUOTED + b'/release')
             .path(b'gitpoller-work')
             .stdout('9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
-            gpo.Expect(b'git', b'log',
-                       b'--format=%H',
+            gpo.Expect(b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                       LOG_FORMAT,
                        b'9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
                        b'^4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'^bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5',
                        b'--')
             .path(b'gitpoller-work')
-            .stdout('\n'.join([
+            .stdout(logOutput([
                 '9118f4ab71963d23d02d4bdc54876ac8bf05acf2'
             ])),
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed(u'by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed([u'/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed(u'hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         self.poller.branches = ['master', 'release']
         self.poller.lastRev = {
@@ -533,8 +499,8 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        b'refs/buildbot/' + self.REPOURL_QUOTED + b'/release')
             .path(b'gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(b'git', b'log',
-                       b'--format=%H',
+            gpo.Expect(b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                       LOG_FORMAT,
                        b'4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'^4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'--')
@@ -570,33 +536,20 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        b'refs/buildbot/' + self.REPOURL_QUOTED + b'/release')
             .path(b'gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(b'git', b'log',
-                       b'--format=%H',
+            gpo.Expect(b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                       LOG_FORMAT,
                        b'4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'^4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'--')
             .path(b'gitpoller-work')
             .stdout(''),
+            gpo.Expect(b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                       LOG_FORMAT, b'--no-walk',
+                       b'4423cdbcbb89c14e50dd5f4152415afd686c5241', b'--')
+            .path(b'gitpoller-work')
+            .stdout(logOutput(['4423cdbcbb89c14e50dd5f4152415afd686c5241'])),
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed(u'by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed([u'/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed(u'hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         self.poller.branches = ['release']
         self.poller.lastRev = {
@@ -640,34 +593,21 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        b'refs/buildbot/' + self.REPOURL_QUOTED + b'/release')
             .path(b'gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(b'git', b'log',
-                       b'--format=%H',
+            gpo.Expect(b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                       LOG_FORMAT,
                        b'4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'^0ba9d553b7217ab4bbad89ad56dc0332c7d57a8c',
                        b'^4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'--')
             .path(b'gitpoller-work')
             .stdout(''),
+            gpo.Expect(b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                       LOG_FORMAT, b'--no-walk',
+                       b'4423cdbcbb89c14e50dd5f4152415afd686c5241', b'--')
+            .path(b'gitpoller-work')
+            .stdout(logOutput(['4423cdbcbb89c14e50dd5f4152415afd686c5241'])),
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed(u'by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed([u'/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed(u'hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         self.poller.branches = ['release']
         self.poller.lastRev = {
@@ -714,34 +654,17 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
             .path(b'gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
             gpo.Expect(
-                b'git', b'log', b'--format=%H',
+                b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                LOG_FORMAT,
                 b'4423cdbcbb89c14e50dd5f4152415afd686c5241',
                 b'^fa3ae8ed68e664d4db24798611b352e3c6509930',
                 b'--')
             .path(b'gitpoller-work')
-            .stdout('\n'.join([
+            .stdout(logOutput([
                 '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
                 '4423cdbcbb89c14e50dd5f4152415afd686c5241'])),
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed(u'by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed([u'/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed(u'hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         self.poller.branches = True
         self.poller.lastRev = {
@@ -791,8 +714,8 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        b'refs/buildbot/' + self.REPOURL_QUOTED + b'/master')
             .path(b'gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(b'git', b'log',
-                       b'--format=%H',
+            gpo.Expect(b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                       LOG_FORMAT,
                        b'4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'^4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'--')
@@ -831,13 +754,14 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
             .path(b'gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
             gpo.Expect(
-                b'git', b'log', b'--format=%H',
+                b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                LOG_FORMAT,
                 b'4423cdbcbb89c14e50dd5f4152415afd686c5241',
                 b'^bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5',
                 b'^fa3ae8ed68e664d4db24798611b352e3c6509930',
                 b'--')
             .path(b'gitpoller-work')
-            .stdout('\n'.join([
+            .stdout(logOutput([
                 '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
                 '4423cdbcbb89c14e50dd5f4152415afd686c5241'])),
             gpo.Expect(
@@ -846,33 +770,16 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
             .path(b'gitpoller-work')
             .stdout('9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
             gpo.Expect(
-                b'git', b'log', b'--format=%H',
+                b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                LOG_FORMAT,
                 b'9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
                 b'^4423cdbcbb89c14e50dd5f4152415afd686c5241',
                 b'^bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5',
                 b'--')
             .path(b'gitpoller-work')
-            .stdout('\n'.join(['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])),
+            .stdout(logOutput(['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])),
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed(u'by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed([u'/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed(u'hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         self.poller.branches = True
         self.poller.lastRev = {
@@ -932,35 +839,18 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
             .path(b'gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
             gpo.Expect(
-                b'git', b'log', b'--format=%H',
+                b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                LOG_FORMAT,
                 b'4423cdbcbb89c14e50dd5f4152415afd686c5241',
                 b'^bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5',
                 b'^fa3ae8ed68e664d4db24798611b352e3c6509930',
                 b'--')
             .path(b'gitpoller-work')
-            .stdout('\n'.join([
+            .stdout(logOutput([
                 '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
                 '4423cdbcbb89c14e50dd5f4152415afd686c5241']))
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed(u'by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed([u'/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed(u'hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         class TestCallable:
 
@@ -1025,33 +915,16 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
             .path(b'gitpoller-work')
             .stdout('9118f4ab71963d23d02d4bdc54876ac8bf05acf2'),
             gpo.Expect(
-                b'git', b'log', b'--format=%H',
+                b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                LOG_FORMAT,
                 b'9118f4ab71963d23d02d4bdc54876ac8bf05acf2',
                 b'^bf0b01df6d00ae8d1ffa0b2e2acbe642a6cd35d5',
                 b'^fa3ae8ed68e664d4db24798611b352e3c6509930',
                 b'--')
             .path(b'gitpoller-work')
-            .stdout('\n'.join(['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])),
+            .stdout(logOutput(['9118f4ab71963d23d02d4bdc54876ac8bf05acf2'])),
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed(u'by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed([u'/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed(u'hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         def pullFilter(branch):
             """
             Note that this isn't useful in practice, because it will only
@@ -1104,36 +977,18 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
                        b'refs/buildbot/' + self.REPOURL_QUOTED + b'/master')
             .path(b'gitpoller-work')
             .stdout('4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
-            gpo.Expect(b'git', b'log',
-                       b'--format=%H',
+            gpo.Expect(b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                       LOG_FORMAT,
                        b'4423cdbcbb89c14e50dd5f4152415afd686c5241',
                        b'^fa3ae8ed68e664d4db24798611b352e3c6509930',
                        b'--')
             .path(b'gitpoller-work')
-            .stdout('\n'.join([
+            .stdout(logOutput([
                 '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
                 '4423cdbcbb89c14e50dd5f4152415afd686c5241'
             ])),
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed(u'by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed([u'/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed(u'hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         self.poller.lastRev = {
             'master': 'fa3ae8ed68e664d4db24798611b352e3c6509930'
@@ -1199,34 +1054,17 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
             .path(b'gitpoller-work')
             .stdout(b'4423cdbcbb89c14e50dd5f4152415afd686c5241\n'),
             gpo.Expect(
-                b'git', b'log', b'--format=%H',
+                b'git', b'log', b'-z', b'--reverse', b'--name-only',
+                LOG_FORMAT,
                 b'4423cdbcbb89c14e50dd5f4152415afd686c5241',
                 b'^fa3ae8ed68e664d4db24798611b352e3c6509930',
                 b'--')
             .path(b'gitpoller-work')
-            .stdout('\n'.join([
+            .stdout(logOutput([
                 '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
                 '4423cdbcbb89c14e50dd5f4152415afd686c5241'])),
         )
 
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-
-        def author(rev):
-            return defer.succeed(u'by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-
-        def files(rev):
-            return defer.succeed([u'/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-
-        def comments(rev):
-            return defer.succeed(u'hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
-
         # do the poll
         self.poller.branches = True
 
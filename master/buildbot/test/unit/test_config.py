@@ -40,6 +40,7 @@ from buildbot import locks
 from buildbot import revlinks
 from buildbot import worker
 from buildbot.changes import base as changes_base
+from buildbot.db import logstores
 from buildbot.process import factory
 from buildbot.process import properties
 from buildbot.schedulers import base as schedulers_base
@@ -66,8 +67,12 @@ global_defaults = dict(
     changeHorizon=None,
     logHorizon=None,
     buildHorizon=None,
+    cleanupTimeBudget=60,
+    logChunkStore=None,
     logCompressionLimit=4096,
     logCompressionMethod='gz',
+    logCompressionDictionaries=False,
+    batchBuildRequestClaims=False,
     logEncoding='utf-8',
     logMaxTailSize=None,
     logMaxSize=None,
@@ -289,7 +294,8 @@ class MasterConfig(ConfigErrorsMixin, dirs.DirsMixin, unittest.TestCase):
                 db_url='sqlite:///state.sqlite'),
             mq=dict(type='simple'),
             metrics=None,
-            caches=dict(Changes=10, Builds=15),
+            caches=dict(BuildDetails=50, Changes=10, Builds=15,
+                        CollapseSignatures=100),
             schedulers={},
             builders=[],
             workers=[],
@@ -502,6 +508,10 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_global_buildHorizon(self):
         self.do_test_load_global(dict(buildHorizon=10), buildHorizon=10)
 
+    def test_load_global_cleanupTimeBudget(self):
+        self.do_test_load_global(dict(cleanupTimeBudget=10),
+                                 cleanupTimeBudget=10)
+
     def test_load_global_logCompressionLimit(self):
         self.do_test_load_global(dict(logCompressionLimit=10),
                                  logCompressionLimit=10)
@@ -514,7 +524,37 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.cfg.load_global(self.filename,
                              dict(logCompressionMethod='foo'))
         self.assertConfigError(
-            self.errors, "c['logCompressionMethod'] must be 'raw', 'bz2', 'gz' or 'lz4'")
+            self.errors, "c['logCompressionMethod'] must be 'raw', 'bz2', 'gz', 'lz4' or 'zstd'")
+
+    def test_load_global_logChunkStore(self):
+        store = logstores.FileLogChunkStore()
+        self.do_test_load_global(dict(logChunkStore=store),
+                                 logChunkStore=store)
+
+    def test_load_global_logChunkStore_invalid(self):
+        self.cfg.load_global(self.filename,
+                             dict(logChunkStore='logchunks'))
+        self.assertConfigError(
+            self.errors, "c['logChunkStore'] must be a LogChunkStore instance")
+
+    def test_load_global_logCompressionMethod_zstd(self):
+        try:
+            import zstandard
+            [zstandard]
+        except ImportError:
+            raise unittest.SkipTest("zstandard not installed")
+        self.do_test_load_global(dict(logCompressionMethod='zstd'),
+                                 logCompressionMethod='zstd')
+
+    def test_load_global_logCompressionDictionaries(self):
+        self.do_test_load_global(dict(logCompressionDictionaries=True),
+                                 logCompressionDictionaries=True)
+
+    def test_load_global_logCompressionDictionaries_invalid(self):
+        self.cfg.load_global(self.filename,
+                             dict(logCompressionDictionaries='yes'))
+        self.assertConfigError(
+            self.errors, "c['logCompressionDictionaries'] must be a boolean")
 
     def test_load_global_codebaseGenerator(self):
         func = lambda _: "dummy"
@@ -587,6 +627,16 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
             self.do_test_load_global(dict(slavePortnum='udp:123'),
                                      protocols={'pb': {'port': 'udp:123'}})
 
+    def test_load_global_batchBuildRequestClaims(self):
+        self.do_test_load_global(dict(batchBuildRequestClaims=True),
+                                 batchBuildRequestClaims=True)
+
+    def test_load_global_batchBuildRequestClaims_invalid(self):
+        self.cfg.load_global(self.filename,
+                             dict(batchBuildRequestClaims=1))
+        self.assertConfigError(
+            self.errors, "c['batchBuildRequestClaims'] must be a boolean")
+
     def test_load_global_protocols_str(self):
         self.do_test_load_global(dict(protocols={'pb': {'port': 'udp:123'}}),
                                  protocols={'pb': {'port': 'udp:123'}})
@@ -700,7 +750,8 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
 
     def test_load_caches_defaults(self):
         self.cfg.load_caches(self.filename, {})
-        self.assertResults(caches=dict(Changes=10, Builds=15))
+        self.assertResults(caches=dict(BuildDetails=50, Changes=10, Builds=15,
+                                       CollapseSignatures=100))
 
     def test_load_caches_invalid(self):
         self.cfg.load_caches(self.filename, dict(caches=13))
@@ -709,7 +760,8 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_caches_buildCacheSize(self):
         self.cfg.load_caches(self.filename,
                              dict(buildCacheSize=13))
-        self.assertResults(caches=dict(Builds=13, Changes=10))
+        self.assertResults(caches=dict(BuildDetails=50, Builds=13, Changes=10,
+                                       CollapseSignatures=100))
 
     def test_load_caches_buildCacheSize_and_caches(self):
         self.cfg.load_caches(self.filename,
@@ -719,7 +771,8 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_caches_changeCacheSize(self):
         self.cfg.load_caches(self.filename,
                              dict(changeCacheSize=13))
-        self.assertResults(caches=dict(Changes=13, Builds=15))
+        self.assertResults(caches=dict(BuildDetails=50, Changes=13, Builds=15,
+                                       CollapseSignatures=100))
 
     def test_load_caches_changeCacheSize_and_caches(self):
         self.cfg.load_caches(self.filename,
@@ -729,7 +782,8 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_caches(self):
         self.cfg.load_caches(self.filename,
                              dict(caches=dict(foo=1)))
-        self.assertResults(caches=dict(Changes=10, Builds=15, foo=1))
+        self.assertResults(caches=dict(BuildDetails=50, Changes=10, Builds=15,
+                                       CollapseSignatures=100, foo=1))
 
     def test_load_caches_not_int_err(self):
         """
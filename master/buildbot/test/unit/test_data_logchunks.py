@@ -202,3 +202,38 @@ class RawLogChunkEndpoint(LogChunkEndpointBase):
 
         self.assertEqual(logchunk,
                          {'filename': expFilename, 'mime-type': u"text/plain", 'raw': expContent})
+
+    @defer.inlineCallbacks
+    def do_test_batches(self, logid, batch_lines):
+        self.patch(self.ep, 'BATCH_LINES', batch_lines)
+        logchunk = yield self.callGet(('logs', logid, self.endpointname))
+        self.patch(self.ep, 'BATCH_LINES', 1000)
+        expected = yield self.callGet(('logs', logid, self.endpointname))
+        self.assertEqual(logchunk, expected)
+
+    def test_get_batches_stream(self):
+        return self.do_test_batches(60, 3)
+
+    def test_get_batches_text(self):
+        return self.do_test_batches(61, 7)
+
+    @defer.inlineCallbacks
+    def test_stream(self):
+        self.patch(self.ep, 'BATCH_LINES', 40)
+        data = yield self.ep.stream(resultspec.ResultSpec(), dict(logid=61))
+        self.assertEqual(data['filename'], 'errors')
+        self.assertEqual(data['mime-type'], u'text/plain')
+        batches = []
+        while True:
+            batch = yield data['read']()
+            if batch is None:
+                break
+            batches.append(batch)
+        self.assertEqual([len(b.splitlines()) for b in batches], [40, 40, 20])
+        self.assertEqual(u''.join(batches),
+                         u'\n'.join(self.log61Lines) + u'\n')
+
+    @defer.inlineCallbacks
+    def test_stream_missing(self):
+        data = yield self.ep.stream(resultspec.ResultSpec(), dict(logid=99))
+        self.assertEqual(data, None)
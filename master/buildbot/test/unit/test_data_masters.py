@@ -287,7 +287,16 @@ class Master(interfaces.InterfaceTests, unittest.TestCase):
             fakedb.Step(id=200, buildid=13),
             fakedb.Log(id=2000, stepid=200, num_lines=2),
             fakedb.LogChunk(logid=2000, first_line=1, last_line=2,
-                            content=u'ab\ncd')
+                            content=u'ab\ncd'),
+
+            # and holding two slots of a distributed lock
+            fakedb.MasterLock(id=5, name='deploy'),
+            fakedb.MasterLockClaim(lockid=5, slot=0, masterid=14,
+                                   claimed_at=SOMETIME),
+            fakedb.MasterLockClaim(lockid=5, slot=1, masterid=14,
+                                   claimed_at=SOMETIME),
+            fakedb.MasterLockClaim(lockid=5, slot=2, masterid=15,
+                                   claimed_at=SOMETIME),
         ])
 
         # mock out the _masterDeactivated methods this will call
@@ -320,7 +329,13 @@ class Master(interfaces.InterfaceTests, unittest.TestCase):
             stepid=200, results=RETRY, hidden=False)
         updates.finishBuild.assert_called_with(buildid=13, results=RETRY)
 
+        # the lock slots it held were released
+        claims = yield self.master.db.masterlocks.getLockClaims(5)
+        self.assertEqual([c['masterid'] for c in claims], [15])
+
         self.assertEqual(self.master.mq.productions, [
+            (('masterlocks', '5', 'released'),
+             dict(lockid=5, masterid=14, slots=[0, 1])),
             (('masters', '14', 'stopped'),
              dict(masterid=14, name='other', active=False)),
         ])
@@ -132,33 +132,69 @@ class Properties(interfaces.InterfaceTests, unittest.TestCase):
             fakedb.Build(id=1234, buildrequestid=5, masterid=3, workerid=42),
         ])
 
-        self.master.db.builds.setBuildProperty = mock.Mock(
-            wraps=self.master.db.builds.setBuildProperty)
+        self.master.db.builds.setBuildProperties = mock.Mock(
+            wraps=self.master.db.builds.setBuildProperties)
         props = processProperties.fromDict(
             dict(a=(1, 't'), b=(['abc', 9], 't')))
         yield self.rtype.setBuildProperties(1234, props)
-        setBuildPropertiesCalls = sorted(self.master.db.builds.setBuildProperty.mock_calls)
-        self.assertEqual(setBuildPropertiesCalls, [
-            mock.call(1234, u'a', 1, u't'),
-            mock.call(1234, u'b', ['abc', 9], u't')])
+        self.master.db.builds.setBuildProperties.assert_called_once_with(
+            1234, {u'a': (1, u't'), u'b': (['abc', 9], u't')})
         self.master.mq.assertProductions([
             (('builds', '1234', 'properties', 'update'),
              {u'a': (1, u't'), u'b': (['abc', 9], u't')}),
         ])
-        # sync without changes: no db write
-        self.master.db.builds.setBuildProperty.reset_mock()
+        props = yield self.master.db.builds.getBuildProperties(1234)
+        self.assertEqual(props, {u'a': (1, u't'), u'b': (['abc', 9], u't')})
+
+    @defer.inlineCallbacks
+    def test_setBuildProperties_dirty_only(self):
+        self.master.db.insertTestData([
+            fakedb.Buildset(id=28),
+            fakedb.BuildRequest(id=5, buildsetid=28),
+            fakedb.Master(id=3),
+            fakedb.Worker(id=42, name="Friday"),
+            fakedb.Build(id=1234, buildrequestid=5, masterid=3, workerid=42),
+        ])
+        props = processProperties.fromDict(
+            dict(a=(1, 't'), b=(['abc', 9], 't')))
+        yield self.rtype.setBuildProperties(1234, props)
+
+        self.master.db.builds.setBuildProperties = mock.Mock(
+            wraps=self.master.db.builds.setBuildProperties)
         self.master.mq.clearProductions()
+
+        # sync without changes: no db write
         yield self.rtype.setBuildProperties(1234, props)
-        self.master.db.builds.setBuildProperty.assert_not_called()
+        self.master.db.builds.setBuildProperties.assert_not_called()
         self.master.mq.assertProductions([])
 
-        # sync with one changes: one db write
-        props.setProperty('b', 2, 'step')
-        self.master.db.builds.setBuildProperty.reset_mock()
+        # setting the same value again is not a change either
+        props.setProperty('a', 1, 't')
         yield self.rtype.setBuildProperties(1234, props)
+        self.master.db.builds.setBuildProperties.assert_not_called()
 
-        self.master.db.builds.setBuildProperty.assert_called_with(
-            1234, u'b', 2, u'step')
+        # sync with one change: one db write, with only that property
+        props.setProperty('b', 2, 'step')
+        yield self.rtype.setBuildProperties(1234, props)
+        self.master.db.builds.setBuildProperties.assert_called_once_with(
+            1234, {u'b': (2, u'step')})
         self.master.mq.assertProductions([
             (('builds', '1234', 'properties', 'update'), {u'b': (2, u'step')})
         ])
+
+    @defer.inlineCallbacks
+    def test_setBuildProperties_mutated_in_place(self):
+        self.master.db.insertTestData([
+            fakedb.Buildset(id=28),
+            fakedb.BuildRequest(id=5, buildsetid=28),
+            fakedb.Master(id=3),
+            fakedb.Worker(id=42, name="Friday"),
+            fakedb.Build(id=1234, buildrequestid=5, masterid=3, workerid=42),
+        ])
+        props = processProperties.fromDict(dict(a=(['x'], 't')))
+        yield self.rtype.setBuildProperties(1234, props)
+
+        props.getProperty('a').append('y')
+        yield self.rtype.setBuildProperties(1234, props)
+        dbprops = yield self.master.db.builds.getBuildProperties(1234)
+        self.assertEqual(dbprops, {u'a': ([u'x', u'y'], u't')})
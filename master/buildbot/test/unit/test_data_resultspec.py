@@ -298,6 +298,79 @@ class ResultSpec(unittest.TestCase):
         rs.removeOrder()
         self.assertEqual(rs.order, None)
 
+    def test_apply_filter_operators(self):
+        data = mklist('x', 1, 2, 3, 4)
+
+        def apply(op, *values):
+            f = resultspec.Filter(field='x', op=op, values=list(values))
+            rv = resultspec.ResultSpec(filters=[f]).apply(data)
+            return [d['x'] for d in rv]
+        self.assertEqual(apply('eq', 2), [2])
+        self.assertEqual(apply('ne', 2), [1, 3, 4])
+        self.assertEqual(apply('lt', 2), [1])
+        self.assertEqual(apply('le', 2), [1, 2])
+        self.assertEqual(apply('gt', 2), [3, 4])
+        self.assertEqual(apply('ge', 2), [2, 3, 4])
+        self.assertEqual(apply('eq', 2, 4), [2, 4])
+        self.assertEqual(apply('ne', 2, 4), [1, 3])
+
+    def test_apply_filter_contains(self):
+        data = mklist('tags', ['a', 'b'], ['b'], ['c'])
+        f = resultspec.Filter(field='tags', op='contains', values=['b'])
+        self.assertEqual(resultspec.ResultSpec(filters=[f]).apply(data),
+                         mklist('tags', ['a', 'b'], ['b']))
+        f = resultspec.Filter(field='tags', op='contains', values=['a', 'b'])
+        self.assertEqual(resultspec.ResultSpec(filters=[f]).apply(data),
+                         mklist('tags', ['a', 'b']))
+
+    def test_apply_filter_unhashable_values(self):
+        data = mklist('x', [1], [2], [3])
+        f = resultspec.Filter(field='x', op='eq', values=[[1], [3]])
+        self.assertEqual(resultspec.ResultSpec(filters=[f]).apply(data),
+                         mklist('x', [1], [3]))
+
+    def test_apply_does_not_modify_data(self):
+        data = mklist('x', 3, 1, 2)
+        resultspec.ResultSpec(order=['x'], fields=['x']).apply(data)
+        self.assertEqual(data, mklist('x', 3, 1, 2))
+
+    def test_apply_ordering_nulls_multi(self):
+        data = mklist(('a', 'b'),
+                      *[(a, b) for a in (None, 1, 2) for b in (None, 'x', 'y')])
+        random.shuffle(data)
+        for order in (['a', 'b'], ['-a', 'b'], ['a', '-b'], ['-a', '-b']):
+            # the result must be the one of the comparator objects
+            def keyFunc(elem):
+                key = []
+                for k in order:
+                    val = NoneComparator(elem[k.lstrip('-')])
+                    if k.startswith('-'):
+                        val = ReverseComparator(val)
+                    key.append(val)
+                return key
+            self.assertEqual(
+                list(resultspec.ResultSpec(order=order).apply(data)),
+                sorted(data, key=keyFunc))
+
+    def test_apply_fields_after_pagination(self):
+        data = mklist(('a', 'b'), *[(i, -i) for i in range(10)])
+        rv = resultspec.ResultSpec(fields=['a'], order=['-a'], offset=2,
+                                   limit=3).apply(data)
+        self.assertListResultEqual(
+            rv, base.ListResult(mklist('a', 7, 6, 5), offset=2, total=10,
+                                limit=3))
+
+    def test_compile_cached(self):
+        f = resultspec.Filter(field='x', op='eq', values=[1])
+        compiled = resultspec.ResultSpec(filters=[f], order=['x']).compile()
+        f = resultspec.Filter(field='x', op='eq', values=[1])
+        self.assertIdentical(
+            resultspec.ResultSpec(filters=[f], order=['x']).compile(),
+            compiled)
+        self.assertNotIdentical(
+            resultspec.ResultSpec(filters=[f], order=['-x']).compile(),
+            compiled)
+
     def test_popField(self):
         rs = resultspec.ResultSpec(fields=['foo', 'bar'])
         self.assertTrue(rs.popField('foo'))
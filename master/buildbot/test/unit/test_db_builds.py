@@ -17,12 +17,15 @@ from __future__ import absolute_import
 from __future__ import print_function
 from future.utils import lrange
 
+import sqlalchemy as sa
+
 from twisted.internet import defer
 from twisted.internet import task
 from twisted.trial import unittest
 
 from buildbot.data import resultspec
 from buildbot.db import builds
+from buildbot.db import logs
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
 from buildbot.test.util import connector_component
@@ -128,6 +131,22 @@ class Tests(interfaces.InterfaceTests):
         def setBuildProperty(self, bid, name, value, source):
             pass
 
+    def test_signature_setBuildProperties(self):
+        @self.assertArgSpecMatches(self.db.builds.setBuildProperties)
+        def setBuildProperties(self, bid, properties):
+            pass
+
+    def test_signature_getPrevBuild(self):
+        @self.assertArgSpecMatches(self.db.builds.getPrevBuild)
+        def getPrevBuild(self, builderid, number, results=None,
+                         skipResults=None, ssBuild=None):
+            pass
+
+    def test_signature_getPrevSuccessfulBuild(self):
+        @self.assertArgSpecMatches(self.db.builds.getPrevSuccessfulBuild)
+        def getPrevSuccessfulBuild(self, builderid, number, ssBuild):
+            pass
+
     # method tests
 
     @defer.inlineCallbacks
@@ -296,9 +315,192 @@ class Tests(interfaces.InterfaceTests):
         props = yield self.db.builds.getBuildProperties(50)
         self.assertEqual(props, {'prop': (45, 'test_source')})
 
+    @defer.inlineCallbacks
+    def testsetgetsetPropertiesBulk(self):
+        yield self.insertTestData(self.backgroundData + self.threeBuilds)
+        yield self.db.builds.setBuildProperties(50, {})
+        props = yield self.db.builds.getBuildProperties(50)
+        self.assertEqual(props, {})
+        yield self.db.builds.setBuildProperties(
+            50, {'a': (42, 'test'), 'b': ([1, 'x'], 'test')})
+        props = yield self.db.builds.getBuildProperties(50)
+        self.assertEqual(props, {'a': (42, 'test'), 'b': ([1, 'x'], 'test')})
+        # a new value, a new source, the same and a new property
+        yield self.db.builds.setBuildProperties(
+            50, {'a': (45, 'test'), 'b': ([1, 'x'], 'other'),
+                 'c': (None, 'test')})
+        yield self.db.builds.setBuildProperties(50, {'c': (None, 'test')})
+        props = yield self.db.builds.getBuildProperties(50)
+        self.assertEqual(props, {'a': (45, 'test'), 'b': ([1, 'x'], 'other'),
+                                 'c': (None, 'test')})
+        # other builds are left alone
+        props = yield self.db.builds.getBuildProperties(51)
+        self.assertEqual(props, {})
+
+    prevBuildsData = [
+        fakedb.Buildset(id=30),
+        fakedb.Buildset(id=31),
+        fakedb.SourceStamp(id=300, branch='master'),
+        fakedb.SourceStamp(id=301, branch='other'),
+        fakedb.BuildsetSourceStamp(buildsetid=30, sourcestampid=300),
+        fakedb.BuildsetSourceStamp(buildsetid=31, sourcestampid=301),
+        fakedb.BuildRequest(id=60, buildsetid=30, builderid=77),
+        fakedb.BuildRequest(id=61, buildsetid=31, builderid=77),
+        fakedb.Build(id=60, buildrequestid=60, number=1, masterid=88,
+                     builderid=77, workerid=13, complete_at=TIME2, results=0),
+        fakedb.Build(id=61, buildrequestid=61, number=2, masterid=88,
+                     builderid=77, workerid=13, complete_at=TIME2, results=0),
+        fakedb.Build(id=62, buildrequestid=60, number=3, masterid=88,
+                     builderid=77, workerid=13, complete_at=TIME2, results=2),
+        fakedb.Build(id=63, buildrequestid=60, number=4, masterid=88,
+                     builderid=77, workerid=13, complete_at=TIME2, results=4),
+        # still running
+        fakedb.Build(id=64, buildrequestid=60, number=5, masterid=88,
+                     builderid=77, workerid=13),
+        fakedb.Build(id=65, buildrequestid=60, number=1, masterid=88,
+                     builderid=88, workerid=13, complete_at=TIME2, results=0),
+    ]
+
+    @defer.inlineCallbacks
+    def test_getPrevBuild(self):
+        yield self.insertTestData(self.backgroundData + self.prevBuildsData)
+        bdict = yield self.db.builds.getPrevBuild(77, 6)
+        validation.verifyDbDict(self, 'dbbuilddict', bdict)
+        # builds still running are returned too
+        self.assertEqual(bdict['id'], 64)
+        bdict = yield self.db.builds.getPrevBuild(77, 5)
+        self.assertEqual(bdict['id'], 63)
+        bdict = yield self.db.builds.getPrevBuild(77, 6, skipResults=[4])
+        self.assertEqual(bdict['id'], 64)
+        bdict = yield self.db.builds.getPrevBuild(77, 5, skipResults=[4])
+        self.assertEqual(bdict['id'], 62)
+        bdict = yield self.db.builds.getPrevBuild(77, 6, results=[0])
+        self.assertEqual(bdict['id'], 61)
+        bdict = yield self.db.builds.getPrevBuild(77, 2, skipResults=[0])
+        self.assertEqual(bdict, None)
+        bdict = yield self.db.builds.getPrevBuild(77, 1)
+        self.assertEqual(bdict, None)
+
+    @defer.inlineCallbacks
+    def test_getPrevBuild_ssBuild(self):
+        yield self.insertTestData(self.backgroundData + self.prevBuildsData)
+        master = dict(repository='repo', branch='master', codebase='')
+        other = dict(repository='repo', branch='other', codebase='')
+        bdict = yield self.db.builds.getPrevBuild(77, 6, ssBuild=[master])
+        self.assertEqual(bdict['id'], 64)
+        bdict = yield self.db.builds.getPrevBuild(77, 5, ssBuild=[master])
+        self.assertEqual(bdict['id'], 63)
+        bdict = yield self.db.builds.getPrevBuild(77, 6, ssBuild=[other])
+        self.assertEqual(bdict['id'], 61)
+        bdict = yield self.db.builds.getPrevBuild(77, 6, ssBuild=[master, other])
+        self.assertEqual(bdict, None)
+        bdict = yield self.db.builds.getPrevBuild(77, 6, ssBuild=[])
+        self.assertEqual(bdict, None)
+
+    @defer.inlineCallbacks
+    def test_getPrevSuccessfulBuild(self):
+        yield self.insertTestData(self.backgroundData + self.prevBuildsData)
+        master = dict(repository='repo', branch='master', codebase='')
+        other = dict(repository='repo', branch='other', codebase='')
+        bdict = yield self.db.builds.getPrevSuccessfulBuild(77, 6, [master])
+        self.assertEqual(bdict['id'], 60)
+        bdict = yield self.db.builds.getPrevSuccessfulBuild(77, 6, [other])
+        self.assertEqual(bdict['id'], 61)
+        bdict = yield self.db.builds.getPrevSuccessfulBuild(77, 2, [other])
+        self.assertEqual(bdict, None)
+        bdict = yield self.db.builds.getPrevSuccessfulBuild(
+            77, 6, [dict(master, repository='elsewhere')])
+        self.assertEqual(bdict, None)
+
+    @defer.inlineCallbacks
+    def test_getPrevSuccessfulBuild_completion_order(self):
+        # build 0 completed after build 1: the previous successful build is
+        # the one completed last, while getPrevBuild goes by number
+        yield self.insertTestData(self.backgroundData + self.prevBuildsData + [
+            fakedb.Build(id=66, buildrequestid=60, number=0, masterid=88,
+                         builderid=77, workerid=13, complete_at=TIME4,
+                         results=0),
+        ])
+        master = dict(repository='repo', branch='master', codebase='')
+        bdict = yield self.db.builds.getPrevSuccessfulBuild(77, 6, [master])
+        self.assertEqual(bdict['id'], 66)
+        bdict = yield self.db.builds.getPrevBuild(77, 6, results=[0],
+                                                  ssBuild=[master])
+        self.assertEqual(bdict['id'], 60)
+
 
 class RealTests(Tests):
 
+    @defer.inlineCallbacks
+    def test_getPrevBuild_ssBuild_batches(self):
+        self.patch(self.db.builds, 'PREV_BUILD_BATCH', 1)
+        yield self.insertTestData(self.backgroundData + self.prevBuildsData)
+        master = dict(repository='repo', branch='master', codebase='')
+        other = dict(repository='repo', branch='other', codebase='')
+        bdict = yield self.db.builds.getPrevBuild(77, 5, ssBuild=[master])
+        self.assertEqual(bdict['id'], 63)
+        bdict = yield self.db.builds.getPrevBuild(77, 6, ssBuild=[other])
+        self.assertEqual(bdict['id'], 61)
+        bdict = yield self.db.builds.getPrevBuild(77, 3, ssBuild=[master],
+                                                  results=[0])
+        self.assertEqual(bdict['id'], 60)
+        bdict = yield self.db.builds.getPrevBuild(77, 6, ssBuild=[master, other])
+        self.assertEqual(bdict, None)
+
+    @defer.inlineCallbacks
+    def test_pruneBuilds(self):
+        yield self.insertTestData(self.backgroundData + [
+            fakedb.Build(id=60 + n, buildrequestid=41, number=n, masterid=88,
+                         builderid=77, workerid=13, complete_at=TIME2)
+            for n in range(4)
+        ] + [
+            # still running, so it is never pruned
+            fakedb.Build(id=64, buildrequestid=41, number=4, masterid=88,
+                         builderid=77, workerid=13),
+            # on another builder
+            fakedb.Build(id=65, buildrequestid=42, number=0, masterid=88,
+                         builderid=88, workerid=13, complete_at=TIME2),
+            fakedb.BuildProperty(buildid=60, name='a'),
+            fakedb.BuildProperty(buildid=60, name='b'),
+            fakedb.Step(id=70, buildid=60, number=1),
+            fakedb.Step(id=71, buildid=60, number=2, name='two'),
+            fakedb.Step(id=72, buildid=63, number=1),
+            fakedb.Log(id=80, stepid=70),
+            fakedb.Log(id=81, stepid=72),
+            fakedb.LogChunk(logid=80, content=u'abcd'),
+            fakedb.LogChunk(logid=81, content=u'efgh'),
+        ])
+        yield self.insertTestData([fakedb.Buildset(id=21, parent_buildid=61)])
+
+        # builds 0 and 1 are beyond a horizon of 3
+        self.assertEqual((yield self.db.builds.pruneBuilds(77, 3, limit=1)),
+                         (1, 7, 4))  # build, 2 props, 2 steps, log, chunk
+        self.assertEqual((yield self.db.builds.pruneBuilds(77, 3, limit=1)),
+                         (1, 1, 0))
+        self.assertEqual((yield self.db.builds.pruneBuilds(77, 3, limit=1)),
+                         (0, 0, 0))
+
+        builds = yield self.db.builds.getBuilds()
+        self.assertEqual(sorted(b['id'] for b in builds), [62, 63, 64, 65])
+        self.assertEqual((yield self.db.builds.getBuildProperties(60)), {})
+
+        def thd(conn):
+            steps = [r.id for r in conn.execute(self.db.model.steps.select())]
+            chunks = [r.logid for r in
+                      conn.execute(self.db.model.logchunks.select())]
+            parent = conn.scalar(sa.select([self.db.model.buildsets.c.parent_buildid],
+                                           self.db.model.buildsets.c.id == 21))
+            return steps, chunks, parent
+        self.assertEqual((yield self.db.pool.do(thd)), ([72], [81], None))
+
+    @defer.inlineCallbacks
+    def test_pruneBuilds_no_horizon(self):
+        yield self.insertTestData(self.backgroundData + self.threeBuilds)
+        self.assertEqual((yield self.db.builds.pruneBuilds(77, None)),
+                         (0, 0, 0))
+        self.assertEqual((yield self.db.builds.pruneBuilds(77, 2)),
+                         (0, 0, 0))
+
     @defer.inlineCallbacks
     def test_addBuild_existing_race(self):
         clock = task.Clock()
@@ -398,11 +600,14 @@ class TestRealDB(unittest.TestCase,
     def setUp(self):
         d = self.setUpConnectorComponent(
             table_names=['builds', 'builders', 'masters', 'buildrequests',
-                         'buildsets', 'workers', 'build_properties'])
+                         'buildsets', 'workers', 'build_properties', 'steps',
+                         'logs', 'logchunks', 'sourcestamps',
+                         'buildset_sourcestamps', 'patches'])
 
         @d.addCallback
         def finish_setup(_):
             self.db.builds = builds.BuildsConnectorComponent(self.db)
+            self.db.logs = logs.LogsConnectorComponent(self.db)
         return d
 
     def tearDown(self):
@@ -21,6 +21,7 @@ import os
 import mock
 
 from twisted.internet import defer
+from twisted.internet import task
 from twisted.trial import unittest
 
 from buildbot import config
@@ -91,6 +92,52 @@ class DBConnector(db.RealDatabaseMixin, unittest.TestCase):
             self.assertTrue(self.db.changes.pruneChanges.called)
         return d
 
+    def setUpPruneHorizons(self, prune_results):
+        self.master.reactor = task.Clock()
+        self.master.config.buildHorizon = 10
+        self.master.config.logHorizon = 5
+        self.db.CLEANUP_BATCH_SIZE = 2
+        self.db.builders.getBuilders = mock.Mock(
+            return_value=defer.succeed([{'id': 1}, {'id': 2}]))
+        calls = []
+
+        def prune(what):
+            def fn(builderid, horizon, limit):
+                calls.append((what, builderid, horizon, limit))
+                # each batch takes 10 seconds
+                self.master.reactor.advance(10)
+                return defer.succeed(prune_results.pop(0))
+            return fn
+        self.db.builds.pruneBuilds = prune('builds')
+        self.db.logs.pruneLogChunks = prune('logs')
+        return calls
+
+    @defer.inlineCallbacks
+    def test_pruneHorizons(self):
+        calls = self.setUpPruneHorizons([
+            (2, 10, 100), (1, 5, 50),  # builds of builder 1
+            (0, 0, 0),  # logs of builder 1
+            (0, 0, 0),  # builds of builder 2
+            (2, 4, 40), (0, 0, 0),  # logs of builder 2
+        ])
+        yield self.db._pruneHorizons()
+        self.assertEqual(calls, [
+            ('builds', 1, 10, 2), ('builds', 1, 10, 2), ('logs', 1, 5, 2),
+            ('builds', 2, 10, 2), ('logs', 2, 5, 2), ('logs', 2, 5, 2),
+        ])
+
+    @defer.inlineCallbacks
+    def test_pruneHorizons_time_budget(self):
+        self.master.config.cleanupTimeBudget = 25
+        calls = self.setUpPruneHorizons([(2, 10, 100)] * 3)
+        yield self.db._pruneHorizons()
+        self.assertEqual(calls, [('builds', 1, 10, 2)] * 3)
+
+    def test_pruneHorizons_unconfigured(self):
+        self.db.builders.getBuilders = mock.Mock()
+        self.db._pruneHorizons()
+        self.assertFalse(self.db.builders.getBuilders.called)
+
     def test_setup_check_version_bad(self):
         d = self.startService(check_version=True)
         return self.assertFailure(d, exceptions.DatabaseNotReadyError)
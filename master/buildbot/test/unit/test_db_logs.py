@@ -18,14 +18,19 @@ from __future__ import print_function
 from future.builtins import range
 
 import base64
+import os
 import textwrap
+import threading
 
 import sqlalchemy as sa
 
 from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import task
 from twisted.trial import unittest
 
 from buildbot.db import logs
+from buildbot.db import logstores
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
 from buildbot.test.util import connector_component
@@ -135,9 +140,24 @@ class Tests(interfaces.InterfaceTests):
         def finishLog(self, logid):
             pass
 
+    def test_signature_getLogIds(self):
+        @self.assertArgSpecMatches(self.db.logs.getLogIds)
+        def getLogIds(self, afterid=None, limit=None):
+            pass
+
+    def test_signature_countLogs(self):
+        @self.assertArgSpecMatches(self.db.logs.countLogs)
+        def countLogs(self, afterid=None):
+            pass
+
     def test_signature_compressLog(self):
         @self.assertArgSpecMatches(self.db.logs.compressLog)
-        def compressLog(self, logid, force=False):
+        def compressLog(self, logid, force=False, convertFrom=None):
+            pass
+
+    def test_signature_flushLogs(self):
+        @self.assertArgSpecMatches(self.db.logs.flushLogs)
+        def flushLogs(self, logid=None):
             pass
 
     # method tests
@@ -201,6 +221,27 @@ class Tests(interfaces.InterfaceTests):
             validation.verifyDbDict(self, 'logdict', logdict)
         self.assertEqual(sorted([ld['id'] for ld in logdicts]), [201, 202])
 
+    @defer.inlineCallbacks
+    def test_getLogIds(self):
+        yield self.insertTestData(self.backgroundData + [
+            fakedb.Log(id=id, stepid=101, name=u'log%d' % id,
+                       slug=u'log%d' % id, complete=1, num_lines=0,
+                       type=u's')
+            for id in (203, 201, 205, 202, 204)
+        ])
+        logids = yield self.db.logs.getLogIds()
+        self.assertEqual(logids, [201, 202, 203, 204, 205])
+        logids = yield self.db.logs.getLogIds(limit=2)
+        self.assertEqual(logids, [201, 202])
+        logids = yield self.db.logs.getLogIds(afterid=202, limit=2)
+        self.assertEqual(logids, [203, 204])
+        logids = yield self.db.logs.getLogIds(afterid=205)
+        self.assertEqual(logids, [])
+        count = yield self.db.logs.countLogs()
+        self.assertEqual(count, 5)
+        count = yield self.db.logs.countLogs(afterid=203)
+        self.assertEqual(count, 2)
+
     @defer.inlineCallbacks
     def test_getLogLines(self):
         yield self.insertTestData(self.backgroundData + self.testLogLines)
@@ -308,6 +349,164 @@ class Tests(interfaces.InterfaceTests):
 
 class RealTests(Tests):
 
+    def getDbChunks(self, logid, compressed=False):
+        def thd(conn):
+            tbl = self.db.model.logchunks
+            columns = [tbl.c.first_line, tbl.c.last_line, tbl.c.content]
+            if compressed:
+                columns.append(tbl.c.compressed)
+            q = sa.select(columns)
+            q = q.where(tbl.c.logid == logid).order_by(tbl.c.first_line)
+            return [tuple(row) for row in conn.execute(q)]
+        return self.db.pool.do(thd)
+
+    def getDbNumLines(self, logid):
+        def thd(conn):
+            tbl = self.db.model.logs
+            q = sa.select([tbl.c.num_lines]).where(tbl.c.id == logid)
+            return conn.execute(q).scalar()
+        return self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def test_appendLog_buffered(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.assertEqual((yield self.db.logs.appendLog(201, u'abc\ndef\n')),
+                         (7, 8))
+        self.assertEqual((yield self.db.logs.appendLog(201, u'ghi\n')),
+                         (9, 9))
+
+        # nothing has been written yet, but readers see the new lines
+        self.assertEqual((yield self.getDbNumLines(201)), 7)
+        self.assertEqual(len((yield self.getDbChunks(201))), 4)
+        self.assertEqual((yield self.db.logs.getLog(201))['num_lines'], 10)
+        self.assertEqual((yield self.db.logs.getLogs(101))[0]['num_lines'], 10)
+        self.assertEqual((yield self.db.logs.getLogLines(201, 5, 8)),
+                         u"another line\nyet another line\nabc\ndef\n")
+        self.assertEqual((yield self.db.logs.getLogLines(201, 8, 20)),
+                         u"def\nghi\n")
+
+        # and the appends are coalesced into a single chunk
+        yield self.db.logs.flushLogs()
+        self.assertEqual((yield self.getDbNumLines(201)), 10)
+        self.assertEqual((yield self.getDbChunks(201))[-1],
+                         (7, 9, b'abc\ndef\nghi'))
+        self.assertEqual((yield self.db.logs.getLogLines(201, 5, 8)),
+                         u"another line\nyet another line\nabc\ndef\n")
+
+    @defer.inlineCallbacks
+    def test_appendLog_several_logs(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        logid = yield self.db.logs.addLog(
+            stepid=102, name=u'another', slug=u'another', type=u's')
+        yield self.db.logs.appendLog(logid, u'xyz\n')
+        yield self.db.logs.appendLog(201, u'abc\n')
+        yield self.db.logs.appendLog(logid, u'\n')
+        yield self.db.logs.appendLog(logid, u'XYZ\n')
+        yield self.db.logs.flushLogs()
+        self.assertEqual((yield self.getDbChunks(logid)),
+                         [(0, 2, b'xyz\n\nXYZ')])
+        self.assertEqual((yield self.getDbNumLines(logid)), 3)
+        self.assertEqual((yield self.getDbChunks(201))[-1], (7, 7, b'abc'))
+        self.assertEqual((yield self.getDbNumLines(201)), 8)
+
+    @defer.inlineCallbacks
+    def test_appendLog_missing(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.assertEqual((yield self.db.logs.appendLog(999, u'abc\n')), None)
+        self.assertEqual((yield self.db.logs.getLogLines(999, 0, 10)), u'')
+
+    @defer.inlineCallbacks
+    def test_appendLog_flush_size(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.db.logs.APPEND_FLUSH_SIZE = 10
+        yield self.db.logs.appendLog(201, u'abc\n')
+        self.assertEqual((yield self.getDbNumLines(201)), 7)
+        # this one crosses the threshold, and starts a flush right away
+        yield self.db.logs.appendLog(201, u'0123456789\n')
+        d = self.db.logs.flushLogs(201)
+        self.assertTrue(self.db.logs._flushing)
+        yield d
+        self.assertEqual((yield self.getDbChunks(201))[-1],
+                         (7, 8, b'abc\n0123456789'))
+
+    @defer.inlineCallbacks
+    def test_appendLog_high_water(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.db.logs.APPEND_FLUSH_SIZE = 10
+        self.db.logs.APPEND_HIGH_WATER = 20
+        yield self.db.logs.appendLog(201, u'abc\n')
+
+        # the database stalls
+        stalled = []
+        do = self.db.pool.do
+
+        def stalledDo(callable, *args, **kwargs):
+            d = defer.Deferred()
+            d.addCallback(lambda _: do(callable, *args, **kwargs))
+            stalled.append(d)
+            return d
+        self.patch(self.db.pool, 'do', stalledDo)
+
+        # this append starts a flush, but stays below the high-water mark
+        self.assertEqual((yield self.db.logs.appendLog(201, u'0123456789\n')),
+                         (8, 8))
+        while not stalled:
+            yield task.deferLater(reactor, 0.01, lambda: None)
+
+        # above the high-water mark, appends wait for their lines to be written
+        fired = []
+        d = self.db.logs.appendLog(201, u'x' * 20 + u'\n')
+        d.addCallback(fired.append)
+        yield task.deferLater(reactor, 0.05, lambda: None)
+        self.assertEqual(fired, [])
+        self.assertEqual(len(stalled), 1)
+        self.assertEqual((yield self.db.logs.getLogLines(201, 9, 9)),
+                         u'x' * 20 + u'\n')
+
+        # the database comes back
+        self.db.pool.do = do
+        stalled[0].callback(None)
+        yield d
+        self.assertEqual(fired, [(9, 9)])
+        self.assertEqual((yield self.getDbNumLines(201)), 10)
+        self.assertEqual(self.db.logs._pendingBytes, 0)
+
+    @defer.inlineCallbacks
+    def test_finishLog_flushes(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        yield self.db.logs.appendLog(201, u'abc\n')
+        yield self.db.logs.finishLog(201)
+        self.assertEqual((yield self.getDbNumLines(201)), 8)
+        self.assertEqual((yield self.getDbChunks(201))[-1], (7, 7, b'abc'))
+        logdict = yield self.db.logs.getLog(201)
+        self.assertEqual((logdict['complete'], logdict['num_lines']),
+                         (True, 8))
+
+    @defer.inlineCallbacks
+    def test_flushLogs_while_flushing(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        yield self.db.logs.appendLog(201, u'abc\n')
+        d1 = self.db.logs.flushLogs()
+        yield self.db.logs.appendLog(201, u'def\n')
+        d2 = self.db.logs.flushLogs()
+        yield d1
+        yield d2
+        self.assertEqual((yield self.getDbNumLines(201)), 9)
+        # no flush is left scheduled
+        self.assertEqual(self.db.logs._flushTimer, None)
+
+    @defer.inlineCallbacks
+    def test_stopBuffering(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        yield self.db.logs.appendLog(201, u'abc\n')
+        yield self.db.logs.stopBuffering()
+        self.assertEqual((yield self.getDbChunks(201))[-1], (7, 7, b'abc'))
+        # lines appended from now on are written without waiting
+        yield self.db.logs.appendLog(201, u'def\n')
+        self.assertEqual(self.db.logs._flushTimer, None)
+        yield self.db.logs.flushLogs()
+        self.assertEqual((yield self.getDbChunks(201))[-1], (8, 8, b'def'))
+
     @defer.inlineCallbacks
     def test_addLogLines_db(self):
         yield self.insertTestData(self.backgroundData + self.testLogLines)
@@ -321,13 +520,159 @@ class RealTests(Tests):
             row = res.fetchone()
             res.close()
             return dict(row)
+        yield self.db.logs.flushLogs()
         newRow = yield self.db.pool.do(thd)
         self.assertEqual(newRow, {
             'logid': 201,
             'first_line': 7,
             'last_line': 10,
             'content': b'abc\ndef\nghi\njkl',
-            'compressed': 0})
+            'compressed': 0,
+            'content_offset': None,
+            'content_length': None})
+
+    pruneData = [
+        fakedb.Build(id=31, buildrequestid=41, number=8, masterid=88,
+                     builderid=88, workerid=47),
+        fakedb.Build(id=32, buildrequestid=41, number=9, masterid=88,
+                     builderid=88, workerid=47),
+        fakedb.Step(id=103, buildid=31, number=1, name='one'),
+        fakedb.Step(id=104, buildid=32, number=1, name='one'),
+        fakedb.Log(id=301, stepid=101, name=u'a', slug=u'a', num_lines=1),
+        fakedb.Log(id=302, stepid=102, name=u'b', slug=u'b', num_lines=1),
+        fakedb.Log(id=303, stepid=103, name=u'c', slug=u'c', num_lines=1),
+        fakedb.Log(id=304, stepid=104, name=u'd', slug=u'd', num_lines=1),
+    ] + [
+        fakedb.LogChunk(logid=logid, first_line=0, last_line=0,
+                        content=u'x' * 10)
+        for logid in (301, 302, 303, 304)
+    ]
+
+    @defer.inlineCallbacks
+    def test_pruneLogChunks(self):
+        yield self.insertTestData(self.backgroundData + self.pruneData)
+        # builds 7 and 8 are beyond the horizon, 9 is kept
+        self.assertEqual((yield self.db.logs.pruneLogChunks(88, 1, limit=2)),
+                         (2, 2, 20))
+        self.assertEqual((yield self.db.logs.pruneLogChunks(88, 1, limit=2)),
+                         (1, 1, 10))
+        self.assertEqual((yield self.db.logs.pruneLogChunks(88, 1, limit=2)),
+                         (0, 0, 0))
+        for logid in 301, 302, 303:
+            self.assertEqual((yield self.getDbChunks(logid)), [])
+            self.assertEqual((yield self.db.logs.getLog(logid))['type'], u'd')
+        self.assertEqual((yield self.getDbChunks(304)), [(0, 0, b'x' * 10)])
+
+    @defer.inlineCallbacks
+    def test_pruneLogChunks_no_horizon(self):
+        yield self.insertTestData(self.backgroundData + self.pruneData)
+        self.assertEqual((yield self.db.logs.pruneLogChunks(88, None)),
+                         (0, 0, 0))
+        self.assertEqual((yield self.db.logs.pruneLogChunks(88, 5)),
+                         (0, 0, 0))
+        self.assertEqual((yield self.getDbChunks(301)), [(0, 0, b'x' * 10)])
+
+    @defer.inlineCallbacks
+    def test_getLogLines_cached(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        yield self.checkTestLogLines()
+        cache = self.db.logs._chunkCache
+        misses = cache.misses
+        # the chunks are decompressed once, then found in the cache
+        yield self.checkTestLogLines()
+        self.assertEqual(cache.misses, misses)
+        self.assertEqual(sorted(cache.keys()),
+                         [(201, 0, 1), (201, 2, 4), (201, 5, 5), (201, 6, 6)])
+
+    @defer.inlineCallbacks
+    def test_getLogLines_cached_compressed(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        lines = yield self.db.logs.getLogLines(201, 0, 6)
+        yield self.db.logs.compressLog(201)
+        self.assertEqual((yield self.db.logs.getLogLines(201, 0, 6)), lines)
+        self.assertEqual((yield self.db.logs.getLogLines(201, 3, 5)),
+                         u'\nline 2**2\nanother line\n')
+
+    @defer.inlineCallbacks
+    def test_getLogLines_cache_size(self):
+        self.db.master.config.caches['logchunks'] = 2
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        yield self.checkTestLogLines()
+        self.assertEqual(len(self.db.logs._chunkCache.keys()), 2)
+
+    @defer.inlineCallbacks
+    def test_pruneLogChunks_invalidates_cache(self):
+        yield self.insertTestData(self.backgroundData + self.pruneData)
+        yield self.db.logs.getLogLines(301, 0, 0)
+        yield self.db.logs.getLogLines(304, 0, 0)
+        yield self.db.logs.pruneLogChunks(88, 1)
+        self.assertEqual(self.db.logs._chunkCache.keys(), [])
+
+    def test_DecodedLogChunk_getLines(self):
+        chunk = logs._DecodedLogChunk(10, u'a\nbc\n\nd')
+        self.assertEqual(list(chunk.newlines), [1, 4, 5])
+        self.assertEqual(chunk.getLines(10, 13), u'a\nbc\n\nd')
+        self.assertEqual(chunk.getLines(0, 100), u'a\nbc\n\nd')
+        self.assertEqual(chunk.getLines(11, 11), u'bc')
+        self.assertEqual(chunk.getLines(12, 13), u'\nd')
+        self.assertEqual(chunk.getLines(5, 10), u'a')
+
+    def setUpChunkStore(self):
+        store = logstores.FileLogChunkStore(os.path.abspath(self.mktemp()))
+        self.db.master.config.logChunkStore = store
+        self.db.master.config.logCompressionMethod = "raw"
+        return store
+
+    @defer.inlineCallbacks
+    def test_appendLog_chunkStore(self):
+        store = self.setUpChunkStore()
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        yield self.db.logs.appendLog(201, u'abc\ndef\n')
+        yield self.db.logs.flushLogs()
+        yield self.db.logs.appendLog(201, u'ghi\n')
+        yield self.db.logs.flushLogs()
+
+        # the content of the new chunks is only in the store
+        self.assertEqual((yield self.getDbChunks(201))[-2:],
+                         [(7, 8, None), (9, 9, None)])
+        self.assertEqual(store.thdRead(201, [(0, 7), (7, 3)]),
+                         [b'abc\ndef', b'ghi'])
+        lines = yield self.db.logs.getLogLines(201, 5, 9)
+        self.assertEqual(lines, u'another line\nyet another line\n'
+                                u'abc\ndef\nghi\n')
+
+    @defer.inlineCallbacks
+    def test_compressLog_chunkStore(self):
+        store = self.setUpChunkStore()
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        for line in u'abc', u'def', u'ghi':
+            yield self.db.logs.appendLog(201, line + u'\n')
+            yield self.db.logs.flushLogs()
+        lines = yield self.db.logs.getLogLines(201, 0, 9)
+
+        yield self.db.logs.compressLog(201)
+
+        # the chunks were merged, and the segment only contains the merged
+        # content
+        self.assertEqual([c[:2] for c in (yield self.getDbChunks(201))],
+                         [(0, 9)])
+        segment = store._segmentPath(201)
+        with open(segment, 'rb') as f:
+            self.assertEqual(len(f.read()), len(lines.encode('utf-8')) - 1)
+        self.assertEqual((yield self.db.logs.getLogLines(201, 0, 9)), lines)
+
+    @defer.inlineCallbacks
+    def test_pruneLogChunks_chunkStore(self):
+        store = self.setUpChunkStore()
+        yield self.insertTestData(self.backgroundData + self.pruneData)
+        for logid in 301, 302, 303, 304:
+            yield self.db.logs.appendLog(logid, u'yyyyy\n')
+        yield self.db.logs.flushLogs()
+        self.assertEqual((yield self.db.logs.pruneLogChunks(88, 1)),
+                         (3, 6, 45))
+        for logid in 301, 302, 303:
+            self.assertFalse(os.path.exists(store._segmentPath(logid)))
+        self.assertTrue(os.path.exists(store._segmentPath(304)))
 
     @defer.inlineCallbacks
     def test_addLogLines_huge_lines(self):
@@ -348,6 +693,75 @@ class RealTests(Tests):
         self.assertEqual(len(chunk), 65534)
         chunk.decode('utf-8')
 
+    @defer.inlineCallbacks
+    def test_compressLog_convertFrom(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.db.master.config.logCompressionMethod = "gz"
+        yield self.db.logs.appendLog(201, u'ab' * 100 + u'\n')
+        yield self.db.logs.flushLogs()
+        self.db.logs.MAX_CHUNK_LINES = 0
+        chunks = yield self.getDbChunks(201, compressed=True)
+        self.assertEqual([c[3] for c in chunks], [0, 0, 0, 0, 1])
+
+        # nothing needs gathering, and no chunk is compressed with bz2
+        self.db.master.config.logCompressionMethod = "bz2"
+        yield self.db.logs.compressLog(201, convertFrom=["lz4"])
+        chunks = yield self.getDbChunks(201, compressed=True)
+        self.assertEqual([c[3] for c in chunks], [0, 0, 0, 0, 1])
+
+        # the gz chunk is recompressed with bz2; the raw ones are left alone
+        yield self.db.logs.compressLog(201, convertFrom=["gz"])
+        chunks = yield self.getDbChunks(201, compressed=True)
+        self.assertEqual([c[3] for c in chunks], [0, 0, 0, 0, 2])
+        lines = yield self.db.logs.getLogLines(201, 5, 7)
+        self.assertEqual(lines, u'another line\nyet another line\n' +
+                         u'ab' * 100 + u'\n')
+
+    @defer.inlineCallbacks
+    def test_compressLog_compress_pool(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.db.master.config.logCompressionMethod = "gz"
+        lines = yield self.db.logs.getLogLines(201, 0, 6)
+        threadNames = []
+        thdGatherChunks = self.db.logs.thdGatherChunks
+
+        def gatherChunks(*args):
+            threadNames.append(threading.current_thread().name)
+            return thdGatherChunks(*args)
+        self.patch(self.db.logs, 'thdGatherChunks', gatherChunks)
+        yield self.db.logs.compressLog(201, force=True)
+        # the chunks are recompressed out of the db threads
+        self.assertEqual(len(threadNames), 1)
+        self.assertIn('LogCompressPool', threadNames[0])
+        self.assertEqual((yield self.db.logs.getLogLines(201, 0, 6)), lines)
+
+    @defer.inlineCallbacks
+    def test_dictionary_training_not_retried(self):
+        try:
+            import zstandard  # noqa
+        except ImportError:
+            raise unittest.SkipTest("zstandard not installed, skip the test")
+
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.db.master.config.logCompressionMethod = "zstd"
+        self.db.master.config.logCompressionDictionaries = True
+        trainings = []
+        thdGetTrainingChunks = self.db.logs.thdGetTrainingChunks
+
+        def getTrainingChunks(conn, builderid):
+            trainings.append(builderid)
+            return thdGetTrainingChunks(conn, builderid)
+        self.patch(self.db.logs, 'thdGetTrainingChunks', getTrainingChunks)
+
+        # there is not enough content to train a dictionary, and that is not
+        # checked again before DICT_RECHECK_INTERVAL
+        yield self.db.logs.compressLog(201)
+        yield self.db.logs.compressLog(201)
+        self.assertEqual(trainings, [88])
+        self.patch(self.db.logs, 'DICT_RECHECK_INTERVAL', 0)
+        yield self.db.logs.compressLog(201)
+        self.assertEqual(trainings, [88, 88])
+
     @defer.inlineCallbacks
     def test_no_compress_small_chunk(self):
         yield self.insertTestData(self.backgroundData + self.testLogLines)
@@ -363,13 +777,16 @@ class RealTests(Tests):
             res.close()
             return dict(row)
 
+        yield self.db.logs.flushLogs()
         newRow = yield self.db.pool.do(thd)
         self.assertEqual(newRow, {
             'logid': 201,
             'first_line': 7,
             'last_line': 7,
             'content': b'abc',
-            'compressed': 0})
+            'compressed': 0,
+            'content_offset': None,
+            'content_length': None})
 
     @defer.inlineCallbacks
     def test_raw_compress_big_chunk(self):
@@ -387,13 +804,16 @@ class RealTests(Tests):
             res.close()
             return dict(row)
 
+        yield self.db.logs.flushLogs()
         newRow = yield self.db.pool.do(thd)
         self.assertEqual(newRow, {
             'logid': 201,
             'first_line': 7,
             'last_line': 7,
             'content': unicode2bytes(line),
-            'compressed': 0})
+            'compressed': 0,
+            'content_offset': None,
+            'content_length': None})
 
     @defer.inlineCallbacks
     def test_gz_compress_big_chunk(self):
@@ -412,13 +832,16 @@ class RealTests(Tests):
             res.close()
             return dict(row)
 
+        yield self.db.logs.flushLogs()
         newRow = yield self.db.pool.do(thd)
         self.assertEqual(newRow, {
             'logid': 201,
             'first_line': 7,
             'last_line': 7,
             'content': zlib.compress(unicode2bytes(line), 9),
-            'compressed': 1})
+            'compressed': 1,
+            'content_offset': None,
+            'content_length': None})
 
     @defer.inlineCallbacks
     def test_bz2_compress_big_chunk(self):
@@ -437,18 +860,21 @@ class RealTests(Tests):
             res.close()
             return dict(row)
 
+        yield self.db.logs.flushLogs()
         newRow = yield self.db.pool.do(thd)
         self.assertEqual(newRow, {
             'logid': 201,
             'first_line': 7,
             'last_line': 7,
             'content': bz2.compress(unicode2bytes(line), 9),
-            'compressed': 2})
+            'compressed': 2,
+            'content_offset': None,
+            'content_length': None})
 
     @defer.inlineCallbacks
     def test_lz4_compress_big_chunk(self):
         try:
-            import lz4
+            import lz4.block
         except ImportError:
             raise unittest.SkipTest("lz4 not installed, skip the test")
 
@@ -466,13 +892,94 @@ class RealTests(Tests):
             res.close()
             return dict(row)
 
+        yield self.db.logs.flushLogs()
         newRow = yield self.db.pool.do(thd)
         self.assertEqual(newRow, {
             'logid': 201,
             'first_line': 7,
             'last_line': 7,
-            'content': lz4.dumps(line),
-            'compressed': 3})
+            'content': lz4.block.compress(unicode2bytes(line)),
+            'compressed': 3,
+            'content_offset': None,
+            'content_length': None})
+
+    @defer.inlineCallbacks
+    def test_zstd_compress_big_chunk(self):
+        try:
+            import zstandard
+        except ImportError:
+            raise unittest.SkipTest("zstandard not installed, skip the test")
+
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        line = u'xy' * 10000
+        self.db.master.config.logCompressionMethod = "zstd"
+        yield self.db.logs.appendLog(201, line + '\n')
+        yield self.db.logs.flushLogs()
+        content, compressed = (yield self.getDbChunks(201, compressed=True))[-1][2:]
+        self.assertEqual(compressed, 4)
+        self.assertEqual(zstandard.ZstdDecompressor().decompress(content),
+                         unicode2bytes(line))
+        self.assertEqual((yield self.db.logs.getLogLines(201, 7, 7)),
+                         line + u'\n')
+
+    def makeTrainingLines(self, count, seed=0):
+        return u''.join(
+            u'[%05d] compiling src/module_%d/file_%d.c with -O2 -Wall ... %s\n'
+            % (i, (i * 7 + seed) % 13, (i * 11 + seed) % 97,
+               u'ok' if i % 5 else u'warning: unused variable')
+            for i in range(count))
+
+    @defer.inlineCallbacks
+    def test_zstd_dictionaries(self):
+        try:
+            import zstandard
+        except ImportError:
+            raise unittest.SkipTest("zstandard not installed, skip the test")
+
+        self.patch(self.db.logs, 'DICT_SIZE', 4096)
+        self.patch(self.db.logs, 'DICT_TRAINING_MIN_BYTES', 100000)
+        yield self.insertTestData(self.backgroundData + [
+            fakedb.Log(id=201, stepid=101, name=u'stdio', slug=u'stdio',
+                       complete=0, num_lines=0, type=u't'),
+            fakedb.Log(id=202, stepid=102, name=u'stdio', slug=u'stdio',
+                       complete=0, num_lines=0, type=u't'),
+        ])
+        self.db.master.config.logCompressionMethod = "zstd"
+        self.db.master.config.logCompressionDictionaries = True
+        lines = self.makeTrainingLines(2000)
+        for i in range(0, 2000, 100):
+            yield self.db.logs.appendLog(201, u''.join(lines.splitlines(True)[i:i + 100]))
+        yield self.db.logs.flushLogs()
+
+        # not enough content was compressed when flushing to train a
+        # dictionary; it is trained when the log is compressed
+        def getDictionaries(conn):
+            tbl = self.db.model.logchunk_dictionaries
+            q = sa.select([tbl.c.builderid, tbl.c.dict_id])
+            return [tuple(row) for row in conn.execute(q)]
+        self.assertEqual((yield self.db.pool.do(getDictionaries)), [])
+        yield self.db.logs.compressLog(201, force=True)
+        dictionaries = yield self.db.pool.do(getDictionaries)
+        self.assertEqual(len(dictionaries), 1)
+        builderid, dict_id = dictionaries[0]
+        self.assertEqual(builderid, 88)
+
+        # new content of the builder's logs is compressed with it
+        more_lines = self.makeTrainingLines(50, seed=3)
+        yield self.db.logs.appendLog(202, more_lines)
+        yield self.db.logs.flushLogs()
+        for logid in 201, 202:
+            for chunk in (yield self.getDbChunks(logid, compressed=True)):
+                self.assertEqual(chunk[3], 4)
+                self.assertEqual(
+                    zstandard.get_frame_parameters(chunk[2]).dict_id, dict_id)
+
+        # and it is loaded from the db to read that content
+        self.db.logs._dictionaries.clear()
+        self.db.logs._chunkCache = self.db.logs._makeChunkCache()
+        self.assertEqual((yield self.db.logs.getLogLines(201, 0, 1999)), lines)
+        self.assertEqual((yield self.db.logs.getLogLines(202, 0, 49)),
+                         more_lines)
 
     @defer.inlineCallbacks
     def do_addLogLines_huge_log(self, NUM_CHUNKS=3000, chunk=(u'xy' * 70 + u'\n') * 3):
@@ -533,14 +1040,17 @@ class TestRealDB(unittest.TestCase,
 
     def setUp(self):
         d = self.setUpConnectorComponent(
-            table_names=['logs', 'logchunks', 'steps', 'builds', 'builders',
-                         'masters', 'buildrequests', 'buildsets',
-                         'workers'])
+            table_names=['logs', 'logchunks', 'logchunk_dictionaries', 'steps',
+                         'builds', 'builders', 'masters', 'buildrequests',
+                         'buildsets', 'workers'])
 
         @d.addCallback
         def finish_setup(_):
             self.db.logs = logs.LogsConnectorComponent(self.db)
         return d
 
+    @defer.inlineCallbacks
     def tearDown(self):
-        return self.tearDownConnectorComponent()
+        yield self.db.logs.flushLogs()
+        self.db.logs.stopCompressing()
+        yield self.tearDownConnectorComponent()
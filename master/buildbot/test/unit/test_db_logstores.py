@@ -0,0 +1,103 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import threading
+
+from twisted.trial import unittest
+
+from buildbot.db import logstores
+from buildbot.test.util import dirs
+from buildbot.test.util.config import ConfigErrorsMixin
+
+
+class FileLogChunkStore(dirs.DirsMixin, ConfigErrorsMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        self.store = logstores.FileLogChunkStore()
+        self.store.setBasedir(self.basedir)
+
+    def tearDown(self):
+        return self.tearDownDirs()
+
+    def test_path_invalid(self):
+        self.assertRaisesConfigError("FileLogChunkStore path must be a string",
+                                     lambda: logstores.FileLogChunkStore(12))
+
+    def test_segmentPath(self):
+        self.assertEqual(self.store._segmentPath(12345),
+                         os.path.join(self.basedir, 'logchunks', '345', '12345'))
+
+    def test_append_read(self):
+        self.assertEqual(self.store.thdAppend(1, [b'abc', b'', b'de']),
+                         [0, 3, 3])
+        self.assertEqual(self.store.thdAppend(1, [b'fgh']), [5])
+        self.assertEqual(self.store.thdAppend(1001, [b'xyz']), [0])
+        self.assertEqual(self.store.thdRead(1, [(5, 3), (0, 3), (3, 0)]),
+                         [b'fgh', b'abc', b''])
+        self.assertEqual(self.store.thdRead(1001, [(0, 3)]), [b'xyz'])
+
+    def test_read_empty(self):
+        # no segment is needed to read empty chunks
+        self.assertEqual(self.store.thdRead(1, [(0, 0)]), [b''])
+
+    def test_compact(self):
+        self.store.thdAppend(1, [b'abc', b'de', b'fgh'])
+        self.assertEqual(self.store.thdCompact(1, [(5, 3), (0, 3)]), [0, 3])
+        self.assertEqual(self.store.thdRead(1, [(0, 6)]), [b'fghabc'])
+
+    def test_compact_empty(self):
+        self.store.thdAppend(1, [b'abc'])
+        self.assertEqual(self.store.thdCompact(1, [(0, 0)]), [0])
+        self.assertFalse(os.path.exists(self.store._segmentPath(1)))
+
+    def test_remove(self):
+        self.store.thdAppend(1, [b'abc'])
+        self.store.thdRemove(1)
+        self.assertFalse(os.path.exists(self.store._segmentPath(1)))
+        # removing a missing segment is fine
+        self.store.thdRemove(1)
+
+    def test_locked_reentrant(self):
+        with self.store.locked(1):
+            self.store.thdAppend(1, [b'abc'])
+            self.assertEqual(self.store.thdRead(1, [(0, 3)]), [b'abc'])
+        self.assertEqual(self.store._locks, {})
+
+    def test_locked_between_masters(self):
+        if logstores.fcntl is None:
+            raise unittest.SkipTest("fcntl is not available")
+        # another master sharing the directory
+        other = logstores.FileLogChunkStore()
+        other.setBasedir(self.basedir)
+        acquired = threading.Event()
+
+        def lock():
+            with self.store.locked(1001):
+                acquired.set()
+        thread = threading.Thread(target=lock)
+        # logs 1 and 1001 have their segments, and lock file, in the same
+        # directory
+        with other.locked(1):
+            thread.start()
+            self.assertFalse(acquired.wait(0.1))
+        self.assertTrue(acquired.wait(10))
+        thread.join()
+        self.assertEqual(other._locks, {})
@@ -0,0 +1,182 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+from __future__ import absolute_import
+from __future__ import print_function
+
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.trial import unittest
+
+from buildbot.db import masterlocks
+from buildbot.test.fake import fakedb
+from buildbot.test.fake import fakemaster
+from buildbot.test.util import connector_component
+from buildbot.test.util import interfaces
+from buildbot.util import epoch2datetime
+
+SOMETIME = 1348971992
+SOMETIME_DT = epoch2datetime(SOMETIME)
+
+
+class Tests(interfaces.InterfaceTests):
+
+    # common sample data
+
+    backgroundData = [
+        fakedb.Master(id=7, name='some:master'),
+        fakedb.Master(id=8, name='other:master'),
+        fakedb.MasterLock(id=3, name='deploy'),
+        fakedb.MasterLock(id=4, name='license'),
+    ]
+
+    # tests
+
+    def test_signature_findLockId(self):
+        @self.assertArgSpecMatches(self.db.masterlocks.findLockId)
+        def findLockId(self, name):
+            pass
+
+    def test_signature_getLockClaims(self):
+        @self.assertArgSpecMatches(self.db.masterlocks.getLockClaims)
+        def getLockClaims(self, lockid):
+            pass
+
+    def test_signature_claimLockSlots(self):
+        @self.assertArgSpecMatches(self.db.masterlocks.claimLockSlots)
+        def claimLockSlots(self, lockid, slots, masterid, exclusive):
+            pass
+
+    def test_signature_releaseLockSlots(self):
+        @self.assertArgSpecMatches(self.db.masterlocks.releaseLockSlots)
+        def releaseLockSlots(self, lockid, slots, masterid):
+            pass
+
+    def test_signature_releaseMasterClaims(self):
+        @self.assertArgSpecMatches(self.db.masterlocks.releaseMasterClaims)
+        def releaseMasterClaims(self, masterid):
+            pass
+
+    @defer.inlineCallbacks
+    def test_findLockId(self):
+        yield self.insertTestData(self.backgroundData)
+        id = yield self.db.masterlocks.findLockId(u'license')
+        self.assertEqual(id, 4)
+        newid = yield self.db.masterlocks.findLockId(u'other')
+        self.assertNotIn(newid, (3, 4))
+        id = yield self.db.masterlocks.findLockId(u'other')
+        self.assertEqual(id, newid)
+
+    @defer.inlineCallbacks
+    def test_claimLockSlots(self):
+        yield self.insertTestData(self.backgroundData)
+        yield self.db.masterlocks.claimLockSlots(3, [1], 7, False,
+                                                 _reactor=self.clock)
+        yield self.db.masterlocks.claimLockSlots(3, [0], 8, False,
+                                                 _reactor=self.clock)
+        yield self.db.masterlocks.claimLockSlots(4, [0, 1], 7, True,
+                                                 _reactor=self.clock)
+        claims = yield self.db.masterlocks.getLockClaims(3)
+        self.assertEqual(claims, [
+            dict(lockid=3, slot=0, masterid=8, exclusive=False,
+                 claimed_at=SOMETIME_DT),
+            dict(lockid=3, slot=1, masterid=7, exclusive=False,
+                 claimed_at=SOMETIME_DT),
+        ])
+        claims = yield self.db.masterlocks.getLockClaims(4)
+        self.assertEqual([(c['slot'], c['exclusive']) for c in claims],
+                         [(0, True), (1, True)])
+
+    @defer.inlineCallbacks
+    def test_claimLockSlots_already_claimed(self):
+        yield self.insertTestData(self.backgroundData + [
+            fakedb.MasterLockClaim(lockid=3, slot=1, masterid=8,
+                                   claimed_at=SOMETIME),
+        ])
+        with self.assertRaises(masterlocks.MasterLockAlreadyClaimedError):
+            yield self.db.masterlocks.claimLockSlots(3, [0, 1], 7, True)
+        # nothing was claimed
+        claims = yield self.db.masterlocks.getLockClaims(3)
+        self.assertEqual([(c['slot'], c['masterid']) for c in claims],
+                         [(1, 8)])
+
+    @defer.inlineCallbacks
+    def test_releaseLockSlots(self):
+        yield self.insertTestData(self.backgroundData + [
+            fakedb.MasterLockClaim(lockid=3, slot=0, masterid=7,
+                                   claimed_at=SOMETIME),
+            fakedb.MasterLockClaim(lockid=3, slot=1, masterid=8,
+                                   claimed_at=SOMETIME),
+            fakedb.MasterLockClaim(lockid=3, slot=2, masterid=7,
+                                   claimed_at=SOMETIME),
+        ])
+        # slot 1 is not held by master 7
+        yield self.db.masterlocks.releaseLockSlots(3, [0, 1], 7)
+        claims = yield self.db.masterlocks.getLockClaims(3)
+        self.assertEqual([(c['slot'], c['masterid']) for c in claims],
+                         [(1, 8), (2, 7)])
+
+    @defer.inlineCallbacks
+    def test_releaseMasterClaims(self):
+        yield self.insertTestData(self.backgroundData + [
+            fakedb.MasterLockClaim(lockid=3, slot=1, masterid=7,
+                                   claimed_at=SOMETIME),
+            fakedb.MasterLockClaim(lockid=3, slot=0, masterid=7,
+                                   claimed_at=SOMETIME),
+            fakedb.MasterLockClaim(lockid=3, slot=2, masterid=8,
+                                   claimed_at=SOMETIME),
+            fakedb.MasterLockClaim(lockid=4, slot=0, masterid=7,
+                                   exclusive=1, claimed_at=SOMETIME),
+        ])
+        released = yield self.db.masterlocks.releaseMasterClaims(7)
+        self.assertEqual(released, {3: [0, 1], 4: [0]})
+        claims = yield self.db.masterlocks.getLockClaims(3)
+        self.assertEqual([(c['slot'], c['masterid']) for c in claims],
+                         [(2, 8)])
+        claims = yield self.db.masterlocks.getLockClaims(4)
+        self.assertEqual(claims, [])
+        released = yield self.db.masterlocks.releaseMasterClaims(7)
+        self.assertEqual(released, {})
+
+
+class TestFakeDB(unittest.TestCase, Tests):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(SOMETIME)
+        self.master = fakemaster.make_master(wantDb=True, testcase=self)
+        self.db = self.master.db
+        self.db.checkForeignKeys = True
+        self.insertTestData = self.db.insertTestData
+
+
+class TestRealDB(unittest.TestCase,
+                 connector_component.ConnectorComponentMixin,
+                 Tests):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(SOMETIME)
+
+        d = self.setUpConnectorComponent(
+            table_names=['masters', 'masterlocks', 'masterlock_claims'])
+
+        @d.addCallback
+        def finish_setup(_):
+            self.db.masterlocks = \
+                masterlocks.MasterLocksConnectorComponent(self.db)
+        return d
+
+    def tearDown(self):
+        return self.tearDownConnectorComponent()
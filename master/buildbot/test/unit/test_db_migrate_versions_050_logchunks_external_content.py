@@ -0,0 +1,73 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sqlalchemy as sa
+
+from twisted.trial import unittest
+
+from buildbot.test.util import migration
+from buildbot.util import sautils
+
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    def create_tables_thd(self, conn):
+        metadata = sa.MetaData()
+        metadata.bind = conn
+
+        logchunks = sautils.Table(
+            'logchunks', metadata,
+            sa.Column('logid', sa.Integer, nullable=False),
+            sa.Column('first_line', sa.Integer, nullable=False),
+            sa.Column('last_line', sa.Integer, nullable=False),
+            sa.Column('content', sa.LargeBinary(65536)),
+            sa.Column('compressed', sa.SmallInteger, nullable=False),
+        )
+
+        logchunks.create()
+
+        conn.execute(logchunks.insert(), [
+            dict(logid=1, first_line=0, last_line=1, content=b'a\nb',
+                 compressed=0)])
+
+    def test_update(self):
+        def setup_thd(conn):
+            self.create_tables_thd(conn)
+
+        def verify_thd(conn):
+            metadata = sa.MetaData()
+            metadata.bind = conn
+
+            logchunks = sautils.Table('logchunks', metadata, autoload=True)
+            self.assertIsInstance(logchunks.c.content_offset.type,
+                                  sa.BigInteger)
+            self.assertIsInstance(logchunks.c.content_length.type,
+                                  sa.Integer)
+
+            q = sa.select([logchunks.c.content, logchunks.c.content_offset,
+                           logchunks.c.content_length])
+            self.assertEqual([tuple(row) for row in conn.execute(q)],
+                             [(b'a\nb', None, None)])
+
+        return self.do_test_migration(49, 50, setup_thd, verify_thd)
@@ -0,0 +1,84 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sqlalchemy as sa
+
+from twisted.trial import unittest
+
+from buildbot.test.util import migration
+from buildbot.util import sautils
+
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    def create_tables_thd(self, conn):
+        metadata = sa.MetaData()
+        metadata.bind = conn
+
+        builders = sautils.Table(
+            'builders', metadata,
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.Text, nullable=False),
+            sa.Column('description', sa.Text, nullable=True),
+            sa.Column('name_hash', sa.String(40), nullable=False),
+        )
+
+        builders.create()
+
+        conn.execute(builders.insert(), [
+            dict(id=3, name='echo', name_hash='a' * 40)])
+
+    def test_update(self):
+        def setup_thd(conn):
+            self.create_tables_thd(conn)
+
+        def verify_thd(conn):
+            metadata = sa.MetaData()
+            metadata.bind = conn
+
+            logchunk_dictionaries = sautils.Table(
+                'logchunk_dictionaries', metadata, autoload=True)
+            self.assertIsInstance(logchunk_dictionaries.c.dict_id.type,
+                                  sa.BigInteger)
+            self.assertIsInstance(logchunk_dictionaries.c.content.type,
+                                  sa.LargeBinary)
+
+            conn.execute(logchunk_dictionaries.insert(), [
+                dict(builderid=3, dict_id=1234, content=b'dict')])
+            q = sa.select([logchunk_dictionaries.c.builderid,
+                           logchunk_dictionaries.c.dict_id,
+                           logchunk_dictionaries.c.content])
+            self.assertEqual([tuple(row) for row in conn.execute(q)],
+                             [(3, 1234, b'dict')])
+
+            insp = sa.inspect(conn)
+            indexes = dict((idx['name'], idx) for idx in
+                           insp.get_indexes('logchunk_dictionaries'))
+            self.assertEqual(
+                indexes['logchunk_dictionaries_builderid']['column_names'],
+                ['builderid'])
+            self.assertTrue(
+                indexes['logchunk_dictionaries_dict_id']['unique'])
+
+        return self.do_test_migration(50, 51, setup_thd, verify_thd)
@@ -0,0 +1,109 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sqlalchemy as sa
+
+from twisted.trial import unittest
+
+from buildbot.test.util import migration
+from buildbot.util import sautils
+
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    def create_tables_thd(self, conn):
+        metadata = sa.MetaData()
+        metadata.bind = conn
+
+        buildrequests = sautils.Table(
+            'buildrequests', metadata,
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('buildsetid', sa.Integer, nullable=False),
+            sa.Column('builderid', sa.Integer, nullable=False),
+            sa.Column('priority', sa.Integer, nullable=False,
+                      server_default=sa.DefaultClause("0")),
+            sa.Column('complete', sa.Integer,
+                      server_default=sa.DefaultClause("0")),
+            sa.Column('results', sa.SmallInteger),
+            sa.Column('submitted_at', sa.Integer, nullable=False),
+            sa.Column('complete_at', sa.Integer),
+            sa.Column('waited_for', sa.SmallInteger,
+                      server_default=sa.DefaultClause("0")),
+        )
+        buildrequests.create()
+
+        builds = sautils.Table(
+            'builds', metadata,
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('number', sa.Integer, nullable=False),
+            sa.Column('builderid', sa.Integer),
+            sa.Column('buildrequestid', sa.Integer, nullable=False),
+            sa.Column('workerid', sa.Integer),
+            sa.Column('masterid', sa.Integer, nullable=False),
+            sa.Column('started_at', sa.Integer, nullable=False),
+            sa.Column('complete_at', sa.Integer),
+            sa.Column('state_string', sa.Text, nullable=False),
+            sa.Column('results', sa.Integer),
+        )
+        builds.create()
+
+        logs = sautils.Table(
+            'logs', metadata,
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.Text, nullable=False),
+            sa.Column('slug', sa.String(50), nullable=False),
+            sa.Column('stepid', sa.Integer),
+            sa.Column('complete', sa.SmallInteger, nullable=False),
+            sa.Column('num_lines', sa.Integer, nullable=False),
+            sa.Column('type', sa.String(1), nullable=False),
+        )
+        logs.create()
+
+        conn.execute(buildrequests.insert(), [
+            dict(id=1, buildsetid=1, builderid=3, submitted_at=0)])
+        conn.execute(builds.insert(), [
+            dict(id=1, number=1, builderid=3, buildrequestid=1, masterid=1,
+                 started_at=0, state_string='done', results=0)])
+        conn.execute(logs.insert(), [
+            dict(id=1, name='stdio', slug='stdio', stepid=1, complete=1,
+                 num_lines=0, type='s')])
+
+    def test_update(self):
+        def setup_thd(conn):
+            self.create_tables_thd(conn)
+
+        def verify_thd(conn):
+            insp = sa.inspect(conn)
+            for table, name, columns in [
+                    ('buildrequests', 'buildrequests_builderid_complete',
+                     ['builderid', 'complete']),
+                    ('builds', 'builds_builderid_complete_at',
+                     ['builderid', 'complete_at']),
+                    ('logs', 'logs_stepid_id', ['stepid', 'id'])]:
+                indexes = dict((idx['name'], idx) for idx in
+                               insp.get_indexes(table))
+                self.assertEqual(indexes[name]['column_names'], columns)
+                self.assertFalse(indexes[name]['unique'])
+
+        return self.do_test_migration(52, 53, setup_thd, verify_thd)
@@ -0,0 +1,97 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sqlalchemy as sa
+
+from twisted.trial import unittest
+
+from buildbot.test.util import migration
+from buildbot.util import sautils
+
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    def create_tables_thd(self, conn):
+        metadata = sa.MetaData()
+        metadata.bind = conn
+
+        masters = sautils.Table(
+            "masters", metadata,
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.Text, nullable=False),
+            sa.Column('name_hash', sa.String(40), nullable=False),
+            sa.Column('active', sa.Integer, nullable=False),
+            sa.Column('last_active', sa.Integer, nullable=False),
+        )
+        masters.create()
+
+        conn.execute(masters.insert(), [
+            dict(id=5, name='master', name_hash='a' * 40, active=1,
+                 last_active=0)])
+
+    def test_update(self):
+        def setup_thd(conn):
+            self.create_tables_thd(conn)
+
+        def verify_thd(conn):
+            metadata = sa.MetaData()
+            metadata.bind = conn
+
+            masterlocks = sautils.Table('masterlocks', metadata,
+                                        autoload=True)
+            masterlock_claims = sautils.Table('masterlock_claims', metadata,
+                                              autoload=True)
+
+            conn.execute(masterlocks.insert(), [
+                dict(id=3, name='deploy', name_hash='b' * 40)])
+            conn.execute(masterlock_claims.insert(), [
+                dict(lockid=3, slot=0, masterid=5, exclusive=0,
+                     claimed_at=10)])
+            q = sa.select([masterlock_claims.c.lockid,
+                           masterlock_claims.c.slot,
+                           masterlock_claims.c.masterid,
+                           masterlock_claims.c.exclusive,
+                           masterlock_claims.c.claimed_at])
+            self.assertEqual([tuple(row) for row in conn.execute(q)],
+                             [(3, 0, 5, 0, 10)])
+
+            # a slot can only be claimed once
+            with self.assertRaises(sa.exc.IntegrityError):
+                conn.execute(masterlock_claims.insert(), [
+                    dict(lockid=3, slot=0, masterid=5, exclusive=0,
+                         claimed_at=11)])
+
+            insp = sa.inspect(conn)
+            indexes = dict((idx['name'], idx) for idx in
+                           insp.get_indexes('masterlocks'))
+            self.assertTrue(indexes['masterlock_name_hash']['unique'])
+            indexes = dict((idx['name'], idx) for idx in
+                           insp.get_indexes('masterlock_claims'))
+            self.assertEqual(
+                indexes['masterlock_claims_slot']['column_names'],
+                ['lockid', 'slot'])
+            self.assertEqual(
+                indexes['masterlock_claims_masterid']['column_names'],
+                ['masterid'])
+
+        return self.do_test_migration(53, 54, setup_thd, verify_thd)
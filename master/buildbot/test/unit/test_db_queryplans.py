@@ -0,0 +1,239 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import re
+
+import sqlalchemy as sa
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from buildbot.data import builds as data_builds
+from buildbot.data import resultspec
+from buildbot.db import buildrequests
+from buildbot.db import builds
+from buildbot.db import logs
+from buildbot.db import steps
+from buildbot.test.fake import fakedb
+from buildbot.test.util import connector_component
+
+# tables which grow with the number of builds, and must never be scanned by
+# the queries run while serving the data API
+LARGE_TABLES = ('buildrequests', 'buildrequest_claims', 'builds',
+                'build_properties', 'steps', 'logs', 'logchunks')
+
+# "SCAN TABLE builds" with SQLite < 3.36, "SCAN builds" after
+scan_re = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?(.*)$')
+
+
+class QueryPlans(unittest.TestCase,
+                 connector_component.ConnectorComponentMixin):
+
+    """
+    Check that the queries run by the connector methods behind the hot
+    data API endpoints do not scan the tables which grow with the number of
+    builds, and that their ORDER BY is served by an index.
+
+    SQLite plans queries without statistics as if the tables were large, so
+    a few rows are enough to get the plans it would use on a large
+    database; see contrib/benchmarks/db_queryplans.py to check the plans
+    and timings on a large synthetic database, for other engines too.
+    """
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield self.setUpConnectorComponent(
+            table_names=['logs', 'logchunks', 'logchunk_dictionaries',
+                         'steps', 'builds', 'build_properties', 'builders',
+                         'masters', 'buildrequests', 'buildrequest_claims',
+                         'buildsets', 'buildset_sourcestamps', 'sourcestamps',
+                         'patches', 'workers'])
+        if self.db_engine.dialect.name != 'sqlite':
+            yield self.tearDownConnectorComponent()
+            raise unittest.SkipTest('query plans are only checked on SQLite')
+
+        self.db.buildrequests = \
+            buildrequests.BuildRequestsConnectorComponent(self.db)
+        self.db.builds = builds.BuildsConnectorComponent(self.db)
+        self.db.steps = steps.StepsConnectorComponent(self.db)
+        self.db.logs = logs.LogsConnectorComponent(self.db)
+
+        yield self.insertTestData([
+            fakedb.Master(id=88),
+            fakedb.Worker(id=13, name='wrk'),
+            fakedb.Builder(id=77, name='b1'),
+            fakedb.SourceStamp(id=234),
+            fakedb.Buildset(id=20),
+            fakedb.BuildsetSourceStamp(buildsetid=20, sourcestampid=234),
+            fakedb.BuildRequest(id=41, buildsetid=20, builderid=77),
+            fakedb.BuildRequest(id=42, buildsetid=20, builderid=77),
+            fakedb.BuildRequestClaim(brid=41, masterid=88, claimed_at=1000),
+            fakedb.Build(id=30, buildrequestid=41, number=7, masterid=88,
+                         builderid=77, workerid=13, results=0),
+            fakedb.BuildProperty(buildid=30, name='prop', value=3),
+            fakedb.Step(id=70, number=0, name='one', buildid=30),
+            fakedb.Log(id=60, stepid=70, name='stdio', slug='stdio',
+                       type='s', num_lines=2),
+            fakedb.LogChunk(logid=60, first_line=0, last_line=1,
+                            content=u'a\nb'),
+        ])
+
+        self.statements = []
+        sa.event.listen(self.db_engine, 'before_cursor_execute',
+                        self.recordStatement)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        sa.event.remove(self.db_engine, 'before_cursor_execute',
+                        self.recordStatement)
+        yield self.tearDownConnectorComponent()
+
+    def recordStatement(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            self.statements.append((statement, parameters))
+
+    def getQueryPlans(self):
+        statements, self.statements = self.statements, []
+
+        def thd(conn):
+            cursor = conn.connection.cursor()
+            plans = []
+            for statement, parameters in statements:
+                cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+                plans.append((statement, [row[-1] for row in cursor]))
+            cursor.close()
+            return plans
+        return self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def assertQueriesUseIndexes(self, d, ordered=True, searches=()):
+        """Wait for C{d}, the result of a connector method, and check the
+        plans of the SELECT statements it ran.  Each of C{searches} must
+        appear in one of the plans."""
+        yield d
+        # do not count the statements run to plan the queries
+        sa.event.remove(self.db_engine, 'before_cursor_execute',
+                        self.recordStatement)
+        try:
+            plans = yield self.getQueryPlans()
+        finally:
+            sa.event.listen(self.db_engine, 'before_cursor_execute',
+                            self.recordStatement)
+        self.assertTrue(plans, 'no query was run')
+        for statement, plan in plans:
+            for detail in plan:
+                mo = scan_re.match(detail)
+                if mo and mo.group(1) in LARGE_TABLES:
+                    self.fail('%r scans %s:\n%s\n%s' % (
+                        statement, mo.group(1), '\n'.join(plan), detail))
+                if ordered and 'TEMP B-TREE FOR ORDER BY' in detail:
+                    self.fail('%r sorts its results:\n%s' % (
+                        statement, '\n'.join(plan)))
+        details = [detail for _, plan in plans for detail in plan]
+        for search in searches:
+            self.assertTrue(any(search in detail for detail in details),
+                            '%r not in plans:\n%s' % (
+                                search, '\n'.join(details)))
+
+    # buildrequests
+
+    def test_getBuildRequest(self):
+        return self.assertQueriesUseIndexes(
+            self.db.buildrequests.getBuildRequest(41))
+
+    def test_getBuildRequests_unclaimed_builder(self):
+        return self.assertQueriesUseIndexes(
+            self.db.buildrequests.getBuildRequests(builderid=77,
+                                                   claimed=False),
+            searches=['buildrequests USING INDEX buildrequests_builderid_'
+                      'complete (builderid=? AND complete=?)'])
+
+    def test_getBuildRequests_incomplete_builder(self):
+        return self.assertQueriesUseIndexes(
+            self.db.buildrequests.getBuildRequests(builderid=77,
+                                                   complete=False),
+            searches=['buildrequests USING INDEX buildrequests_builderid_'
+                      'complete (builderid=? AND complete=?)'])
+
+    def test_getBuildRequests_buildset(self):
+        return self.assertQueriesUseIndexes(
+            self.db.buildrequests.getBuildRequests(bsid=20))
+
+    # builds
+
+    def test_getBuild(self):
+        return self.assertQueriesUseIndexes(self.db.builds.getBuild(30))
+
+    def test_getBuildByNumber(self):
+        return self.assertQueriesUseIndexes(
+            self.db.builds.getBuildByNumber(77, 7))
+
+    def test_getBuilds_builder(self):
+        return self.assertQueriesUseIndexes(
+            self.db.builds.getBuilds(builderid=77), ordered=False)
+
+    def test_getBuilds_builder_recent(self):
+        rs = resultspec.ResultSpec(order=['-complete_at'], limit=10)
+        rs.fieldMapping = data_builds.BuildsEndpoint.fieldMapping
+        return self.assertQueriesUseIndexes(
+            self.db.builds.getBuilds(builderid=77, resultSpec=rs))
+
+    def test_getBuilds_builder_by_number(self):
+        rs = resultspec.ResultSpec(order=['-number'], limit=10)
+        rs.fieldMapping = data_builds.BuildsEndpoint.fieldMapping
+        return self.assertQueriesUseIndexes(
+            self.db.builds.getBuilds(builderid=77, resultSpec=rs))
+
+    def test_getBuilds_buildrequest(self):
+        return self.assertQueriesUseIndexes(
+            self.db.builds.getBuilds(buildrequestid=41), ordered=False)
+
+    def test_getPrevBuild(self):
+        return self.assertQueriesUseIndexes(
+            self.db.builds.getPrevBuild(77, 8, results=[0]))
+
+    def test_getBuildProperties(self):
+        return self.assertQueriesUseIndexes(
+            self.db.builds.getBuildProperties(30))
+
+    # steps
+
+    def test_getSteps(self):
+        return self.assertQueriesUseIndexes(self.db.steps.getSteps(30))
+
+    def test_getStep_number(self):
+        return self.assertQueriesUseIndexes(
+            self.db.steps.getStep(buildid=30, number=0))
+
+    def test_getStep_name(self):
+        return self.assertQueriesUseIndexes(
+            self.db.steps.getStep(buildid=30, name='one'))
+
+    # logs
+
+    def test_getLogs(self):
+        return self.assertQueriesUseIndexes(self.db.logs.getLogs(70))
+
+    def test_getLogBySlug(self):
+        return self.assertQueriesUseIndexes(
+            self.db.logs.getLogBySlug(70, 'stdio'))
+
+    def test_getLogLines(self):
+        return self.assertQueriesUseIndexes(
+            self.db.logs.getLogLines(60, 0, 1))
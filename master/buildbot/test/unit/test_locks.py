@@ -16,15 +16,455 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import task
 from twisted.trial import unittest
 
+from buildbot.db import masterlocks
+from buildbot.locks import BaseLock
+from buildbot.locks import LockAccess
+from buildbot.locks import MasterLock
+from buildbot.locks import RealDistributedMasterLock
 from buildbot.locks import WorkerLock
+from buildbot.mq import simple
+from buildbot.test.fake import fakedb
+from buildbot.test.fake import fakemaster
+from buildbot.test.util import connector_component
 from buildbot.test.util.warnings import assertNotProducesWarnings
 from buildbot.test.util.warnings import assertProducesWarning
+from buildbot.util import eventual
 from buildbot.worker_transition import DeprecatedWorkerAPIWarning
 from buildbot.worker_transition import DeprecatedWorkerNameWarning
 
 
+class Requester(object):
+    pass
+
+
+class BaseLockTests(unittest.TestCase):
+
+    def setUp(self):
+        lockid = MasterLock('lock', maxCount=2)
+        self.lock = BaseLock('lock', maxCount=2)
+        self.counting = LockAccess(lockid, 'counting')
+        self.exclusive = LockAccess(lockid, 'exclusive')
+
+    def wait(self, owner, access):
+        d = self.lock.waitUntilMaybeAvailable(owner, access)
+        fired = []
+        d.addCallback(fired.append)
+        return d, fired
+
+    def test_counting(self):
+        a, b, c = Requester(), Requester(), Requester()
+        self.lock.claim(a, self.counting)
+        self.assertTrue(self.lock.isAvailable(b, self.counting))
+        self.assertFalse(self.lock.isAvailable(b, self.exclusive))
+        self.lock.claim(b, self.counting)
+        self.assertFalse(self.lock.isAvailable(c, self.counting))
+        self.assertTrue(self.lock.isOwner(a, self.counting))
+        self.assertFalse(self.lock.isOwner(a, self.exclusive))
+        self.assertFalse(self.lock.isOwner(c, self.counting))
+        self.lock.release(a, self.counting)
+        self.assertFalse(self.lock.isOwner(a, self.counting))
+        self.assertTrue(self.lock.isAvailable(c, self.counting))
+        self.assertEqual(self.lock._getOwnersCount(), (0, 1))
+
+    def test_exclusive(self):
+        a, b = Requester(), Requester()
+        self.lock.claim(a, self.exclusive)
+        self.assertFalse(self.lock.isAvailable(b, self.counting))
+        self.assertFalse(self.lock.isAvailable(b, self.exclusive))
+        self.assertEqual(self.lock._getOwnersCount(), (1, 0))
+        self.lock.release(a, self.exclusive)
+        self.assertTrue(self.lock.isAvailable(b, self.exclusive))
+        self.assertEqual(self.lock._getOwnersCount(), (0, 0))
+
+    def test_release_twice(self):
+        a = Requester()
+        self.lock.claim(a, self.counting)
+        self.lock.release(a, self.counting)
+        self.lock.release(a, self.counting)
+        self.assertEqual(self.lock._getOwnersCount(), (0, 0))
+
+    def test_claim_twice(self):
+        a = Requester()
+        self.lock.claim(a, self.counting)
+        self.lock.claim(a, self.counting)
+        self.assertEqual(self.lock._getOwnersCount(), (0, 2))
+        self.lock.release(a, self.counting)
+        self.assertTrue(self.lock.isOwner(a, self.counting))
+        self.lock.release(a, self.counting)
+        self.assertFalse(self.lock.isOwner(a, self.counting))
+
+    def test_isAvailable_no_requester(self):
+        a, b = Requester(), Requester()
+        self.lock.claim(a, self.counting)
+        self.assertTrue(self.lock.isAvailable(None, self.counting))
+        self.wait(b, self.exclusive)
+        self.assertFalse(self.lock.isAvailable(None, self.counting))
+
+    def test_isAvailableAfter(self):
+        a, b = Requester(), Requester()
+        self.assertTrue(self.lock.isAvailableAfter(self.exclusive, []))
+        self.assertTrue(self.lock.isAvailableAfter(self.counting,
+                                                   [self.counting]))
+        self.assertFalse(self.lock.isAvailableAfter(self.exclusive,
+                                                    [self.counting]))
+        self.assertFalse(self.lock.isAvailableAfter(self.counting,
+                                                    [self.exclusive]))
+        self.assertFalse(self.lock.isAvailableAfter(
+            self.counting, [self.counting, self.counting]))
+        self.lock.claim(a, self.counting)
+        self.assertTrue(self.lock.isAvailableAfter(self.counting, []))
+        self.assertFalse(self.lock.isAvailableAfter(self.counting,
+                                                    [self.counting]))
+        self.lock.release(a, self.counting)
+        # the waiters get the lock first
+        self.lock.claim(a, self.exclusive)
+        self.wait(b, self.counting)
+        self.lock.release(a, self.exclusive)
+        self.assertFalse(self.lock.isAvailableAfter(self.counting,
+                                                    [self.counting]))
+
+    @defer.inlineCallbacks
+    def test_fifo(self):
+        owners = [Requester() for _ in range(5)]
+        self.lock.claim(owners[0], self.exclusive)
+        waits = [self.wait(o, self.counting) for o in owners[1:]]
+        # only the first waiters which fit in the lock are available
+        self.lock.release(owners[0], self.exclusive)
+        self.assertEqual([self.lock.isAvailable(o, self.counting)
+                          for o in owners[1:]],
+                         [True, True, False, False])
+        yield eventual.flushEventualQueue()
+        self.assertEqual([bool(fired) for _, fired in waits],
+                         [True, True, False, False])
+
+    @defer.inlineCallbacks
+    def test_exclusive_not_starved(self):
+        a, b, c, d = Requester(), Requester(), Requester(), Requester()
+        self.lock.claim(a, self.counting)
+        _, b_fired = self.wait(b, self.exclusive)
+        # there is room for c, but it comes after an exclusive waiter
+        self.assertFalse(self.lock.isAvailable(c, self.counting))
+        _, c_fired = self.wait(c, self.counting)
+        self.assertFalse(self.lock.isAvailable(c, self.counting))
+        self.lock.release(a, self.counting)
+        yield eventual.flushEventualQueue()
+        self.assertEqual((b_fired, c_fired), ([self.lock], []))
+        # the woken waiter keeps its place until it claims the lock
+        self.assertFalse(self.lock.isAvailable(d, self.exclusive))
+        self.assertFalse(self.lock.isAvailable(c, self.counting))
+        self.lock.claim(b, self.exclusive)
+        self.assertEqual(list(self.lock.waiting), [c])
+        self.lock.release(b, self.exclusive)
+        yield eventual.flushEventualQueue()
+        self.assertEqual(c_fired, [self.lock])
+        self.lock.claim(c, self.counting)
+        self.assertEqual(list(self.lock.waiting), [])
+
+    def test_wait_again_keeps_place(self):
+        a, b, c = Requester(), Requester(), Requester()
+        self.lock.claim(a, self.exclusive)
+        self.wait(b, self.exclusive)
+        self.wait(c, self.exclusive)
+        d, _ = self.wait(b, self.exclusive)
+        self.assertEqual(list(self.lock.waiting), [b, c])
+        self.assertEqual(self.lock.waiting[b], (self.exclusive, d))
+
+    def test_stopWaitingUntilAvailable(self):
+        a, b, c = Requester(), Requester(), Requester()
+        self.lock.claim(a, self.exclusive)
+        d, _ = self.wait(b, self.exclusive)
+        self.wait(c, self.exclusive)
+        self.lock.stopWaitingUntilAvailable(b, self.exclusive, d)
+        self.assertEqual(list(self.lock.waiting), [c])
+        self.lock.release(a, self.exclusive)
+        self.assertFalse(self.lock.isAvailable(b, self.exclusive))
+        self.assertTrue(self.lock.isAvailable(c, self.exclusive))
+
+    def test_many_waiters(self):
+        owner = Requester()
+        self.lock.claim(owner, self.exclusive)
+        waiters = [Requester() for _ in range(10000)]
+        for w in waiters:
+            self.wait(w, self.counting)
+        self.lock.release(owner, self.exclusive)
+        self.assertEqual([w for w in waiters
+                          if self.lock.isAvailable(w, self.counting)],
+                         waiters[:2])
+        self.assertEqual([w for w, (_, d) in self.lock.waiting.items()
+                          if d is None], waiters[:2])
+
+
+class DistributedMasterLockTests(unittest.TestCase,
+                                 connector_component.ConnectorComponentMixin):
+
+    """
+    Two masters in the same process, sharing a database and a message queue,
+    each with its own instance of the same distributed lock.
+    """
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield self.setUpConnectorComponent(
+            table_names=['masters', 'masterlocks', 'masterlock_claims'])
+        self.db.masterlocks = masterlocks.MasterLocksConnectorComponent(
+            self.db)
+        yield self.insertTestData([
+            fakedb.Master(id=1, name='master1'),
+            fakedb.Master(id=2, name='master2'),
+        ])
+        self.clock = task.Clock()
+        self.mq = simple.SimpleMQ()
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.settle()
+        yield self.tearDownConnectorComponent()
+
+    def makeLocks(self, maxCount):
+        lockid = MasterLock('deploy', maxCount=maxCount, distributed=True)
+        self.counting = lockid.access('counting')
+        self.exclusive = lockid.access('exclusive')
+        self.locks = []
+        for masterid in (1, 2):
+            master = fakemaster.make_master(testcase=self)
+            master.masterid = masterid
+            master.db = self.db
+            master.mq = self.mq
+            master.reactor = self.clock
+            self.locks.append(RealDistributedMasterLock(lockid, master))
+        return self.locks
+
+    @defer.inlineCallbacks
+    def settle(self):
+        """Wait for the locks to be done with the database."""
+        while any(l._reserving for l in self.locks):
+            yield task.deferLater(reactor, 0.01, lambda: None)
+        yield eventual.flushEventualQueue()
+
+    @defer.inlineCallbacks
+    def waitFor(self, fired):
+        """Wait for the lock to be handed over, which may take a few round
+        trips through the database and the message queue."""
+        for _ in range(500):
+            if fired:
+                break
+            yield task.deferLater(reactor, 0.01, lambda: None)
+        yield self.settle()
+
+    @defer.inlineCallbacks
+    def getClaims(self):
+        lockid = yield self.db.masterlocks.findLockId(u'deploy')
+        claims = yield self.db.masterlocks.getLockClaims(lockid)
+        defer.returnValue([(c['slot'], c['masterid'], c['exclusive'])
+                           for c in claims])
+
+    @defer.inlineCallbacks
+    def acquire(self, lock, owner, access):
+        self.assertFalse(lock.isAvailable(owner, access))
+        yield lock.waitUntilMaybeAvailable(owner, access)
+        self.assertTrue(lock.isAvailable(owner, access))
+        lock.claim(owner, access)
+
+    @defer.inlineCallbacks
+    def test_exclusive(self):
+        lock1, lock2 = self.makeLocks(maxCount=2)
+        a, b = Requester(), Requester()
+        yield self.acquire(lock1, a, self.exclusive)
+        self.assertTrue(lock1.isOwner(a, self.exclusive))
+        claims = yield self.getClaims()
+        self.assertEqual(claims, [(0, 1, True), (1, 1, True)])
+
+        fired = []
+        lock2.waitUntilMaybeAvailable(b, self.counting).addCallback(
+            fired.append)
+        yield self.settle()
+        self.assertEqual(fired, [])
+        self.assertFalse(lock2.isAvailable(None, self.counting))
+
+        # the release is sent to the other master, which takes the lock
+        lock1.release(a, self.exclusive)
+        yield self.waitFor(fired)
+        self.assertEqual(fired, [lock2])
+        lock2.claim(b, self.counting)
+        claims = yield self.getClaims()
+        self.assertEqual(claims, [(0, 2, False)])
+        self.assertEqual(lock1.remoteSlots, {0: 2})
+
+    @defer.inlineCallbacks
+    def test_counting(self):
+        lock1, lock2 = self.makeLocks(maxCount=2)
+        a, b, c = Requester(), Requester(), Requester()
+        yield self.acquire(lock1, a, self.counting)
+        yield self.acquire(lock2, b, self.counting)
+        self.assertFalse(lock1.isAvailable(None, self.counting))
+
+        fired = []
+        lock1.waitUntilMaybeAvailable(c, self.counting).addCallback(
+            fired.append)
+        yield self.settle()
+        self.assertEqual(fired, [])
+
+        lock2.release(b, self.counting)
+        yield self.waitFor(fired)
+        self.assertEqual(fired, [lock1])
+        lock1.claim(c, self.counting)
+        claims = yield self.getClaims()
+        self.assertEqual(claims, [(0, 1, False), (1, 1, False)])
+
+    @defer.inlineCallbacks
+    def test_isAvailableAfter(self):
+        lock1, lock2 = self.makeLocks(maxCount=2)
+        a = Requester()
+        yield self.acquire(lock2, a, self.counting)
+        # start caching the claims of the other master
+        self.assertTrue(lock1.isAvailableAfter(self.counting, []))
+        yield self.settle()
+        self.assertFalse(lock1.isAvailableAfter(self.counting,
+                                                [self.counting]))
+        fired = []
+        lock1.subscribeToReleases(lambda: fired.append(True))
+        lock2.release(a, self.counting)
+        yield self.waitFor(fired)
+        self.assertTrue(lock1.isAvailableAfter(self.counting,
+                                               [self.counting]))
+
+    @defer.inlineCallbacks
+    def test_replaced_instance(self):
+        # a reconfig changes maxCount while the old instance is held
+        old, _ = self.makeLocks(maxCount=1)
+        a, b = Requester(), Requester()
+        yield self.acquire(old, a, self.counting)
+        new = RealDistributedMasterLock(
+            MasterLock('deploy', maxCount=2, distributed=True), old.master)
+        self.locks.append(new)
+        yield self.acquire(new, b, self.counting)
+        self.assertEqual(new.remoteSlots, {0: 1})
+
+        # the new instance hears about the releases of the old one, without
+        # waiting for the next poll
+        old.discard()
+        fired = []
+        new.subscribeToReleases(lambda: fired.append(True))
+        old.release(a, self.counting)
+        yield self.waitFor(fired)
+        self.assertEqual(new.remoteSlots, {})
+        self.assertIdentical(old._consumer, None)
+
+    @defer.inlineCallbacks
+    def test_discard(self):
+        lock1, lock2 = self.makeLocks(maxCount=1)
+        a = Requester()
+        yield self.acquire(lock1, a, self.counting)
+        self.assertTrue(lock2.isAvailableAfter(self.counting, []))
+        yield self.settle()
+        lock2.discard()
+        self.assertIdentical(lock2._consumer, None)
+        self.assertEqual(list(self.mq.qrefs.match(
+            ('masterlocks', str(lock1.dblockid), 'released'))),
+            [lock1._consumer])
+
+        # a held instance stops consuming once it is released
+        lock1.discard()
+        self.assertNotIdentical(lock1._consumer, None)
+        fired = []
+        lock1.subscribeToReleases(lambda: fired.append(True))
+        lock1.release(a, self.counting)
+        yield self.waitFor(fired)
+        self.assertIdentical(lock1._consumer, None)
+
+    @defer.inlineCallbacks
+    def test_exclusive_not_starved(self):
+        lock1, lock2 = self.makeLocks(maxCount=2)
+        a, b, c = Requester(), Requester(), Requester()
+        yield self.acquire(lock1, a, self.counting)
+        fired = []
+        lock2.waitUntilMaybeAvailable(b, self.exclusive).addCallback(
+            fired.append)
+        lock2.waitUntilMaybeAvailable(c, self.counting).addCallback(
+            fired.append)
+        yield self.settle()
+        # c could fit, but it comes after an exclusive waiter
+        self.assertEqual(fired, [])
+        lock1.release(a, self.counting)
+        yield self.waitFor(fired)
+        self.assertEqual(fired, [lock2])
+        self.assertTrue(lock2.isAvailable(b, self.exclusive))
+        self.assertFalse(lock2.isAvailable(c, self.counting))
+
+    @defer.inlineCallbacks
+    def test_reservation_timeout(self):
+        lock1, lock2 = self.makeLocks(maxCount=1)
+        a, b = Requester(), Requester()
+        yield lock1.waitUntilMaybeAvailable(a, self.counting)
+        fired = []
+        lock2.waitUntilMaybeAvailable(b, self.counting).addCallback(
+            fired.append)
+        yield self.settle()
+        self.assertEqual(fired, [])
+
+        # a does not claim the lock in time, so it goes to b
+        self.clock.advance(lock1.reservationTimeout)
+        yield self.waitFor(fired)
+        self.assertEqual(fired, [lock2])
+        self.assertFalse(lock1.isAvailable(a, self.counting))
+        self.assertEqual(list(lock1.waiting), [])
+
+    @defer.inlineCallbacks
+    def test_stopWaitingUntilAvailable(self):
+        lock1, lock2 = self.makeLocks(maxCount=1)
+        a, b = Requester(), Requester()
+        d = lock1.waitUntilMaybeAvailable(a, self.counting)
+        yield self.settle()
+        lock1.stopWaitingUntilAvailable(a, self.counting, d)
+        yield self.acquire(lock2, b, self.counting)
+        claims = yield self.getClaims()
+        self.assertEqual(claims, [(0, 2, False)])
+
+    @defer.inlineCallbacks
+    def test_missed_release(self):
+        lock1, lock2 = self.makeLocks(maxCount=1)
+        a, b = Requester(), Requester()
+        yield self.acquire(lock1, a, self.counting)
+        fired = []
+        lock2.waitUntilMaybeAvailable(b, self.counting).addCallback(
+            fired.append)
+        yield self.settle()
+
+        # the first master is gone without a word; its claims are cleaned up
+        yield self.db.masterlocks.releaseMasterClaims(1)
+        yield self.settle()
+        self.assertEqual(fired, [])
+        # the claims are reloaded from time to time
+        self.clock.advance(lock2.pollInterval)
+        yield self.waitFor(fired)
+        self.assertEqual(fired, [lock2])
+
+    @defer.inlineCallbacks
+    def test_stale_cache(self):
+        lock1, lock2 = self.makeLocks(maxCount=1)
+        a, b = Requester(), Requester()
+        # lock2 does not hear about the claim of lock1
+        self.assertTrue(lock2.isAvailable(None, self.counting))
+        yield self.settle()
+        lock2._consumer.stopConsuming()
+        yield self.acquire(lock1, a, self.counting)
+        self.assertTrue(lock2.isAvailable(None, self.counting))
+
+        # .. but the database has the last word
+        fired = []
+        lock2.waitUntilMaybeAvailable(b, self.counting).addCallback(
+            fired.append)
+        yield self.settle()
+        self.assertEqual(fired, [])
+        self.assertEqual(lock2.remoteSlots, {0: 1})
+        self.assertFalse(lock2.isAvailable(None, self.counting))
+
+
 class TestWorkerTransition(unittest.TestCase):
 
     def test_SlaveLock_deprecated(self):
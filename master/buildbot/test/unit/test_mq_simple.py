@@ -21,13 +21,28 @@ import mock
 from twisted.trial import unittest
 
 from buildbot.mq import simple
+from buildbot.util import tuplematch
 
 
 class SimpleMQ(unittest.TestCase):
 
     def setUp(self):
         self.master = mock.Mock(name='master')
-        self.mq = simple.SimpleMQ(self.master)
+        self.mq = simple.SimpleMQ()
 
     # this class *only* implements the interface, so there's little left to
     # test
+
+    def test_produce_indexed(self):
+        calls = []
+        for i in range(1000):
+            self.mq.startConsuming(lambda *args: None,
+                                   ('builds', str(i), None))
+        self.mq.startConsuming(lambda *args: calls.append(args),
+                               ('builds', '10', None))
+
+        # produce only looks at the consumers that match the routing key
+        self.patch(tuplematch, 'matchTuple', mock.Mock(side_effect=AssertionError))
+        self.mq.produce(('builds', '10', 'new'), {'x': 1})
+        self.mq.produce(('builds', '11', 'new'), {'x': 2})
+        self.assertEqual(calls, [(('builds', '10', 'new'), {'x': 1})])
@@ -22,6 +22,7 @@ from twisted.internet import defer
 from twisted.trial import unittest
 
 from buildbot import config
+from buildbot import locks
 from buildbot.process import factory
 from buildbot.process.botmaster import BotMaster
 from buildbot.process.results import CANCELLED
@@ -230,3 +231,31 @@ class TestBotMaster(unittest.TestCase):
         self.botmaster.maybeStartBuildsForAllBuilders()
 
         brd.maybeStartBuildsOn.assert_called_once_with(['frank', 'larry'])
+
+    def test_getLockByID(self):
+        lockid = locks.MasterLock('lock', maxCount=2)
+        lock = self.botmaster.getLockByID(lockid)
+        self.assertIsInstance(lock, locks.RealMasterLock)
+        self.assertNotIsInstance(lock, locks.RealDistributedMasterLock)
+        self.assertIdentical(self.botmaster.getLockByID(
+            locks.MasterLock('lock', maxCount=2)), lock)
+
+    def test_getLockByID_distributed(self):
+        lockid = locks.MasterLock('lock', maxCount=2, distributed=True)
+        lock = self.botmaster.getLockByID(lockid)
+        self.assertIsInstance(lock, locks.RealDistributedMasterLock)
+        self.assertIdentical(lock.master, self.master)
+        self.assertEqual(lock.maxCount, 2)
+        # a different lock than the local one with the same name
+        self.assertNotIdentical(self.botmaster.getLockByID(
+            locks.MasterLock('lock', maxCount=2)), lock)
+
+    def test_getLockByID_distributed_reconfigured(self):
+        lock = self.botmaster.getLockByID(
+            locks.MasterLock('lock', maxCount=2, distributed=True))
+        lock.discard = mock.Mock()
+        newLock = self.botmaster.getLockByID(
+            locks.MasterLock('lock', maxCount=3, distributed=True))
+        self.assertNotIdentical(newLock, lock)
+        lock.discard.assert_called_with()
+        self.assertEqual(list(self.botmaster.locks.values()), [newLock])
@@ -23,6 +23,7 @@ from twisted.internet import defer
 from twisted.trial import unittest
 
 from buildbot.process import buildrequest
+from buildbot.process import cache
 from buildbot.process.builder import Builder
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
@@ -185,6 +186,105 @@ class TestBuildRequestCollapser(unittest.TestCase):
         yield self.do_request_collapse(rows, [22], [])
         yield self.do_request_collapse(rows, [21], [19, 20])
 
+    def makeSignatureRows(self):
+        return [
+            fakedb.Builder(id=77, name='A'),
+            fakedb.SourceStamp(id=234, codebase='C', revision='abcd'),
+            fakedb.SourceStamp(id=235, codebase='C', revision='abcd'),
+            fakedb.SourceStamp(id=236, codebase='C', revision='1234'),
+            fakedb.Patch(id=1),
+            fakedb.SourceStamp(id=237, codebase='C', revision='abcd',
+                               patchid=1),
+            fakedb.SourceStamp(id=238, codebase='C', revision='abcd'),
+            fakedb.SourceStamp(id=239, codebase='D', revision='abcd'),
+        ] + [
+            row
+            for bsid, ssids in [(30, [234]), (31, [235]), (32, [236]),
+                                (33, [237]), (34, [238, 239])]
+            for row in (
+                fakedb.Buildset(id=bsid, reason='foo',
+                                submitted_at=1300305712, results=-1),
+                fakedb.BuildRequest(id=bsid - 10, buildsetid=bsid,
+                                    builderid=77, priority=13,
+                                    submitted_at=1300305712 + bsid,
+                                    results=-1),
+            ) + tuple(fakedb.BuildsetSourceStamp(sourcestampid=ssid,
+                                                 buildsetid=bsid)
+                      for ssid in ssids)
+        ]
+
+    @defer.inlineCallbacks
+    def test_collapseRequests_collapse_default_signatures(self):
+        rows = self.makeSignatureRows() + [
+            fakedb.Buildset(id=35, reason='foo',
+                            submitted_at=1300305712, results=-1),
+            fakedb.BuildsetSourceStamp(sourcestampid=234, buildsetid=35),
+            fakedb.BuildRequest(id=25, buildsetid=35, builderid=77,
+                                priority=13, submitted_at=1300305790,
+                                results=-1),
+        ]
+        self.bldr.getCollapseRequestsFn = lambda: Builder._defaultCollapseRequestFn
+        # only collapsed with the buildsets with the same sourcestamps; not
+        # with a different revision, a patch or more codebases
+        yield self.do_request_collapse(rows, [25], [20, 21])
+
+    @defer.inlineCallbacks
+    def test_collapseRequests_collapse_default_patch(self):
+        rows = self.makeSignatureRows()
+        self.bldr.getCollapseRequestsFn = lambda: Builder._defaultCollapseRequestFn
+        yield self.do_request_collapse(rows, [23], [])
+
+    @defer.inlineCallbacks
+    def test_collapseRequests_collapse_default_same_buildset(self):
+        rows = self.makeSignatureRows() + [
+            fakedb.BuildRequest(id=26, buildsetid=33, builderid=77,
+                                priority=13, submitted_at=1300305790,
+                                results=-1),
+        ]
+        self.bldr.getCollapseRequestsFn = lambda: Builder._defaultCollapseRequestFn
+        yield self.do_request_collapse(rows, [26], [23])
+
+    @defer.inlineCallbacks
+    def test_collapseRequests_collapse_default_cached(self):
+        self.master.caches = cache.CacheManager()
+        self.master.caches.config = dict(CollapseSignatures=10)
+        get = self.master.data.get
+        fetched = []
+
+        def dataGet(path, *args, **kwargs):
+            if path[0] == 'buildsets':
+                fetched.append(int(path[1]))
+            return get(path, *args, **kwargs)
+        self.patch(self.master.data, 'get', dataGet)
+
+        rows = self.makeSignatureRows()
+        self.bldr.getCollapseRequestsFn = lambda: Builder._defaultCollapseRequestFn
+        yield self.do_request_collapse(rows, [24], [])
+        self.assertEqual(sorted(fetched), [30, 31, 32, 33, 34])
+        # the buildsets are not fetched again
+        yield self.do_request_collapse([], [20], [21])
+        self.assertEqual(sorted(fetched), [30, 31, 32, 33, 34])
+
+    @defer.inlineCallbacks
+    def test_collapseRequests_collapse_default_small_cache(self):
+        # the queue is longer than the cache, yet each buildset is only
+        # fetched once per collapse
+        self.master.caches = cache.CacheManager()
+        self.master.caches.config = dict(CollapseSignatures=1)
+        get = self.master.data.get
+        fetched = []
+
+        def dataGet(path, *args, **kwargs):
+            if path[0] == 'buildsets':
+                fetched.append(int(path[1]))
+            return get(path, *args, **kwargs)
+        self.patch(self.master.data, 'get', dataGet)
+
+        rows = self.makeSignatureRows()
+        self.bldr.getCollapseRequestsFn = lambda: Builder._defaultCollapseRequestFn
+        yield self.do_request_collapse(rows, [24, 20], [21])
+        self.assertEqual(sorted(fetched), [30, 31, 32, 33, 34])
+
 
 class TestBuildRequest(unittest.TestCase):
 
@@ -26,6 +26,7 @@ from twisted.python import failure
 from twisted.trial import unittest
 
 from buildbot import config
+from buildbot import locks
 from buildbot.db import buildrequests
 from buildbot.process import buildrequestdistributor
 from buildbot.process import factory
@@ -139,6 +140,7 @@ class TestBRDBase(unittest.TestCase):
             return d
         bldr.maybeStartBuild = maybeStartBuild
         bldr.canStartWithWorkerForBuilder = lambda _: True
+        bldr.getLocksForWorker = lambda _: []
         bldr.getCollapseRequestsFn = lambda: False
 
         bldr.workers = []
@@ -934,3 +936,307 @@ class TestMaybeStartBuilds(TestBRDBase):
         result = self.do_test_nextBuild(nextBuild)
         self.assertEqual(1, len(self.flushLoggedErrors(RuntimeError)))
         return result
+
+
+class TestMaybeStartBuildsBatched(TestBRDBase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        TestBRDBase.setUp(self)
+        self.master.config.batchBuildRequestClaims = True
+
+        self.startedBuilds = []
+        yield self.createBuilder('A', builderid=77)
+        yield self.createBuilder('B', builderid=78)
+
+        self.claims = []
+        old_claimBuildRequests = self.master.db.buildrequests.claimBuildRequests
+
+        def claimBuildRequests(brids, claimed_at=None, _reactor=None):
+            self.claims.append(sorted(brids))
+            return old_claimBuildRequests(brids, claimed_at=claimed_at)
+        self.master.db.buildrequests.claimBuildRequests = claimBuildRequests
+
+        self.rows = self.base_rows + [
+            fakedb.Builder(id=78, name='B'),
+            fakedb.BuildRequest(id=10, buildsetid=11, builderid=77,
+                                submitted_at=130000),
+            fakedb.BuildRequest(id=11, buildsetid=11, builderid=78,
+                                submitted_at=135000),
+            fakedb.BuildRequest(id=12, buildsetid=11, builderid=78,
+                                submitted_at=140000),
+        ]
+
+    def addWorker(self, bldr_name, name, worker=None):
+        wfb = mock.Mock(spec=['isAvailable', 'worker'], name=name)
+        wfb.name = name
+        wfb.worker = worker or mock.Mock(name='worker-' + name)
+        wfb.isAvailable.return_value = True
+        self.builders[bldr_name].workers.append(wfb)
+
+    def assertBuildsStarted(self, exp):
+        builds_started = sorted(
+            (worker, [br.id for br in breqs])
+            for (worker, breqs) in self.startedBuilds)
+        self.assertEqual(builds_started, exp)
+
+    @defer.inlineCallbacks
+    def test_single_claim(self):
+        self.addWorker('A', 'wA')
+        self.addWorker('B', 'wB1')
+        self.addWorker('B', 'wB2')
+        yield self.master.db.insertTestData(self.rows)
+
+        yield self.brd._maybeStartBuildsOnBuilders(
+            [self.builders['A'], self.builders['B']])
+
+        self.assertEqual(self.claims, [[10, 11, 12]])
+        self.assertMyClaims([10, 11, 12])
+        self.assertEqual(len(self.startedBuilds), 3)
+        self.assertEqual(sorted(br.id for _, breqs in self.startedBuilds
+                                for br in breqs), [10, 11, 12])
+
+    @defer.inlineCallbacks
+    def test_shared_worker(self):
+        # A and B can both use the same worker; B gets it on a second pass
+        worker = mock.Mock(name='worker')
+        self.addWorker('A', 'wA', worker)
+        self.addWorker('B', 'wB', worker)
+        self.builders['B'].config.nextBuild = lambda bldr, breqs: breqs[0]
+        yield self.master.db.insertTestData(self.rows)
+
+        self.brd.maybeStartBuildsOn(['A', 'B'])
+        yield self.quiet_deferred
+
+        self.assertEqual(self.claims, [[10], [11]])
+        self.assertBuildsStarted([('wA', [10]), ('wB', [11])])
+
+    @defer.inlineCallbacks
+    def test_shared_lock(self):
+        # A and B need the same lock; B gets it on a second pass
+        lockid = locks.MasterLock('lock', maxCount=1)
+        lock = locks.RealMasterLock(lockid)
+        access = lockid.access('counting')
+        for name in 'AB':
+            self.builders[name].getLocksForWorker = \
+                lambda _: [(lock, access)]
+        self.addWorker('A', 'wA')
+        self.addWorker('B', 'wB')
+        self.builders['B'].config.nextBuild = lambda bldr, breqs: breqs[0]
+        yield self.master.db.insertTestData(self.rows)
+
+        assignments, retry = yield self.brd._chooseBuilds(
+            [self.builders['A'], self.builders['B']])
+
+        self.assertEqual([(bldr.name, [br.id for br in breqs])
+                          for bldr, _, breqs in assignments], [('A', [10])])
+        self.assertEqual(retry, set(['B']))
+
+    @defer.inlineCallbacks
+    def test_claim_race(self):
+        self.addWorker('A', 'wA')
+        self.addWorker('B', 'wB')
+        yield self.master.db.insertTestData(self.rows)
+
+        # another master claims brid 11 after it was chosen
+        old_claimBuildRequests = self.master.db.buildrequests.claimBuildRequests
+
+        def claimBuildRequests(brids, claimed_at=None, _reactor=None):
+            self.master.db.buildrequests.claimBuildRequests = old_claimBuildRequests
+            self.master.db.buildrequests.fakeClaimBuildRequest(11, 136000,
+                                                               masterid=9999)
+            return old_claimBuildRequests(brids, claimed_at=claimed_at)
+        self.master.db.buildrequests.claimBuildRequests = claimBuildRequests
+
+        self.brd.maybeStartBuildsOn(['A', 'B'])
+        yield self.quiet_deferred
+
+        # the batch fails, A's build is claimed on its own, and B chooses
+        # again
+        self.assertEqual(self.claims, [[10, 11], [10], [11], [12]])
+        self.assertMyClaims([10, 12])
+        self.assertBuildsStarted([('wA', [10]), ('wB', [12])])
+
+    @defer.inlineCallbacks
+    def test_maybeStartBuild_fails(self):
+        self.addWorker('A', 'wA')
+        yield self.master.db.insertTestData(self.rows)
+
+        def maybeStartBuild(worker, builds):
+            return defer.succeed(False)
+        self.builders['A'].maybeStartBuild = maybeStartBuild
+
+        yield self.brd._maybeStartBuildsOnBuilders([self.builders['A']])
+
+        self.assertEqual(self.claims, [[10]])
+        self.assertMyClaims([])
+
+
+class TestUnclaimedBuildRequests(TestBRDBase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        TestBRDBase.setUp(self)
+        self.index = self.brd.unclaimedBuildRequests
+        yield self.master.db.insertTestData(self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, builderid=77,
+                                submitted_at=130000),
+            fakedb.BuildRequest(id=11, buildsetid=11, builderid=77,
+                                submitted_at=120000),
+            fakedb.BuildRequest(id=12, buildsetid=11, builderid=77,
+                                priority=5, submitted_at=140000),
+        ])
+        self.master.mq.verifyMessages = False
+        self.data_get = mock.Mock(wraps=self.master.data.get)
+        self.patch(self.master.data, 'get', self.data_get)
+
+    @property
+    def loads(self):
+        return len([c for c in self.data_get.call_args_list
+                    if c[0][0][2:] == ('buildrequests',)])
+
+    def makeMessage(self, brid, claimed=False, complete=False,
+                    submitted_at=150000, priority=0):
+        return {'buildrequestid': brid, 'buildsetid': 11, 'builderid': 77,
+                'priority': priority, 'claimed': claimed,
+                'claimed_at': None, 'claimed_by_masterid': None,
+                'complete': complete, 'results': -1,
+                'submitted_at': epoch2datetime(submitted_at),
+                'complete_at': None, 'waited_for': False}
+
+    def sendMessage(self, msg, event):
+        self.master.mq.callConsumer(
+            ('buildrequests', str(msg['buildrequestid']), event), msg)
+
+    @defer.inlineCallbacks
+    def assertBrids(self, exp):
+        brdicts = yield self.index.getBuildRequests(77)
+        self.assertEqual([brd['buildrequestid'] for brd in brdicts], exp)
+
+    @defer.inlineCallbacks
+    def test_sorted(self):
+        yield self.assertBrids([12, 11, 10])
+
+    @defer.inlineCallbacks
+    def test_loaded_once(self):
+        yield self.assertBrids([12, 11, 10])
+        yield self.assertBrids([12, 11, 10])
+        self.assertEqual(self.loads, 1)
+
+    @defer.inlineCallbacks
+    def test_messages(self):
+        yield self.assertBrids([12, 11, 10])
+        self.sendMessage(self.makeMessage(13), 'new')
+        self.sendMessage(self.makeMessage(14, submitted_at=100000), 'new')
+        self.sendMessage(self.makeMessage(11, claimed=True), 'claimed')
+        self.sendMessage(self.makeMessage(12, claimed=True, complete=True),
+                         'complete')
+        yield self.assertBrids([14, 10, 13])
+        self.sendMessage(self.makeMessage(11, submitted_at=120000),
+                         'unclaimed')
+        yield self.assertBrids([14, 11, 10, 13])
+        self.assertEqual(self.loads, 1)
+
+    @defer.inlineCallbacks
+    def test_messages_other_builders(self):
+        yield self.assertBrids([12, 11, 10])
+        msg = self.makeMessage(13)
+        msg['builderid'] = 78
+        self.sendMessage(msg, 'new')
+        yield self.assertBrids([12, 11, 10])
+
+    @defer.inlineCallbacks
+    def test_messages_while_loading(self):
+        d = defer.Deferred()
+        get = self.master.data.get
+
+        @defer.inlineCallbacks
+        def slowGet(*args, **kwargs):
+            res = yield get(*args, **kwargs)
+            yield d
+            defer.returnValue(res)
+        self.patch(self.master.data, 'get', slowGet)
+
+        loads = [self.index.getBuildRequests(77),
+                 self.index.getBuildRequests(77)]
+        self.sendMessage(self.makeMessage(10, claimed=True), 'claimed')
+        self.sendMessage(self.makeMessage(13), 'new')
+        d.callback(None)
+        for load in loads:
+            brdicts = yield load
+            self.assertEqual([brd['buildrequestid'] for brd in brdicts],
+                             [12, 11, 13])
+
+    @defer.inlineCallbacks
+    def test_removeBuildRequests(self):
+        yield self.assertBrids([12, 11, 10])
+        self.index.removeBuildRequests(77, [11, 12])
+        self.index.removeBuildRequests(78, [10])
+        yield self.assertBrids([10])
+
+    @defer.inlineCallbacks
+    def test_invalidate(self):
+        yield self.assertBrids([12, 11, 10])
+        yield self.master.db.insertTestData([
+            fakedb.BuildRequest(id=13, buildsetid=11, builderid=77,
+                                submitted_at=150000)])
+        self.index.invalidate(77)
+        yield self.assertBrids([12, 11, 10, 13])
+        self.assertEqual(self.loads, 2)
+
+    @defer.inlineCallbacks
+    def test_stopped(self):
+        yield self.brd.stopService()
+        yield self.assertBrids([12, 11, 10])
+        yield self.assertBrids([12, 11, 10])
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(self.master.mq.qrefs, [])
+
+    def test_queue_compaction(self):
+        queue = buildrequestdistributor._UnclaimedQueue(
+            [self.makeMessage(i, submitted_at=i) for i in range(100)])
+        for i in range(0, 100, 2):
+            queue.update(self.makeMessage(i, claimed=True))
+        self.assertEqual(len(queue), 50)
+        self.assertTrue(len(queue.heap) <= 2 * 50 + 16)
+        queue.update(self.makeMessage(2, submitted_at=2))
+        self.assertEqual([brd['buildrequestid'] for brd in queue.sorted()],
+                         [1, 2] + list(range(3, 100, 2)))
+
+    def test_queue_view(self):
+        queue = buildrequestdistributor._UnclaimedQueue(
+            [self.makeMessage(i, submitted_at=1000 - i) for i in range(1000)])
+        view = queue.view()
+        # only what is looked at is sorted
+        self.assertEqual(view[0]['buildrequestid'], 999)
+        self.assertEqual(len(view._taken), 1)
+        self.assertEqual(view[1]['buildrequestid'], 998)
+        self.assertEqual(len(view._taken), 2)
+        # removing from the view leaves the queue alone
+        view.remove(view[0])
+        self.assertEqual(view[0]['buildrequestid'], 998)
+        self.assertEqual(view.get(999), None)
+        self.assertEqual(len(view), 999)
+        self.assertEqual(len(queue), 1000)
+        # the view follows the queue
+        queue.update(self.makeMessage(998, claimed=True))
+        queue.update(self.makeMessage(1000, submitted_at=0))
+        self.assertEqual([brd['buildrequestid'] for brd in view][:3],
+                         [1000, 997, 996])
+        self.assertEqual(len(view), 999)
+        self.assertEqual(view.get(1000)['buildrequestid'], 1000)
+
+    @defer.inlineCallbacks
+    def test_chooser_uses_index(self):
+        yield self.createBuilder('A', builderid=77)
+        self.addWorkers({'test-worker1': 1})
+        self.startedBuilds = []
+        bldr = self.builders['A']
+
+        yield self.brd._maybeStartBuildsOnBuilder(bldr)
+        self.assertMyClaims([12])
+        # the claim removed the request from the index, so the next chooser
+        # does not need the db
+        yield self.brd._maybeStartBuildsOnBuilder(bldr)
+        self.assertMyClaims([12, 11])
+        self.assertEqual(self.loads, 1)
@@ -241,3 +241,14 @@ class TestBufferObserver(unittest.TestCase):
         yield self.do_test_sequence(lo)
         self.assertEqual(lo.getStdout(), u'hello\nmulti\nline\nchunk\n')
         self.assertEqual(lo.getStderr(), u'cruel\n')
+
+    @defer.inlineCallbacks
+    def test_spilled(self):
+        lo = logobserver.BufferLogObserver(wantStdout=True, wantStderr=True)
+        lo.maxMemory = 10
+        lo.stdout = lo._makeCollector()
+        yield self.do_test_sequence(lo)
+        self.assertTrue(lo.stdout.spilled)
+        self.assertFalse(lo.stderr.spilled)
+        self.assertEqual(lo.getStdout(), u'hello\nmulti\nline\nchunk\n')
+        self.assertEqual(lo.getStderr(), u'cruel\n')
@@ -988,6 +988,81 @@ class TestProperties(unittest.TestCase):
         self.assertEqual(self.props.getProperty('x'), 24)
         self.assertEqual(self.props.getPropertySource('x'), 'old')
 
+    def test_dirty_setProperty(self):
+        self.props.setProperty('x', 'y', 'test')
+        self.assertEqual(self.props.getDirtyProperties(),
+                         {'x': ('y', 'test')})
+        self.props.markClean({'x': ('y', 'test')})
+        self.assertEqual(self.props.getDirtyProperties(), {})
+        # setting the same value does not dirty the property
+        self.props.setProperty('x', 'y', 'test')
+        self.assertEqual(self.props.getDirtyProperties(), {})
+        # but a new source does
+        self.props.setProperty('x', 'y', 'other')
+        self.assertEqual(self.props.getDirtyProperties(),
+                         {'x': ('y', 'other')})
+
+    def test_dirty_markClean_changed_meanwhile(self):
+        self.props.setProperty('x', 1, 'test')
+        self.props.setProperty('y', 2, 'test')
+        dirty = self.props.getDirtyProperties()
+        self.props.setProperty('x', 3, 'test')
+        self.props.markClean(dirty)
+        self.assertEqual(self.props.getDirtyProperties(), {'x': (3, 'test')})
+
+    def test_dirty_mutated_in_place(self):
+        self.props.setProperty('x', [1], 'test')
+        dirty = self.props.getDirtyProperties()
+        self.props.getProperty('x').append(2)
+        # the values returned are not affected by the mutation
+        self.assertEqual(dirty, {'x': ([1], 'test')})
+        self.props.markClean(dirty)
+        self.assertEqual(self.props.getDirtyProperties(),
+                         {'x': ([1, 2], 'test')})
+
+    def test_dirty_only_serialized(self):
+        for i in range(10):
+            self.props.setProperty('p%d' % i, i, 'test')
+        self.props.markClean(self.props.getDirtyProperties())
+        self.props.setProperty('p3', 33, 'test')
+        serialized = []
+        serialize = self.props._serialize
+
+        def count(value_source):
+            serialized.append(value_source)
+            return serialize(value_source)
+        self.patch(self.props, '_serialize', count)
+        self.assertEqual(self.props.getDirtyProperties(), {'p3': (33, 'test')})
+        self.assertEqual(serialized, [(33, 'test')])
+
+    def test_dirty_mutated_after_flush(self):
+        self.props.setProperty('x', [1], 'test')
+        value = self.props.getProperty('x')
+        self.props.markClean(self.props.getDirtyProperties())
+        self.assertEqual(self.props.getDirtyProperties(), {})
+        value.append(2)
+        self.assertEqual(self.props.getDirtyProperties(),
+                         {'x': ([1, 2], 'test')})
+
+    def test_dirty_updateFromProperties(self):
+        self.props.setProperty('a', 1, 'old')
+        self.props.setProperty('b', 2, 'old')
+        self.props.markClean(self.props.getDirtyProperties())
+        newprops = Properties()
+        newprops.setProperty('a', 1, 'old')
+        newprops.setProperty('b', 3, 'new', runtime=True)
+        newprops.setProperty('c', 4, 'new')
+        self.props.updateFromProperties(newprops)
+        self.assertEqual(self.props.getDirtyProperties(),
+                         {'b': (3, 'new'), 'c': (4, 'new')})
+
+    def test_dirty_updateFromPropertiesNoRuntime(self):
+        newprops = Properties()
+        newprops.setProperty('a', 1, 'new', runtime=True)
+        newprops.setProperty('b', 2, 'new')
+        self.props.updateFromPropertiesNoRuntime(newprops)
+        self.assertEqual(self.props.getDirtyProperties(), {'b': (2, 'new')})
+
     def test_setProperty_notJsonable(self):
         self.assertRaises(TypeError, self.props.setProperty,
                           "project", ConstantRenderable('testing'), "test")
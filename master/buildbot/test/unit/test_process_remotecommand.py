@@ -18,11 +18,17 @@ from __future__ import print_function
 
 import mock
 
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import task
 from twisted.trial import unittest
 
+from buildbot.db import logs
 from buildbot.process import remotecommand
 from buildbot.test.fake import remotecommand as fakeremotecommand
 from buildbot.test.fake import logfile
+from buildbot.test.unit import test_db_logs
+from buildbot.test.util import connector_component
 from buildbot.test.util import interfaces
 from buildbot.test.util.warnings import assertNotProducesWarnings
 from buildbot.test.util.warnings import assertProducesWarning
@@ -179,6 +185,229 @@ class TestRunCommand(unittest.TestCase, Tests):
         self.assertEqual(cmd.args['usePTY'], 'slave-config')
 
 
+class SlowLog(object):
+
+    """A log whose writes only complete when told to"""
+
+    def __init__(self):
+        self.pending = []
+
+    def getName(self):
+        return 'stdio'
+
+    def addStdout(self, data):
+        d = defer.Deferred()
+        self.pending.append((data, d))
+        return d
+    addStderr = addHeader = addStdout
+
+    def writeAll(self):
+        # writes are serialized by the command's loglock, so completing one
+        # may start the next
+        while self.pending:
+            _, d = self.pending.pop(0)
+            d.callback(None)
+
+
+class TestRemoteUpdateFlowControl(unittest.TestCase):
+
+    def setUp(self):
+        self.cmd = remotecommand.RemoteCommand('shell', {})
+        self.cmd.worker = mock.Mock()
+        self.cmd.active = True
+        self.cmd.maxPendingUpdateBytes = 10
+        self.log = SlowLog()
+        self.cmd.useLog(self.log)
+        self.acks = []
+
+    def tearDown(self):
+        self.log.writeAll()
+        self.assertEqual(remotecommand.RemoteCommand._totalPendingUpdateBytes, 0)
+
+    def update(self, updates):
+        d = defer.maybeDeferred(self.cmd.remote_update, updates)
+        d.addCallback(self.acks.append)
+
+    def test_ack_immediately_below_limit(self):
+        self.update([[{'stdout': u'12345\n'}, 0], [{'header': u'hi\n'}, 1]])
+        self.assertEqual(self.acks, [1])
+        self.assertEqual(self.cmd._pendingUpdateBytes, 9)
+        self.log.writeAll()
+        self.assertEqual(self.cmd._pendingUpdateBytes, 0)
+
+    def test_ack_delayed_above_limit(self):
+        self.update([[{'stdout': u'12345\n'}, 0]])
+        self.update([[{'stderr': u'12345\n'}, 1], [{'rc': 0}, 2]])
+        self.assertEqual(self.acks, [0])
+        self.assertEqual(self.cmd._pendingUpdateBytes, 12)
+        self.log.writeAll()
+        self.assertEqual(self.acks, [0, 2])
+        self.assertEqual(self.cmd._pendingUpdateBytes, 0)
+        # and acks are immediate again
+        self.update([[{'stdout': u'1\n'}, 3]])
+        self.assertEqual(self.acks, [0, 2, 3])
+
+    def test_ack_delayed_above_master_limit(self):
+        self.patch(remotecommand.RemoteCommand, 'maxTotalPendingUpdateBytes', 10)
+        other = remotecommand.RemoteCommand('shell', {})
+        other.worker = mock.Mock()
+        other.active = True
+        otherLog = SlowLog()
+        other.useLog(otherLog)
+        other.remote_update([[{'stdout': u'12345678\n'}, 0]])
+
+        self.cmd.maxPendingUpdateBytes = 100
+        self.update([[{'stdout': u'12345\n'}, 0]])
+        self.assertEqual(self.acks, [])
+        otherLog.writeAll()
+        self.assertEqual(self.acks, [])
+        self.log.writeAll()
+        self.assertEqual(self.acks, [0])
+
+    def test_inactive(self):
+        self.cmd.active = False
+        self.update([[{'stdout': u'12345678901234567890\n'}, 4]])
+        self.assertEqual(self.acks, [4])
+        self.assertEqual(self.log.pending, [])
+
+    def test_write_failure(self):
+        self.update([[{'stdout': u'12345678901234567890\n'}, 4]])
+        self.log.pending.pop(0)[1].errback(RuntimeError('oh noes'))
+        self.assertEqual(self.acks, [4])
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        self.assertEqual(self.cmd._pendingUpdateBytes, 0)
+
+    @defer.inlineCallbacks
+    def test_update_raises(self):
+        def remoteUpdate(update):
+            raise RuntimeError('oh noes')
+        self.cmd.remoteUpdate = remoteUpdate
+        self.cmd.deferred = defer.Deferred()
+        self.update([[{'stdout': u'12345\n'}, 0], [{'rc': 0}, 1]])
+        # the command is finished with the failure, and the updates acked
+        self.assertEqual(self.acks, [1])
+        self.assertFalse(self.cmd.active)
+        self.assertEqual(self.cmd._pendingUpdateBytes, 0)
+        yield self.assertFailure(self.cmd.deferred, RuntimeError)
+
+
+class DbLog(object):
+
+    """A log writing its lines straight to the database"""
+
+    def __init__(self, db, logid):
+        self.db = db
+        self.logid = logid
+
+    def getName(self):
+        return 'stdio'
+
+    def addStdout(self, data):
+        return self.db.logs.appendLog(self.logid, data)
+    addStderr = addHeader = addStdout
+
+
+class TestRemoteUpdateLogBackpressure(unittest.TestCase,
+                                      connector_component.ConnectorComponentMixin):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield self.setUpConnectorComponent(
+            table_names=['logs', 'logchunks', 'logchunk_dictionaries', 'steps',
+                         'builds', 'builders', 'masters', 'buildrequests',
+                         'buildsets', 'workers'])
+        self.db.logs = logs.LogsConnectorComponent(self.db)
+        yield self.insertTestData(test_db_logs.Tests.backgroundData +
+                                  test_db_logs.Tests.testLogLines)
+
+        self.cmd = remotecommand.RemoteCommand('shell', {})
+        self.cmd.worker = mock.Mock()
+        self.cmd.active = True
+        self.cmd.maxPendingUpdateBytes = 10
+        self.cmd.useLog(DbLog(self.db, 201))
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.db.logs.flushLogs()
+        self.db.logs.stopCompressing()
+        yield self.tearDownConnectorComponent()
+
+    @defer.inlineCallbacks
+    def test_ack_held_back_above_high_water(self):
+        self.db.logs.APPEND_FLUSH_SIZE = 10
+        self.db.logs.APPEND_HIGH_WATER = 20
+
+        # the database stalls
+        stalled = []
+        do = self.db.pool.do
+
+        def stalledDo(callable, *args, **kwargs):
+            d = defer.Deferred()
+            d.addCallback(lambda _: do(callable, *args, **kwargs))
+            stalled.append(d)
+            return d
+        self.patch(self.db.pool, 'do', stalledDo)
+
+        # the update is over the high-water mark of the log writer, so its
+        # append, and the ack, wait for the lines to be written
+        acks = []
+        d = defer.maybeDeferred(self.cmd.remote_update,
+                                [[{'stdout': u'x' * 30 + u'\n'}, 0]])
+        d.addCallback(acks.append)
+        while not stalled:
+            yield task.deferLater(reactor, 0.01, lambda: None)
+        yield task.deferLater(reactor, 0.05, lambda: None)
+        self.assertEqual(acks, [])
+        self.assertEqual(self.cmd._pendingUpdateBytes, 31)
+
+        # the database comes back
+        self.db.pool.do = do
+        stalled[0].callback(None)
+        yield d
+        self.assertEqual(acks, [0])
+        self.assertEqual(self.cmd._pendingUpdateBytes, 0)
+        self.assertEqual((yield self.db.logs.getLogLines(201, 7, 7)),
+                         u'x' * 30 + u'\n')
+
+
+class TestCollectOutput(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def test_collect(self):
+        cmd = remotecommand.RemoteCommand('shell', {}, collectStdout=True,
+                                          collectStderr=True)
+        for data in ['a', 'b', 'c\n']:
+            yield cmd.addStdout(data)
+        yield cmd.addStderr('oops')
+        yield cmd.addHeader('header')
+        self.assertEqual(cmd.stdout, 'abc\n')
+        self.assertEqual(cmd.stderr, 'oops')
+
+    @defer.inlineCallbacks
+    def test_not_collected(self):
+        cmd = remotecommand.RemoteCommand('shell', {})
+        yield cmd.addStdout('abc')
+        yield cmd.addStderr('oops')
+        self.assertEqual(cmd.stdout, '')
+        self.assertEqual(cmd.stderr, '')
+
+    @defer.inlineCallbacks
+    def test_collect_spilled(self):
+        self.patch(remotecommand.RemoteCommand,
+                   'maxCollectedOutputInMemory', 4)
+        cmd = remotecommand.RemoteCommand('shell', {}, collectStdout=True)
+        for data in ['ab', 'cd', 'ef']:
+            yield cmd.addStdout(data)
+        self.assertTrue(cmd._stdout.spilled)
+        self.assertEqual(cmd.stdout, 'abcdef')
+
+    def test_set(self):
+        cmd = remotecommand.RemoteCommand('shell', {}, collectStdout=True)
+        cmd.stdout = 'abc'
+        cmd.stdout += 'def'
+        self.assertEqual(cmd.stdout, 'abcdef')
+
+
 class TestFakeRunCommand(unittest.TestCase, Tests):
 
     remoteCommandClass = fakeremotecommand.FakeRemoteCommand
@@ -19,6 +19,7 @@ from __future__ import print_function
 from mock import Mock
 
 from twisted.internet import defer
+from twisted.internet import task
 from twisted.trial import unittest
 
 from buildbot import config
@@ -97,6 +98,37 @@ class TestGitHubStatusPush(unittest.TestCase, ReporterTestMixin):
         build['results'] = FAILURE
         self.sp.buildFinished(("build", 20, "finished"), build)
 
+    @defer.inlineCallbacks
+    def test_collapse_rate_limited(self):
+        self.sp.statusQueue.reactor = clock = task.Clock()
+        build = yield self.setupBuildResults(SUCCESS)
+        self._http.expect(
+            'post',
+            '/repos/buildbot/buildbot/statuses/d34db33fd43db33f',
+            json={'state': 'pending',
+                  'target_url': 'http://localhost:8080/#builders/79/builds/0',
+                  'description': 'Build started.', 'context': 'buildbot/Builder0'},
+            headers={'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '60'})
+        build['complete'] = False
+        yield self.sp.buildStarted(("build", 20, "started"), build)
+
+        # both updates wait for the rate limit reset, and only the last one
+        # is sent
+        build['complete'] = True
+        d1 = self.sp.buildFinished(("build", 20, "finished"), build)
+        build['results'] = FAILURE
+        d2 = self.sp.buildFinished(("build", 20, "finished"), build)
+        self.assertNoResult(d1)
+        self._http.expect(
+            'post',
+            '/repos/buildbot/buildbot/statuses/d34db33fd43db33f',
+            json={'state': 'failure',
+                  'target_url': 'http://localhost:8080/#builders/79/builds/0',
+                  'description': 'Build done.', 'context': 'buildbot/Builder0'})
+        clock.advance(60)
+        yield d1
+        yield d2
+
     @defer.inlineCallbacks
     def setupBuildResultsMin(self, buildResults):
         self.insertTestData([buildResults], buildResults, insertSS=False)
@@ -149,3 +181,30 @@ class TestGitHubCommentPush(TestGitHubStatusPush):
         self.sp.buildFinished(("build", 20, "finished"), build)
         build['results'] = FAILURE
         self.sp.buildFinished(("build", 20, "finished"), build)
+
+    @defer.inlineCallbacks
+    def test_collapse_rate_limited(self):
+        self.sp.statusQueue.reactor = clock = task.Clock()
+        build = yield self.setupBuildResults(SUCCESS)
+        self._http.expect(
+            'post',
+            '/repos/buildbot/buildbot/issues/34/comments',
+            json={'body': 'Build done.'},
+            headers={'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '60'})
+        build['complete'] = True
+        yield self.sp.buildFinished(("build", 20, "finished"), build)
+
+        # comments are never collapsed
+        d1 = self.sp.buildFinished(("build", 20, "finished"), build)
+        d2 = self.sp.buildFinished(("build", 20, "finished"), build)
+        self._http.expect(
+            'post',
+            '/repos/buildbot/buildbot/issues/34/comments',
+            json={'body': 'Build done.'})
+        self._http.expect(
+            'post',
+            '/repos/buildbot/buildbot/issues/34/comments',
+            json={'body': 'Build done.'})
+        clock.advance(60)
+        yield d1
+        yield d2
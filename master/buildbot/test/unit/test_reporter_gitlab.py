@@ -19,6 +19,7 @@ from __future__ import print_function
 from mock import Mock
 
 from twisted.internet import defer
+from twisted.internet import task
 from twisted.trial import unittest
 
 from buildbot import config
@@ -96,3 +97,41 @@ class TestGitLabStatusPush(unittest.TestCase, ReporterTestMixin):
         self.sp.buildFinished(("build", 20, "finished"), build)
         build['results'] = FAILURE
         self.sp.buildFinished(("build", 20, "finished"), build)
+
+    @defer.inlineCallbacks
+    def test_collapse_rate_limited(self):
+        self.sp.statusQueue.reactor = clock = task.Clock()
+        build = yield self.setupBuildResults(SUCCESS)
+        self._http.expect(
+            'get',
+            '/api/v3/projects/buildbot%2Fbuildbot', content_json={
+                "id": 1
+            })
+        self._http.expect(
+            'post',
+            '/api/v3/projects/1/statuses/d34db33fd43db33f',
+            json={'state': 'pending',
+                  'target_url': 'http://localhost:8080/#builders/79/builds/0',
+                  'ref': 'master',
+                  'description': 'Build started.', 'name': 'buildbot/Builder0'},
+            headers={'RateLimit-Remaining': '0', 'RateLimit-Reset': '60'})
+        build['complete'] = False
+        yield self.sp.buildStarted(("build", 20, "started"), build)
+
+        # both updates wait for the rate limit reset, and only the last one
+        # is sent
+        build['complete'] = True
+        d1 = self.sp.buildFinished(("build", 20, "finished"), build)
+        build['results'] = FAILURE
+        d2 = self.sp.buildFinished(("build", 20, "finished"), build)
+        self.assertNoResult(d1)
+        self._http.expect(
+            'post',
+            '/api/v3/projects/1/statuses/d34db33fd43db33f',
+            json={'state': 'failed',
+                  'target_url': 'http://localhost:8080/#builders/79/builds/0',
+                  'ref': 'master',
+                  'description': 'Build done.', 'name': 'buildbot/Builder0'})
+        clock.advance(60)
+        yield d1
+        yield d2
@@ -19,11 +19,13 @@ from __future__ import print_function
 from mock import Mock
 
 from twisted.internet import defer
+from twisted.internet import task
 from twisted.trial import unittest
 
 from buildbot import config
 from buildbot.process.results import SUCCESS
 from buildbot.reporters.http import HttpStatusPush
+from buildbot.reporters.http import StatusQueue
 from buildbot.test.fake import httpclientservice as fakehttpclientservice
 from buildbot.test.fake import fakemaster
 from buildbot.test.util.reporter import ReporterTestMixin
@@ -125,3 +127,104 @@ class TestHttpStatusPush(unittest.TestCase, ReporterTestMixin):
         build = yield self.setupBuildResults(SUCCESS)
         build['complete'] = True
         self.sp.buildFinished(("build", 20, "finished"), build)
+
+
+class TestStatusQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.queue = StatusQueue(self.clock)
+        self.sent = []
+
+    def send(self, state, headers=None):
+        d = defer.Deferred()
+        self.sent.append((state, d))
+        return d
+
+    def answer(self, index, headers=None):
+        res = fakehttpclientservice.ResponseWrapper(201, '', headers)
+        self.sent[index][1].callback(res)
+        return res
+
+    def test_in_order(self):
+        self.queue.add('a', self.send, 'a1')
+        self.queue.add('b', self.send, 'b1')
+        self.assertEqual([s for s, _ in self.sent], ['a1'])
+        self.answer(0)
+        self.assertEqual([s for s, _ in self.sent], ['a1', 'b1'])
+
+    def test_replace_waiting(self):
+        d1 = self.queue.add('a', self.send, 'a1')
+        d2 = self.queue.add('a', self.send, 'a2')
+        d3 = self.queue.add('a', self.send, 'a3')
+        self.queue.add('b', self.send, 'b1')
+        self.answer(0)
+        # a2 was replaced by a3 while a1 was being sent
+        self.assertEqual([s for s, _ in self.sent], ['a1', 'a3'])
+        res = self.answer(1)
+        self.assertEqual([s for s, _ in self.sent], ['a1', 'a3', 'b1'])
+        self.assertIdentical(self.successResultOf(d2), res)
+        self.assertIdentical(self.successResultOf(d3), res)
+        self.assertNotIdentical(self.successResultOf(d1), res)
+
+    def test_no_key(self):
+        self.queue.add(None, self.send, 'c1')
+        self.queue.add(None, self.send, 'c2')
+        self.queue.add(None, self.send, 'c3')
+        self.answer(0)
+        self.answer(1)
+        self.assertEqual([s for s, _ in self.sent], ['c1', 'c2', 'c3'])
+
+    def test_error(self):
+        d = self.queue.add('a', self.send, 'a1')
+        self.queue.add('b', self.send, 'b1')
+        self.sent[0][1].errback(RuntimeError('oops'))
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        self.assertIdentical(self.successResultOf(d), None)
+        self.assertEqual([s for s, _ in self.sent], ['a1', 'b1'])
+
+    def test_rate_limit_exhausted(self):
+        self.clock.advance(100)
+        self.queue.add('a', self.send, 'a1')
+        self.answer(0, {'X-RateLimit-Remaining': '0',
+                        'X-RateLimit-Reset': '130'})
+        # updates added later also wait for the reset
+        self.queue.add('b', self.send, 'b1')
+        self.clock.advance(29)
+        self.assertEqual(len(self.sent), 1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_rate_limit_spread(self):
+        for k in 'abcde':
+            self.queue.add(k, self.send, k)
+        # 4 waiting updates for 2 remaining requests in the next 10s
+        self.answer(0, {'RateLimit-Remaining': '2', 'RateLimit-Reset': '10'})
+        self.assertEqual(len(self.sent), 1)
+        self.clock.advance(5)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_rate_limit_plenty(self):
+        self.queue.add('a', self.send, 'a1')
+        self.queue.add('b', self.send, 'b1')
+        self.answer(0, {'X-RateLimit-Remaining': '4000',
+                        'X-RateLimit-Reset': '3600'})
+        self.assertEqual(len(self.sent), 2)
+
+    def test_retry_after(self):
+        self.queue.add('a', self.send, 'a1')
+        self.queue.add('b', self.send, 'b1')
+        self.answer(0, {'Retry-After': '60'})
+        self.clock.advance(59)
+        self.assertEqual(len(self.sent), 1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_stop(self):
+        self.queue.add('a', self.send, 'a1')
+        d = self.queue.add('b', self.send, 'b1')
+        self.answer(0, {'Retry-After': '60'})
+        self.queue.stop()
+        self.assertIdentical(self.successResultOf(d), None)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(len(self.sent), 1)
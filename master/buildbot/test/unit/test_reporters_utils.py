@@ -18,9 +18,14 @@ from __future__ import print_function
 
 import textwrap
 
+import mock
+
 from twisted.internet import defer
+from twisted.internet import task
 from twisted.trial import unittest
 
+from buildbot.data import resultspec
+from buildbot.process import cache
 from buildbot.process.results import FAILURE
 from buildbot.process.results import RETRY
 from buildbot.process.results import SUCCESS
@@ -178,6 +183,167 @@ class TestDataUtils(unittest.TestCase, logging.LoggingMixin):
         res = yield utils.getPreviousBuild(self.master, build)
         self.assertEqual(res['buildid'], 18)
 
+    @defer.inlineCallbacks
+    def test_getPreviousBuildUnfinished(self):
+        self.setupDb()
+        self.db.builds.builds[20]['results'] = None
+        self.db.builds.builds[20]['complete_at'] = None
+        build = yield self.master.data.get(("builds", 21))
+        res = yield utils.getPreviousBuild(self.master, build)
+        self.assertEqual(res['buildid'], 20)
+        self.assertFalse(res['complete'])
+
+    @defer.inlineCallbacks
+    def test_getPreviousBuildNone(self):
+        self.setupDb()
+        build = yield self.master.data.get(("builds", 18))
+        res = yield utils.getPreviousBuild(self.master, build)
+        self.assertEqual(res, None)
+
+
+class TestDetailsCache(TestDataUtils):
+
+    def setUp(self):
+        TestDataUtils.setUp(self)
+        self.master.reactor = task.Clock()
+        self.master.caches = cache.CacheManager()
+        self.master.caches.config = {'BuildDetails': 50}
+        self.master.data.get = mock.Mock(wraps=self.master.data.get)
+
+    @defer.inlineCallbacks
+    def test_getDetailsForBuildset_shared(self):
+        self.setupDb()
+        res1 = yield utils.getDetailsForBuildset(self.master, 98, wantProperties=True,
+                                                 wantSteps=True, wantPreviousBuild=True)
+        calls = self.master.data.get.call_count
+        res2 = yield utils.getDetailsForBuildset(self.master, 98, wantProperties=True,
+                                                 wantSteps=True, wantPreviousBuild=True)
+        # only the buildset itself (with its sourcestamps) is fetched again, to
+        # key the rest on its state
+        self.assertEqual([c[0][0][0] for c in self.master.data.get.call_args_list[calls:]],
+                         ['buildsets', 'sourcestamps'])
+        self.assertEqual(res1, res2)
+        # the builds themselves are not shared, as they are completed
+        self.assertNotIdentical(res1['builds'][0], res2['builds'][0])
+
+    @defer.inlineCallbacks
+    def test_getDetailsForBuildset_logs_not_shared(self):
+        self.setupDb()
+        res = yield utils.getDetailsForBuildset(self.master, 98,
+                                                wantSteps=True, wantLogs=True)
+        self.assertIn('logs', res['builds'][0]['steps'][0])
+        res = yield utils.getDetailsForBuildset(self.master, 98, wantSteps=True)
+        self.assertNotIn('logs', res['builds'][0]['steps'][0])
+
+    @defer.inlineCallbacks
+    def test_getDetailsForBuild_new_then_finished(self):
+        self.setupDb()
+        build = yield self.master.data.get(('builds', 20))
+        build['complete'], build['results'] = False, None
+        new = dict(build)
+        yield utils.getDetailsForBuild(self.master, new,
+                                       wantProperties=True, wantSteps=True)
+        self.assertNotIn('got_revision', new['properties'])
+        # the build finishes within the same TTL
+        self.db.insertTestData([
+            fakedb.BuildProperty(
+                buildid=20, name="got_revision", value="abcd", source="Step"),
+        ])
+        build['complete'], build['results'] = True, SUCCESS
+        finished = dict(build)
+        yield utils.getDetailsForBuild(self.master, finished,
+                                       wantProperties=True, wantSteps=True)
+        self.assertEqual(finished['properties']['got_revision'], ('abcd', 'Step'))
+
+    @defer.inlineCallbacks
+    def test_getDetailsForBuildset_log_contents_not_cached(self):
+        self.setupDb()
+
+        def contentsCalls():
+            return len([c for c in self.master.data.get.call_args_list
+                        if c[0][0][-1] == 'contents'])
+        yield utils.getDetailsForBuildset(self.master, 98,
+                                          wantSteps=True, wantLogs=True)
+        calls = contentsCalls()
+        self.assertNotEqual(calls, 0)
+        yield utils.getDetailsForBuildset(self.master, 98,
+                                          wantSteps=True, wantLogs=True)
+        self.assertEqual(contentsCalls(), 2 * calls)
+
+    @defer.inlineCallbacks
+    def test_getDetail_expires(self):
+        self.setupDb()
+        yield utils.getDetail(self.master, ('builds', 20))
+        self.master.reactor.advance(utils.DETAILS_CACHE_TTL)
+        build = yield utils.getDetail(self.master, ('builds', 20))
+        self.assertEqual(build['buildid'], 20)
+        self.assertEqual(self.master.data.get.call_count, 2)
+
+    @defer.inlineCallbacks
+    def test_getDetail_expires_by_age(self):
+        # a fetch shortly before a multiple of the TTL is still shared after it
+        self.setupDb()
+        self.master.reactor.advance(utils.DETAILS_CACHE_TTL - 1)
+        yield utils.getDetail(self.master, ('builds', 20))
+        self.master.reactor.advance(2)
+        yield utils.getDetail(self.master, ('builds', 20))
+        self.assertEqual(self.master.data.get.call_count, 1)
+
+    @defer.inlineCallbacks
+    def test_getDetail_copies(self):
+        self.setupDb()
+        build = yield utils.getDetail(self.master, ('builds', 20))
+        build['url'] = 'http://example.com'
+        properties = yield utils.getDetail(self.master,
+                                           ('builds', 20, 'properties'))
+        properties['reporter'] = ('one', 'test')
+        build = yield utils.getDetail(self.master, ('builds', 20))
+        properties = yield utils.getDetail(self.master,
+                                           ('builds', 20, 'properties'))
+        self.assertNotIn('url', build)
+        self.assertNotIn('reporter', properties)
+        self.assertEqual(self.master.data.get.call_count, 2)
+
+    @defer.inlineCallbacks
+    def test_getDetailsForBuild_not_shared(self):
+        self.setupDb()
+        build1 = yield self.master.data.get(('builds', 20))
+        build2 = dict(build1)
+        yield utils.getDetailsForBuild(self.master, build1,
+                                       wantProperties=True, wantSteps=True)
+        build1['buildset']['reason'] = 'changed by a reporter'
+        build1['properties']['reporter'] = ('one', 'test')
+        build1['steps'][0]['name'] = 'renamed'
+        yield utils.getDetailsForBuild(self.master, build2,
+                                       wantProperties=True, wantSteps=True)
+        self.assertNotEqual(build2['buildset']['reason'],
+                            'changed by a reporter')
+        self.assertNotIn('reporter', build2['properties'])
+        self.assertNotEqual(build2['steps'][0]['name'], 'renamed')
+
+    @defer.inlineCallbacks
+    def test_getDetail_filters(self):
+        self.setupDb()
+        breqs1 = yield utils.getDetail(
+            self.master, ('buildrequests',),
+            filters=[resultspec.Filter('buildsetid', 'eq', [98])])
+        breqs2 = yield utils.getDetail(
+            self.master, ('buildrequests',),
+            filters=[resultspec.Filter('buildsetid', 'eq', [97])])
+        self.assertEqual(sorted(br['buildrequestid'] for br in breqs1), [11, 12])
+        self.assertEqual(sorted(br['buildrequestid'] for br in breqs2), [9, 10])
+
+    def test_getDetail_concurrent(self):
+        d = defer.Deferred()
+        self.master.data.get = mock.Mock(return_value=d)
+        results = []
+        utils.getDetail(self.master, ('builds', 20)).addCallback(results.append)
+        utils.getDetail(self.master, ('builds', 20)).addCallback(results.append)
+        self.assertEqual(results, [])
+        d.callback({'buildid': 20})
+        self.assertEqual(results, [{'buildid': 20}, {'buildid': 20}])
+        self.assertEqual(self.master.data.get.call_count, 1)
+
 
 class TestURLUtils(unittest.TestCase):
 
@@ -40,13 +40,33 @@ try:
 except ImportError:
     hasLz4 = False
 
+try:
+    import zstandard
+    [zstandard]
+    hasZstd = True
+except ImportError:
+    hasZstd = False
+
 
 def mkconfig(**kwargs):
-    config = dict(quiet=False, basedir=os.path.abspath('basedir'), force=True)
+    config = dict(quiet=False, basedir=os.path.abspath('basedir'), force=True,
+                  restart=False, jobs=4, convert=None)
+    config['time-limit'] = None
     config.update(kwargs)
     return config
 
 
+class FakeClock(object):
+    # a clock which moves one second forward each time it is read
+
+    def __init__(self):
+        self.now = 0
+
+    def seconds(self):
+        self.now += 1
+        return self.now
+
+
 def patch_environ(case, key, value):
     """
     Add an environment variable for the duration of a test.
@@ -124,12 +144,11 @@ class TestCleanupDb(misc.StdoutAssertionsMixin, dirs.DirsMixin,
         self.flushLoggedErrors()
 
     @defer.inlineCallbacks
-    def test_cleanup(self):
-
+    def setUpCleanupDb(self):
         # we reuse RealDatabaseMixin to setup the db
         yield self.setUpRealDatabase(table_names=['logs', 'logchunks', 'steps', 'builds', 'builders',
                                                   'masters', 'buildrequests', 'buildsets',
-                                                  'workers'])
+                                                  'workers', 'objects', 'object_state'])
         master = fakemaster.make_master()
         master.config.db['db_url'] = self.db_url
         self.db = DBConnector(self.basedir)
@@ -139,10 +158,125 @@ class TestCleanupDb(misc.StdoutAssertionsMixin, dirs.DirsMixin,
         # we reuse the fake db background data from db.logs unit tests
         yield self.insertTestData(test_db_logs.Tests.backgroundData)
 
+    @defer.inlineCallbacks
+    def addLogs(self, count):
+        # logs with many small chunks, all compressed with gz
+        self.db.master.config.logCompressionMethod = 'gz'
+        logids = []
+        for i in range(count):
+            logid = yield self.db.logs.addLog(102, "log%d" % i, "log%d" % i, "s")
+            for j in range(5):
+                yield self.db.logs.appendLog(logid, "xx\n" * 200)
+                yield self.db.logs.flushLogs()
+            logids.append(logid)
+        defer.returnValue(logids)
+
+    def getCompressed(self):
+        # number of chunks of each log, and their compression methods
+        def thd(conn):
+            tbl = self.db.model.logchunks
+            q = sa.select([tbl.c.logid, tbl.c.compressed])
+            q = q.order_by(tbl.c.logid, tbl.c.first_line)
+            compressed = {}
+            for row in conn.execute(q):
+                compressed.setdefault(row.logid, []).append(row.compressed)
+            return compressed
+        return self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def getCheckpoint(self):
+        objectid = yield self.db.state.getObjectId(
+            'cleanupdb', 'buildbot.scripts.cleanupdb')
+        checkpoint = yield self.db.state.getState(
+            objectid, 'compress_logs_lastid', None)
+        defer.returnValue(checkpoint)
+
+    @defer.inlineCallbacks
+    def test_cleanup_resume(self):
+        yield self.setUpCleanupDb()
+        self.patch(cleanupdb, 'BATCH_SIZE', 2)
+        logids = yield self.addLogs(5)
+        self.createMasterCfg("c['logCompressionMethod'] = 'gz'")
+
+        # the clock moves on by one second each time it is read; the first
+        # batch is done in time, then the time limit is reached
+        res = yield cleanupdb._cleanupDatabase(
+            mkconfig(force=False, jobs=1,
+                     **{'time-limit': 4}),
+            _reactor=FakeClock())
+        self.assertEqual(res, 0)
+        self.assertInStdout("2/5 logs (40%)")
+        self.assertInStdout("time limit reached; run cleanupdb again to "
+                            "resume after log %d" % logids[1])
+        self.assertNotIn("vacuum", self.getStdout())
+        compressed = yield self.getCompressed()
+        self.assertEqual([len(compressed[logid]) for logid in logids],
+                         [1, 1, 5, 5, 5])
+        checkpoint = yield self.getCheckpoint()
+        self.assertEqual(checkpoint, logids[1])
+
+        # the next run resumes where the first one stopped
+        self.setUpStdoutAssertions()
+        self.createMasterCfg("c['logCompressionMethod'] = 'gz'")
+        res = yield cleanupdb._cleanupDatabase(
+            mkconfig(force=False))
+        self.assertEqual(res, 0)
+        self.assertInStdout("resuming after log %d" % logids[1])
+        self.assertInStdout("3/3 logs (100%)")
+        self.assertInStdout("recompressed 3 logs")
+        compressed = yield self.getCompressed()
+        self.assertEqual([len(compressed[logid]) for logid in logids],
+                         [1, 1, 1, 1, 1])
+        checkpoint = yield self.getCheckpoint()
+        self.assertEqual(checkpoint, None)
+
+    @defer.inlineCallbacks
+    def test_cleanup_restart(self):
+        yield self.setUpCleanupDb()
+        logids = yield self.addLogs(2)
+        self.createMasterCfg("c['logCompressionMethod'] = 'gz'")
+        objectid = yield self.db.state.getObjectId(
+            'cleanupdb', 'buildbot.scripts.cleanupdb')
+        yield self.db.state.setState(objectid, 'compress_logs_lastid',
+                                     logids[0])
+        res = yield cleanupdb._cleanupDatabase(
+            mkconfig(force=False, restart=True))
+        self.assertEqual(res, 0)
+        self.assertNotIn("resuming", self.getStdout())
+        self.assertInStdout("2/2 logs (100%)")
+
+    @defer.inlineCallbacks
+    def test_cleanup_convert(self):
+        yield self.setUpCleanupDb()
+        logids = yield self.addLogs(3)
+        self.createMasterCfg("c['logCompressionMethod'] = 'bz2'")
+        # gather the chunks of the first log, still with gz
+        yield self.db.logs.compressLog(logids[0])
+
+        res = yield cleanupdb._cleanupDatabase(
+            mkconfig(force=False, convert=['lz4']))
+        self.assertEqual(res, 0)
+        compressed = yield self.getCompressed()
+        self.assertEqual([compressed[logid] for logid in logids],
+                         [[1], [2], [2]])
+
+        self.createMasterCfg("c['logCompressionMethod'] = 'bz2'")
+        res = yield cleanupdb._cleanupDatabase(
+            mkconfig(force=False, convert=['gz']))
+        self.assertEqual(res, 0)
+        compressed = yield self.getCompressed()
+        self.assertEqual([compressed[logid] for logid in logids],
+                         [[2], [2], [2]])
+
+    @defer.inlineCallbacks
+    def test_cleanup(self):
+        yield self.setUpCleanupDb()
+
         # insert a log with lots of redundancy
         LOGDATA = "xx\n" * 2000
         logid = yield self.db.logs.addLog(102, "x", "x", "s")
         yield self.db.logs.appendLog(logid, LOGDATA)
+        yield self.db.logs.flushLogs()
 
         # test all methods
         lengths = {}
@@ -151,6 +285,9 @@ class TestCleanupDb(misc.StdoutAssertionsMixin, dirs.DirsMixin,
                 # ok.. lz4 is not installed, don't fail
                 lengths["lz4"] = 40
                 continue
+            if mode == "zstd" and not hasZstd:
+                lengths["zstd"] = 20
+                continue
             # create a master.cfg with different compression method
             self.createMasterCfg("c['logCompressionMethod'] = '%s'" % (mode,))
             res = yield cleanupdb._cleanupDatabase(mkconfig(basedir='basedir'))
@@ -170,7 +307,7 @@ class TestCleanupDb(misc.StdoutAssertionsMixin, dirs.DirsMixin,
             lengths[mode] = yield self.db.pool.do(thd)
 
         self.assertDictAlmostEqual(
-            lengths, {'raw': 5999, 'bz2': 44, 'lz4': 40, 'gz': 31})
+            lengths, {'raw': 5999, 'bz2': 44, 'lz4': 40, 'gz': 31, 'zstd': 20})
 
     def assertDictAlmostEqual(self, d1, d2):
         # The test shows each methods return different size
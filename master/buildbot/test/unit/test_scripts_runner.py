@@ -612,6 +612,46 @@ class TestCheckConfigOptions(OptionsMixin, unittest.TestCase):
         self.assertOptions(opts, exp)
 
 
+class TestCleanupDBOptions(OptionsMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpOptions()
+
+    def parse(self, *args):
+        self.opts = runner.CleanupDBOptions()
+        self.opts.parseOptions(args)
+        return self.opts
+
+    def test_synopsis(self):
+        opts = runner.CleanupDBOptions()
+        self.assertIn('buildbot cleanupdb', opts.getSynopsis())
+
+    def test_defaults(self):
+        opts = self.parse()
+        exp = {'quiet': False, 'force': False, 'restart': False, 'jobs': 4,
+               'convert': None, 'time-limit': None}
+        self.assertOptions(opts, exp)
+
+    def test_options(self):
+        opts = self.parse('-q', '-f', '--restart', '-j', '8',
+                          '--convert', 'gz,bz2', '--time-limit', '3600')
+        exp = {'quiet': True, 'force': True, 'restart': True, 'jobs': 8,
+               'convert': ['gz', 'bz2'], 'time-limit': 3600}
+        self.assertOptions(opts, exp)
+
+    def test_jobs_invalid(self):
+        self.assertRaises(usage.UsageError,
+                          lambda: self.parse('--jobs', '0'))
+
+    def test_time_limit_invalid(self):
+        self.assertRaises(usage.UsageError,
+                          lambda: self.parse('--time-limit', '0'))
+
+    def test_convert_unknown_method(self):
+        self.assertRaises(usage.UsageError,
+                          lambda: self.parse('--convert', 'gz,zip'))
+
+
 class TestUserOptions(OptionsMixin, unittest.TestCase):
 
     # mandatory arguments
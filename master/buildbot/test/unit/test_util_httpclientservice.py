@@ -25,10 +25,14 @@ import os
 import mock
 
 from twisted.internet import defer
+from twisted.internet import error
 from twisted.internet import reactor
+from twisted.internet import task
 from twisted.python.compat import intToBytes
 from twisted.trial import unittest
 from twisted.web import resource
+from twisted.web.client import ResponseFailed
+from twisted.web.http_headers import Headers
 from twisted.web import server
 
 from buildbot.test.fake import httpclientservice as fakehttpclientservice
@@ -197,6 +201,205 @@ class HTTPClientServiceTestTReq(HTTPClientServiceTestBase):
                                                             })
 
 
+class GetResponseHeader(unittest.SynchronousTestCase):
+
+    def test_dict(self):
+        res = fakehttpclientservice.ResponseWrapper(
+            200, '', {'Retry-After': '10'})
+        self.assertEqual(
+            httpclientservice.getResponseHeader(res, 'retry-after'), '10')
+        self.assertEqual(
+            httpclientservice.getResponseHeader(res, 'X-Other'), None)
+
+    def test_twisted_headers(self):
+        res = mock.Mock(headers=Headers({b'Retry-After': [b'1', b'10']}))
+        self.assertEqual(
+            httpclientservice.getResponseHeader(res, 'Retry-After'), '10')
+        self.assertEqual(
+            httpclientservice.getResponseHeader(res, 'X-Other'), None)
+
+    def test_no_headers(self):
+        res = mock.Mock(spec=['code'])
+        self.assertEqual(
+            httpclientservice.getResponseHeader(res, 'Retry-After'), None)
+
+
+class FakeResponse(object):
+
+    def __init__(self, code):
+        self.code = code
+
+    def content(self):
+        return defer.succeed(b'')
+
+
+class HTTPClientServiceTestLimits(unittest.SynchronousTestCase):
+
+    def setUp(self):
+        if httpclientservice.txrequests is None or httpclientservice.treq is None:
+            raise unittest.SkipTest('this test requires txrequests and treq')
+        self.patch(httpclientservice, 'txrequests', mock.Mock())
+        self.patch(httpclientservice, 'treq', mock.Mock())
+        self.patch(httpclientservice.HTTPClientService,
+                   'MAX_CONCURRENT_PER_HOST', 2)
+        self.patch(httpclientservice.HTTPClientService,
+                   'MAX_QUEUED_PER_HOST', 3)
+        self.parent = service.MasterService()
+        self.parent.reactor = self.clock = task.Clock()
+        self.successResultOf(self.parent.startService())
+        self.requests = []
+        self._http = self.getService()
+
+    def getService(self, **kwargs):
+        http = self.successResultOf(
+            httpclientservice.HTTPClientService.getService(
+                self.parent, 'http://foo', **kwargs))
+        http._doRequest = self.doRequest
+        return http
+
+    def doRequest(self, method, ep, **kwargs):
+        d = defer.Deferred()
+        self.requests.append((method, ep, d))
+        return d
+
+    def answer(self, index, code=200):
+        res = FakeResponse(code)
+        self.requests[index][2].callback(res)
+        return res
+
+    def test_concurrency(self):
+        ds = [self._http.get('/%d' % i) for i in range(4)]
+        self.assertEqual([ep for _, ep, _ in self.requests], ['/0', '/1'])
+        self.answer(0)
+        self.assertEqual([ep for _, ep, _ in self.requests],
+                         ['/0', '/1', '/2'])
+        self.answer(1)
+        self.answer(2)
+        self.answer(3)
+        self.assertEqual(len(self.requests), 4)
+        for d in ds:
+            self.assertEqual(self.successResultOf(d).code, 200)
+
+    def test_concurrency_shared_by_host(self):
+        other = self.getService(auth=('user', 'pa$$'))
+        self.assertNotIdentical(other, self._http)
+        self._http.get('/a')
+        self._http.get('/b')
+        other.get('/c')
+        self.assertEqual(len(self.requests), 2)
+        self.answer(0)
+        self.assertEqual(self.requests[2][1], '/c')
+
+    def test_concurrency_other_host(self):
+        other = self.successResultOf(
+            httpclientservice.HTTPClientService.getService(
+                self.parent, 'http://bar'))
+        other._doRequest = self.doRequest
+        self._http.get('/a')
+        self._http.get('/b')
+        other.get('/c')
+        self.assertEqual(len(self.requests), 3)
+
+    def test_queue_full(self):
+        for i in range(5):
+            self._http.get('/%d' % i)
+        self.failureResultOf(self._http.get('/5'),
+                             httpclientservice.HTTPQueueFull)
+        self.answer(0)
+        self.assertNoResult(self._http.get('/6'))
+
+    def test_retry_code(self):
+        d = self._http.get('/')
+        self.answer(0, 503)
+        self.assertEqual(len(self.requests), 1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.requests), 2)
+        self.answer(1, 429)
+        self.clock.advance(1)
+        self.assertEqual(len(self.requests), 2)
+        self.clock.advance(1)
+        self.assertEqual(len(self.requests), 3)
+        self.answer(2, 201)
+        self.assertEqual(self.successResultOf(d).code, 201)
+
+    def test_retry_code_releases_slot(self):
+        self._http.get('/a')
+        self._http.get('/b')
+        self._http.get('/c')
+        self.answer(0, 503)
+        # the retry waits for its delay without holding a slot
+        self.assertEqual(self.requests[2][1], '/c')
+
+    def test_retry_give_up(self):
+        d = self._http.put('/')
+        for i in range(4):
+            self.answer(i, 502)
+            self.clock.advance(2 ** i)
+        self.assertEqual(len(self.requests), 4)
+        self.assertEqual(self.successResultOf(d).code, 502)
+
+    def test_retry_code_post(self):
+        d = self._http.post('/')
+        self.answer(0, 503)
+        self.clock.advance(1)
+        self.answer(1, 429)
+        self.clock.advance(2)
+        self.answer(2, 201)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(self.successResultOf(d).code, 201)
+
+    def test_no_retry_gateway_error_post(self):
+        for code in (502, 504):
+            d = self._http.post('/')
+            self.answer(-1, code)
+            self.assertEqual(self.successResultOf(d).code, code)
+            self.clock.advance(10)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_no_retry_client_error(self):
+        d = self._http.get('/')
+        self.answer(0, 404)
+        self.assertEqual(self.successResultOf(d).code, 404)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_retry_connect_error(self):
+        d = self._http.post('/')
+        self.requests[0][2].errback(error.ConnectionRefusedError())
+        self.clock.advance(1)
+        self.answer(1)
+        self.assertEqual(self.successResultOf(d).code, 200)
+
+    def test_retry_connect_error_give_up(self):
+        d = self._http.get('/')
+        for i in range(4):
+            self.requests[i][2].errback(error.ConnectionRefusedError())
+            self.clock.advance(2 ** i)
+        self.failureResultOf(d, error.ConnectionRefusedError)
+
+    def test_retry_response_failed_idempotent(self):
+        d = self._http.put('/')
+        self.requests[0][2].errback(ResponseFailed([]))
+        self.clock.advance(1)
+        self.answer(1)
+        self.assertEqual(self.successResultOf(d).code, 200)
+
+    def test_no_retry_response_failed_post(self):
+        d = self._http.post('/')
+        self.requests[0][2].errback(ResponseFailed([]))
+        self.failureResultOf(d, ResponseFailed)
+        self.clock.advance(10)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_no_retry_other_error(self):
+        d = self._http.get('/')
+        self.requests[0][2].errback(ValueError('oops'))
+        self.failureResultOf(d, ValueError)
+        # the slot was released
+        self._http.get('/a')
+        self._http.get('/b')
+        self.assertEqual(len(self.requests), 3)
+
+
 class MyResource(resource.Resource):
     isLeaf = True
 
@@ -373,3 +576,60 @@ class HTTPClientServiceTestFakeE2E(HTTPClientServiceTestTxRequestE2E):
 
     def expect(self, *arg, **kwargs):
         self._http.expect(*arg, **kwargs)
+
+
+class FlakyResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, failures):
+        resource.Resource.__init__(self)
+        self.failures = failures
+        self.requests = 0
+
+    def render_GET(self, request):
+        self.requests += 1
+        if self.requests <= self.failures:
+            request.setResponseCode(503)
+            return b'busy'
+        request.setHeader(b'x-ratelimit-remaining', b'42')
+        return b'ok'
+
+
+class HTTPClientServiceTestTxRequestRetryE2E(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        if httpclientservice.txrequests is None or httpclientservice.treq is None:
+            raise unittest.SkipTest('this test requires txrequests and treq')
+        self.patch(httpclientservice.HTTPClientService, 'RETRY_DELAY', 0.01)
+        self.resource = FlakyResource(failures=2)
+        self.listenport = reactor.listenTCP(0, server.Site(self.resource))
+        self.parent = service.MasterService()
+        self.parent.reactor = reactor
+        yield self.parent.startService()
+        self._http = yield httpclientservice.HTTPClientService.getService(
+            self.parent,
+            'http://127.0.0.1:{}'.format(self.listenport.getHost().port))
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        self.listenport.stopListening()
+        yield self.parent.stopService()
+
+    @defer.inlineCallbacks
+    def test_retry(self):
+        res = yield self._http.get('/')
+        content = yield res.content()
+        self.assertEqual((res.code, content), (200, b'ok'))
+        self.assertEqual(self.resource.requests, 3)
+        self.assertEqual(httpclientservice.getResponseHeader(
+            res, 'X-RateLimit-Remaining'), '42')
+        self.assertEqual(httpclientservice.getResponseHeader(
+            res, 'X-Missing'), None)
+
+
+class HTTPClientServiceTestTReqRetryE2E(HTTPClientServiceTestTxRequestRetryE2E):
+
+    def setUp(self):
+        self.patch(httpclientservice.HTTPClientService, 'PREFER_TREQ', True)
+        return HTTPClientServiceTestTxRequestRetryE2E.setUp(self)
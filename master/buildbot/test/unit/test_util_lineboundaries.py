@@ -117,6 +117,26 @@ class LBF(unittest.TestCase):
             self.assertEqual(res, 'a\nb\nc\nd\n\ne\n')
             self.callbacks = []
 
+    @defer.inlineCallbacks
+    def test_long_line_in_chunks(self):
+        for i in range(1000):
+            yield self.lbf.append('x')
+        self.assertCallbacks([])
+        self.assertEqual(len(self.lbf.partialLine), 1000)
+        yield self.lbf.append('y\nz')
+        self.assertCallbacks(['x' * 1000 + 'y\n'])
+        self.assertEqual(self.lbf.partialLine, ['z'])
+
+    @defer.inlineCallbacks
+    def test_bare_cr_before_chunk(self):
+        yield self.lbf.append('a')
+        yield self.lbf.append('b\r')
+        self.assertCallbacks([])
+        yield self.lbf.append('c')
+        self.assertCallbacks(['ab\n'])
+        yield self.lbf.flush()
+        self.assertCallbacks(['c\n'])
+
     def test_empty_flush(self):
         d = self.lbf.flush()
 
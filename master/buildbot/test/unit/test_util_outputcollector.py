@@ -0,0 +1,73 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+from twisted.trial import unittest
+
+from buildbot.util.outputcollector import OutputCollector
+
+
+class OutputCollectorTests(unittest.TestCase):
+
+    def test_empty(self):
+        oc = OutputCollector()
+        self.assertEqual(oc.getvalue(), '')
+        self.assertEqual(len(oc), 0)
+        self.assertEqual(OutputCollector(empty=u'').getvalue(), u'')
+
+    def test_append(self):
+        oc = OutputCollector()
+        for chunk in ['ab', '', 'c', 'de\n']:
+            oc.append(chunk)
+        self.assertEqual(len(oc), 6)
+        self.assertEqual(oc.getvalue(), 'abcde\n')
+        # the joined value is kept
+        self.assertEqual(oc.chunks, ['abcde\n'])
+        oc.append('f')
+        self.assertEqual(oc.getvalue(), 'abcde\nf')
+
+    def test_clear(self):
+        oc = OutputCollector()
+        oc.append('abc')
+        oc.clear()
+        self.assertEqual(oc.getvalue(), '')
+        self.assertEqual(len(oc), 0)
+
+    def test_spill(self):
+        oc = OutputCollector(maxMemory=4)
+        oc.append(u'ab')
+        oc.append(u'c')
+        self.assertFalse(oc.spilled)
+        oc.append(u'd\xe9')
+        self.assertTrue(oc.spilled)
+        self.assertEqual(oc.chunks, [])
+        oc.append(u'f')
+        self.assertEqual(len(oc), 6)
+        self.assertEqual(oc.getvalue(), u'abcd\xe9f')
+        # reading does not lose the position for the next chunks
+        oc.append(u'g')
+        self.assertEqual(oc.getvalue(), u'abcd\xe9fg')
+        oc.clear()
+        self.assertFalse(oc.spilled)
+        self.assertEqual(oc.getvalue(), '')
+
+    def test_spill_bytes(self):
+        oc = OutputCollector(empty=b'', maxMemory=2)
+        oc.append(b'\x00\xff')
+        oc.append(b'\x01')
+        self.assertTrue(oc.spilled)
+        self.assertEqual(oc.getvalue(), b'\x00\xff\x01')
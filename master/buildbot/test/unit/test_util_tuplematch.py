@@ -32,3 +32,74 @@ class MatchTuple(tuplematching.TupleMatchingMixin, unittest.TestCase):
                          % (routingKey,
                             'should match' if shouldMatch else "shouldn't match",
                             filter))
+
+
+class TupleIndexMatch(tuplematching.TupleMatchingMixin, unittest.TestCase):
+
+    def do_test_match(self, routingKey, shouldMatch, filter):
+        index = tuplematch.TupleIndex()
+        index.add(filter, 'v')
+        self.assertEqual(index.match(routingKey), ['v'] if shouldMatch else [],
+                         '%r %s %r'
+                         % (routingKey,
+                            'should match' if shouldMatch else "shouldn't match",
+                            filter))
+
+
+class TupleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = tuplematch.TupleIndex()
+        for value, filter in [
+                (1, ('builds', None, 'new')),
+                (2, ('builds', '10', None)),
+                (3, ('builds', '10', 'new')),
+                (4, ('builds', None, None)),
+                (5, ('changes', None, 'new')),
+                (6, ('builds', '10')),
+                (7, ('builds', '10', 'new'))]:
+            self.index.add(filter, value)
+
+    def test_match_order(self):
+        self.assertEqual(self.index.match(('builds', '10', 'new')),
+                         [1, 2, 3, 4, 7])
+        self.assertEqual(self.index.match(('builds', '11', 'new')), [1, 4])
+        self.assertEqual(self.index.match(('builds', '10', 'finished')),
+                         [2, 4])
+        self.assertEqual(self.index.match(('builds', '10')), [6])
+        self.assertEqual(self.index.match(('buildsets', '10', 'new')), [])
+        self.assertEqual(self.index.match(('builds',)), [])
+
+    def test_add_twice(self):
+        self.index.add(('builds', '10', 'new'), 3)
+        self.assertEqual(len(self.index), 7)
+        self.assertEqual(self.index.match(('builds', '10', 'new')),
+                         [1, 2, 3, 4, 7])
+
+    def test_remove(self):
+        self.index.remove(('builds', '10', 'new'), 3)
+        self.index.remove(('builds', '10'), 6)
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.match(('builds', '10', 'new')),
+                         [1, 2, 4, 7])
+        self.assertEqual(self.index.match(('builds', '10')), [])
+        self.assertEqual(list(self.index), [1, 2, 4, 5, 7])
+
+    def test_remove_prunes(self):
+        index = tuplematch.TupleIndex()
+        index.add(('a', 'b'), 1)
+        index.add((), 2)
+        index.remove(('a', 'b'), 1)
+        index.remove((), 2)
+        self.assertEqual(index._roots, {})
+
+    def test_remove_missing(self):
+        self.assertRaises(KeyError, self.index.remove,
+                          ('builds', '10', 'new'), 5)
+        self.assertRaises(KeyError, self.index.remove,
+                          ('builds', '11', 'new'), 1)
+        self.assertRaises(KeyError, self.index.remove, ('builds',), 1)
+        self.assertEqual(len(self.index), 7)
+
+    def test_iter(self):
+        self.assertEqual(list(self.index), [1, 2, 3, 4, 5, 6, 7])
@@ -0,0 +1,83 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from buildbot.www.batching import MessageBatcher
+
+
+class MessageBatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sent = []
+        self.batcher = MessageBatcher(self.send, 0.1, 3, self.clock)
+
+    def send(self, messages, dropped):
+        self.sent.append((messages, dropped))
+
+    def test_batch(self):
+        self.batcher.add(('builds', '1', 'new'), 1)
+        self.batcher.add(['steps', '2', 'new'], 2)
+        self.assertEqual(self.sent, [])
+        self.clock.advance(0.1)
+        self.assertEqual(self.sent, [
+            ([(('builds', '1', 'new'), 1), (('steps', '2', 'new'), 2)], 0)])
+        # nothing is sent when there are no messages
+        self.clock.advance(1)
+        self.assertEqual(len(self.sent), 1)
+
+    def test_superseded(self):
+        self.batcher.add(('builds', '1', 'update'), 1)
+        self.batcher.add(('steps', '2', 'update'), 2)
+        self.batcher.add(('builds', '1', 'update'), 3)
+        self.batcher.add(('builds', '1', 'finished'), 4)
+        self.clock.advance(0.1)
+        self.assertEqual(self.sent, [
+            ([(('steps', '2', 'update'), 2), (('builds', '1', 'update'), 3),
+              (('builds', '1', 'finished'), 4)], 0)])
+
+    def test_dropped(self):
+        for i in range(5):
+            self.batcher.add(('logs', str(i), 'append'), i)
+        self.clock.advance(0.1)
+        self.assertEqual(self.sent, [
+            ([(('logs', '2', 'append'), 2), (('logs', '3', 'append'), 3),
+              (('logs', '4', 'append'), 4)], 2)])
+
+    def test_paused(self):
+        self.batcher.add(('builds', '1', 'new'), 1)
+        self.batcher.pauseProducing()
+        self.clock.advance(0.1)
+        for i in range(4):
+            self.batcher.add(('logs', str(i), 'append'), i)
+        self.clock.advance(1)
+        self.assertEqual(self.sent, [])
+        self.batcher.resumeProducing()
+        self.assertEqual(self.sent, [
+            ([(('logs', '1', 'append'), 1), (('logs', '2', 'append'), 2),
+              (('logs', '3', 'append'), 3)], 2)])
+
+    def test_stop(self):
+        self.batcher.add(('builds', '1', 'new'), 1)
+        self.batcher.stopProducing()
+        self.batcher.add(('builds', '2', 'new'), 2)
+        self.clock.advance(1)
+        self.assertEqual(self.sent, [])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
@@ -319,6 +319,27 @@ class V2RootResource_REST(www.WwwTestMixin, unittest.TestCase):
             responseCode=200,
             headers={b"content-disposition": [b'attachment; filename=test.txt']})
 
+    @defer.inlineCallbacks
+    def test_raw_stream(self):
+        batches = [u'val', u'\N{SNOWMAN}ue']
+
+        def stream(ep, resultSpec, kwargs):
+            def read():
+                return defer.succeed(batches.pop(0) if batches else None)
+            return defer.succeed({
+                "filename": "test.txt",
+                "mime-type": "text/test",
+                'read': read
+            })
+        self.patch(endpoint.RawTestsEndpoint, 'stream', stream)
+        yield self.render_resource(self.rsrc, b'/rawtest')
+        self.assertRequest(
+            content=u'val\N{SNOWMAN}ue'.encode('utf-8'),
+            contentType=b'text/test; charset=utf-8',
+            responseCode=200,
+            headers={b"content-disposition": [b'attachment; filename=test.txt']})
+        self.assertEqual(self.request.producer, None)
+
     @defer.inlineCallbacks
     def test_api_head(self):
         get = yield self.render_resource(self.rsrc, b'/test', method=b'GET')
@@ -885,3 +906,50 @@ class ContentTypeParser(unittest.TestCase):
     def test_text(self):
         self.assertEqual(
             rest.ContentTypeParser(b"text/plain; Charset=UTF-8").gettype(), "text/plain")
+
+
+class RawProducer(unittest.TestCase):
+
+    def setUp(self):
+        self.request = www.FakeRequest(b'/')
+        self.reads = []
+
+    def read(self):
+        d = defer.Deferred()
+        self.reads.append(d)
+        return d
+
+    def test_produce(self):
+        producer = rest.RawProducer(self.request, self.read)
+        d = producer.produce()
+        self.assertIdentical(self.request.producer, producer)
+        self.reads[0].callback(u'abc')
+        self.reads[1].callback(u'def')
+        self.reads[2].callback(None)
+        self.assertEqual(self.request.written, b'abcdef')
+        self.assertEqual(self.request.producer, None)
+        return d
+
+    def test_pause(self):
+        producer = rest.RawProducer(self.request, self.read)
+        d = producer.produce()
+        producer.pauseProducing()
+        self.reads[0].callback(u'abc')
+        # nothing is read while the consumer is paused
+        self.assertEqual(len(self.reads), 1)
+        producer.resumeProducing()
+        self.assertEqual(len(self.reads), 2)
+        self.reads[1].callback(None)
+        self.assertEqual(self.request.written, b'abc')
+        return d
+
+    def test_stop(self):
+        producer = rest.RawProducer(self.request, self.read)
+        d = producer.produce()
+        producer.stopProducing()
+        # the pending batch is dropped
+        self.reads[0].callback(u'abc')
+        self.assertEqual(len(self.reads), 1)
+        self.assertEqual(self.request.written, b'')
+        self.assertEqual(self.request.producer, None)
+        return d
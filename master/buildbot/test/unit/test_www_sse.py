@@ -19,6 +19,7 @@ from __future__ import print_function
 import datetime
 import json
 
+from twisted.internet import task
 from twisted.trial import unittest
 
 from buildbot.test.unit import test_data_changes
@@ -92,6 +93,45 @@ class EventResource(www.WwwTestMixin, unittest.TestCase):
         self.assertEqual(self.request.responseCode, 400)
         self.assertIn(b"unknown uuid", self.request.written)
 
+    def test_listen_batch(self):
+        self.master.reactor = task.Clock()
+        self.master.mq.verifyMessages = False
+        self.render_resource(self.sse, b'/listen/changes/*/*?batch=100')
+        request = self.request
+        self.readUUID(request)
+        self.assertIsInstance(request.producer, sse.MessageBatcher)
+        self.master.mq.callConsumer(("changes", "500", "new"), {'a': 1})
+        self.master.mq.callConsumer(("changes", "501", "new"), {'a': 2})
+        self.master.mq.callConsumer(("changes", "500", "new"), {'a': 3})
+        self.assertEqual(request.written, b'')
+        self.master.reactor.advance(0.1)
+        kw = self.readEvent(request)
+        self.assertEqual(kw[b"event"], b"batch")
+        self.assertEqual(json.loads(bytes2NativeString(kw[b"data"])), [
+            {'key': ['changes', '501', 'new'], 'message': {'a': 2}},
+            {'key': ['changes', '500', 'new'], 'message': {'a': 3}}])
+
+        request.producer.pauseProducing()
+        for i in range(1002):
+            self.master.mq.callConsumer(("changes", str(i), "new"), {'a': i})
+        request.producer.resumeProducing()
+        lines = request.written.split(b"\n\n")
+        self.assertEqual(lines[0], b"event: dropped\ndata: 2")
+        request.written = lines[1] + b"\n\n"
+        kw = self.readEvent(request)
+        self.assertEqual(kw[b"event"], b"batch")
+        self.assertEqual(len(json.loads(bytes2NativeString(kw[b"data"]))),
+                         1000)
+
+        request.finish()
+        self.assertTrue(request.producer.stopped)
+
+    def test_listen_bad_batch(self):
+        self.render_resource(self.sse, b'/listen/changes/*/*?batch=soon')
+        self.assertEqual(self.request.finished, True)
+        self.assertEqual(self.request.responseCode, 400)
+        self.assertIn(b"invalid batch window", self.request.written)
+
     def readEvent(self, request):
         kw = {}
         hasEmptyLine = False
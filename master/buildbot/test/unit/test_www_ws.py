@@ -17,10 +17,14 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import json
+import struct
 
 from mock import Mock
 
+from twisted.internet import task
+from twisted.test import proto_helpers
 from twisted.trial import unittest
+from twisted.web import server
 
 from buildbot.test.util import www
 from buildbot.util import bytes2NativeString
@@ -93,3 +97,149 @@ class WsResource(www.WwwTestMixin, unittest.TestCase):
             json.dumps(dict(cmd="stopConsuming", path="builds/*/*", _id=2)), False)
         self.assert_called_with_json(self.proto.sendMessage,
             {"msg": "OK", "code": 200, "_id": 2})
+
+    def startBatching(self, **kw):
+        self.master.reactor = task.Clock()
+        self.proto.transport = Mock()
+        self.proto.onMessage(
+            json.dumps(dict(cmd="startConsuming", path="builds/*/*", _id=1)), False)
+        self.proto.onMessage(
+            json.dumps(dict(cmd="setBatching", _id=2, **kw)), False)
+        self.assert_called_with_json(self.proto.sendMessage,
+            {"msg": "OK", "code": 200, "_id": 2})
+        self.master.mq.verifyMessages = False
+
+    def test_setBatching(self):
+        self.startBatching(window=100)
+        self.proto.transport.registerProducer.assert_called_with(
+            self.proto.batcher, True)
+        self.proto.sendMessage.reset_mock()
+        self.master.mq.callConsumer(("builds", "1", "update"), {"buildid": 1})
+        self.master.mq.callConsumer(("builds", "2", "new"), {"buildid": 2})
+        self.master.mq.callConsumer(("builds", "1", "update"), {"buildid": 3})
+        self.assertFalse(self.proto.sendMessage.called)
+        self.master.reactor.advance(0.1)
+        self.assert_called_with_json(self.proto.sendMessage,
+            {"b": [{"k": "builds/2/new", "m": {"buildid": 2}},
+                   {"k": "builds/1/update", "m": {"buildid": 3}}]})
+
+    def test_setBatching_dropped(self):
+        self.startBatching(window=0, maxPending=1)
+        self.proto.batcher.pauseProducing()
+        self.master.mq.callConsumer(("builds", "1", "new"), {"buildid": 1})
+        self.master.mq.callConsumer(("builds", "2", "new"), {"buildid": 2})
+        self.master.reactor.advance(0)
+        self.proto.sendMessage.reset_mock()
+        self.proto.batcher.resumeProducing()
+        self.assert_called_with_json(self.proto.sendMessage,
+            {"b": [{"k": "builds/2/new", "m": {"buildid": 2}}], "d": 1})
+
+    def test_setBatching_off(self):
+        self.startBatching(window=100)
+        batcher = self.proto.batcher
+        self.master.mq.callConsumer(("builds", "1", "new"), {"buildid": 1})
+        self.proto.onMessage(
+            json.dumps(dict(cmd="setBatching", window=None, _id=3)), False)
+        # pending messages are sent before turning batching off
+        self.assertEqual(
+            json.loads(bytes2NativeString(
+                self.proto.sendMessage.call_args_list[-2][0][0])),
+            {"b": [{"k": "builds/1/new", "m": {"buildid": 1}}]})
+        self.assert_called_with_json(self.proto.sendMessage,
+            {"msg": "OK", "code": 200, "_id": 3})
+        self.assertTrue(batcher.stopped)
+        self.proto.transport.unregisterProducer.assert_called_with()
+        self.master.mq.callConsumer(("builds", "2", "new"), {"buildid": 2})
+        self.assert_called_with_json(self.proto.sendMessage,
+            {"k": "builds/2/new", "m": {"buildid": 2}})
+
+    def test_setBatching_bad_window(self):
+        self.proto.onMessage(
+            json.dumps(dict(cmd="setBatching", window=5000, _id=1)), False)
+        self.assert_called_with_json(self.proto.sendMessage,
+            {"_id": 1, "code": 400, "error": "invalid batching window '5000'"})
+        self.assertIsNone(self.proto.batcher)
+
+    def test_setBatching_bad_maxPending(self):
+        self.proto.onMessage(
+            json.dumps(dict(cmd="setBatching", window=10, maxPending=0,
+                            _id=1)), False)
+        self.assert_called_with_json(self.proto.sendMessage,
+            {"_id": 1, "code": 400, "error": "invalid maxPending '0'"})
+
+    def test_connectionLost_batching(self):
+        self.startBatching(window=100)
+        batcher = self.proto.batcher
+        self.master.mq.callConsumer(("builds", "1", "new"), {"buildid": 1})
+        self.proto.connectionLost(None)
+        self.assertTrue(batcher.stopped)
+        self.assertEqual(self.master.reactor.getDelayedCalls(), [])
+
+
+class WsResourceSite(www.WwwTestMixin, unittest.TestCase):
+
+    """
+    Go through a real Site, which hands the connection over to the websocket
+    protocol.
+    """
+
+    def setUp(self):
+        self.master = master = self.make_master(url='h:/a/b/')
+        master.reactor = task.Clock()
+        master.mq.verifyMessages = False
+        site = server.Site(ws.WsResource(master))
+        self.channel = site.buildProtocol(None)
+        self.transport = proto_helpers.StringTransport()
+        self.channel.makeConnection(self.transport)
+        self.channel.dataReceived(
+            b'GET / HTTP/1.1\r\n'
+            b'Host: localhost\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n'
+            b'Sec-WebSocket-Version: 13\r\n\r\n')
+        response = self.transport.value()
+        self.assertTrue(response.startswith(b'HTTP/1.1 101'))
+        self.transport.clear()
+        self.proto = self.transport.protocol
+
+    def tearDown(self):
+        self.proto.connectionLost(None)
+
+    def sendFrame(self, **msg):
+        # a masked text frame, with an all-zero mask
+        payload = json.dumps(msg).encode('utf8')
+        assert len(payload) < 126
+        self.proto.dataReceived(
+            struct.pack('!BB', 0x81, 0x80 | len(payload)) + b'\0' * 4 +
+            payload)
+
+    def receivedFrames(self):
+        data, frames = self.transport.value(), []
+        self.transport.clear()
+        while data:
+            length, start = struct.unpack('!B', data[1:2])[0], 2
+            if length == 126:
+                length, start = struct.unpack('!H', data[2:4])[0], 4
+            frames.append(json.loads(
+                bytes2NativeString(data[start:start + length])))
+            data = data[start + length:]
+        return frames
+
+    def test_setBatching(self):
+        self.sendFrame(cmd="startConsuming", path="builds/*/*", _id=1)
+        self.sendFrame(cmd="setBatching", window=100, _id=2)
+        self.assertEqual(self.receivedFrames(),
+                         [{"msg": "OK", "code": 200, "_id": 1},
+                          {"msg": "OK", "code": 200, "_id": 2}])
+        self.assertIdentical(self.transport.producer, self.proto.batcher)
+
+        self.master.mq.callConsumer(("builds", "1", "new"), {"buildid": 1})
+        self.master.reactor.advance(0.1)
+        self.assertEqual(self.receivedFrames(),
+                         [{"b": [{"k": "builds/1/new", "m": {"buildid": 1}}]}])
+
+        self.sendFrame(cmd="setBatching", window=None, _id=3)
+        self.assertEqual(self.receivedFrames(),
+                         [{"msg": "OK", "code": 200, "_id": 3}])
+        self.assertIdentical(self.transport.producer, None)
@@ -337,6 +337,27 @@ dbdict['masterdict'] = DictValidator(
     last_active=DateTimeValidator(),
 )
 
+# masterlocks
+
+message['masterlocks'] = Selector()
+message['masterlocks'].add(lambda k: k[-1] == 'claimed',
+                           MessageValidator(
+                               events=[b'claimed'],
+                               messageValidator=DictValidator(
+                                   lockid=IntValidator(),
+                                   masterid=IntValidator(),
+                                   slots=ListValidator(IntValidator()),
+                                   exclusive=BooleanValidator(),
+                               )))
+message['masterlocks'].add(None,
+                           MessageValidator(
+                               events=[b'released'],
+                               messageValidator=DictValidator(
+                                   lockid=IntValidator(),
+                                   masterid=IntValidator(),
+                                   slots=ListValidator(IntValidator()),
+                               )))
+
 # sourcestamp
 
 _sourcestamp = dict(
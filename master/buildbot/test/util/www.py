@@ -51,6 +51,7 @@ class FakeRequest(object):
     written = b''
     finished = False
     redirected_to = None
+    producer = None
     rendered_resource = None
     failure = None
     method = b'GET'
@@ -80,6 +81,12 @@ class FakeRequest(object):
     def write(self, data):
         self.written = self.written + data
 
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
     def redirect(self, url):
         self.redirected_to = url
 
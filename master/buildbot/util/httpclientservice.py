@@ -16,17 +16,24 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+from future.moves.urllib.parse import urlparse
 
 import json as jsonmodule
 import textwrap
 
 from twisted.internet import defer
+from twisted.internet import error
+from twisted.internet import task
+from twisted.python import failure
 from twisted.web.client import Agent
 from twisted.web.client import HTTPConnectionPool
+from twisted.web.client import ResponseFailed
 from zope.interface import implementer
 
 from buildbot import config
 from buildbot.interfaces import IHttpResponse
+from buildbot.process import metrics
+from buildbot.util import bytes2NativeString
 from buildbot.util import service
 from buildbot.util import toJson
 from buildbot.util import unicode2bytes
@@ -34,8 +41,10 @@ from buildbot.util.logger import Logger
 
 try:
     import txrequests
+    import requests
 except ImportError:
     txrequests = None
+    requests = None
 
 try:
     import treq
@@ -47,6 +56,11 @@ except ImportError:
 log = Logger()
 
 
+class HTTPQueueFull(Exception):
+
+    """Raised when too many requests are already waiting for a host"""
+
+
 @implementer(IHttpResponse)
 class TxRequestsResponseWrapper(object):
 
@@ -63,6 +77,40 @@ class TxRequestsResponseWrapper(object):
     def code(self):
         return self._res.status_code
 
+    @property
+    def headers(self):
+        return self._res.headers
+
+
+def getResponseHeader(res, name):
+    """Return the value of the header C{name} of the IHttpResponse C{res} as
+    a native string, or None if the response does not have that header"""
+    headers = getattr(res, 'headers', None)
+    if headers is None:
+        return None
+    if hasattr(headers, 'getRawHeaders'):
+        # twisted.web.http_headers.Headers, from treq
+        values = headers.getRawHeaders(name)
+        if not values:
+            return None
+        return bytes2NativeString(values[-1])
+    # requests' case insensitive dict, or a plain dict
+    name = name.lower()
+    for k, v in headers.items():
+        if k.lower() == name:
+            return bytes2NativeString(v)
+    return None
+
+
+class HTTPHostLimiter(service.SharedService):
+
+    """Limit the number of requests sent at the same time to a host, by all
+    the HTTPClientServices of a master"""
+
+    def __init__(self, host, maxConcurrent):
+        service.SharedService.__init__(self)
+        self.semaphore = defer.DeferredSemaphore(maxConcurrent)
+
 
 class HTTPClientService(service.SharedService):
     """A SharedService class that can make http requests to remote services.
@@ -90,6 +138,24 @@ class HTTPClientService(service.SharedService):
     PREFER_TREQ = False
     MAX_THREADS = 5
 
+    # at most this many requests are sent at the same time to a host, by all
+    # the services using it; the other requests wait in a queue, which is
+    # bounded so that a stuck host does not make requests pile up forever
+    MAX_CONCURRENT_PER_HOST = MAX_THREADS
+    MAX_QUEUED_PER_HOST = 1000
+
+    # requests which failed to reach the host, or got one of those answers,
+    # are retried after RETRY_DELAY seconds, doubling for each retry.
+    # Requests which were sent but not answered, or which got a gateway
+    # error (which the upstream server may have processed), are only retried
+    # for idempotent methods; the others are only retried on the answers
+    # meaning that the request was not processed
+    MAX_RETRIES = 3
+    RETRY_DELAY = 1
+    RETRY_CODES = (429, 502, 503, 504)
+    NON_IDEMPOTENT_RETRY_CODES = (429, 503)
+    IDEMPOTENT_METHODS = ('get', 'put', 'delete')
+
     def __init__(self, base_url, auth=None, headers=None):
         assert not base_url.endswith(
             "/"), "baseurl should not end with /: " + base_url
@@ -98,6 +164,8 @@ class HTTPClientService(service.SharedService):
         self._auth = auth
         self._headers = headers
         self._session = None
+        self._host = urlparse(base_url).netloc
+        self._limiter = None
 
     def updateHeaders(self, headers):
         if self._headers is None:
@@ -113,7 +181,11 @@ class HTTPClientService(service.SharedService):
             config.error("neither txrequests nor treq is installed, but {} is requiring it\n\n{}".format(
                 from_module, HTTPClientService.TREQ_PROS_AND_CONS))
 
+    @defer.inlineCallbacks
     def startService(self):
+        limiter = yield HTTPHostLimiter.getService(
+            self.parent, self._host, self.MAX_CONCURRENT_PER_HOST)
+        self._limiter = limiter.semaphore
         # treq only supports basicauth, so we force txrequests if the auth is
         # something else
         if self._auth is not None and not isinstance(self._auth, tuple):
@@ -128,7 +200,7 @@ class HTTPClientService(service.SharedService):
         else:
             self._doRequest = self._doTReq
             self._pool = HTTPConnectionPool(self.master.reactor)
-            self._pool.maxPersistentPerHost = self.MAX_THREADS
+            self._pool.maxPersistentPerHost = self.MAX_CONCURRENT_PER_HOST
             self._agent = Agent(self.master.reactor, pool=self._pool)
 
     def stopService(self):
@@ -183,15 +255,88 @@ class HTTPClientService(service.SharedService):
         d.addCallback(IHttpResponse)
         return d
 
+    def _isRetryable(self, method, f):
+        # the request did not reach the host
+        if f.check(error.ConnectError, error.ConnectingCancelledError):
+            return True
+        if requests is not None and f.check(requests.exceptions.ConnectTimeout):
+            return True
+        # the request may have been processed
+        if method in self.IDEMPOTENT_METHODS:
+            if f.check(ResponseFailed, error.ConnectionLost,
+                       error.TimeoutError):
+                return True
+            if requests is not None and f.check(
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                return True
+        return False
+
+    def _isRetryableCode(self, method, code):
+        if method in self.IDEMPOTENT_METHODS:
+            return code in self.RETRY_CODES
+        return code in self.NON_IDEMPOTENT_RETRY_CODES
+
+    def _logQueueDepth(self):
+        metrics.MetricCountEvent.log(
+            'HTTPClientService.queued.' + self._host,
+            len(self._limiter.waiting), absolute=True)
+
+    @defer.inlineCallbacks
+    def _sendRequest(self, method, ep, **kwargs):
+        if len(self._limiter.waiting) >= self.MAX_QUEUED_PER_HOST:
+            raise HTTPQueueFull("%d requests are already waiting for %s" %
+                                (len(self._limiter.waiting), self._host))
+        reactor = self.master.reactor
+        attempt = 0
+        while True:
+            d = self._limiter.acquire()
+            self._logQueueDepth()
+            yield d
+            start = reactor.seconds()
+            try:
+                res = yield self._doRequest(method, ep, **kwargs)
+            except Exception:
+                f = failure.Failure()
+                if attempt >= self.MAX_RETRIES or not self._isRetryable(method, f):
+                    raise
+                log.info("{method} {url} failed, retrying: {error}",
+                         method=method, url=self._base_url + ep,
+                         error=f.getErrorMessage())
+            else:
+                if (attempt >= self.MAX_RETRIES or
+                        not self._isRetryableCode(method, res.code)):
+                    metrics.MetricTimeEvent.log(
+                        'HTTPClientService.latency.' + self._host,
+                        reactor.seconds() - start)
+                    defer.returnValue(res)
+                # read the content, so that the connection can be reused
+                try:
+                    yield res.content()
+                except Exception:
+                    pass
+                log.info("{method} {url} got {code}, retrying",
+                         method=method, url=self._base_url + ep,
+                         code=res.code)
+            finally:
+                self._limiter.release()
+                self._logQueueDepth()
+
+            metrics.MetricCountEvent.log(
+                'HTTPClientService.retries.' + self._host)
+            yield task.deferLater(reactor, self.RETRY_DELAY * 2 ** attempt,
+                                  lambda: None)
+            attempt += 1
+
     # lets be nice to the auto completers, and don't generate that code
     def get(self, ep, **kwargs):
-        return self._doRequest('get', ep, **kwargs)
+        return self._sendRequest('get', ep, **kwargs)
 
     def put(self, ep, **kwargs):
-        return self._doRequest('put', ep, **kwargs)
+        return self._sendRequest('put', ep, **kwargs)
 
     def delete(self, ep, **kwargs):
-        return self._doRequest('delete', ep, **kwargs)
+        return self._sendRequest('delete', ep, **kwargs)
 
     def post(self, ep, **kwargs):
-        return self._doRequest('post', ep, **kwargs)
+        return self._sendRequest('post', ep, **kwargs)
@@ -30,22 +30,31 @@ class LineBoundaryFinder(object):
     newline_re = re.compile(r'(\r\n|\r(?=.)|\n)')
 
     def __init__(self, callback):
-        self.partialLine = None
+        # the chunks of the last, incomplete, line; they are only joined once
+        # the line is complete, so that a very long line arriving in many
+        # chunks is not copied again on each of them
+        self.partialLine = []
         self.callback = callback
 
     def append(self, text):
         if self.partialLine:
-            text = self.partialLine + text
-            self.partialLine = None
+            if ('\n' not in text and '\r' not in text and
+                    not self.partialLine[-1].endswith('\r')):
+                self.partialLine.append(text)
+                return defer.succeed(None)
+            self.partialLine.append(text)
+            text = text[:0].join(self.partialLine)
+            self.partialLine = []
         text = self.newline_re.sub('\n', text)
         if text:
             if text[-1] != '\n':
                 i = text.rfind('\n')
                 if i >= 0:
                     i = i + 1
-                    text, self.partialLine = text[:i], text[i:]
+                    text, partialLine = text[:i], text[i:]
+                    self.partialLine = [partialLine]
                 else:
-                    self.partialLine = text
+                    self.partialLine = [text]
                     return defer.succeed(None)
             return self.callback(text)
         return defer.succeed(None)
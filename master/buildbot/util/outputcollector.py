@@ -0,0 +1,106 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+from future.utils import text_type
+
+import tempfile
+
+
+class OutputCollector(object):
+
+    """
+    Accumulate the output of a command, chunk by chunk.
+
+    Appending a chunk is O(1): the chunks are only joined when the value is
+    requested, and the joined value is kept so that repeated reads are cheap.
+    Growing a string with ``+=`` instead copies everything collected so far
+    on each append, which is quadratic for large outputs.
+
+    If ``maxMemory`` is given, the output is moved to an anonymous temporary
+    file once it grows larger than that many characters, and further chunks
+    are written to that file.  The value is then read back from the file
+    each time it is requested.
+    """
+
+    __slots__ = ['chunks', 'length', 'empty', 'maxMemory', 'spillFile',
+                 'isText']
+
+    def __init__(self, empty='', maxMemory=None):
+        self.chunks = []
+        self.length = 0
+        self.empty = empty
+        self.maxMemory = maxMemory
+        self.spillFile = None
+        self.isText = isinstance(empty, text_type)
+
+    def __len__(self):
+        return self.length
+
+    def append(self, data):
+        if not data:
+            return
+        if not self.length:
+            self.isText = isinstance(data, text_type)
+        self.length += len(data)
+        if self.spillFile is not None:
+            self._write(data)
+            return
+        self.chunks.append(data)
+        if self.maxMemory is not None and self.length > self.maxMemory:
+            self._spill()
+
+    def getvalue(self):
+        if self.spillFile is not None:
+            self.spillFile.seek(0)
+            value = self.spillFile.read()
+            self.spillFile.seek(0, 2)
+            if self.isText:
+                value = value.decode('utf-8')
+            return value
+        if not self.chunks:
+            return self.empty
+        if len(self.chunks) > 1:
+            self.chunks = [self.chunks[0][:0].join(self.chunks)]
+        return self.chunks[0]
+
+    @property
+    def spilled(self):
+        return self.spillFile is not None
+
+    def clear(self):
+        self.close()
+        self.chunks = []
+        self.length = 0
+
+    def close(self):
+        if self.spillFile is not None:
+            self.spillFile.close()
+            self.spillFile = None
+
+    def __del__(self):
+        self.close()
+
+    def _spill(self):
+        self.spillFile = tempfile.TemporaryFile()
+        for chunk in self.chunks:
+            self._write(chunk)
+        self.chunks = []
+
+    def _write(self, data):
+        if isinstance(data, text_type):
+            data = data.encode('utf-8')
+        self.spillFile.write(data)
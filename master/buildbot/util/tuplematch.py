@@ -24,3 +24,94 @@ def matchTuple(routingKey, filter):
         if f is not None and f != k:
             return False
     return True
+
+
+class TupleIndex(object):
+
+    """
+    Index of values by filter tuple, as used by L{matchTuple}.  Looking up
+    the values matching a routing key only visits the branches of the index
+    that can match it, rather than every filter.
+
+    Filters are stored in a trie with one level per tuple element; a C{None}
+    element is stored as a wildcard branch.  Values are returned in the
+    order they were added.
+    """
+
+    def __init__(self):
+        # filter length -> trie; each leaf is a dict {value: seq}
+        self._roots = {}
+        self._seq = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        items = []
+        for length, root in self._roots.items():
+            items.extend(self._leaves(root, length))
+        return iter(self._ordered(items))
+
+    def add(self, filter, value):
+        filter = tuple(filter)
+        node = self._roots.setdefault(len(filter), {})
+        for f in filter:
+            node = node.setdefault(f, {})
+        if value not in node:
+            self._seq += 1
+            node[value] = self._seq
+            self._len += 1
+
+    def remove(self, filter, value):
+        """Remove the given value; raises KeyError if it is not present."""
+        filter = tuple(filter)
+        path = [self._roots]
+        node = self._roots.get(len(filter))
+        if node is None:
+            raise KeyError(value)
+        path.append(node)
+        for f in filter:
+            node = node.get(f)
+            if node is None:
+                raise KeyError(value)
+            path.append(node)
+        del node[value]
+        self._len -= 1
+        # prune the branches left empty
+        keys = (len(filter),) + filter
+        for i in range(len(path) - 1, 0, -1):
+            if path[i]:
+                break
+            del path[i - 1][keys[i - 1]]
+
+    def match(self, routingKey):
+        """Return the values whose filter matches the given routing key."""
+        node = self._roots.get(len(routingKey))
+        if node is None:
+            return []
+        nodes = [node]
+        for k in routingKey:
+            next_nodes = []
+            for node in nodes:
+                if k is not None and k in node:
+                    next_nodes.append(node[k])
+                if None in node:
+                    next_nodes.append(node[None])
+            if not next_nodes:
+                return []
+            nodes = next_nodes
+        return self._ordered(item for node in nodes
+                             for item in node.items())
+
+    def _leaves(self, node, depth):
+        if not depth:
+            return list(node.items())
+        items = []
+        for child in node.values():
+            items.extend(self._leaves(child, depth - 1))
+        return items
+
+    @staticmethod
+    def _ordered(items):
+        return [value for value, seq in sorted(items, key=lambda i: i[1])]
@@ -0,0 +1,103 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+from collections import OrderedDict
+
+from twisted.internet import interfaces
+from zope.interface import implementer
+
+
+@implementer(interfaces.IPushProducer)
+class MessageBatcher(object):
+
+    """
+    Collect the mq messages sent to a client for C{window} seconds, and
+    pass them to C{send} in a single batch.
+
+    Data API messages carry the whole resource, so a message replaces any
+    pending message with the same routing key (same resource, same event);
+    it then takes the place of the newest message.
+
+    The batcher is registered as the streaming producer of the connection:
+    while the connection's send buffer is full, messages are kept pending.
+    At most C{maxPending} messages are kept; older ones are dropped and
+    only counted, and the count is passed to C{send} with the next batch,
+    so the client knows it should reload its data.
+
+    @param send: callable taking a list of (key, message) tuples and the
+    number of messages dropped since the last batch
+    """
+
+    def __init__(self, send, window, maxPending, reactor):
+        self.send = send
+        self.window = window
+        self.maxPending = maxPending
+        self.reactor = reactor
+        self.pending = OrderedDict()
+        self.dropped = 0
+        self.paused = False
+        self.stopped = False
+        self.timer = None
+
+    def add(self, key, message):
+        if self.stopped:
+            return
+        key = tuple(key)
+        # move superseded messages to the end
+        self.pending.pop(key, None)
+        self.pending[key] = message
+        while len(self.pending) > self.maxPending:
+            self.pending.popitem(last=False)
+            self.dropped += 1
+        if self.timer is None and not self.paused:
+            self.timer = self.reactor.callLater(self.window, self.flush)
+
+    def flush(self):
+        if self.timer is not None:
+            if self.timer.active():
+                self.timer.cancel()
+            self.timer = None
+        if self.paused or self.stopped:
+            return
+        if not self.pending and not self.dropped:
+            return
+        messages, dropped = list(self.pending.items()), self.dropped
+        self.pending = OrderedDict()
+        self.dropped = 0
+        self.send(messages, dropped)
+
+    def stop(self):
+        """Stop batching, discarding the pending messages."""
+        self.stopped = True
+        if self.timer is not None:
+            if self.timer.active():
+                self.timer.cancel()
+            self.timer = None
+        self.pending = OrderedDict()
+
+    # IPushProducer
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.flush()
+
+    def stopProducing(self):
+        self.stop()
@@ -27,8 +27,10 @@ import re
 from contextlib import contextmanager
 
 from twisted.internet import defer
+from twisted.internet.interfaces import IPushProducer
 from twisted.python import log
 from twisted.web.error import Error
+from zope.interface import implementer
 
 from buildbot.data import exceptions
 from buildbot.data import resultspec
@@ -51,6 +53,52 @@ class BadJsonRpc2(Exception):
         self.jsonrpccode = jsonrpccode
 
 
+@implementer(IPushProducer)
+class RawProducer(object):
+
+    """
+    Write the batches returned by C{read} to the request as they come, pausing
+    while the client is not keeping up, so that only one batch is held in
+    memory at a time.
+    """
+
+    def __init__(self, request, read):
+        self.request = request
+        self.read = read
+        self.paused = False
+        self.stopped = False
+        self._resumed = None
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        if self._resumed is not None:
+            d, self._resumed = self._resumed, None
+            d.callback(None)
+
+    def stopProducing(self):
+        self.stopped = True
+        self.resumeProducing()
+
+    @defer.inlineCallbacks
+    def produce(self):
+        self.request.registerProducer(self, True)
+        try:
+            while not self.stopped:
+                if self.paused:
+                    self._resumed = defer.Deferred()
+                    yield self._resumed
+                    continue
+                data = yield self.read()
+                if data is None or self.stopped:
+                    break
+                self.request.write(data.encode('utf-8'))
+        finally:
+            self.request.unregisterProducer()
+
+
 class ContentTypeParser(object):
 
     def __init__(self, contenttype):
@@ -357,8 +405,10 @@ class V2RootResource(resource.Resource):
                           data['mime-type'].encode() + b'; charset=utf-8')
         request.setHeader(b"content-disposition",
                           b'attachment; filename=' + data['filename'].encode())
+        if 'read' in data:
+            return RawProducer(request, data['read']).produce()
         request.write(data['raw'].encode('utf-8'))
-        return
+        return defer.succeed(None)
 
     @defer.inlineCallbacks
     def renderRest(self, request):
@@ -378,7 +428,10 @@ class V2RootResource(resource.Resource):
             ep, kwargs = self.getEndpoint(request)
 
             rspec = self.decodeResultSpec(request, ep)
-            data = yield ep.get(rspec, kwargs)
+            if ep.isRaw:
+                data = yield ep.stream(rspec, kwargs)
+            else:
+                data = yield ep.get(rspec, kwargs)
             if data is None:
                 msg = ("not found while getting from {} with "
                        "arguments {} and {}").format(repr(ep), repr(rspec),
@@ -388,7 +441,7 @@ class V2RootResource(resource.Resource):
                 return
 
             if ep.isRaw:
-                self.encodeRaw(data, request)
+                yield self.encodeRaw(data, request)
                 return
 
             # post-process any remaining parts of the resultspec
@@ -28,6 +28,7 @@ from buildbot.data.exceptions import InvalidPathError
 from buildbot.util import bytes2NativeString
 from buildbot.util import toJson
 from buildbot.util import unicode2bytes
+from buildbot.www.batching import MessageBatcher
 
 
 class Consumer(object):
@@ -35,6 +36,12 @@ class Consumer(object):
     def __init__(self, request):
         self.request = request
         self.qrefs = {}
+        self.batcher = None
+
+    def startBatching(self, window, maxPending, reactor):
+        self.batcher = MessageBatcher(self.sendBatch, window, maxPending,
+                                      reactor)
+        self.request.registerProducer(self.batcher, True)
 
     def stopConsuming(self, key=None):
         if key is not None:
@@ -43,14 +50,29 @@ class Consumer(object):
             for qref in itervalues(self.qrefs):
                 qref.stopConsuming()
             self.qrefs = {}
+            if self.batcher is not None:
+                self.batcher.stop()
 
     def onMessage(self, event, data):
-        request = self.request
+        if self.batcher is not None:
+            return self.batcher.add(event, data)
         key = [bytes2NativeString(e) for e in event]
         msg = dict(key=key, message=data)
-        request.write(b"event: " + b"event" + b"\n")
-        request.write(
-            b"data: " + unicode2bytes(json.dumps(msg, default=toJson)) + b"\n")
+        self.writeEvent(b"event", json.dumps(msg, default=toJson))
+
+    def sendBatch(self, messages, dropped):
+        if dropped:
+            self.writeEvent(b"dropped", str(dropped))
+        if messages:
+            msgs = [dict(key=[bytes2NativeString(e) for e in key],
+                         message=data)
+                    for key, data in messages]
+            self.writeEvent(b"batch", json.dumps(msgs, default=toJson))
+
+    def writeEvent(self, event, data):
+        request = self.request
+        request.write(b"event: " + event + b"\n")
+        request.write(b"data: " + unicode2bytes(data) + b"\n")
         request.write(b"\n")
 
     def registerQref(self, path, qref):
@@ -60,6 +82,11 @@ class Consumer(object):
 class EventResource(resource.Resource):
     isLeaf = True
 
+    # largest batching window a client can ask for, in milliseconds
+    maxBatchWindow = 1000
+    # most messages kept for a batching client which does not keep up
+    maxPendingMessages = 1000
+
     def __init__(self, master):
         resource.Resource.__init__(self)
 
@@ -72,6 +99,21 @@ class EventResource(resource.Resource):
                 path[i] = None
         return path
 
+    def getBatchWindow(self, request):
+        """Return the batching window asked for with the C{batch} argument,
+        in seconds, None if batching was not asked for, or False if the
+        window is invalid."""
+        args = request.args.get(b'batch')
+        if not args:
+            return None
+        try:
+            window = float(args[0])
+        except ValueError:
+            return False
+        if not 0 <= window <= self.maxBatchWindow:
+            return False
+        return window / 1000.
+
     def finish(self, request, code, msg):
         request.setResponseCode(code)
         request.setHeader('content-type', 'text/plain; charset=utf-8')
@@ -89,8 +131,14 @@ class EventResource(resource.Resource):
             path = path[1:]
 
         if command == b"listen":
+            window = self.getBatchWindow(request)
+            if window is False:
+                return self.finish(request, 400, b"invalid batch window")
             cid = unicode2bytes(str(uuid.uuid4()))
             consumer = Consumer(request)
+            if window is not None:
+                consumer.startBatching(window, self.maxPendingMessages,
+                                       self.master.reactor)
 
         elif command == b"add" or command == b"remove":
             if path:
@@ -109,7 +157,7 @@ class EventResource(resource.Resource):
             options = request.args
             for k in options:
                 if len(options[k]) == 1:
-                    options[k] = options[k][1]
+                    options[k] = options[k][0]
 
             try:
                 d = self.master.mq.startConsuming(
@@ -19,6 +19,7 @@ from future.utils import itervalues
 from future.utils import string_types
 
 import json
+import numbers
 
 from autobahn.twisted.resource import WebSocketResource
 from autobahn.twisted.websocket import WebSocketServerFactory
@@ -27,14 +28,21 @@ from twisted.internet import defer
 from twisted.python import log
 
 from buildbot.util import toJson
+from buildbot.www.batching import MessageBatcher
 
 
 class WsProtocol(WebSocketServerProtocol):
 
+    # largest batching window a client can ask for, in milliseconds
+    maxBatchWindow = 1000
+    # most messages kept for a batching client which does not keep up
+    maxPendingMessages = 1000
+
     def __init__(self, master):
         WebSocketServerProtocol.__init__(self)
         self.master = master
         self.qrefs = {}
+        self.batcher = None
         self.debug = self.master.config.www.get('debug', False)
 
     def sendJsonMessage(self, **msg):
@@ -88,6 +96,8 @@ class WsProtocol(WebSocketServerProtocol):
             return
 
         def callback(key, message):
+            if self.batcher is not None:
+                return self.batcher.add(key, message)
             # protocol is deliberately concise in size
             return self.sendJsonMessage(k="/".join(key), m=message)
 
@@ -119,12 +129,58 @@ class WsProtocol(WebSocketServerProtocol):
     def cmd_ping(self, _id):
         self.sendJsonMessage(msg="pong", code=200, _id=_id)
 
+    def isNumber(self, value, minimum, maximum):
+        return (isinstance(value, numbers.Number) and
+                not isinstance(value, bool) and minimum <= value <= maximum)
+
+    def cmd_setBatching(self, window, _id, maxPending=None):
+        if window is not None and not self.isNumber(window, 0,
+                                                    self.maxBatchWindow):
+            return self.sendJsonMessage(
+                error="invalid batching window '%s'" % (window, ), code=400,
+                _id=_id)
+        if maxPending is None:
+            maxPending = self.maxPendingMessages
+        elif not self.isNumber(maxPending, 1, self.maxPendingMessages):
+            return self.sendJsonMessage(
+                error="invalid maxPending '%s'" % (maxPending, ), code=400,
+                _id=_id)
+
+        self.stopBatching()
+        if window is not None:
+            self.batcher = MessageBatcher(self.sendBatch, window / 1000.,
+                                          int(maxPending),
+                                          self.master.reactor)
+            # Twisted Web registered the HTTPChannel as the producer of the
+            # connection, and autobahn took the connection over without
+            # unregistering it: the channel is done with the connection, so
+            # the batcher replaces it
+            self.transport.unregisterProducer()
+            self.transport.registerProducer(self.batcher, True)
+        return self.ack(_id=_id)
+
+    def sendBatch(self, messages, dropped):
+        msg = dict(b=[dict(k="/".join(key), m=message)
+                      for key, message in messages])
+        if dropped:
+            msg['d'] = dropped
+        return self.sendJsonMessage(**msg)
+
+    def stopBatching(self):
+        if self.batcher is not None:
+            self.batcher.flush()
+            self.batcher.stop()
+            self.transport.unregisterProducer()
+            self.batcher = None
+
     def connectionLost(self, reason):
         if self.debug:
             log.msg("connection lost", system=self)
         for qref in itervalues(self.qrefs):
             qref.stopConsuming()
         self.qrefs = None  # to be sure we don't add any more
+        if self.batcher is not None:
+            self.batcher.stop()
 
 
 class WsProtocolFactory(WebSocketServerFactory):
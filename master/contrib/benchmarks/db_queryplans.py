@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""Show the plans and timings of the hot data API queries on a large database.
+
+A synthetic database (1M builds with 10 steps each by default) is created
+at the given URL, with the buildbot schema, then the connector methods
+behind the most used data API endpoints are run against it; the plan of
+each of their queries (as given by EXPLAIN) and their duration are printed,
+and queries scanning a whole table which grows with the number of builds
+are flagged.
+
+The database must be empty, or created by an earlier run of this script
+(use --reuse to skip seeding it again).  SQLite and PostgreSQL are
+supported.
+
+    python contrib/benchmarks/db_queryplans.py [--db URL] [--builds N] \\
+        [--steps N] [--reuse]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import re
+import sys
+import time
+from optparse import OptionParser
+
+import sqlalchemy as sa
+
+from twisted.internet import defer
+
+from buildbot.data import builds as data_builds
+from buildbot.data import resultspec
+from buildbot.db import buildrequests
+from buildbot.db import builds
+from buildbot.db import logs
+from buildbot.db import model
+from buildbot.db import steps
+from buildbot.test.fake import fakemaster
+
+BATCH = 10000
+
+# tables which grow with the number of builds
+LARGE_TABLES = ('buildrequests', 'buildrequest_claims', 'builds',
+                'build_properties', 'steps', 'logs', 'logchunks')
+
+# full scans, as reported by SQLite ("SCAN TABLE builds" or "SCAN builds")
+# and PostgreSQL ("Seq Scan on builds")
+scan_re = re.compile(r'^(?:SCAN (?:TABLE )?|.*Seq Scan on )(\w+)(?: AS \w+)?'
+                     r'(?P<rest>.*)$')
+
+
+def isFullScan(detail):
+    mo = scan_re.match(detail)
+    return (mo is not None and mo.group(1) in LARGE_TABLES and
+            'USING' not in mo.group('rest'))
+
+
+class SyncPool(object):
+
+    """Run the connectors' thread functions synchronously."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def do(self, callable, *args, **kwargs):
+        conn = self.engine.connect()
+        try:
+            return defer.succeed(callable(conn, *args, **kwargs))
+        finally:
+            conn.close()
+
+
+class Connector(object):
+
+    def __init__(self, engine):
+        self.pool = SyncPool(engine)
+        self.master = fakemaster.make_master()
+        self.model = model.Model(self)
+        self.buildrequests = buildrequests.BuildRequestsConnectorComponent(
+            self)
+        self.builds = builds.BuildsConnectorComponent(self)
+        self.steps = steps.StepsConnectorComponent(self)
+        self.logs = logs.LogsConnectorComponent(self)
+
+
+def insertBatches(conn, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH:
+            conn.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        conn.execute(table.insert(), batch)
+
+
+def seed(engine, opts):
+    meta = model.Model.metadata
+    meta.create_all(bind=engine)
+    t = meta.tables
+    nbuilds, nbuilders = opts.builds, opts.builders
+    conn = engine.connect()
+    trans = conn.begin()
+    conn.execute(t['masters'].insert(), [
+        dict(id=1, name='master', name_hash='master', active=1,
+             last_active=0)])
+    conn.execute(t['workers'].insert(), [dict(id=1, name='wrk', info={})])
+    insertBatches(conn, t['builders'], (
+        dict(id=b, name='builder%d' % b, name_hash='builder%d' % b)
+        for b in range(1, nbuilders + 1)))
+    conn.execute(t['sourcestamps'].insert(), [
+        dict(id=1, branch='master', revision='abcd', repository='repo',
+             codebase='', project='', ss_hash='1', created_at=0)])
+    nrequests = nbuilds + opts.pending
+    insertBatches(conn, t['buildsets'], (
+        dict(id=i, external_idstring=None, reason='bench', submitted_at=i,
+             complete=int(i <= nbuilds), complete_at=None, results=0)
+        for i in range(1, nrequests + 1)))
+    insertBatches(conn, t['buildset_sourcestamps'], (
+        dict(buildsetid=i, sourcestampid=1)
+        for i in range(1, nrequests + 1)))
+    insertBatches(conn, t['buildrequests'], (
+        dict(id=i, buildsetid=i, builderid=1 + i % nbuilders, priority=0,
+             complete=int(i <= nbuilds), results=0, submitted_at=i,
+             complete_at=i + 10 if i <= nbuilds else None)
+        for i in range(1, nrequests + 1)))
+    insertBatches(conn, t['buildrequest_claims'], (
+        dict(brid=i, masterid=1, claimed_at=i)
+        for i in range(1, nbuilds + 1)))
+    insertBatches(conn, t['builds'], (
+        dict(id=i, number=1 + i // nbuilders, builderid=1 + i % nbuilders,
+             buildrequestid=i, workerid=1, masterid=1, started_at=i,
+             complete_at=i + 10, state_string='finished', results=i % 3)
+        for i in range(1, nbuilds + 1)))
+    insertBatches(conn, t['steps'], (
+        dict(id=i * opts.steps + s, number=s, name='step%d' % s, buildid=i,
+             started_at=i, complete_at=i + 1, state_string='done',
+             results=0, urls_json='[]', hidden=0)
+        for i in range(1, nbuilds + 1) for s in range(opts.steps)))
+    insertBatches(conn, t['logs'], (
+        dict(id=i, name='stdio', slug='stdio', stepid=i, complete=1,
+             num_lines=1, type='s')
+        for i in range(opts.steps, (nbuilds + 1) * opts.steps)))
+    trans.commit()
+    if engine.dialect.name in ('sqlite', 'postgresql'):
+        conn.execute('ANALYZE')
+    conn.close()
+
+
+def explain(engine, statement, parameters):
+    conn = engine.connect()
+    try:
+        cursor = conn.connection.cursor()
+        if engine.dialect.name == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            return [row[-1] for row in cursor]
+        cursor.execute('EXPLAIN ' + statement, parameters)
+        return [row[0] for row in cursor]
+    finally:
+        conn.close()
+
+
+def queries(db, opts):
+    builderid = 1 + opts.builders // 2
+    buildid = opts.builds // 2
+    stepid = buildid * opts.steps
+    recent = resultspec.ResultSpec(order=['-complete_at'], limit=20)
+    recent.fieldMapping = data_builds.BuildsEndpoint.fieldMapping
+    return [
+        ('buildrequests.getBuildRequests(builderid, claimed=False)',
+         lambda: db.buildrequests.getBuildRequests(builderid=builderid,
+                                                   claimed=False)),
+        ('buildrequests.getBuildRequests(builderid, complete=False)',
+         lambda: db.buildrequests.getBuildRequests(builderid=builderid,
+                                                   complete=False)),
+        ('builds.getBuilds(builderid, order=-complete_at, limit=20)',
+         lambda: db.builds.getBuilds(builderid=builderid,
+                                     resultSpec=recent)),
+        ('builds.getBuildByNumber(builderid, number)',
+         lambda: db.builds.getBuildByNumber(builderid, 10)),
+        ('builds.getPrevBuild(builderid, number, results=[0])',
+         lambda: db.builds.getPrevBuild(builderid, 100, results=[0])),
+        ('steps.getSteps(buildid)',
+         lambda: db.steps.getSteps(buildid)),
+        ('steps.getStep(buildid, number)',
+         lambda: db.steps.getStep(buildid=buildid, number=1)),
+        ('logs.getLogs(stepid)',
+         lambda: db.logs.getLogs(stepid)),
+        ('logs.getLogBySlug(stepid, slug)',
+         lambda: db.logs.getLogBySlug(stepid, 'stdio')),
+    ]
+
+
+def main():
+    parser = OptionParser(usage='%prog [--db URL] [--builds N] [--steps N]')
+    parser.add_option('--db', default='sqlite:///queryplans.sqlite',
+                      help='URL of the database to create or reuse')
+    parser.add_option('--builds', type='int', default=1000000,
+                      help='number of builds')
+    parser.add_option('--builders', type='int', default=100,
+                      help='number of builders')
+    parser.add_option('--steps', type='int', default=10,
+                      help='number of steps per build')
+    parser.add_option('--pending', type='int', default=1000,
+                      help='number of unclaimed build requests')
+    parser.add_option('--reuse', action='store_true', default=False,
+                      help='use the database seeded by an earlier run')
+    opts, args = parser.parse_args()
+
+    engine = sa.create_engine(opts.db)
+    if not opts.reuse:
+        start = time.time()
+        seed(engine, opts)
+        print('seeded %d builds, %d steps in %.1fs' % (
+            opts.builds, opts.builds * opts.steps, time.time() - start))
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    db = Connector(engine)
+    scans = 0
+    for name, fn in queries(db, opts):
+        sa.event.listen(engine, 'before_cursor_execute', record)
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        sa.event.remove(engine, 'before_cursor_execute', record)
+        print('%-60s %8.2fms' % (name, elapsed * 1000))
+        for statement, parameters in statements:
+            for detail in explain(engine, statement, parameters):
+                flag = '  '
+                if isFullScan(detail):
+                    flag = '!!'
+                    scans += 1
+                print('  %s %s' % (flag, detail))
+        del statements[:]
+    if scans:
+        print('%d full table scans (flagged with !!)' % scans)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Compare the ways of reading the metadata of new commits in GitPoller.
+
+A synthetic local repository is created with the given number of commits,
+then the metadata of all of them is read both with four ``git log --no-walk``
+processes per commit (as GitPoller used to) and with the single
+``git log -z --name-only`` process of ``GitPoller._get_commits``.
+
+    python contrib/benchmarks/gitpoller_log.py [--commits N] [--files N]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.python import failure
+
+from buildbot.changes import gitpoller
+
+
+def git(repo, *args, **kwargs):
+    env = dict(os.environ,
+               GIT_AUTHOR_NAME='Bench', GIT_AUTHOR_EMAIL='bench@example.com',
+               GIT_COMMITTER_NAME='Bench',
+               GIT_COMMITTER_EMAIL='bench@example.com')
+    return subprocess.check_output(('git',) + args, cwd=repo, env=env,
+                                   **kwargs)
+
+
+def makeRepo(repo, commits, files):
+    git(repo, 'init', '-q')
+    for i in range(commits):
+        for j in range(files):
+            with open(os.path.join(repo, 'file %d' % ((i + j) % 100)), 'a') as f:
+                f.write('line %d\n' % i)
+        git(repo, 'add', '-A')
+        git(repo, 'commit', '-q', '-m',
+            'commit %d\n\nwith a longer description' % i)
+
+
+def perCommit(repo):
+    revs = git(repo, 'log', '--format=%H').split()
+    revs.reverse()
+    for rev in revs:
+        for fmt in ('--format=%ct', '--format=%aN <%aE>', '--format=%s%n%b'):
+            git(repo, 'log', '--no-walk', fmt, rev, '--')
+        git(repo, 'log', '--name-only', '--no-walk', '--format=%n', rev, '--')
+    return len(revs)
+
+
+@defer.inlineCallbacks
+def batched(repo):
+    poller = gitpoller.GitPoller('file://' + repo, workdir=repo)
+    commits = yield poller._get_commits(['HEAD', '--'])
+    defer.returnValue(len(commits))
+
+
+def main():
+    parser = OptionParser(usage='%prog [--commits N] [--files N]')
+    parser.add_option('--commits', type='int', default=500,
+                      help='number of commits in the synthetic repository')
+    parser.add_option('--files', type='int', default=3,
+                      help='number of files changed by each commit')
+    opts, args = parser.parse_args()
+
+    repo = tempfile.mkdtemp()
+    try:
+        makeRepo(repo, opts.commits, opts.files)
+
+        start = time.time()
+        count = perCommit(repo)
+        print('4 processes per commit: %d commits in %.2fs' % (
+            count, time.time() - start))
+
+        start = time.time()
+        results = []
+        d = batched(repo)
+        d.addBoth(results.append)
+        d.addBoth(lambda _: reactor.stop())
+        reactor.run()
+        if isinstance(results[0], failure.Failure):
+            results[0].raiseException()
+        print('single git log:         %d commits in %.2fs' % (
+            results[0], time.time() - start))
+    finally:
+        shutil.rmtree(repo)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Measure the cost of lock operations as the number of waiters grows.
+
+A lock (as used by MasterLock and WorkerLock) is fully claimed and gets N
+counting waiters, then the operations the build request distributor and
+the builds perform on it are timed: checking whether the lock is
+available for a new requester and for a queued one, releasing it (which
+wakes up the next waiter), claiming it for the waiter which was woken up
+and queueing the previous owner again, and giving up waiting.  The time
+per operation should not depend on the number of waiters.
+
+    python contrib/benchmarks/lock_waiters.py [--ops N] [--max-count N]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import time
+from collections import deque
+from optparse import OptionParser
+
+from buildbot import locks
+
+WAITERS = [10, 100, 1000, 10000, 50000]
+
+
+class Owner(object):
+    pass
+
+
+def makeLock(waiters, maxCount):
+    lockid = locks.MasterLock('bench', maxCount=maxCount)
+    lock = locks.BaseLock('bench', maxCount=maxCount)
+    counting = locks.LockAccess(lockid, 'counting')
+    exclusive = locks.LockAccess(lockid, 'exclusive')
+    # the lock is fully used, so that everybody has to wait
+    holders = deque(Owner() for _ in range(maxCount))
+    for o in holders:
+        lock.claim(o, counting)
+    queued = deque()
+    for i in range(waiters):
+        o = Owner()
+        lock.waitUntilMaybeAvailable(o, counting)
+        queued.append(o)
+    return lock, counting, exclusive, holders, queued
+
+
+def timeit(fn, ops):
+    start = time.time()
+    for i in range(ops):
+        fn(i)
+    return (time.time() - start) / ops * 1e6
+
+
+def run(waiters, ops, maxCount):
+    lock, counting, exclusive, holders, queued = makeLock(waiters, maxCount)
+    newcomer = Owner()
+    results = []
+    results.append(timeit(
+        lambda i: lock.isAvailable(newcomer, exclusive), ops))
+    results.append(timeit(
+        lambda i: lock.isAvailable(queued[-1], counting), ops))
+    results.append(timeit(
+        lambda i: lock.isOwner(holders[0], counting), ops))
+
+    # the oldest owner releases the lock and queues again, and the waiter
+    # which was woken up claims it
+    def releaseClaim(i):
+        holder = holders.popleft()
+        lock.release(holder, counting)
+        lock.waitUntilMaybeAvailable(holder, counting)
+        queued.append(holder)
+        o = queued.popleft()
+        lock.claim(o, counting)
+        holders.append(o)
+    results.append(timeit(releaseClaim, ops))
+
+    # the first waiter gives up waiting, and queues again
+    def stopWaiting(i):
+        o = queued.popleft()
+        d = lock.waitUntilMaybeAvailable(o, counting)
+        lock.stopWaitingUntilAvailable(o, counting, d)
+        lock.waitUntilMaybeAvailable(o, counting)
+        queued.append(o)
+    results.append(timeit(stopWaiting, ops))
+    print('%8d waiters: ' % waiters +
+          '  '.join('%8.2fus' % r for r in results))
+
+
+def main():
+    parser = OptionParser(usage='%prog [--ops N] [--max-count N]')
+    parser.add_option('--ops', type='int', default=1000,
+                      help='number of operations timed')
+    parser.add_option('--max-count', type='int', default=3,
+                      help='maxCount of the lock')
+    opts, args = parser.parse_args()
+    print('%18s %10s %10s %10s %10s %10s' % (
+        '', 'avail(new)', 'avail(last)', 'isOwner', 'rel+claim',
+        'stopWait'))
+    for waiters in WAITERS:
+        run(waiters, opts.ops, opts.max_count)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
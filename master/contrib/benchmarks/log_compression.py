@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Compare the log chunk compression methods of the buildmaster.
+
+Compresses synthetic (or given) build log content chunk by chunk, the way
+the buildmaster stores it, and reports the compression ratio and throughput
+of each method in buildbot.db.logs.LogsConnectorComponent.COMPRESSION_MODE,
+as well as zstd with a dictionary trained on a similar log.
+
+    python contrib/benchmarks/log_compression.py [--level N] [logfile ...]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+import sys
+import time
+from optparse import OptionParser
+
+from buildbot.db import logs
+
+CHUNK_SIZE = logs.LogsConnectorComponent.MAX_CHUNK_SIZE
+
+
+def synthetic_log(seed, lines=20000):
+    rnd = random.Random(seed)
+    modules = ['core', 'net', 'db', 'ui', 'util', 'test']
+    out = []
+    for i in range(lines):
+        kind = rnd.random()
+        if kind < 0.6:
+            out.append('gcc -O2 -Wall -Isrc/include -c src/%s/file_%d.c -o '
+                       'build/%s/file_%d.o\n' % (rnd.choice(modules),
+                                                 rnd.randint(0, 500),
+                                                 rnd.choice(modules),
+                                                 rnd.randint(0, 500)))
+        elif kind < 0.9:
+            out.append('test_%s.Test%d.test_case_%d ... ok (%.3fs)\n' % (
+                rnd.choice(modules), rnd.randint(0, 50),
+                rnd.randint(0, 200), rnd.random()))
+        else:
+            out.append('src/%s/file_%d.c:%d:%d: warning: unused variable '
+                       "'tmp%d' [-Wunused-variable]\n" % (
+                           rnd.choice(modules), rnd.randint(0, 500),
+                           rnd.randint(1, 2000), rnd.randint(1, 80),
+                           rnd.randint(0, 9)))
+    return ''.join(out).encode('utf-8')
+
+
+def chunks(content):
+    # split on line boundaries, like thdSplitChunks
+    while content:
+        end = content.rfind(b'\n', 0, CHUNK_SIZE) + 1 or CHUNK_SIZE
+        yield content[:end]
+        content = content[end:]
+
+
+def run(name, dumps, loads, data):
+    start = time.time()
+    compressed = [dumps(c) for c in data]
+    compress_time = time.time() - start
+    start = time.time()
+    for c in compressed:
+        loads(c)
+    read_time = time.time() - start
+    size = sum(len(c) for c in data)
+    csize = sum(len(c) for c in compressed)
+    mb = size / (1 << 20)
+    print('%-16s ratio %6.2f  compress %8.1f MB/s  read %8.1f MB/s' % (
+        name, size / csize, mb / max(compress_time, 1e-9),
+        mb / max(read_time, 1e-9)))
+
+
+def main():
+    parser = OptionParser(usage='%prog [--level N] [logfile ...]')
+    parser.add_option('--level', type='int', default=logs.ZSTD_LEVEL,
+                      help='zstd compression level')
+    opts, args = parser.parse_args()
+    logs.ZSTD_LEVEL = opts.level
+
+    if args:
+        contents = [open(f, 'rb').read() for f in args]
+    else:
+        contents = [synthetic_log(1), synthetic_log(2)]
+    # train the dictionary on the first log, measure on the others
+    training, measured = contents[0], contents[1:] or contents
+    data = [c for content in measured for c in chunks(content)]
+
+    for name, mode in sorted(
+            logs.LogsConnectorComponent.COMPRESSION_MODE.items(),
+            key=lambda item: item[1]['id']):
+        if mode['dumps'] is None:
+            continue
+        try:
+            run(name, mode['dumps'], mode['read'], data)
+        except ImportError as e:
+            print('%-16s skipped: %s' % (name, e))
+
+    try:
+        import zstandard
+    except ImportError:
+        return
+    samples = [c[:logs.LogsConnectorComponent.DICT_SAMPLE_SIZE]
+               for c in chunks(training)]
+    zdict = zstandard.train_dictionary(
+        logs.LogsConnectorComponent.DICT_SIZE, samples)
+    run('zstd+dict', lambda c: logs.dumps_zstd(c, zdict),
+        lambda c: logs.read_zstd(c, zdict), data)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
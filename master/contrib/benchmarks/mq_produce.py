@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""Measure the cost of SimpleMQ.produce as the number of consumers grows.
+
+Each consumer subscribes to the log lines of one log, the way an open log
+tab in the web UI does; messages are produced for a single log, so only one
+consumer matches.  With an indexed dispatch, the time per message should
+stay flat as the number of consumers grows.
+
+    python contrib/benchmarks/mq_produce.py [--messages N]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import time
+from optparse import OptionParser
+
+from buildbot.mq import simple
+
+
+def run(consumers, messages):
+    mq = simple.SimpleMQ()
+    received = []
+    for i in range(consumers):
+        mq.startConsuming(lambda key, msg: received.append(msg),
+                          ('logs', str(i), 'append'))
+    # and a few consumers with wildcards, as the data layer has
+    mq.startConsuming(lambda key, msg: None, ('logs', None, 'finished'))
+    mq.startConsuming(lambda key, msg: None, ('builds', None, None))
+
+    key = ('logs', '0', 'append')
+    start = time.time()
+    for i in range(messages):
+        mq.produce(key, i)
+    elapsed = time.time() - start
+    assert len(received) == messages
+    print('%7d consumers: %8.2f us/message' % (
+        consumers, elapsed / messages * 1e6))
+
+
+def main():
+    parser = OptionParser(usage='%prog [--messages N]')
+    parser.add_option('--messages', type='int', default=10000,
+                      help='number of messages to produce')
+    opts, args = parser.parse_args()
+    for consumers in (10, 100, 1000, 10000, 100000):
+        run(consumers, opts.messages)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Compare the ways of collecting the output of a command.
+
+The output of a command arrives in chunks (of 4 KiB by default, like the
+worker's).  This measures the time taken to collect outputs of growing sizes
+by concatenating strings on an attribute (as RemoteCommand used to) and with
+an OutputCollector, optionally spilling to a temporary file, as well as the
+time LineBoundaryFinder takes to split a single long line arriving in chunks.
+
+Concatenation is quadratic, so it is only measured up to --max-concat.
+
+    python contrib/benchmarks/output_collect.py [--chunk N] [--max-concat N]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import time
+from optparse import OptionParser
+
+from buildbot.util.lineboundaries import LineBoundaryFinder
+from buildbot.util.outputcollector import OutputCollector
+
+SIZES = [1 << 10, 1 << 20, 16 << 20, 128 << 20, 500 << 20]
+
+
+class Concatenate(object):
+
+    def __init__(self):
+        self.value = u''
+
+    def append(self, data):
+        self.value += data
+
+    def getvalue(self):
+        return self.value
+
+
+def collect(collector, chunk, count):
+    start = time.time()
+    for _ in range(count):
+        collector.append(chunk)
+    value = collector.getvalue()
+    elapsed = time.time() - start
+    assert len(value) == len(chunk) * count
+    return elapsed
+
+
+def splitLongLine(chunk, count):
+    lines = []
+
+    def callback(text):
+        lines.append(len(text))
+    lbf = LineBoundaryFinder(callback)
+    start = time.time()
+    for _ in range(count):
+        lbf.append(chunk)
+    lbf.flush()
+    elapsed = time.time() - start
+    assert lines == [len(chunk) * count + 1]
+    return elapsed
+
+
+def fmt(size):
+    if size >= 1 << 20:
+        return '%dMiB' % (size >> 20)
+    return '%dKiB' % (size >> 10)
+
+
+def main():
+    parser = OptionParser(usage='%prog [--chunk N] [--max-concat N]')
+    parser.add_option('--chunk', type='int', default=4096,
+                      help='size of each chunk of output')
+    parser.add_option('--max-concat', type='int', default=16 << 20,
+                      help='largest output collected by concatenation')
+    parser.add_option('--spill', type='int', default=16 << 20,
+                      help='maxMemory of the spilling collector')
+    opts, args = parser.parse_args()
+
+    chunk = u'x' * opts.chunk
+    print('%8s %12s %12s %12s %12s' % (
+        'output', 'concatenate', 'collector', 'spilling', 'long line'))
+    for size in SIZES:
+        count = max(1, size // opts.chunk)
+        if size <= opts.max_concat:
+            concat = '%11.3fs' % collect(Concatenate(), chunk, count)
+        else:
+            concat = '%12s' % 'skipped'
+        collector = collect(OutputCollector(empty=u''), chunk, count)
+        spilling = collect(OutputCollector(empty=u'', maxMemory=opts.spill),
+                           chunk, count)
+        longLine = splitLongLine(chunk, count)
+        print('%8s %s %11.3fs %11.3fs %11.3fs' % (
+            fmt(size), concat, collector, spilling, longLine))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Measure the time ResultSpec.apply takes on large collections.
+
+This is the path taken by the data API when the filters, ordering or
+fields of a request cannot be handled by the database (e.g. for endpoints
+which are not backed by a single query, or for filters on computed fields).
+A collection of build-like dictionaries is generated, and a set of typical
+result specs (filters, ordering with null values, field selection,
+pagination) is applied to it several times; the best time of each is
+printed.
+
+    python contrib/benchmarks/resultspec_apply.py [--rows N] [--repeat N]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+import sys
+import time
+from optparse import OptionParser
+
+from buildbot.data import resultspec
+
+
+def makeRows(count):
+    rnd = random.Random(42)
+    rows = []
+    for i in range(count):
+        complete = rnd.random() < 0.9
+        rows.append(dict(
+            buildid=i, number=i // 100, builderid=i % 100, workerid=i % 37,
+            buildrequestid=i, masterid=1, started_at=i * 10,
+            complete=complete,
+            complete_at=i * 10 + rnd.randint(1, 1000) if complete else None,
+            results=rnd.choice([0, 0, 0, 1, 2, 4]) if complete else None,
+            state_string=u'build %d' % i, properties={}))
+    return rows
+
+
+def F(field, op, *values):
+    return resultspec.Filter(field, op, list(values))
+
+
+SPECS = [
+    ('filter builderid=5',
+     dict(filters=[F('builderid', 'eq', 5)])),
+    ('filter results in (2, 4)',
+     dict(filters=[F('results', 'eq', 2, 4)])),
+    ('filter complete, started_at__gt',
+     dict(filters=[F('complete', 'eq', True), F('started_at', 'gt', 500000)])),
+    ('order -complete_at (with nulls)',
+     dict(order=['-complete_at'])),
+    ('order builderid,-number',
+     dict(order=['builderid', '-number'])),
+    ('fields buildid,number,results',
+     dict(fields=['buildid', 'number', 'results'])),
+    ('filter+order+fields, limit 50',
+     dict(filters=[F('complete', 'eq', True)], order=['-complete_at'],
+          fields=['buildid', 'complete_at', 'complete'], limit=50)),
+    ('order -buildid, offset 1000 limit 50',
+     dict(order=['-buildid'], offset=1000, limit=50)),
+]
+
+
+def bench(rows, kwargs, repeat):
+    best = None
+    for _ in range(repeat):
+        spec = resultspec.ResultSpec(**kwargs)
+        start = time.time()
+        spec.apply(rows)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = OptionParser(usage='%prog [--rows N] [--repeat N]')
+    parser.add_option('--rows', type='int', default=100000,
+                      help='number of rows in the collection')
+    parser.add_option('--repeat', type='int', default=5,
+                      help='number of runs of each spec (the best is kept)')
+    opts, args = parser.parse_args()
+    rows = makeRows(opts.rows)
+    print('%d rows' % len(rows))
+    for name, kwargs in SPECS:
+        print('%-40s %8.1fms' % (name, bench(rows, kwargs, opts.repeat) * 1000))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
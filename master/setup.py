@@ -377,6 +377,8 @@ setup_args = {
                 'GoogleAuth', 'GitHubAuth', 'GitLabAuth', 'BitbucketAuth']),
             ('buildbot.db.dbconfig', [
                 'DbConfig']),
+            ('buildbot.db.logstores', [
+                'FileLogChunkStore']),
             ('buildbot.www.authz', [
                 'Authz', 'fnmatchStrMatcher', 'reStrMatcher']),
             ('buildbot.www.authz.roles', [
@@ -461,6 +463,8 @@ test_deps = [
     'txgithub',
     'ramlfications',
     'mock>=2.0.0',
+    # zstandard required for zstd log compression tests
+    'zstandard',
 ]
 if sys.platform != 'win32':
     test_deps += [
@@ -62,9 +62,21 @@ class WorkerForBuilderBase(service.Service):
 
     bf = None
 
+    # updates are sent to the master as soon as they are produced, unless
+    # maxUpdatesInFlight update calls are already waiting for the master's
+    # acknowledgement; the updates produced meanwhile are queued, and sent
+    # together in one call (of at most maxUpdatesPerCall updates) when an
+    # acknowledgement arrives.  Masters acknowledge once they have processed
+    # the updates, so this also keeps a slow master from being flooded.
+    maxUpdatesInFlight = 4
+    maxUpdatesPerCall = 100
+
     def __init__(self, name):
         # service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
+        self.pendingUpdates = []
+        self.updatesInFlight = 0
+        self.resetUpdateStats()
 
     def __repr__(self):
         return "<WorkerForBuilder '%s' at %d>" % (self.name, id(self))
@@ -113,6 +125,7 @@ class WorkerForBuilderBase(service.Service):
     def lostRemoteStep(self, remotestep):
         log.msg("lost remote step")
         self.remoteStep = None
+        self.pendingUpdates = []
         if self.stopCommandOnShutdown:
             self.stopCommand()
 
@@ -145,6 +158,9 @@ class WorkerForBuilderBase(service.Service):
         self.command = factory(self, stepId, args)
 
         log.msg(" startCommand:%s [id %s]" % (command, stepId))
+        # the updates of the previous command go to its step
+        self.flushUpdates()
+        self.resetUpdateStats()
         self.remoteStep = stepref
         self.remoteStep.notifyOnDisconnect(self.lostRemoteStep)
         d = self.command.doStart()
@@ -177,10 +193,10 @@ class WorkerForBuilderBase(service.Service):
     # sendUpdate is invoked by the Commands we spawn
     def sendUpdate(self, data):
         """This sends the status update to the master-side
-        L{buildbot.process.step.RemoteCommand} object, giving it a sequence
-        number in the process. It adds the update to a queue, and asks the
-        master to acknowledge the update so it can be removed from that
-        queue."""
+        L{buildbot.process.step.RemoteCommand} object. It adds the update to
+        a queue, which is sent to the master (in a single call if several
+        updates are waiting) unless too many previous calls are still waiting
+        for the master's acknowledgement."""
 
         if not self.running:
             # .running comes from service.Service, and says whether the
@@ -191,11 +207,53 @@ class WorkerForBuilderBase(service.Service):
         # master still expects to receive. Provide it to avoid significant
         # interoperability issues between new workers and old masters.
         if self.remoteStep:
-            update = [data, 0]
-            updates = [update]
+            self.pendingUpdates.append([data, 0])
+            stats = self.updateStats
+            stats['updates'] += 1
+            stats['maxQueued'] = max(stats['maxQueued'],
+                                     len(self.pendingUpdates))
+            self.sendUpdates()
+
+    def sendUpdates(self, force=False):
+        """Send the queued updates, within the window of calls in flight
+        unless C{force} is true"""
+        while self.pendingUpdates and self.remoteStep and (
+                force or self.updatesInFlight < self.maxUpdatesInFlight):
+            updates = self.pendingUpdates[:self.maxUpdatesPerCall]
+            del self.pendingUpdates[:self.maxUpdatesPerCall]
+            self.updatesInFlight += 1
+            self.updateStats['calls'] += 1
             d = self.remoteStep.callRemote("update", updates)
             d.addCallback(self.ackUpdate)
             d.addErrback(self._ackFailed, "WorkerForBuilder.sendUpdate")
+            d.addBoth(self._updateCallDone, self.updateStats, reactor.seconds())
+
+    def flushUpdates(self):
+        """Send all the queued updates now, e.g. before the command's
+        completion, which the master must receive after them"""
+        self.sendUpdates(force=True)
+
+    def _updateCallDone(self, _, stats, sent):
+        self.updatesInFlight -= 1
+        rtt = reactor.seconds() - sent
+        stats['rtts'] += 1
+        stats['rttTotal'] += rtt
+        stats['rttMax'] = max(stats['rttMax'], rtt)
+        self.sendUpdates()
+
+    def resetUpdateStats(self):
+        self.updateStats = dict(updates=0, calls=0, maxQueued=0, rtts=0,
+                                rttTotal=0.0, rttMax=0.0)
+
+    def logUpdateStats(self):
+        stats = self.updateStats
+        if not stats['calls']:
+            return
+        log.msg(" sent %d updates in %d calls, at most %d queued; "
+                "round-trip avg %.3fs max %.3fs" % (
+                    stats['updates'], stats['calls'], stats['maxQueued'],
+                    stats['rttTotal'] / max(stats['rtts'], 1),
+                    stats['rttMax']))
 
     def ackUpdate(self, acknum):
         self.activity()  # update the "last activity" timer
@@ -224,6 +282,8 @@ class WorkerForBuilderBase(service.Service):
             log.msg(" but we weren't running, quitting silently")
             return
         if self.remoteStep:
+            self.flushUpdates()
+            self.logUpdateStats()
             self.remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
             d = self.remoteStep.callRemote("complete", failure)
             d.addCallback(self.ackComplete)
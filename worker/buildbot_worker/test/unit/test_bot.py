@@ -394,6 +394,107 @@ class TestWorkerForBuilder(command.CommandTestMixin, unittest.TestCase):
         yield self.assertFailure(do_start(), ValueError)
 
 
+class SlowStep(object):
+
+    "A fake remote BuildStep which acknowledges calls when told to."
+
+    def __init__(self):
+        self.calls = []
+
+    def callRemote(self, method, *args):
+        d = defer.Deferred()
+        self.calls.append((method, args, d))
+        return d
+
+    def ack(self, index):
+        self.calls[index][2].callback(None)
+
+    def notifyOnDisconnect(self, what):
+        pass
+
+    def dontNotifyOnDisconnect(self, what):
+        pass
+
+    def updates(self):
+        return [[u[0] for u in args[0]]
+                for method, args, _ in self.calls if method == 'update']
+
+
+class TestWorkerForBuilderUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.wfb = base.WorkerForBuilderBase('wfb')
+        self.wfb.startService()
+        self.wfb.remoteStep = self.step = SlowStep()
+        self.patch(base.WorkerForBuilderBase, 'maxUpdatesInFlight', 2)
+
+    def test_send_within_window(self):
+        self.wfb.sendUpdate({'hdr': 'a'})
+        self.wfb.sendUpdate({'stdout': 'b'})
+        self.assertEqual(self.step.updates(),
+                         [[{'hdr': 'a'}], [{'stdout': 'b'}]])
+
+    def test_batch_while_waiting(self):
+        for i in range(5):
+            self.wfb.sendUpdate({'stdout': str(i)})
+        self.assertEqual(len(self.step.calls), 2)
+        self.step.ack(1)
+        self.assertEqual(self.step.updates(), [
+            [{'stdout': '0'}], [{'stdout': '1'}],
+            [{'stdout': '2'}, {'stdout': '3'}, {'stdout': '4'}]])
+        self.assertEqual(self.step.calls[2][1][0][0], [{'stdout': '2'}, 0])
+
+    def test_batch_size(self):
+        self.patch(base.WorkerForBuilderBase, 'maxUpdatesPerCall', 2)
+        for i in range(5):
+            self.wfb.sendUpdate({'stdout': str(i)})
+        self.step.ack(0)
+        self.step.ack(1)
+        self.assertEqual(self.step.updates(), [
+            [{'stdout': '0'}], [{'stdout': '1'}],
+            [{'stdout': '2'}, {'stdout': '3'}], [{'stdout': '4'}]])
+
+    @compat.usesFlushLoggedErrors
+    def test_failed_call_frees_window(self):
+        for i in range(3):
+            self.wfb.sendUpdate({'stdout': str(i)})
+        self.step.calls[0][2].errback(RuntimeError('oh noes'))
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        self.assertEqual(len(self.step.calls), 3)
+
+    def test_complete_after_queued_updates(self):
+        for i in range(4):
+            self.wfb.sendUpdate({'stdout': str(i)})
+        self.wfb.commandComplete(None)
+        self.assertEqual([c[0] for c in self.step.calls],
+                         ['update', 'update', 'update', 'complete'])
+        self.assertEqual(self.step.updates()[2],
+                         [{'stdout': '2'}, {'stdout': '3'}])
+        self.assertIdentical(self.wfb.remoteStep, None)
+
+    def test_stats(self):
+        msgs = []
+        self.patch(log, 'msg', lambda *args: msgs.append(' '.join(map(str, args))))
+        clock = task.Clock()
+        self.patch(base, 'reactor', clock)
+        for i in range(4):
+            self.wfb.sendUpdate({'stdout': str(i)})
+        clock.advance(1)
+        self.step.ack(0)
+        clock.advance(2)
+        self.step.ack(1)
+        self.wfb.commandComplete(None)
+        self.assertIn(' sent 4 updates in 3 calls, at most 2 queued; '
+                      'round-trip avg 2.000s max 3.000s', msgs)
+
+    def test_lost_step_drops_queue(self):
+        for i in range(3):
+            self.wfb.sendUpdate({'stdout': str(i)})
+        self.wfb.lostRemoteStep(self.step)
+        self.step.ack(0)
+        self.assertEqual(len(self.step.calls), 2)
+
+
 class TestBotFactory(unittest.TestCase):
 
     def setUp(self):